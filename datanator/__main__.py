@@ -8,24 +8,21 @@
 :License: MIT
 """
 
-from datanator.core import data_model
-from datanator_query_python.query import query_metabolites_meta, query_pax, query_sabiork, query_taxon_tree
-from datanator.data_source import *
-from datanator.util import molecule_util
-from datanator.util import taxonomy_util
-from pkg_resources import resource_filename
-import bioservices
+from datanator.util.constants import DATA_CACHE_DIR
+import ast
 import cement
-import flask_migrate
 import datanator
-import os
-import pubchempy
+import inspect
+import json
 import re
-import shutil
-import sqlalchemy_utils
+import subprocess
 import sys
-from Bio import SeqIO
-from datanator.util.constants import DATA_CACHE_DIR
+import textwrap
+
+# Dependencies of the commands (data sources, pubchempy, openbabel, ete3, pandas, ...) are imported
+# inside the commands so that starting the utility and printing help stay fast. The imports of
+# each controller are read from its source by `get_lazy_imports` and are timed by
+# `datanator benchmark-startup`.
 
 
 class BaseController(cement.Controller):
@@ -73,6 +70,7 @@ class UploadReferenceGenome(cement.Controller):
 
     @cement.ex(hide=True)
     def _default(self):
+        from datanator.data_source import upload_data
         pargs = self.app.pargs
         #bio_seqio_object = SeqIO.parse(pargs.genome_path, "genbank")
         #list_of_bio_seqio_objects = [bio_seqio_object]
@@ -95,6 +93,8 @@ class UploadRNASeqExperiment(cement.Controller):
 
     @cement.ex(hide=True)
     def _default(self):
+        from Bio import SeqIO
+        from datanator.data_source import refseq
         pargs = self.app.pargs
         bio_seqio_object = SeqIO.parse(pargs.ref_genome_path, "genbank")
         list_of_bio_seqio_objects = [bio_seqio_object]
@@ -115,6 +115,7 @@ class UploadData(cement.Controller):
 
     @cement.ex(hide=True)
     def _default(self):
+        from datanator.data_source import json_schema, render_html_from_schema
         pargs = self.app.pargs
         data_type = pargs.data_type
 
@@ -155,47 +156,55 @@ class BuildController(cement.Controller):
 
     @cement.ex(help='Builds Corum Complex DB from source')
     def corum(self):
+        from datanator.data_source import corum
         pargs = self.app.pargs
         corum.Corum(cache_dirname=pargs.path, load_content=True, download_backups=False,
                     max_entries=pargs.max_entries, verbose=pargs.verbose)
 
     @cement.ex(help='Builds IntAct Interactions and Complex DB from source')
     def intact(self):
+        from datanator.data_source import intact
         pargs = self.app.pargs
         intact.IntAct(cache_dirname=pargs.path, load_content=True, download_backups=False,
                       max_entries=pargs.max_entries, verbose=pargs.verbose)
 
     @cement.ex(help='Builds Sabio Reaction Kinetics DB from source')
     def sabio(self):
+        from datanator.data_source import sabio_rk
         pargs = self.app.pargs
         sabio_rk.SabioRk(cache_dirname=pargs.path, load_content=True, download_backups=False,
                          max_entries=pargs.max_entries, verbose=pargs.verbose)
 
     @cement.ex(help='Builds Pax Protein Abundance DB from source')
     def pax(self):
+        from datanator.data_source import pax
         pargs = self.app.pargs
         pax.Pax(cache_dirname=pargs.path, load_content=True, download_backups=False, max_entries=pargs.max_entries, verbose=pargs.verbose)
 
     @cement.ex(help='Builds Array Express RNA Seq DB from source')
     def array_express(self):
+        from datanator.data_source import array_express
         pargs = self.app.pargs
         array_express.ArrayExpress(cache_dirname=pargs.path, load_content=True, download_backups=False,
                                    max_entries=pargs.max_entries, verbose=pargs.verbose)
 
     @cement.ex(help='Builds Jaspar DNA protein interaction DB from source')
     def jaspar(self):
+        from datanator.data_source import jaspar
         pargs = self.app.pargs
         jaspar.Jaspar(cache_dirname=pargs.path, load_content=True, download_backups=False,
                       max_entries=pargs.max_entries, verbose=pargs.verbose)
 
     @cement.ex(help='Builds Uniprot Protein DB from source')
     def uniprot(self):
+        from datanator.data_source import uniprot
         pargs = self.app.pargs
         uniprot.Uniprot(cache_dirname=pargs.path, load_content=True, download_backups=False,
                         max_entries=pargs.max_entries, verbose=pargs.verbose)
 
     @cement.ex(help='Builds ECMDB metabolite DB from source')
     def ecmdb(self):
+        from datanator.data_source import ecmdb
         pargs = self.app.pargs
         ecmdb.Ecmdb(cache_dirname=pargs.path, load_content=True, download_backups=False,
                     max_entries=pargs.max_entries, verbose=pargs.verbose)
@@ -238,6 +247,7 @@ class AggregateBuildController(cement.Controller):
 
     @cement.ex(help='Controller that controls aggregated')
     def _default(self):
+        from datanator.data_source import common_schema
         pargs = self.app.pargs
         # todo: set restore_backup_schema=False after fixing Alembic issue with migrations
         # todo: restore_backup_exit_on_error=True after fixing Alembic issue with migrations
@@ -262,46 +272,55 @@ class DownloadController(cement.Controller):
 
     @cement.ex(help='Loads Corum Complex DB from Karr Lab Server')
     def corum(self):
+        from datanator.data_source import corum
         pargs = self.app.pargs
         corum.Corum(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads IntAct Interactions and Complex DB from Karr Lab Server')
     def intact(self):
+        from datanator.data_source import intact
         pargs = self.app.pargs
         intact.IntAct(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads Sabio Reaction Kinetics DB from Karr Lab Server')
     def sabio(self):
+        from datanator.data_source import sabio_rk
         pargs = self.app.pargs
         sabio_rk.SabioRk(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads Pax Protein Abundance DB from Karr Lab Server')
     def pax(self):
+        from datanator.data_source import pax
         pargs = self.app.pargs
         pax.Pax(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads Array Express RNA Seq DB from Karr Lab Server')
     def array_express(self):
+        from datanator.data_source import array_express
         pargs = self.app.pargs
         array_express.ArrayExpress(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads Jaspar DNA protein interaction DB from Karr Lab Server')
     def jaspar(self):
+        from datanator.data_source import jaspar
         pargs = self.app.pargs
         jaspar.Jaspar(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads Uniprot Protein DB from Karr Lab Server')
     def uniprot(self):
+        from datanator.data_source import uniprot
         pargs = self.app.pargs
         uniprot.Uniprot(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads ECMDB metabolite DB from Karr Lab Server')
     def ecmdb(self):
+        from datanator.data_source import ecmdb
         pargs = self.app.pargs
         ecmdb.Ecmdb(cache_dirname=pargs.path, download_backups=True)
 
     @cement.ex(help='Loads Aggregated DB from Karr Lab Server')
     def aggregate(self):
+        from datanator.data_source import common_schema
         pargs = self.app.pargs
         # todo: set restore_backup_schema=False after fixing Alembic issue with migrations
         # todo: restore_backup_exit_on_error=True after fixing Alembic issue with migrations
@@ -328,6 +347,8 @@ class GenerateTemplateController(cement.Controller):
 
     @cement.ex(hide=True)
     def _default(self):
+        from pkg_resources import resource_filename
+        import shutil
         # todo: generate template
         template_filename = resource_filename('datanator', 'data/InputTemplate.xlsx')
         shutil.copyfile(template_filename, self.app.pargs.filename)
@@ -347,6 +368,8 @@ class GenerateRNASeqTemplate(cement.Controller):
 
     @cement.ex(hide=True)
     def _default(self):
+        from pkg_resources import resource_filename
+        import shutil
         # todo: generate template
         template_directory = resource_filename('datanator', 'data/RNA-Seq_Experiment_Template')
         shutil.copytree(template_directory, "{}/RNA-Seq_Experiment_Template".format(self.app.pargs.directory_name))
@@ -525,6 +548,8 @@ class MoleculeGetStructureController(cement.Controller):
 
     @cement.ex(hide=True)
     def _default(self):
+        import bioservices
+        import pubchempy
         if self.app.pargs.by_name:
             compounds = pubchempy.get_compounds(self.app.pargs.name_or_id, 'name')
             results = [[compound.synonyms[0], 'pubchem.compound', compound.cid, compound.inchi] for compound in compounds]
@@ -568,6 +593,7 @@ class MoleculeConvertStructureController(cement.Controller):
 
     @cement.ex(hide=True)
     def _default(self):
+        from datanator.util import molecule_util
         structure = self.app.pargs.structure
         format = self.app.pargs.format
         print(molecule_util.Molecule(structure=structure).to_format(format))
@@ -607,6 +633,11 @@ class ReactionGetEcNumberController(cement.Controller):
     # todo: add find_ec
     @cement.ex(hide=True)
     def _default(self):
+        from datanator.core import data_model
+        from datanator.data_source import ezyme
+        from datanator.util import molecule_util
+        import pubchempy
+
         # parse input
         def parse_participants(side, coefficient, reaction, errors):
             for participant in side.split(' + '):
@@ -652,36 +683,42 @@ class ReactionGetEcNumberController(cement.Controller):
             print('There is no appropriate EC number for the reaction')
 
 
+class StartupBenchmarkController(cement.Controller):
+
     class Meta:
-        label = 'restore'
-        description = 'Restore the content of the Datanator database'
-        help = 'Restore the content of the Datanator database'
-        stacked_on = 'db'
+        label = 'benchmark-startup'
+        description = "Measure the start up time of the utility and the import time of the dependencies of each controller"
+        help = "Measure the start up time of the utility and the import time of the dependencies of each controller"
+        stacked_on = 'base'
         stacked_type = 'nested'
         arguments = [
-            (['--do-not-restore-data'], dict(
-                dest='restore_data',
-                action='store_false',
-                help='If set, do not restore the data')),
-            (['--restore-schema'], dict(
-                dest='restore_schema',
-                action='store_true',
-                help='If set, restore the schema')),
-            (['--do-not-exit-on-error'], dict(
-                dest='exit_on_error',
-                action='store_false',
-                help='If set, do not exit on errors')),
+            (['--repeats'], dict(type=int, default=3,
+                                 help="number of measurements per controller; the fastest is reported")),
+            (['--output'], dict(type=str, default=None, help="path to save the timings in JSON format")),
+            (['--max-startup-seconds'], dict(type=float, default=None,
+                                             help="exit with an error if starting the utility takes longer")),
         ]
 
     @cement.ex(hide=True)
     def _default(self):
         pargs = self.app.pargs
-        common_schema.CommonSchema(clear_content=True,
-                                   restore_backup_data=pargs.restore_data,
-                                   restore_backup_schema=pargs.restore_schema,
-                                   restore_backup_exit_on_error=pargs.exit_on_error,
-                                   load_content=False,
-                                   verbose=True)
+        timings = benchmark_startup(repeats=pargs.repeats)
+
+        print('Start up: {:.3f} s'.format(timings['startup']))
+        width = max(len(controller['controller']) for controller in timings['controllers'])
+        print('{{:<{}}}  Seconds  Error'.format(width).format('Controller'))
+        print('{}  =======  ====='.format('=' * width))
+        for controller in timings['controllers']:
+            print('{{:<{}}}  {{:>7.3f}}  {{}}'.format(width).format(
+                controller['controller'], controller['seconds'], controller['error'] or ''))
+
+        if pargs.output:
+            with open(pargs.output, 'w') as file:
+                json.dump(timings, file, indent=2)
+
+        if pargs.max_startup_seconds is not None and timings['startup'] > pargs.max_startup_seconds:
+            raise SystemExit('Start up took {:.3f} s which is more than {:.3f} s'.format(
+                timings['startup'], pargs.max_startup_seconds))
 
 
 class App(cement.App):
@@ -720,6 +757,8 @@ class App(cement.App):
 
             ReactionController,
             ReactionGetEcNumberController,
+
+            StartupBenchmarkController,
         ]
 
 
@@ -732,6 +771,7 @@ def create_taxon(id_or_name):
     Returns:
         :obj:`taxonomy_util.Taxon`: taxon
     """
+    from datanator.util import taxonomy_util
     ncbi_id = None
     name = None
     try:
@@ -742,6 +782,104 @@ def create_taxon(id_or_name):
     return taxonomy_util.Taxon(ncbi_id=ncbi_id, name=name)
 
 
+_STARTUP_TIMER = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import datanator.__main__
+startup = time.perf_counter() - start
+start = time.perf_counter()
+errors = []
+for spec in sys.argv[1:]:
+    module, _, name = spec.partition(':')
+    try:
+        imported = importlib.import_module(module)
+        if name and not hasattr(imported, name):
+            importlib.import_module(module + '.' + name)
+    except Exception as exception:
+        errors.append('{}: {}: {}'.format(spec, exception.__class__.__name__, exception))
+print(json.dumps({'startup': startup, 'seconds': time.perf_counter() - start, 'error': '; '.join(errors) or None}))
+"""
+
+
+def get_lazy_imports(controller):
+    """ Get the imports of the commands of a controller, including those of the functions of this
+    module which the commands call (e.g. :obj:`create_taxon`)
+
+    Args:
+        controller (:obj:`type`): controller
+
+    Returns:
+        :obj:`list` of :obj:`str`: imported modules (e.g. `pubchempy`) and, for `from ... import ...`
+            statements, modules and names separated by colons (e.g. `datanator.data_source:corum`)
+    """
+    imports = []
+    visited = set()
+
+    def visit(obj):
+        if obj in visited:
+            return
+        visited.add(obj)
+        for node in ast.walk(ast.parse(textwrap.dedent(inspect.getsource(obj)))):
+            if isinstance(node, ast.Import):
+                specs = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                specs = [node.module + ':' + alias.name for alias in node.names]
+            else:
+                specs = []
+                if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+                    func = globals().get(node.func.id)
+                    if inspect.isfunction(func) and func.__module__ == __name__:
+                        visit(func)
+            for spec in specs:
+                if spec not in imports:
+                    imports.append(spec)
+
+    visit(controller)
+    return imports
+
+
+def benchmark_startup(controllers=None, repeats=3, python=sys.executable):
+    """ Measure the time needed to import the command line utility and, for each controller,
+    the additional time needed to import the modules which its commands import (see :obj:`get_lazy_imports`)
+
+    Each measurement runs in a new interpreter so that no module is already loaded.
+
+    Args:
+        controllers (:obj:`list` of :obj:`type`, optional): controllers to measure. Defaults to
+            all controllers of :obj:`App` whose commands import modules
+        repeats (:obj:`int`, optional): number of measurements; the fastest is reported
+        python (:obj:`str`, optional): path to the Python interpreter
+
+    Returns:
+        :obj:`dict`: start up time (startup) in seconds and list of timings of the
+            controllers (controller, modules, seconds, error)
+    """
+    if controllers is None:
+        controllers = [handler for handler in App.Meta.handlers if get_lazy_imports(handler)]
+
+    def measure(modules):
+        best = None
+        for _ in range(max(1, repeats)):
+            output = subprocess.run([python, '-c', _STARTUP_TIMER] + list(modules),
+                                    stdout=subprocess.PIPE, check=True).stdout
+            timing = json.loads(output.decode().strip().split('\n')[-1])
+            if best is None or timing['startup'] + timing['seconds'] < best['startup'] + best['seconds']:
+                best = timing
+        return best
+
+    timings = {'startup': measure([])['startup'], 'controllers': []}
+    for controller in controllers:
+        modules = get_lazy_imports(controller)
+        timing = measure(modules)
+        timings['controllers'].append({
+            'controller': controller.Meta.label,
+            'modules': modules,
+            'seconds': timing['seconds'],
+            'error': timing['error'],
+        })
+    return timings
+
+
 def main():
     with App() as app:
         app.run()
@@ -10,7 +10,6 @@ from datanator.util import molecule_util
 import copy
 import enum
 import itertools
-import numpy
 import obj_tables.core
 import obj_tables.bio.seq
 
@@ -360,45 +359,68 @@ class Reaction(Interaction):
     def get_ordered_participants(self, collapse_repeated=True):
         """ Get an ordered list of the participants
 
+        Repeated participants are participants with the same species (structure and id), compartment,
+        and role (reactant or product). They are collapsed in a single pass by summing their coefficients
+        into a copy of the first of them, leaving the participants of the reaction unchanged; modifiers
+        are dropped. The result is cached until the participants of the reaction, or their species,
+        compartments, coefficients, or orders, change.
+
         Args:
             collapse_repeated (:obj:`bool`): if :obj:`True`, collapse any repeated participants
 
         Returns:
             :obj:`list` of :obj:`ReactionParticipant`: ordered list of reaction participants
         """
+        cache = self.__dict__.setdefault('_ordered_participants', {})
+        signature = self._get_participants_signature()
+        cached = cache.get(collapse_repeated)
+        if cached is not None and cached[0] == signature:
+            return list(cached[1])
 
         # create copy of participants
-        participants = copy.copy(list(self.participants))
+        participants = list(self.participants)
 
         # collapse repeated participants
         if collapse_repeated:
-            i_part = 0
-            while i_part < len(participants):
-                part = participants[i_part]
+            collapsed = {}
+            summed = set()
+            for part in participants:
                 if part.coefficient == 0:
-                    participants.pop(i_part)
                     continue
-
-                i_other_part = i_part + 1
-                while i_other_part < len(participants):
-                    other_part = participants[i_other_part]
-                    if other_part.specie.structure == part.specie.structure and \
-                            other_part.specie.id == part.specie.id and \
-                            ((other_part.compartment is None and part.compartment is None) or
-                                other_part.compartment.id == part.compartment.id) and \
-                            numpy.sign(other_part.coefficient) == numpy.sign(part.coefficient):
-                        part.coefficient += other_part.coefficient
-                        participants.pop(i_other_part)
-                    else:
-                        i_other_part += 1
-
-                i_part += 1
+                key = (part.specie.structure, part.specie.id,
+                       part.compartment.id if part.compartment is not None else None,
+                       part.coefficient > 0)
+                first_part = collapsed.get(key)
+                if first_part is None:
+                    collapsed[key] = part
+                    continue
+                if key not in summed:
+                    first_part = collapsed[key] = copy.copy(first_part)
+                    summed.add(key)
+                first_part.coefficient += part.coefficient
+            participants = list(collapsed.values())
 
         # order participants
         participants.sort(key=lambda part: part.order if part.order is not None else 1e10)
 
+        # cache the participants
+        cache[collapse_repeated] = (signature, participants)
+
         # return
-        return participants
+        return list(participants)
+
+    def _get_participants_signature(self):
+        """ Get a signature of the participants which changes whenever the result of
+        :obj:`get_ordered_participants` could change
+
+        Returns:
+            :obj:`tuple`: signature
+        """
+        return tuple((id(part), part.coefficient, part.order,
+                      id(part.specie), part.specie.id if part.specie is not None else None,
+                      part.specie.structure if part.specie is not None else None,
+                      id(part.compartment), part.compartment.id if part.compartment is not None else None)
+                     for part in self.participants)
 
     def stringify(self):
         #TODO: Add the modifier
@@ -6,21 +6,22 @@
 """
 
 import abc
+import contextlib
 import datanator.config
 import os
+import re
 import requests
 import requests_cache
 import shutil
 import sqlalchemy
 import sqlalchemy.orm
 from sqlalchemy_utils.functions import database_exists, create_database
+from datanator.util import backup_util
 from datanator.util.constants import DATA_CACHE_DIR, DATA_DUMP_PATH
 import sys
 import tarfile
 import subprocess
-import tempfile
 import time
-import wc_utils.quilt
 
 
 class DataSource(object, metaclass=abc.ABCMeta):
@@ -53,7 +54,14 @@ class PostgresDataSource(DataSource):
         max_entries (:obj:`float`): maximum number of entries to save locally
         quilt_owner (:obj:`str`): owner of Quilt package to save data
         quilt_package (:obj:`str`): identifier of Quilt package to save data
+        backup_store (:obj:`backup_util.PackageStore`): store for backups; defaults to the Quilt package
         cache_dirname (:obj:`str`): directory to store the local copy of the data source
+        dump_format (:obj:`str`): format of dumps, `custom` (single file) or `directory` (one file per table,
+            dumped and restored by parallel jobs)
+        dump_jobs (:obj:`int`): number of parallel jobs for dumping and restoring
+        dump_compression (:obj:`str`): compression method and/or level of dumps (e.g. `zstd`, `zstd:3`, `6`)
+        dump_timings (:obj:`dict`): seconds spent dumping each table during the last dump
+        restore_timings (:obj:`dict`): seconds spent restoring each table during the last restore
         verbose (:obj:`bool`): if :obj:`True`, print status information to the standard output
 
         engine (:obj:`sqlalchemy.engine.Engine`): SQLAlchemy engine
@@ -66,7 +74,8 @@ class PostgresDataSource(DataSource):
                  load_content=False, max_entries=float('inf'),
                  restore_backup_data=False, restore_backup_schema=False, restore_backup_exit_on_error=True,
                  quilt_owner=None, quilt_package=None, cache_dirname=None,
-                 verbose=False):
+                 verbose=False, backup_store=None,
+                 dump_format='custom', dump_jobs=None, dump_compression=None):
         """
         Args:
             name (:obj:`str`, optional): name
@@ -80,6 +89,13 @@ class PostgresDataSource(DataSource):
             quilt_package (:obj:`str`, optional): identifier of Quilt package to save data
             cache_dirname (:obj:`str`, optional): directory to store the local copy of the data source
             verbose (:obj:`bool`, optional): if :obj:`True`, print status information to the standard output
+            backup_store (:obj:`backup_util.PackageStore`, optional): store for backups; defaults to the Quilt package
+            dump_format (:obj:`str`, optional): format of dumps, `custom` (single file) or `directory` (one file per
+                table, dumped and restored by parallel jobs)
+            dump_jobs (:obj:`int`, optional): number of parallel jobs for dumping and restoring; defaults to the
+                number of CPUs
+            dump_compression (:obj:`str`, optional): compression method and/or level of dumps (e.g. `zstd`, `zstd:3`,
+                `6`); zstd requires PostgreSQL 16 or later
         """
 
         super(PostgresDataSource, self).__init__(name=name, verbose=verbose)
@@ -93,12 +109,22 @@ class PostgresDataSource(DataSource):
         quilt_config = datanator.config.get_config()['datanator']['quilt']
         self.quilt_owner = quilt_owner or quilt_config['owner']
         self.quilt_package = quilt_package or quilt_config['package']
+        self.backup_store = backup_store
 
         # local directory for dump in Quilt package
         if not cache_dirname:
             cache_dirname = DATA_CACHE_DIR
         self.cache_dirname = cache_dirname
 
+        # dump settings
+        if dump_format not in ['custom', 'directory']:
+            raise ValueError('Dump format must be `custom` or `directory`')
+        self.dump_format = dump_format
+        self.dump_jobs = dump_jobs or os.cpu_count() or 1
+        self.dump_compression = dump_compression
+        self.dump_timings = {}
+        self.restore_timings = {}
+
         # setup database and restore or load content
         self.engine = self.get_engine()
         if clear_content:
@@ -143,88 +169,90 @@ class PostgresDataSource(DataSource):
         return self.base_model.session
 
     def upload_backup(self):
-        """ Dump and backup the database to Quilt """
+        """ Dump and backup the database to Quilt
+
+        Only the chunks of the dump which changed since the previous backup are uploaded.
+        """
 
         # dump database
         self.dump_database()
 
-        # create temporary directory to checkout package
-        tmp_dirname = tempfile.mkdtemp()
-
-        # install and export package
-        manager = wc_utils.quilt.QuiltManager(tmp_dirname, self.quilt_package, owner=self.quilt_owner)
-        manager.download(sym_links=True)
-
-        # copy new files to package
+        # upload changed chunks of dump
         path = self._get_dump_path()
-        if os.path.exists(os.path.join(tmp_dirname, path)):
-            os.remove(os.path.join(tmp_dirname, path))
-        os.symlink(os.path.join(self.cache_dirname, path), os.path.join(tmp_dirname, path))
-
-        # build and push package
-        manager.upload()
-
-        # cleanup temporary directory
-        os.remove(os.path.join(tmp_dirname, path))
-        shutil.rmtree(tmp_dirname)
+        self.get_backup().upload(path, os.path.join(self.cache_dirname, path))
 
     def restore_backup(self, restore_data=True, restore_schema=False, exit_on_error=True):
         """ Download and restore the database from Quilt
 
+        Only the chunks which differ from the local copy of the dump are downloaded.
+
         Args:
             restore_data (:obj:`bool`, optional): If :obj:`True`, restore data
             restore_schema (:obj:`bool`, optional): If :obj:`True`, clear and restore schema
             exit_on_error (:obj:`bool`, optional): If :obj:`True`, exit on errors
         """
 
-        # create temporary directory to checkout package
-        tmp_dirname = tempfile.mkdtemp()
-
-        # install and export dumped database from package
-        manager = wc_utils.quilt.QuiltManager(tmp_dirname, self.quilt_package, owner=self.quilt_owner)
-        path = self._get_dump_path()
-        manager.download(system_path=path, sym_links=True)
+        # download dumped database
         if not os.path.isdir(self.cache_dirname):
             os.makedirs(self.cache_dirname)
-        if os.path.isfile(os.path.join(self.cache_dirname, path)):
-            os.remove(os.path.join(self.cache_dirname, path))
-        elif os.path.isdir(os.path.join(self.cache_dirname, path)):
-            shutil.rmtree(os.path.join(self.cache_dirname, path))
-        os.rename(os.path.join(tmp_dirname, path),
-                  os.path.join(self.cache_dirname, path))
-
-        # cleanup temporary directory
-        shutil.rmtree(tmp_dirname)
+        path = self._get_dump_path()
+        self.get_backup().download(path, os.path.join(self.cache_dirname, path))
 
         # restore database
         self.restore_database(restore_data=restore_data,
                               restore_schema=restore_schema,
                               exit_on_error=exit_on_error)
 
+    def get_backup(self):
+        """ Get the content-addressed backup of the dump of the database
+
+        Returns:
+            :obj:`backup_util.ChunkedBackup`: backup
+        """
+        store = self.backup_store or backup_util.QuiltPackageStore(self.quilt_package, quilt_owner=self.quilt_owner,
+                                                                   verbose=self.verbose)
+        return backup_util.ChunkedBackup(store, verbose=self.verbose)
+
     def dump_database(self):
-        """ Create a dump file of the Postgres database """
+        """ Create a dump of the Postgres database
+
+        In `directory` format, the tables are dumped by :obj:`dump_jobs` parallel jobs. The time spent
+        dumping each table is saved to :obj:`dump_timings`.
+        """
         path = os.path.join(self.cache_dirname, self._get_dump_path())
         if os.path.isfile(path):
             os.remove(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
 
         cmd = [
             'pg_dump',
             '--dbname=' + str(self.base_model.engine.url),
             '--no-owner',
             '--no-privileges',
-            '--format=c',
+            '--verbose',
             '--file=' + path,
         ]
+        if self.dump_format == 'directory':
+            cmd += ['--format=d', '--jobs={}'.format(self.dump_jobs)]
+        else:
+            cmd.append('--format=c')
+        if self.dump_compression is not None:
+            self._check_compression('pg_dump')
+            cmd.append('--compress={}'.format(self.dump_compression))
 
-        p = subprocess.Popen(cmd, stderr=subprocess.PIPE)
-        err = p.communicate()[1].decode()
-        if p.returncode != 0:
+        returncode, err, self.dump_timings = self._run_timed(cmd, parallel=self.dump_format == 'directory')
+        if returncode != 0:
             raise Exception(err)
         if err:
             print(err, file=sys.stderr)
+        self._print_timings('Dumped', self.dump_timings)
 
     def restore_database(self, restore_data=True, restore_schema=False, exit_on_error=True):
-        """ Restore a dump file of the Postgres database
+        """ Restore a dump of the Postgres database
+
+        The tables are restored by :obj:`dump_jobs` parallel jobs. The time spent restoring each
+        table is saved to :obj:`restore_timings`.
 
         Args:
             restore_data (:obj:`bool`, optional): If :obj:`True`, restore data
@@ -235,6 +263,8 @@ class PostgresDataSource(DataSource):
             'pg_restore',
             '--dbname=' + str(self.base_model.engine.url),
             '--no-owner', '--no-privileges',
+            '--verbose',
+            '--jobs={}'.format(self.dump_jobs),
             os.path.join(self.cache_dirname, self._get_dump_path()),
         ]
         if not restore_data:
@@ -245,9 +275,10 @@ class PostgresDataSource(DataSource):
             cmd.append('--data-only')
         if exit_on_error:
             cmd.append('--exit-on-error')
+        if self.dump_compression is not None:
+            self._check_compression('pg_restore')
 
-        p = subprocess.Popen(cmd, stderr=subprocess.PIPE)
-        err = p.communicate()[1].decode()
+        returncode, err, self.restore_timings = self._run_timed(cmd, parallel=self.dump_jobs > 1)
         # Return code is not checked because `pg_restore` exits with non-zero
         # codes even without the `--exit-on-error` option. E.g. `pg_restore`
         # exits with 1 when there are warnings for errors. See:
@@ -256,10 +287,66 @@ class PostgresDataSource(DataSource):
         # todo: try to uncomment below after implementing first migration and
         #       creating new database dump
         #
-        # if p.returncode != 0:
+        # if returncode != 0:
         #     raise Exception(err)
         if err:
             print(err, file=sys.stderr)
+        self._print_timings('Restored', self.restore_timings)
+
+    def _run_timed(self, cmd, parallel=False):
+        """ Run `pg_dump` or `pg_restore` in verbose mode and time the tables from its progress messages
+
+        Args:
+            cmd (:obj:`list` of :obj:`str`): command
+            parallel (:obj:`bool`, optional): if :obj:`True`, the command runs parallel jobs
+
+        Returns:
+            :obj:`tuple`:
+
+                * :obj:`int`: return code
+                * :obj:`str`: errors and warnings
+                * :obj:`dict`: seconds spent on each table
+        """
+        p = subprocess.Popen(cmd, stderr=subprocess.PIPE, universal_newlines=True)
+        lines = []
+        errors = []
+        for line in p.stderr:
+            line = line.rstrip('\n')
+            lines.append((time.time(), line))
+            if 'error:' in line or 'warning:' in line or 'ERROR:' in line or 'WARNING:' in line:
+                errors.append(line)
+        returncode = p.wait()
+        return returncode, '\n'.join(errors), parse_table_timings(lines, time.time(), parallel=parallel)
+
+    def _print_timings(self, action, timings, n=10):
+        """ Print the slowest tables of a dump or restore
+
+        Args:
+            action (:obj:`str`): past tense of action (e.g. `Dumped`)
+            timings (:obj:`dict`): seconds spent on each table
+            n (:obj:`int`, optional): number of tables to print
+        """
+        self.vprint('{} {} tables in {:.1f} s of table time'.format(action, len(timings), sum(timings.values())))
+        for table, seconds in sorted(timings.items(), key=lambda item: -item[1])[:n]:
+            self.vprint('  {:<40s} {:>8.1f} s'.format(table, seconds))
+
+    def _check_compression(self, program):
+        """ Check that `program` supports :obj:`dump_compression`
+
+        Args:
+            program (:obj:`str`): `pg_dump` or `pg_restore`
+
+        Raises:
+            :obj:`ValueError`: if zstd compression is requested and `program` is older than PostgreSQL 16
+        """
+        if not str(self.dump_compression).startswith('zstd'):
+            return
+        version = subprocess.run([program, '--version'], stdout=subprocess.PIPE,
+                                 universal_newlines=True).stdout
+        match = re.search(r'\(PostgreSQL\)\s+(\d+)', version)
+        if not match or int(match.group(1)) < 16:
+            raise ValueError('zstd compression of dumps requires PostgreSQL 16 or later; {} is {}'.format(
+                program, version.strip()))
 
     def _get_dump_path(self):
         """ Get the path where the dump of the database should be saved to or restored from
@@ -267,6 +354,8 @@ class PostgresDataSource(DataSource):
         Returns:
             :obj:`str`: path to the dump of the database
         """
+        if self.dump_format == 'directory':
+            return self.name + '.dump'
         return self.name + '.sql'
 
     @abc.abstractmethod
@@ -310,13 +399,29 @@ class CachedDataSource(DataSource):
         verbose (:obj:`bool`): if :obj:`True`, print status information to the standard output
         quilt_owner (:obj:`str`): owner of Quilt package to save data
         quilt_package (:obj:`str`): identifier of Quilt package to save data
+        backup_store (:obj:`backup_util.PackageStore`): store for backups; defaults to the Quilt package
 
         base_model (:obj:`Base`): base ORM model for the sqlite databse
+
+        BULK_LOAD_PRAGMAS (:obj:`dict`): SQLite settings of connections during bulk loads
+        SAFE_PRAGMAS (:obj:`dict`): SQLite settings restored after bulk loads
     """
 
+    BULK_LOAD_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -512 * 1024,  # KiB
+        'mmap_size': 1024 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    SAFE_PRAGMAS = {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+    }
+
     def __init__(self, name=None, cache_dirname=None, clear_content=False, load_content=False, max_entries=float('inf'),
                  commit_intermediate_results=False, download_backups=True, verbose=False,
-                 quilt_owner=None, quilt_package=None):
+                 quilt_owner=None, quilt_package=None, backup_store=None):
         """
         Args:
             name (:obj:`str`, optional): name
@@ -330,6 +435,7 @@ class CachedDataSource(DataSource):
             verbose (:obj:`bool`, optional): if :obj:`True`, print status information to the standard output
             quilt_owner (:obj:`str`, optional): owner of Quilt package to save data
             quilt_package (:obj:`str`, optional): identifier of Quilt package to save data
+            backup_store (:obj:`backup_util.PackageStore`, optional): store for backups; defaults to the Quilt package
         """
 
         super(CachedDataSource, self).__init__(name=name, verbose=verbose)
@@ -351,6 +457,7 @@ class CachedDataSource(DataSource):
         quilt_config = datanator.config.get_config()['datanator']['quilt']
         self.quilt_owner = quilt_owner or quilt_config['owner']
         self.quilt_package = quilt_package or quilt_config['package']
+        self.backup_store = backup_store
 
         """ Create SQLAlchemy session and load content if necessary """
         if os.path.isfile(self.filename):
@@ -390,6 +497,85 @@ class CachedDataSource(DataSource):
 
         return engine
 
+    @contextlib.contextmanager
+    def bulk_load(self, defer_indexes=True):
+        """ Context in which the sqlite database is configured for loading many rows
+
+        Within the context, connections use a write-ahead log, don't wait for writes to reach
+        the disk, and use large page caches and memory maps (:obj:`BULK_LOAD_PRAGMAS`), and the
+        indexes returned by :obj:`get_deferrable_indexes` are dropped. When the context exits, the
+        session is committed (or rolled back on error), the indexes are recreated, the
+        :obj:`SAFE_PRAGMAS` are restored and the database is analyzed.
+
+        A crash within the context can corrupt the database; the load should be restarted with
+        `clear_content=True`.
+
+        Args:
+            defer_indexes (:obj:`bool`, optional): if :obj:`True`, create the deferrable indexes at the
+                end of the load rather than maintaining them during it
+        """
+        self.session.commit()
+        self.session.close()
+
+        def set_pragmas(dbapi_connection, connection_record):
+            set_sqlite_pragmas(dbapi_connection, self.BULK_LOAD_PRAGMAS)
+        sqlalchemy.event.listen(self.engine, 'connect', set_pragmas)
+        self.engine.dispose()
+
+        deferred = []
+        if defer_indexes:
+            connection = self.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+                existing = set(row[0] for row in cursor.fetchall())
+                for index in self.get_deferrable_indexes():
+                    if index.name in existing:
+                        cursor.execute('DROP INDEX "{}"'.format(index.name))
+                        deferred.append(index)
+                connection.commit()
+            finally:
+                connection.close()
+
+        try:
+            yield
+            self.session.commit()
+        except BaseException:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.close()
+            sqlalchemy.event.remove(self.engine, 'connect', set_pragmas)
+            self.engine.dispose()
+
+            for index in deferred:
+                index.create(bind=self.engine)
+
+            connection = self.engine.raw_connection()
+            try:
+                set_sqlite_pragmas(connection, self.SAFE_PRAGMAS)
+                connection.cursor().execute('ANALYZE')
+                connection.commit()
+            finally:
+                connection.close()
+            self.engine.dispose()
+
+    def get_deferrable_indexes(self):
+        """ Get the indexes which can be created after a bulk load rather than maintained during it
+
+        By default, these are the non-unique indexes of foreign keys, which serve joins rather
+        than the lookups which loaders use to avoid creating duplicate rows.
+
+        Returns:
+            :obj:`list` of :obj:`sqlalchemy.schema.Index`: indexes
+        """
+        indexes = []
+        for table in self.base_model.metadata.sorted_tables:
+            for index in table.indexes:
+                if not index.unique and all(column.foreign_keys for column in index.columns):
+                    indexes.append(index)
+        return indexes
+
     def clear_content(self):
         """ Clear the content of the sqlite database (i.e. drop and recreate all tables). """
         self.base_model.metadata.drop_all(self.engine)
@@ -404,74 +590,36 @@ class CachedDataSource(DataSource):
         return sqlalchemy.orm.sessionmaker(bind=self.engine)()
 
     def upload_backups(self):
-        """ Backup the local sqlite database to Quilt """
-
-        # create temporary directory to checkout package
-        tmp_dirname = tempfile.mkdtemp()
-
-        # install and export package
-        manager = wc_utils.quilt.QuiltManager(tmp_dirname, self.quilt_package, owner=self.quilt_owner)
-        manager.download(sym_links=True)
-
-        # copy new files to package
-        paths = self.get_paths_to_backup()
-        for path in paths:
-            if os.path.isfile(os.path.join(self.cache_dirname, path)):
-                if os.path.isfile(os.path.join(tmp_dirname, path)):
-                    os.remove(os.path.join(tmp_dirname, path))
-                os.symlink(os.path.join(self.cache_dirname, path), os.path.join(tmp_dirname, path))
-            else:
-                if os.path.isdir(os.path.join(tmp_dirname, path)):
-                    shutil.rmtree(os.path.join(tmp_dirname, path))
-
-                root_cache_path = os.path.join(self.cache_dirname, path)
-                root_tmp_path = os.path.join(tmp_dirname, path)
-                for abs_cache_dirname, subdirnames, filenames in os.walk(root_cache_path):
-                    rel_dirname = os.path.relpath(abs_cache_dirname, root_cache_path)
-
-                    for subdirname in subdirnames:
-                        if rel_dirname == '.':
-                            rel_subdirname = subdirname
-                        else:
-                            rel_subdirname = os.path.join(rel_dirname, subdirname)
-                        os.makedirs(os.path.join(root_tmp_path, rel_subdirname))
-
-                    for filename in filenames:
-                        if rel_dirname == '.':
-                            rel_filename = filename
-                        else:
-                            rel_filename = os.path.join(rel_dirname, filename)
-                        os.symlink(os.path.join(root_cache_path, rel_filename),
-                                   os.path.join(root_tmp_path, rel_filename))
-
-        # build and push package
-        manager.upload()
-
-        # cleanup temporary directory
-        shutil.rmtree(tmp_dirname)
+        """ Backup the local sqlite database to Quilt
+
+        Only the chunks which changed since the previous backup are uploaded.
+        """
+        backup = self.get_backup()
+        for path in self.get_paths_to_backup():
+            backup.upload(path, os.path.join(self.cache_dirname, path), flush=False)
+        backup.store.flush()
 
     def download_backups(self):
-        """ Download the local sqlite database from Quilt """
+        """ Download the local sqlite database from Quilt
 
-        # create temporary directory to checkout package
-        tmp_dirname = tempfile.mkdtemp()
+        Only the chunks which differ from the local copy are downloaded.
+        """
+        if not os.path.isdir(self.cache_dirname):
+            os.makedirs(self.cache_dirname)
 
-        # install and export package
-        manager = wc_utils.quilt.QuiltManager(tmp_dirname, self.quilt_package, owner=self.quilt_owner)
+        backup = self.get_backup()
+        for path in self.get_paths_to_backup(download=True):
+            backup.download(path, os.path.join(self.cache_dirname, path))
 
-        # copy requested files from package
-        paths = self.get_paths_to_backup(download=True)
-        for path in paths:
-            manager.download(system_path=path, sym_links=True)
-            if os.path.isfile(os.path.join(self.cache_dirname, path)):
-                os.remove(os.path.join(self.cache_dirname, path))
-            elif os.path.isdir(os.path.join(self.cache_dirname, path)):
-                shutil.rmtree(os.path.join(self.cache_dirname, path))
-            os.rename(os.path.join(tmp_dirname, path),
-                      os.path.join(self.cache_dirname, path))
+    def get_backup(self):
+        """ Get the content-addressed backup of the local copy of the data source
 
-        # cleanup temporary directory
-        shutil.rmtree(tmp_dirname)
+        Returns:
+            :obj:`backup_util.ChunkedBackup`: backup
+        """
+        store = self.backup_store or backup_util.QuiltPackageStore(self.quilt_package, quilt_owner=self.quilt_owner,
+                                                                   verbose=self.verbose)
+        return backup_util.ChunkedBackup(store, verbose=self.verbose)
 
     def get_paths_to_backup(self, download=False):
         """ Get a list of the files to backup/unpack
@@ -538,7 +686,7 @@ class HttpDataSource(CachedDataSource):
     def __init__(self, name=None, cache_dirname=None, clear_content=False, load_content=False, max_entries=float('inf'),
                  commit_intermediate_results=False, download_backups=True, verbose=False,
                  clear_requests_cache=False, download_request_backup=False,
-                 quilt_owner=None, quilt_package=None):
+                 quilt_owner=None, quilt_package=None, backup_store=None):
         """
         Args:
             name (:obj:`str`, optional): name
@@ -554,6 +702,7 @@ class HttpDataSource(CachedDataSource):
             download_request_backup (:obj:`bool`, optional): if :obj:`True`, download the request backup
             quilt_owner (:obj:`str`, optional): owner of Quilt package to save data
             quilt_package (:obj:`str`, optional): identifier of Quilt package to save data
+            backup_store (:obj:`backup_util.PackageStore`, optional): store for backups; defaults to the Quilt package
         """
 
         """ CachedDataSource settings """
@@ -578,7 +727,8 @@ class HttpDataSource(CachedDataSource):
                                              clear_content=clear_content, load_content=load_content, max_entries=max_entries,
                                              commit_intermediate_results=commit_intermediate_results,
                                              download_backups=download_backups, verbose=verbose,
-                                             quilt_owner=quilt_owner, quilt_package=quilt_package)
+                                             quilt_owner=quilt_owner, quilt_package=quilt_package,
+                                             backup_store=backup_store)
 
     def get_requests_session(self):
         """ Setup an cache-enabled HTTP request session
@@ -636,6 +786,63 @@ class WebserviceDataSource(DataSource):
             self.requests_session.mount(endpoint_domain, requests.adapters.HTTPAdapter(max_retries=self.MAX_HTTP_RETRIES))
 
 
+def parse_table_timings(lines, end_time, parallel=False):
+    """ Get the time spent on each table from the verbose messages of `pg_dump` or `pg_restore`
+
+    A table starts when a job reports that it is dumping, processing or launching the table and
+    ends when the job reports that it finished the table. Serial runs don't report when tables
+    finish; there, each table ends when the next one starts.
+
+    Args:
+        lines (:obj:`list` of :obj:`tuple`): pairs of the time and text of each message
+        end_time (:obj:`float`): time when the command exited
+        parallel (:obj:`bool`, optional): if :obj:`True`, the messages are from parallel jobs
+
+    Returns:
+        :obj:`dict`: seconds spent on each table
+    """
+    start_patterns = [
+        re.compile(r'dumping contents of table "(?P<table>[^"]+)"'),
+        re.compile(r'processing data for table "(?P<table>[^"]+)"'),
+        re.compile(r'launching item \d+ TABLE DATA (?:(?P<schema>\S+) )?(?P<table>\S+)$'),
+    ]
+    finish_pattern = re.compile(r'finished item \d+ TABLE DATA (?:(?P<schema>\S+) )?(?P<table>\S+)$')
+
+    timings = {}
+    started = {}
+    for timestamp, line in lines:
+        for pattern in start_patterns:
+            match = pattern.search(line)
+            if match:
+                if not parallel:
+                    for table, start in started.items():
+                        timings[table] = timings.get(table, 0.) + timestamp - start
+                    started = {}
+                started[match.group('table').rpartition('.')[2]] = timestamp
+                break
+        else:
+            match = finish_pattern.search(line)
+            if match and match.group('table') in started:
+                table = match.group('table')
+                timings[table] = timings.get(table, 0.) + timestamp - started.pop(table)
+    for table, start in started.items():
+        timings[table] = timings.get(table, 0.) + end_time - start
+    return timings
+
+
+def set_sqlite_pragmas(dbapi_connection, pragmas):
+    """ Set the pragmas of a sqlite connection
+
+    Args:
+        dbapi_connection (:obj:`sqlite3.Connection`): connection
+        pragmas (:obj:`dict`): values of pragmas
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas.items():
+        cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+    cursor.close()
+
+
 class DataSourceWarning(UserWarning):
     """ Data source warning """
     pass
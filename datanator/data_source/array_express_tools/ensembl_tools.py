@@ -1,5 +1,8 @@
-from ete3 import NCBITaxa
+from datanator.util import taxonomy_util
+from datanator.util.constants import DATA_CACHE_DIR
+import bisect
 import ftplib
+import functools
 import os
 import socket
 import json
@@ -99,7 +102,7 @@ class StrainInfo(object):
 
 
 def get_taxonomic_lineage(base_species):
-    """ Get the lineage of a species
+    """ Get the lineage of a species. Lookups are memoized.
 
         Args:
             base_species (:obj:`bool`): a species (e.g. escherichia coli)
@@ -107,18 +110,16 @@ def get_taxonomic_lineage(base_species):
         Returns:
             :`list` of :obj:`str`: a list of strings corresponding to the layer of its taxonomy
     """
+    return list(_get_taxonomic_lineage(base_species))
 
-    ncbi = NCBITaxa()
+
+@functools.lru_cache(maxsize=None)
+def _get_taxonomic_lineage(base_species):
+    ncbi = taxonomy_util.get_ncbi_taxa()
     base_species = ncbi.get_name_translator([base_species])[base_species][0]
     lineage = ncbi.get_lineage(base_species)
     names = ncbi.get_taxid_translator(lineage)
-    chain = [names[taxid] for taxid in lineage]
-    i = len(chain)
-    new = []
-    while i > 0:
-        new.append(chain[i-1])
-        i = i-1
-    return new
+    return tuple(names[taxid] for taxid in reversed(lineage))
 
 
 def format_org_name(name):
@@ -174,7 +175,7 @@ def get_strain_info(sample):
     if domain == "Bacteria":
         if strain:
             organism = "{} {}".format(organism.lower(), strain.lower())
-        data = json.load(open('{}/kegg_taxon_prokaryotes.txt'.format(os.path.dirname(__file__))))
+        index = get_organism_index()
         org_tree = organism.split(" ")
 
         for num in range(len(org_tree), 0, -1):
@@ -182,21 +183,15 @@ def get_strain_info(sample):
             if num >= 2:
                 if num < len(org_tree):
                     full_strain_specificity = False  # this means it didnt find the specificity on the first try
-                file = open("{}/find_cdna_url.txt".format(os.path.dirname(os.path.abspath(__file__))))
-                try_org = ""
-                for word in org_tree[:num]:
-                    try_org = try_org + word + " "
-                try_org = try_org[:-1]
+                try_org = " ".join(org_tree[:num])
                 print(try_org)
 
-                for thing in get_json_ends(data):
-                    org_name = format_org_name(thing.split('  ')[1])
-                    if org_name.startswith(format_org_name(try_org)):
-                        kegg_org_symbol = thing.split('  ')[0]
-                        url = get_ref_seq_url(kegg_org_symbol)
-                        spec_name = org_name.replace("-","_").replace(" ", "_")
-                        full_strain_specificity ==True
-                        return StrainInfo(spec_name, url, full_strain_specificity, "Bacteria")
+                match = index.find(try_org)
+                if match is not None:
+                    kegg_org_symbol, org_name = match
+                    url = get_ref_seq_url(kegg_org_symbol)
+                    spec_name = org_name.replace("-","_").replace(" ", "_")
+                    return StrainInfo(spec_name, url, full_strain_specificity, "Bacteria")
         raise LookupError("organism not recognized")
 
 
@@ -222,6 +217,143 @@ def get_strain_info(sample):
 
 
 
+class OrganismIndex(object):
+    """ Index of the names of the prokaryotes in the KEGG taxonomy
+
+    Names are normalized with :obj:`format_org_name` and kept in sorted order, so that the
+    organisms whose names start with a query are found by binary search. Answers are memoized
+    by normalized query.
+
+    Attributes:
+        symbols (:obj:`list` of :obj:`str`): KEGG organism codes, in the order of the KEGG taxonomy
+        names (:obj:`list` of :obj:`str`): normalized names, in the order of the KEGG taxonomy
+        sorted_names (:obj:`list` of :obj:`str`): normalized names in alphabetical order
+        sorted_ids (:obj:`list` of :obj:`int`): position in :obj:`names` of each name in :obj:`sorted_names`
+    """
+
+    def __init__(self, symbols, names):
+        """
+        Args:
+            symbols (:obj:`list` of :obj:`str`): KEGG organism codes, in the order of the KEGG taxonomy
+            names (:obj:`list` of :obj:`str`): normalized names, in the order of the KEGG taxonomy
+        """
+        self.symbols = symbols
+        self.names = names
+        self.sorted_ids = sorted(range(len(names)), key=lambda i: (names[i], i))
+        self.sorted_names = [names[i] for i in self.sorted_ids]
+        self._matches = {}
+
+    @classmethod
+    def from_taxonomy(cls, filename):
+        """ Build the index from the KEGG taxonomy (e.g. `kegg_taxon_prokaryotes.txt`)
+
+        Args:
+            filename (:obj:`str`): path to the KEGG taxonomy in JSON format
+
+        Returns:
+            :obj:`OrganismIndex`: index
+        """
+        with open(filename, 'r') as file:
+            tree = json.load(file)
+        symbols = []
+        names = []
+        for end in get_json_ends(tree):
+            parts = end.split('  ')
+            symbols.append(parts[0])
+            names.append(format_org_name(parts[1]))
+        return cls(symbols, names)
+
+    @classmethod
+    def load(cls, filename):
+        """ Load an index saved with :obj:`save`
+
+        Args:
+            filename (:obj:`str`): path to the saved index
+
+        Returns:
+            :obj:`OrganismIndex`: index
+        """
+        with open(filename, 'r') as file:
+            data = json.load(file)
+        index = cls.__new__(cls)
+        index.symbols = data['symbols']
+        index.names = data['names']
+        index.sorted_ids = data['sorted_ids']
+        index.sorted_names = [index.names[i] for i in index.sorted_ids]
+        index._matches = {}
+        return index
+
+    def save(self, filename):
+        """ Save the index
+
+        Args:
+            filename (:obj:`str`): path to save the index
+        """
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp_filename, 'w') as file:
+            json.dump({'symbols': self.symbols, 'names': self.names, 'sorted_ids': self.sorted_ids},
+                      file, separators=(',', ':'))
+        os.replace(tmp_filename, filename)
+
+    def find(self, organism):
+        """ Find the first organism in the KEGG taxonomy whose normalized name starts with the
+        normalized name of an organism
+
+        Args:
+            organism (:obj:`str`): name of an organism (e.g. escherichia coli str. k-12)
+
+        Returns:
+            :obj:`tuple`: KEGG organism code and normalized name, or :obj:`None` if no organism matches
+        """
+        query = format_org_name(organism)
+        if query not in self._matches:
+            start = bisect.bisect_left(self.sorted_names, query)
+            end = start
+            while end < len(self.sorted_names) and self.sorted_names[end].startswith(query):
+                end += 1
+            if start == end:
+                self._matches[query] = None
+            else:
+                i = min(self.sorted_ids[start:end])
+                self._matches[query] = (self.symbols[i], self.names[i])
+        return self._matches[query]
+
+
+ORGANISM_TAXONOMY_FILENAME = os.path.join(os.path.dirname(__file__), 'kegg_taxon_prokaryotes.txt')
+ORGANISM_INDEX_FILENAME = os.path.join(DATA_CACHE_DIR, 'array_express', 'kegg_prokaryotes_index.json')
+
+
+@functools.lru_cache(maxsize=None)
+def get_organism_index(taxonomy_filename=ORGANISM_TAXONOMY_FILENAME, index_filename=ORGANISM_INDEX_FILENAME):
+    """ Get the index of the prokaryotes in the KEGG taxonomy, loading it once per process
+
+    The index is saved to :obj:`index_filename` the first time it is built from the taxonomy,
+    and rebuilt when the taxonomy is newer than the saved index.
+
+    Args:
+        taxonomy_filename (:obj:`str`, optional): path to the KEGG taxonomy in JSON format
+        index_filename (:obj:`str`, optional): path to the saved index, or :obj:`None` to not save the index
+
+    Returns:
+        :obj:`OrganismIndex`: index
+    """
+    if index_filename and os.path.isfile(index_filename) \
+            and os.path.getmtime(index_filename) >= os.path.getmtime(taxonomy_filename):
+        try:
+            return OrganismIndex.load(index_filename)
+        except (ValueError, KeyError):
+            pass
+    index = OrganismIndex.from_taxonomy(taxonomy_filename)
+    if index_filename:
+        try:
+            index.save(index_filename)
+        except OSError:
+            pass
+    return index
+
+
+@functools.lru_cache(maxsize=None)
 def get_ref_seq_url(org_symbol):
     text = requests.get("http://www.kegg.jp/kegg-bin/show_organism?org={}".format(org_symbol)).text
     text = text[text.find("ftp://ftp.ncbi.nlm.nih.gov/genomes/all"):]
@@ -1,12 +1,12 @@
 from io import BytesIO
 import csv
-import ete3
 import json
 import os
 import pymongo
 import requests
 import zipfile
 from datanator.util import mongo_util
+from datanator.util import taxonomy_util
 import datanator.config.core
 
 class CorumNoSQL(mongo_util.MongoUtil):
@@ -27,8 +27,16 @@ class CorumNoSQL(mongo_util.MongoUtil):
                     verbose=verbose, max_entries=max_entries, username = username, password = password,
                     authSource = authSource)
 
-    def load_content(self, endpoint='corum'):
-        """ Collect and parse all data from CORUM website into JSON files and add to NoSQL database """
+    def load_content(self, endpoint='corum', bulk_size=1000):
+        """ Collect and parse all data from CORUM website into JSON files and add to NoSQL database
+
+        Args:
+            endpoint (:obj:`str`, optional): 'corum' or 'splice'
+            bulk_size (:obj:`int`, optional): number of complexes per bulk write
+
+        Returns:
+            :obj:`pymongo.collection.Collection`: collection of complexes
+        """
         database_url = self.ENDPOINT_DOMAINS[endpoint]
         _, _, collection = self.con_db(self.collection)
         os.makedirs(os.path.join(
@@ -53,128 +61,24 @@ class CorumNoSQL(mongo_util.MongoUtil):
         else:
             cwd = os.path.join(self.cache_dirname, 'spliceComplexes.txt')
 
-        # create object to find NCBI taxonomy IDs
-        ncbi_taxa = ete3.NCBITaxa()
-
-        with open(cwd, 'r') as file:
-            i_entry = 0
-            for entry in csv.DictReader(file, delimiter='\t'):
-                # entry/line number in file
-                i_entry += 1
-
-                # stop if the maximum desired number of entries has been reached
-                if i_entry > self.max_entries:
-                    break
-
-                # replace 'None' strings with None
-                for key, val in entry.items():
-                    if val == 'None':
-                        entry[key] = None
-
-                # extract attributes
-                complex_id = int(entry['ComplexID'])
-                entry['complex_id'] = complex_id #replace string value with int value
-                complex_name = entry['ComplexName']
-                cell_line = entry['Cell line']
-                pur_method = entry['Protein complex purification method']
-                # SETS OF INT IDS SEPARATED BY ; eg. GO:0005634
-                go_id = entry['GO ID']
-                go_dsc = entry['GO description']
-                funcat_id = entry['FunCat ID']
-                funcat_dsc = entry['FunCat description']
-                pubmed_id = int(entry['PubMed ID'])
-                entry['pubmed_id'] = pubmed_id
-                gene_name = entry['subunits(Gene name)']
-                gene_syn = entry['subunits(Gene name syn)']
-                complex_syn = entry['Synonyms']
-                disease_cmt = entry['Disease comment']
-                su_cmt = entry['Subunits comment']
-                complex_cmt = entry['Complex comment']
-
-                su_uniprot = entry['subunits(UniProt IDs)']  # SETS OF STRING IDS SEPARATED BY ;\
-                su_entrez = entry['subunits(Entrez IDs)']  # SETS OF INT IDS SEPARATED BY ;
-                protein_name = entry['subunits(Protein name)']
-                swissprot_id = entry['SWISSPROT organism']
-
-                """ ----------------- Apply field level corrections-----------------"""
-                # Split the semicolon-separated lists of subunits into protein components,
-                # ignoring semicolons inside square brackets
-                su_uniprot_list = parse_list(su_uniprot)
-                entry['subunits_isoform_id'] = su_uniprot_list
-                parsed_su_uniprot_list = parse_subunits(su_uniprot_list)
-                entry['subunits_uniprot_id'] = parsed_su_uniprot_list
-                del entry['subunits(UniProt IDs)']
-                
-                su_entrez_list = parse_list(su_entrez)
-                entry['subunits_entrez_id'] = su_entrez_list
-                del entry['subunits(Entrez IDs)']
-                
-                go_id_list = parse_list(go_id)
-                entry['go_id'] = go_id_list
-                del entry['GO ID']
-                
-                go_dsc_list = parse_list(go_dsc)
-                entry['go_description'] = go_dsc_list
-                del entry['GO description']
-
-                funcat_id_list = parse_list(funcat_id)
-                entry['funcat_id'] = funcat_id_list
-                del entry['FunCat ID']
-
-                funcat_dsc_list = parse_list(funcat_dsc)
-                entry['funcat_description'] = funcat_dsc_list
-                del entry['FunCat description']
-
-
-                gene_name_list = parse_list(gene_name)
-                entry['subunits_gene_name'] = gene_name_list
-                del entry['subunits(Gene name)']
-
-                gene_syn_list = parse_list(gene_syn)
-                entry['subunits_gene_name_synonym'] = gene_syn_list
-                del entry['subunits(Gene name syn)']
-
-                protein_name_list = parse_list(
-                    correct_protein_name_list(protein_name))
-               	entry['subunits_protein_name'] = protein_name_list
-                del entry['subunits(Protein name)']
-
-
-                # check list lengths match
-                if len(protein_name_list) != len(su_entrez_list):
-                    msg = 'Unequal number of uniprot/entrez subunits at line {}\n  {}\n  {}'.format(
-                        i_entry, '; '.join(protein_name_list), '; '.join(su_entrez_list))
-                    raise Exception(msg)
-
-                if len(su_uniprot_list) != len(su_entrez_list):
-                    msg = 'Unequal number of uniprot/entrezs subunits at line {}\n  {}\n  {}'.format(
-                        i_entry, '; '.join(su_uniprot_list), '; '.join(su_entrez_list))
-                    raise Exception(msg)
-
-                # Fix the redundancy issue with swissprot_id field
-                if swissprot_id:
-                    swissprot_id, _, _ = swissprot_id.partition(';')
-                    ncbi_name, _, _ = swissprot_id.partition(' (')
-                    result = ncbi_taxa.get_name_translator([ncbi_name])
-                    ncbi_id = result[ncbi_name][0]
-                else:
-                    ncbi_id = None
-                entry['SWISSPROT_organism_NCBI_ID'] = ncbi_id
-                del entry['SWISSPROT organism']
-
-                file_name = 'corum_' + str(entry['complex_id']) + '.json'
-                full_path = os.path.join(
-                    self.cache_dirname, self.collection, file_name)
-
-                with open(full_path, 'w') as f:
-                    f.write(json.dumps(entry, indent=4))
-
-                
-                collection.update_one({'ComplexID': entry['ComplexID']},
-                    {'$set': entry},
-                    upsert=True
-                    )
-                    
+        bulk = []
+        for entry in iter_complexes(cwd, max_entries=self.max_entries):
+            file_name = 'corum_' + str(entry['complex_id']) + '.json'
+            full_path = os.path.join(
+                self.cache_dirname, self.collection, file_name)
+
+            with open(full_path, 'w') as f:
+                f.write(json.dumps(entry, indent=4))
+
+            bulk.append(pymongo.UpdateOne({'ComplexID': entry['ComplexID']},
+                {'$set': entry},
+                upsert=True
+                ))
+            if len(bulk) == bulk_size:
+                collection.bulk_write(bulk, ordered=False)
+                bulk = []
+        if len(bulk) != 0:
+            collection.bulk_write(bulk, ordered=False)
 
         return collection
 
@@ -183,6 +87,91 @@ class CorumNoSQL(mongo_util.MongoUtil):
 '''Helper functions
 '''
 
+def iter_complexes(filename, max_entries=float('inf')):
+    """ Parse a CORUM complex file (e.g. allComplexes.txt) into documents, one complex at a time
+
+    Args:
+        filename (:obj:`str`): path to the tab-separated CORUM file
+        max_entries (:obj:`int`, optional): maximum number of complexes to parse
+
+    Yields:
+        :obj:`dict`: parsed complex
+    """
+    with open(filename, 'r') as file:
+        i_entry = 0
+        for entry in csv.DictReader(file, delimiter='\t'):
+            # entry/line number in file
+            i_entry += 1
+
+            # stop if the maximum desired number of entries has been reached
+            if i_entry > max_entries:
+                break
+
+            yield parse_complex(entry, i_entry)
+
+
+def parse_complex(entry, i_entry):
+    """ Apply field level corrections to a raw CORUM row
+
+    Args:
+        entry (:obj:`dict`): row of the CORUM file
+        i_entry (:obj:`int`): line number of the row, used in error messages
+
+    Returns:
+        :obj:`dict`: parsed complex
+    """
+    # replace 'None' strings with None
+    for key, val in entry.items():
+        if val == 'None':
+            entry[key] = None
+
+    entry['complex_id'] = int(entry['ComplexID']) #replace string value with int value
+    entry['pubmed_id'] = int(entry['PubMed ID'])
+
+    # Split the semicolon-separated lists of subunits into protein components,
+    # ignoring semicolons inside square brackets
+    su_uniprot_list = parse_list(entry.pop('subunits(UniProt IDs)'))
+    entry['subunits_isoform_id'] = su_uniprot_list
+    entry['subunits_uniprot_id'] = parse_subunits(su_uniprot_list)
+
+    su_entrez_list = parse_list(entry.pop('subunits(Entrez IDs)'))
+    entry['subunits_entrez_id'] = su_entrez_list
+
+    entry['go_id'] = parse_list(entry.pop('GO ID'))
+    entry['go_description'] = parse_list(entry.pop('GO description'))
+    entry['funcat_id'] = parse_list(entry.pop('FunCat ID'))
+    entry['funcat_description'] = parse_list(entry.pop('FunCat description'))
+    entry['subunits_gene_name'] = parse_list(entry.pop('subunits(Gene name)'))
+    entry['subunits_gene_name_synonym'] = parse_list(entry.pop('subunits(Gene name syn)'))
+
+    protein_name_list = parse_list(
+        correct_protein_name_list(entry.pop('subunits(Protein name)')))
+    entry['subunits_protein_name'] = protein_name_list
+
+    # check list lengths match
+    if len(protein_name_list) != len(su_entrez_list):
+        msg = 'Unequal number of uniprot/entrez subunits at line {}\n  {}\n  {}'.format(
+            i_entry, '; '.join(protein_name_list), '; '.join(su_entrez_list))
+        raise Exception(msg)
+
+    if len(su_uniprot_list) != len(su_entrez_list):
+        msg = 'Unequal number of uniprot/entrezs subunits at line {}\n  {}\n  {}'.format(
+            i_entry, '; '.join(su_uniprot_list), '; '.join(su_entrez_list))
+        raise Exception(msg)
+
+    # Fix the redundancy issue with swissprot_id field
+    swissprot_id = entry.pop('SWISSPROT organism')
+    if swissprot_id:
+        swissprot_id, _, _ = swissprot_id.partition(';')
+        ncbi_name, _, _ = swissprot_id.partition(' (')
+        ncbi_id = taxonomy_util.get_ncbi_id_by_name(ncbi_name)
+    else:
+        ncbi_id = None
+    entry['SWISSPROT_organism_NCBI_ID'] = ncbi_id
+
+    return entry
+
+
 def parse_list(str_lst):
     """ Parse a semicolon-separated list of strings into a list, ignoring semicolons that are inside square brackets
 
@@ -1,7 +1,10 @@
 from datanator_query_python.util import mongo_util
+from datanator.util import flat_file_util
 import datanator.config.core
 from ftplib import FTP
 from pathlib import Path
+from pymongo import UpdateOne
+import itertools
 import tempfile
 import shutil
 
@@ -40,28 +43,30 @@ class EC(mongo_util.MongoUtil):
         ftp.close()
         return data_file
 
-    def parse_content(self, file_location):
+    def parse_content(self, file_location, bulk_size=1000):
         """Parse enzyme.dat file.
 
+        Records are read off a memory map of the file and upserted in batches.
+
         Args:
             file_location(:obj:`str`): location of enzyme.dat file.
+            bulk_size (:obj:`int`, optional): number of records per bulk write.
+
+        Return:
+            (:obj:`int`): number of records upserted.
         """
-        with open(file_location, 'r') as f:
-            count = 0
-            while count < self.max_entries:
-                lines_of_interest = []
-                for line in f:
-                    if line.strip() == '//':
-                        break
-                    lines_of_interest.append(line.rstrip('\n'))
-                doc = self.make_doc(lines_of_interest)
-                if doc == {}:
-                    continue
-                if self.verbose and count % 10 == 0:
-                    print('Updating EC record {}'.format(doc.get('ec_number')))
-                self.collection.update_one({'ec_number': doc.get('ec_number')},
-                                           {'$set': doc}, upsert=True)
-                count += 1
+        records = flat_file_util.ENZYME_FORMAT.iter_records(file_location)
+        docs = (doc for doc in map(self.make_doc, records) if doc != {})
+        if self.max_entries != float('inf'):
+            docs = itertools.islice(docs, int(self.max_entries))
+        count = 0
+        for batch in flat_file_util.iter_batches(docs, bulk_size):
+            if self.verbose:
+                print('Updating EC records {} to {}'.format(batch[0].get('ec_number'), batch[-1].get('ec_number')))
+            self.collection.bulk_write([UpdateOne({'ec_number': doc.get('ec_number')}, {'$set': doc}, upsert=True)
+                                        for doc in batch], ordered=False)
+            count += len(batch)
+        return count
 
     def make_doc(self, lines):
         """Turn a block of EC info into a dictionary object
@@ -2,17 +2,247 @@ from datanator_query_python.query import query_kegg_organism_code, query_uniprot
 from datanator_query_python.util import mongo_util
 from datanator.data_source import uniprot_nosql
 import datanator.config.core
+import itertools
 import json
+import os
 import requests
+import threading
+import time
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pymongo import UpdateOne
+from urllib.parse import quote, urlparse
 import re
 
 
+class HostRateLimiter:
+    """Space out requests to each host.
+
+    Attributes:
+        interval (:obj:`float`): minimum number of seconds between the starts of two requests to a host
+    """
+
+    def __init__(self, requests_per_second=3.):
+        """
+        Args:
+            requests_per_second (:obj:`float`, optional): maximum number of requests per second to each host
+        """
+        self.interval = 1. / requests_per_second if requests_per_second else 0.
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """Block until a request to the host of a URL may be sent.
+
+        Args:
+            url (:obj:`str`): URL of the request
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class SsdbFetcher:
+    """Fetch KEGG SSDB best-hit pages concurrently.
+
+    Pages are downloaded by a bounded pool of threads which share a per-host rate limit,
+    and, if a cache directory is given, are saved on disk keyed by org:gene so that
+    later runs only download new genes.
+
+    Attributes:
+        cache_dirname (:obj:`str`): directory of saved pages
+        max_workers (:obj:`int`): maximum number of concurrent downloads
+        rate_limiter (:obj:`HostRateLimiter`): per-host rate limit
+        session (:obj:`requests.Session`): HTTP session
+        verbose (:obj:`bool`): if :obj:`True`, print failed downloads
+        counts (:obj:`dict`): numbers of pages fetched, cache hits, downloads, errors and bytes downloaded
+    """
+
+    endpoint = 'https://www.kegg.jp/ssdb-bin/ssdb_best?org_gene='
+
+    def __init__(self, cache_dirname=None, max_workers=4, requests_per_second=3., session=None,
+                 verbose=False):
+        """
+        Args:
+            cache_dirname (:obj:`str`, optional): directory of saved pages
+            max_workers (:obj:`int`, optional): maximum number of concurrent downloads
+            requests_per_second (:obj:`float`, optional): maximum number of requests per second to each host
+            session (:obj:`requests.Session`, optional): HTTP session
+            verbose (:obj:`bool`, optional): if :obj:`True`, print failed downloads
+        """
+        self.cache_dirname = cache_dirname
+        self.max_workers = max_workers
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.session = session or requests.Session()
+        self.verbose = verbose
+        self.counts = {'pages': 0, 'cache_hits': 0, 'downloads': 0, 'errors': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        self._start = time.time()
+        if cache_dirname:
+            os.makedirs(cache_dirname, exist_ok=True)
+
+    @property
+    def metrics(self):
+        """Progress and throughput of the fetcher.
+
+        Return:
+            (:obj:`dict`): counts, elapsed seconds, pages per second and cache hit rate
+        """
+        with self._lock:
+            metrics = dict(self.counts)
+        metrics['seconds'] = time.time() - self._start
+        metrics['pages_per_second'] = metrics['pages'] / metrics['seconds'] if metrics['seconds'] else 0.
+        metrics['cache_hit_rate'] = metrics['cache_hits'] / metrics['pages'] if metrics['pages'] else 0.
+        return metrics
+
+    def reset(self):
+        """ Restart the counts and the clock of :obj:`metrics` """
+        with self._lock:
+            self.counts = {key: 0 for key in self.counts}
+        self._start = time.time()
+
+    def _count(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] += value
+
+    def cache_path(self, query):
+        """Path of the saved page of a gene.
+
+        Args:
+            query (:obj:`str`): org:gene_code string, e.g. aly:ARALYDRAFT_486312.
+
+        Return:
+            (:obj:`str`): path, or :obj:`None` if pages are not saved
+        """
+        if not self.cache_dirname:
+            return None
+        return os.path.join(self.cache_dirname, quote(query, safe='') + '.html')
+
+    def fetch(self, query):
+        """Get the page of a gene, from the cache if it was already downloaded.
+
+        Args:
+            query (:obj:`str`): org:gene_code string, e.g. aly:ARALYDRAFT_486312.
+
+        Return:
+            (:obj:`str`): HTML
+
+        Raises:
+            :obj:`requests.exceptions.RequestException`: if the page cannot be downloaded
+        """
+        path = self.cache_path(query)
+        if path and os.path.isfile(path):
+            with open(path, 'r') as f:
+                text = f.read()
+            self._count(pages=1, cache_hits=1)
+            return text
+
+        url = self.endpoint + query
+        self.rate_limiter.wait(url)
+        try:
+            r = self.session.get(url)
+            r.raise_for_status()
+        except requests.exceptions.RequestException:
+            self._count(errors=1)
+            raise
+        text = r.text
+        if path:
+            tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        self._count(pages=1, downloads=1, bytes=len(r.content))
+        return text
+
+    def fetch_all(self, queries):
+        """Fetch the pages of genes concurrently, in the order in which they arrive.
+
+        Queries are read lazily and at most twice :obj:`max_workers` pages are in flight, so
+        the caller can parse each page while the next ones are downloaded. Repeated queries
+        are fetched once. Pages which cannot be downloaded are skipped.
+
+        Args:
+            queries (:obj:`iter` of :obj:`str`): org:gene_code strings
+
+        Return:
+            (:obj:`iter` of :obj:`tuple`): (query, HTML) pairs
+        """
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            queries = iter(queries)
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < 2 * self.max_workers:
+                    query = next(queries, None)
+                    if query is None:
+                        exhausted = True
+                    elif query not in seen:
+                        seen.add(query)
+                        pending[executor.submit(self.fetch, query)] = query
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    query = pending.pop(future)
+                    try:
+                        text = future.result()
+                    except requests.exceptions.RequestException as e:
+                        if self.verbose:
+                            print('    Unable to fetch {}: {}'.format(query, e))
+                        continue
+                    yield query, text
+
+
+def parse_ssdb_hits(soup):
+    """Parse the hits of a KEGG SSDB best-hit page
+    (https://www.kegg.jp/ssdb-bin/ssdb_best?org_gene=aly:ARALYDRAFT_486312).
+
+    Args:
+        soup (:obj:`BeautifulSoup`): BeautifulSoup object
+
+    Return:
+        (:obj:`iter` of :obj:`dict`): org_gene, length, sw_score, margin, bits, identity and overlap of each hit
+    """
+    org_gene_objs = soup.find_all(attrs={"type": "checkbox"})
+    value_objs = soup.find_all(string=re.compile('<->'))
+    for org_gene, value_str in zip(org_gene_objs, value_objs):
+        values_list = ' '.join(value_str.split()).split()
+        bits = int(values_list[-4])
+        identity = float(values_list[-3])
+        overlap = int(values_list[-2])
+        margin = values_list[-5]
+        if margin[0] == '(':
+            margin = int(margin[1:-1])
+            length = int(values_list[-7])
+            sw_score = int(values_list[-6])
+        elif margin[0] == '-':
+            margin = None
+            length = int(values_list[-8])
+            sw_score = int(values_list[-7])
+        else:
+            margin = int(margin[0:-1])
+            length = int(values_list[-8])
+            sw_score = int(values_list[-7])
+        yield {'org_gene': org_gene.get('value'),
+               'length': length,
+               'sw_score': sw_score,
+               'margin': margin,
+               'bits': bits,
+               'identity': identity,
+               'overlap': overlap}
+
+
 class KeggGeneOrtholog(mongo_util.MongoUtil):
 
     def __init__(self, server, src_db='datanator', des_db='datanator', collection_str='uniprot',
                 username=None, password=None, readPreference='nearest', authSource='admin', verbose=True,
-                max_entries=float('inf')):
+                max_entries=float('inf'), cache_dirname=None, max_workers=4, requests_per_second=3.):
         super().__init__(MongoDB=server, db=des_db, verbose=verbose, max_entries=max_entries,
                         username=username, password=password, authSource=authSource,
                         readPreference=readPreference)
@@ -31,7 +261,13 @@ class KeggGeneOrtholog(mongo_util.MongoUtil):
         authSource=authSource, database=src_db, max_entries=max_entries, verbose=verbose, readPreference=readPreference)
         self.uniprot_nosql_manager = uniprot_nosql.UniprotNoSQL(MongoDB=server, db=des_db, max_entries=max_entries,
         verbose=verbose, username=username, password=password, authSource=authSource)
-        self.endpoint = 'https://www.kegg.jp/ssdb-bin/ssdb_best?org_gene='
+        self.fetcher = SsdbFetcher(cache_dirname=os.path.join(cache_dirname, 'kegg_ssdb') if cache_dirname else None,
+                                   max_workers=max_workers, requests_per_second=requests_per_second, verbose=verbose)
+        self.endpoint = self.fetcher.endpoint
+        # answers of the nested lookups, which repeat across the hits of different pages
+        self._uniprot_ids = {}
+        self._org_genes = {}
+        self._gene_info = {}
 
     def get_html(self, query):
         """Get HTML file based on org:gene_code string,
@@ -40,9 +276,7 @@ class KeggGeneOrtholog(mongo_util.MongoUtil):
         Args:
             query (:obj:`str`): org:gene_code string.
         """
-        r = requests.get(self.endpoint + query)
-        soup = BeautifulSoup(r.content, 'html.parser')
-        return soup
+        return BeautifulSoup(self.fetcher.fetch(query), 'html.parser')
     
     def parse_html(self, soup):
         """Parse out gene_orthologs from HTML 
@@ -51,56 +285,48 @@ class KeggGeneOrtholog(mongo_util.MongoUtil):
         Args:
             soup (:obj:`BeautifulSoup`): BeautifulSoup object
         """
-        org_gene_objs = soup.find_all(attrs={"type": "checkbox"})
-        value_objs = soup.find_all(string=re.compile('<->'))
-        for org_gene, value_str in zip(org_gene_objs, value_objs):
-            values_list = ' '.join(value_str.split()).split()
-            bits = int(values_list[-4])
-            identity = float(values_list[-3])
-            overlap = int(values_list[-2])            
-            margin = values_list[-5]
-            if margin[0] == '(':
-                margin = int(margin[1:-1])
-                length = int(values_list[-7])
-                sw_score = int(values_list[-6])
-            elif margin[0] == '-':
-                margin = None
-                length = int(values_list[-8])
-                sw_score = int(values_list[-7])
-            else:
-                margin = int(margin[0:-1])
-                length = int(values_list[-8])
-                sw_score = int(values_list[-7])                                
-            org_gene_str = org_gene.get('value')
-            docs, count = self.uniprot_manager.get_id_by_org_gene(org_gene_str)
-            ncbi_id = self.koc_manager.get_ncbi_by_org_code(org_gene_str.split(':')[0])
-            uniprot_id = []
-            if count != 0:
-                for doc in docs:
-                    uniprot_id.append(doc['uniprot_id'])
-            else:
-                proteins = self.parse_gene_info(org_gene_str.split(':')[1])
-                if isinstance(proteins, str):
-                    self.uniprot_nosql_manager.load_uniprot(query=True, msg=proteins.split('.')[0], species=[ncbi_id])
-                    doc = self.uniprot_manager.get_info_by_entrez_id(org_gene_str.split(':')[1])
-                    if doc is not None:
-                        uniprot_id.append(doc)                    
-                elif proteins != []: 
-                    for protein in proteins:
-                        self.uniprot_nosql_manager.load_uniprot(query=True, msg=protein.split('.')[0], species=[ncbi_id])
-                        doc = self.uniprot_manager.get_info_by_entrez_id(org_gene_str.split(':')[1])
-                        if doc is not None:
-                            uniprot_id.append(doc)
+        for hit in parse_ssdb_hits(soup):
+            org_gene_str = hit['org_gene']
             yield {'org_gene': org_gene_str,
-                   'uniprot_id': uniprot_id,
-                   'length': length,
-                   'sw_score': sw_score,
-                   'margin': margin,
-                   'bits': bits,
-                   'identity': identity,
-                   'overlap': overlap,
+                   'uniprot_id': self.get_uniprot_ids(org_gene_str),
+                   'length': hit['length'],
+                   'sw_score': hit['sw_score'],
+                   'margin': hit['margin'],
+                   'bits': hit['bits'],
+                   'identity': hit['identity'],
+                   'overlap': hit['overlap'],
                    'reference': self.endpoint + org_gene_str}
 
+    def get_uniprot_ids(self, org_gene_str):
+        """Get the UniProt IDs of a KEGG gene, loading the proteins of the gene
+        into the uniprot collection if they are not there yet. Answers are memoized.
+
+        Args:
+            org_gene_str (:obj:`str`): org:gene_code string.
+
+        Return:
+            (:obj:`list`): UniProt IDs
+        """
+        if org_gene_str in self._uniprot_ids:
+            return self._uniprot_ids[org_gene_str]
+        docs, count = self.uniprot_manager.get_id_by_org_gene(org_gene_str)
+        uniprot_id = []
+        if count != 0:
+            for doc in docs:
+                uniprot_id.append(doc['uniprot_id'])
+        else:
+            ncbi_id = self.koc_manager.get_ncbi_by_org_code(org_gene_str.split(':')[0])
+            proteins = self.parse_gene_info(org_gene_str.split(':')[1])
+            if isinstance(proteins, str):
+                proteins = [proteins]
+            for protein in proteins:
+                self.uniprot_nosql_manager.load_uniprot(query=True, msg=protein.split('.')[0], species=[ncbi_id])
+                doc = self.uniprot_manager.get_info_by_entrez_id(org_gene_str.split(':')[1])
+                if doc is not None:
+                    uniprot_id.append(doc)
+        self._uniprot_ids[org_gene_str] = uniprot_id
+        return uniprot_id
+
     def uniprot_to_org_gene(self, uniprot_id):
         """Given uniprot_id, convert to kegg org_gene format.
         
@@ -110,6 +336,8 @@ class KeggGeneOrtholog(mongo_util.MongoUtil):
         Return:
             (:obj:`str`): Kegg org_gene format.
         """
+        if uniprot_id in self._org_genes:
+            return self._org_genes[uniprot_id]
         protein_doc = self.protein_manager.get_meta_by_id([uniprot_id])[0] #id from db so won't have missing entries
         ko = protein_doc.get('ko_number')
         ncbi_id = protein_doc['ncbi_taxonomy_id']
@@ -119,11 +347,13 @@ class KeggGeneOrtholog(mongo_util.MongoUtil):
             protein_gene = protein_doc['gene_name']
             gene_id = self.kegg_manager.get_loci_by_id_org(ko, org_code, protein_gene)
 
-        return '{}:{}'.format(org_code, gene_id)
+        org_gene = '{}:{}'.format(org_code, gene_id)
+        self._org_genes[uniprot_id] = org_gene
+        return org_gene
 
     def parse_gene_info(self, gene):
         """Use mygene.info to get protein information
-        given a string of gene code.
+        given a string of gene code. Answers are memoized.
         
         Args:
             gene (:obj:`str`): Gene information.
@@ -131,22 +361,34 @@ class KeggGeneOrtholog(mongo_util.MongoUtil):
         Return:
             (:obj:`list` of :obj:`str`): List of protein IDs. 
         """
+        if gene in self._gene_info:
+            return self._gene_info[gene]
         endpoint = 'https://mygene.info/v3/gene/' + gene
+        self.fetcher.rate_limiter.wait(endpoint)
         r = requests.get(endpoint)
         r.raise_for_status
         info = json.loads(r.content)
         accession = info.get('accession')
         if accession is None:
-            return []
+            proteins = []
         else:
-            return accession.get('protein', [])
+            proteins = accession.get('protein', [])
+        self._gene_info[gene] = proteins
+        return proteins
 
-    def load_data(self, skip=0, top_hits=10):
+    def load_data(self, skip=0, top_hits=10, bulk_size=100):
         """Loading data.
+
+        The SSDB pages of the proteins are fetched concurrently by :obj:`fetcher` and each page is
+        parsed as soon as it arrives. The orthologs are written with bulk updates.
         
         Args:
             skip (:obj:`int`, optional): Beginning of the documents. Defaults to 0.
             top_hits (:obj:`int`, optional): Number of top hits to iterate through. Defaults to 10.
+            bulk_size (:obj:`int`, optional): Number of updates per bulk write. Defaults to 100.
+
+        Return:
+            (:obj:`dict`): progress and throughput metrics of :obj:`fetcher`
         """
         con_0 = {'entrez_id': {'$ne': None}}
         con_1 = {'ko_number': {'$ne': "nan"}}
@@ -156,27 +398,52 @@ class KeggGeneOrtholog(mongo_util.MongoUtil):
                                                     collation=self.uniprot_manager.collation, skip=skip,
                                                     no_cursor_timeout=True)
         count = self.uniprot_manager.collection.count_documents(query, collation=self.uniprot_manager.collation)
-        for i, doc in enumerate(docs):
-            if i == self.max_entries:
-                break
-            if i % 50 == 0 and self.verbose:
-                print('Processing document {} out of {} ...'.format(i+skip, count))
-            uniprot_id = doc['uniprot_id']
-            org_gene_code = self.uniprot_to_org_gene(uniprot_id)
-            print('    Processing protein {} whose org_gene code is: {}'.format(uniprot_id, org_gene_code))
-            soup = self.get_html(org_gene_code)
-            results = self.parse_html(soup)
-            tmp = []
-            for j, result in enumerate(results):
-                if j == top_hits:
+        self.fetcher.reset()
+
+        # proteins of each gene whose page hasn't been parsed yet, and the orthologs of parsed genes
+        owners = {}
+        orthologs = {}
+        bulk = []
+
+        def update(uniprot_id, tmp):
+            bulk.append(UpdateOne({'uniprot_id': uniprot_id}, {'$set': {'orthologs': tmp}},
+                                  upsert=False, collation=self.uniprot_manager.collation))
+            if len(bulk) == bulk_size:
+                self.uniprot_manager.collection.bulk_write(bulk, ordered=False)
+                bulk.clear()
+
+        def queries():
+            for i, doc in enumerate(docs):
+                if i == self.max_entries:
                     break
-                else:
-                    tmp.append(result)
-            self.uniprot_manager.collection.update_one({'uniprot_id': uniprot_id},
-                                                       {'$set': {'orthologs': tmp}}, upsert=False, 
-                                                        collation=self.uniprot_manager.collation)
+                uniprot_id = doc['uniprot_id']
+                org_gene_code = self.uniprot_to_org_gene(uniprot_id)
+                if org_gene_code in orthologs:
+                    update(uniprot_id, orthologs[org_gene_code])
+                    continue
+                owners.setdefault(org_gene_code, []).append(uniprot_id)
+                yield org_gene_code
+
+        for i, (org_gene_code, html) in enumerate(self.fetcher.fetch_all(queries())):
+            if i % 50 == 0 and self.verbose:
+                metrics = self.fetcher.metrics
+                print('Processing page {} for {} documents ({:.1f} pages/s, {:.0%} cached) ...'.format(
+                    i, count - skip, metrics['pages_per_second'], metrics['cache_hit_rate']))
+            tmp = list(itertools.islice(self.parse_html(BeautifulSoup(html, 'html.parser')), top_hits))
+            orthologs[org_gene_code] = tmp
+            for uniprot_id in owners.pop(org_gene_code):
+                update(uniprot_id, tmp)
+        if bulk:
+            self.uniprot_manager.collection.bulk_write(bulk, ordered=False)
         docs.close()
 
+        metrics = self.fetcher.metrics
+        if self.verbose:
+            print('Fetched {} pages ({} from the cache, {} errors) in {:.1f} s ({:.1f} pages/s)'.format(
+                metrics['pages'], metrics['cache_hits'], metrics['errors'], metrics['seconds'],
+                metrics['pages_per_second']))
+        return metrics
+
 
 def main():
     des_db = 'datanator'
@@ -7,7 +7,6 @@ import os
 import zipfile
 from ftplib import FTP
 from datanator.util import mongo_util
-import json
 
 class IntActNoSQL(mongo_util.MongoUtil):
     """ A local MongoDB copy of the IntAct database """
@@ -63,8 +62,15 @@ class IntActNoSQL(mongo_util.MongoUtil):
 
         ftp.quit()
 
-    def add_complexes(self):
-        """ Parse complexes from data and add complexes to MongoDB """
+    def add_complexes(self, bulk_size=1000):
+        """ Parse complexes from data and add complexes to MongoDB
+
+        Documents are written into a staging collection which replaces `intact_complex` once
+        all files have been parsed.
+
+        Args:
+            bulk_size (:obj:`int`, optional): number of documents per insertion
+        """
         raw_columns = [
             '#Complex ac', 'Recommended name', 'Taxonomy identifier',
             'Identifiers (and stoichiometry) of molecules in complex', 'Experimental evidence',
@@ -73,80 +79,171 @@ class IntActNoSQL(mongo_util.MongoUtil):
         relabeled_columns = ['identifier', 'name', 'ncbi_id', 'subunits', 'evidence', 'go_annotation', 'go_description', 'source']
 
         filenames = glob.glob(os.path.join(self.cache_dirname, 'intact', 'complextab', '*.tsv'))
+        staging = self.db_complex[self.collection_complex.name + '_staging']
+        staging.drop()
         total_operations = 0
         for filename in filenames:
-            raw_data = pandas.read_csv(filename, delimiter='\t', encoding='utf-8')
+            if total_operations == self.max_entries:
+                break
+            raw_data = pandas.read_csv(filename, delimiter='\t', encoding='utf-8', usecols=raw_columns)
             relabeled_data = raw_data.loc[:, raw_columns]
             relabeled_data.columns = relabeled_columns
-            # relabeled_data = relabeled_data.set_index('identifier')
-
-            relabeled_data_json = json.loads(relabeled_data.to_json(orient = 'records'))
-            # separate string of subunits
-            for j in range(len(relabeled_data_json)):
-                if total_operations == self.max_entries:
-                    break
-                if self.verbose and total_operations%50 ==0:
-                    print ('Inserting {} of {} complex document'.format(total_operations+1, min(self.max_entries,len(relabeled_data_json))))
-
-                # separate string of subunits
-                subunit_info = []
-                if relabeled_data_json[j]['subunits'] is not None:
-                    subunit_list_with_count = relabeled_data_json[j]['subunits'].split('|')
-                    subunit_list = [item.split('(')[0] for item in subunit_list_with_count] 
-                    count_list = [item.split('(')[1].split(')')[0] for item in subunit_list_with_count]
-                    for unit, count in zip(subunit_list, count_list):
-                        subunit_info.append( {'uniprot_id': unit, 'count': count} )
-                    relabeled_data_json[j]['subunits'] = subunit_info
-
-                # separate string of go_annotation
-                annotation_list = []
-                if relabeled_data_json[j]['go_annotation'] is not None:
-                    go_anno_after_split = relabeled_data_json[j]['go_annotation'].split('|')
-                    go_id = [item[3:10] for item in go_anno_after_split]
-                    go_term = [item[11:-1] for item in go_anno_after_split]
-                    for _id, term in zip(go_id, go_term):
-                        annotation_list.append( {'go_id': _id, 'go_term': term} )
-                    relabeled_data_json[j]['go_annotation'] = annotation_list
-
-                self.collection_complex.replace_one({'identifier': relabeled_data_json[j]['identifier']},
-                        relabeled_data_json[j],
-                        upsert=True
-                        )
-                total_operations += 1 
-
-    def add_interactions(self):
-        """ Parse interactions from data and add interactions to mongodb database """
-        data = pandas.read_csv(os.path.join(self.cache_dirname, 'intact', 'psimitab', 'intact_negative.txt'),
-                               delimiter='\t', encoding='utf-8')
-        for index, row in data.iterrows():
-            if index == self.max_entries:
-                break
-            if self.verbose and index%20==0:
-                print ('Inserting {} of {} intercation document'.format(index+1, min(self.max_entries,len(data.index) ) ))
-
-            interaction = {} # one document
-            interaction['_id'] = index
-            interaction['protein_a'], interaction['gene_a'] = self.find_protein_gene(row['#ID(s) interactor A'], row['Alias(es) interactor A'])
-            interaction['protein_b'], interaction['gene_b'] = self.find_protein_gene(row['ID(s) interactor B'], row['Alias(es) interactor B'])
-            interaction['interaction_type'] = self.find_between_psi_mi_parentheses(row['Interaction type(s)'])
-            interaction['method'] = self.find_between_psi_mi_parentheses(row['Interaction detection method(s)'])
-            interaction['type_a'] = self.find_between_psi_mi_parentheses(row['Type(s) interactor A'])
-            interaction['type_b'] = self.find_between_psi_mi_parentheses(row['Type(s) interactor B'])
-            interaction['role_a'] = self.find_between_psi_mi_parentheses(row['Biological role(s) interactor A'])
-            interaction['role_b'] = self.find_between_psi_mi_parentheses(row['Biological role(s) interactor B'])
-            interaction['feature_a'] = row['Feature(s) interactor A']
-            interaction['feature_b'] = row['Feature(s) interactor B']
-            interaction['stoich_a'] = row['Stoichiometry(s) interactor A']
-            interaction['stoich_b'] = row['Stoichiometry(s) interactor B']
-            interaction['interaction_id'] = row['Interaction identifier(s)']
-            interaction['publication'] = self.find_pubmed_id(row['Publication Identifier(s)'])
-            interaction['publication_author'] = row['Publication 1st author(s)']
-            interaction['confidence'] = row['Confidence value(s)']
-
-            self.collection_interaction.replace_one({'_id': interaction['_id']},
-                    interaction,
-                    upsert=True
-                    )
+            if self.max_entries != float('inf'):
+                relabeled_data = relabeled_data.iloc[:int(self.max_entries - total_operations)]
+            if self.verbose:
+                print('Inserting {} complex documents from {}'.format(len(relabeled_data.index), filename))
+
+            # separate string of subunits, e.g. 'P12345(2)|Q67890(1)'
+            subunits = relabeled_data['subunits'].str.split('|').explode()
+            subunits = subunits.str.extract(r'^([^(]*)\(([^)]*)\)').rename(columns={0: 'uniprot_id', 1: 'count'})
+            relabeled_data['subunits'] = self._group_records(subunits, relabeled_data.index)
+
+            # separate string of go_annotation, e.g. '"GO:0005634(nucleus)"|...'
+            annotations = relabeled_data['go_annotation'].str.split('|').explode()
+            annotations = pandas.DataFrame({'go_id': annotations.str.slice(3, 10),
+                                            'go_term': annotations.str.slice(11, -1)})
+            relabeled_data['go_annotation'] = self._group_records(annotations, relabeled_data.index)
+
+            docs = self._frame_to_docs(relabeled_data)
+            for i in range(0, len(docs), bulk_size):
+                staging.insert_many(docs[i:i + bulk_size], ordered=False)
+            total_operations += len(docs)
+
+        self._swap_in(staging, self.collection_complex)
+
+    def add_interactions(self, chunksize=100000):
+        """ Parse interactions from data and add interactions to mongodb database
+
+        The psimitab file is streamed in chunks of :obj:`chunksize` rows, parsed column-wise
+        and written into a staging collection which replaces `intact_interaction` at the end.
+
+        Args:
+            chunksize (:obj:`int`, optional): number of rows parsed and inserted at a time
+        """
+        nrows = None if self.max_entries == float('inf') else int(self.max_entries)
+        reader = pandas.read_csv(os.path.join(self.cache_dirname, 'intact', 'psimitab', 'intact_negative.txt'),
+                                 delimiter='\t', encoding='utf-8', chunksize=chunksize, nrows=nrows)
+        staging = self.db_interaction[self.collection_interaction.name + '_staging']
+        staging.drop()
+        for data in reader:
+            if self.verbose:
+                print ('Inserting {} to {} intercation document'.format(data.index[0] + 1, data.index[-1] + 1))
+            interactions = self.parse_interactions(data)
+            staging.insert_many(self._frame_to_docs(interactions), ordered=False)
+
+        self._swap_in(staging, self.collection_interaction)
+
+    def parse_interactions(self, data):
+        """ Parse a frame of psimitab rows into interaction columns
+
+        Args:
+            data (:obj:`pandas.DataFrame`): rows of the psimitab file
+
+        Returns:
+            :obj:`pandas.DataFrame`: one interaction per row, indexed like :obj:`data`
+        """
+        interactions = pandas.DataFrame(index=data.index)
+        interactions['_id'] = data.index
+        interactions['protein_a'], interactions['gene_a'] = self.find_protein_gene_columns(
+            data['#ID(s) interactor A'], data['Alias(es) interactor A'])
+        interactions['protein_b'], interactions['gene_b'] = self.find_protein_gene_columns(
+            data['ID(s) interactor B'], data['Alias(es) interactor B'])
+        interactions['interaction_type'] = self.find_between_psi_mi_parentheses_column(data['Interaction type(s)'])
+        interactions['method'] = self.find_between_psi_mi_parentheses_column(data['Interaction detection method(s)'])
+        interactions['type_a'] = self.find_between_psi_mi_parentheses_column(data['Type(s) interactor A'])
+        interactions['type_b'] = self.find_between_psi_mi_parentheses_column(data['Type(s) interactor B'])
+        interactions['role_a'] = self.find_between_psi_mi_parentheses_column(data['Biological role(s) interactor A'])
+        interactions['role_b'] = self.find_between_psi_mi_parentheses_column(data['Biological role(s) interactor B'])
+        interactions['feature_a'] = data['Feature(s) interactor A']
+        interactions['feature_b'] = data['Feature(s) interactor B']
+        interactions['stoich_a'] = data['Stoichiometry(s) interactor A']
+        interactions['stoich_b'] = data['Stoichiometry(s) interactor B']
+        interactions['interaction_id'] = data['Interaction identifier(s)']
+        interactions['publication'] = self.find_pubmed_id_column(data['Publication Identifier(s)'])
+        interactions['publication_author'] = data['Publication 1st author(s)']
+        interactions['confidence'] = data['Confidence value(s)']
+        return interactions
+
+    def find_protein_gene_columns(self, interactor, alias):
+        """ Column-wise version of :obj:`find_protein_gene`
+
+        Args:
+            interactor (:obj:`pandas.Series`): key-value pairs of interactors
+            alias (:obj:`pandas.Series`): key-value pairs of the aliases of the interactors
+
+        Returns:
+            :obj:`pandas.Series`: protein identifiers
+            :obj:`pandas.Series`: gene identifiers
+        """
+        interactor = interactor.astype(str)
+        alias = alias.astype(str)
+        protein = interactor.str.split(':').str[1].where(interactor.str.contains('uniprotkb', regex=False))
+        protein_alias = alias.str.extract(r'psi-mi:(.*?)\(display_short\)', expand=False)
+        protein = protein.fillna(protein_alias.where(alias.str.contains('display_short', regex=False)))
+        gene = alias.str.findall(r'(?:^|\|)[^|]*?uniprotkb:([^|]*?)\(gene name\)').str[-1]
+        return protein, gene
+
+    def find_pubmed_id_column(self, string):
+        """ Column-wise version of :obj:`find_pubmed_id`
+
+        Args:
+            string (:obj:`pandas.Series`): key-value pairs of publication type-identifier
+
+        Returns:
+            :obj:`pandas.Series`: PubMed identifiers
+        """
+        item = string.astype(str).str.extract(r'(?:^|\|)([^|]*pubmed:[^|]*)', expand=False)
+        return item.str.split(':').str[1]
+
+    def find_between_psi_mi_parentheses_column(self, string):
+        """ Column-wise version of :obj:`find_between_psi_mi_parentheses`
+
+        Args:
+            string (:obj:`pandas.Series`): psi-mi key-value pairs
+
+        Returns:
+            :obj:`pandas.Series`: text between the first pair of parentheses of each psi-mi value
+        """
+        string = string.astype(str)
+        return string.str.extract(r'\(([^)]*)\)', expand=False).where(string.str.contains('psi-mi:', regex=False))
+
+    def _group_records(self, exploded, index):
+        """ Collapse an exploded frame back into one list of records per row
+
+        Args:
+            exploded (:obj:`pandas.DataFrame`): frame whose index repeats once per item of a row
+            index (:obj:`pandas.Index`): index of the original frame
+
+        Returns:
+            :obj:`pandas.Series`: list of records (or :obj:`None` if the row had no items) per row
+        """
+        exploded = exploded.dropna(how='all')
+        records = pandas.Series(exploded.to_dict('records'), index=exploded.index, dtype=object)
+        grouped = records.groupby(level=0).agg(list)
+        return grouped.reindex(index).astype(object).where(lambda s: s.notna(), None)
+
+    def _frame_to_docs(self, frame):
+        """ Build documents from the columns of a frame, mapping missing values to :obj:`None`
+
+        Args:
+            frame (:obj:`pandas.DataFrame`): frame
+
+        Returns:
+            :obj:`list` of :obj:`dict`: one document per row
+        """
+        columns = [frame[column].astype(object).where(frame[column].notna(), None).tolist()
+                   for column in frame.columns]
+        return [dict(zip(frame.columns, values)) for values in zip(*columns)]
+
+    def _swap_in(self, staging, target):
+        """ Replace a collection by its fully loaded staging collection
+
+        Args:
+            staging (:obj:`pymongo.collection.Collection`): staging collection
+            target (:obj:`pymongo.collection.Collection`): collection to be replaced
+        """
+        if staging.name in staging.database.list_collection_names():
+            staging.rename(target.name, dropTarget=True)
 
     def find_protein_gene(self, interactor, alias):
         """ Parse the protein and gene identifiers from key-value pairs of interactors and their aliases
@@ -1,9 +1,16 @@
+import itertools
 import json
+import mmap
 import requests
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from pprint import pprint
 from datanator.util import mongo_util
 from datanator.util import file_util
+from datanator.util import flat_file_util
 import datanator.config.core
 import tempfile
 
@@ -12,9 +19,10 @@ class KeggOrthology(mongo_util.MongoUtil):
 
     def __init__(self, cache_dirname=None, MongoDB=None, db=None, replicaSet='', 
         verbose=False, max_entries=float('inf'), username = None,
-        password = None, authSource = 'admin'):
+        password = None, authSource = 'admin', max_workers=4, bulk_size=500):
         self.ENDPOINT_DOMAINS = {
             'root': 'https://www.genome.jp/kegg-bin/download_htext?htext=ko00001&format=json&filedir=',
+            'get': 'http://rest.kegg.jp/get/',
         }
         self.cache_dirname = cache_dirname
         self.MongoDB = MongoDB
@@ -23,30 +31,41 @@ class KeggOrthology(mongo_util.MongoUtil):
         self.max_entries = max_entries
         self.collection = 'kegg_orthology'
         self.path = os.path.join(self.cache_dirname, self.collection)
+        self.archive_path = os.path.join(self.path, self.collection + '_mirror.txt')
+        self.index_path = os.path.join(self.path, self.collection + '_mirror_index.json')
+        self.max_workers = max_workers
+        self.bulk_size = bulk_size
         super(KeggOrthology, self).__init__(cache_dirname=cache_dirname, MongoDB=MongoDB, replicaSet=replicaSet, db=db,
                                             verbose=verbose, max_entries=max_entries, username = username,
                                             password = password, authSource = authSource)
         self.file_manager = file_util.FileUtil()
 
-    def load_content(self):
-        '''Load kegg_orthologs into MongoDB
-        '''
-        _, _, collection = self.con_db(self.collection)
+    def download_root(self):
+        """Download root kegg orthology hierarchy and list its KO entries
+
+        Return:
+            (:obj:`dict`): {ko_id: htext line} for every KO entry in the hierarchy,
+            e.g. {'K00844': 'K00844  HK; hexokinase [EC:2.7.1.1]'}.
+        """
         root_url = self.ENDPOINT_DOMAINS['root']
         if self.verbose:
             print('\n Downloading root kegg orthology file ...')
         manager = requests.get(root_url)
         manager.raise_for_status()
         os.makedirs(self.path, exist_ok=True)
-        file_name = manager.json()['name']
-        store_path = os.path.join(self.path, file_name)
         data = manager.json()
+        store_path = os.path.join(self.path, data['name'])
         with open(store_path, 'w') as f:
             json.dump(data, f, indent=4)
 
         names = self.file_manager.extract_values(data, 'name')
-        names = [name.split()[0] for name in names if name[0] == 'K']
-        names = list(set(names)) # remove duplicate name
+        return {name.split()[0]: name for name in names if name[0] == 'K'}
+
+    def load_content(self):
+        '''Load kegg_orthologs into MongoDB
+        '''
+        _, _, collection = self.con_db(self.collection)
+        names = list(self.download_root())
         names.sort()
 
         iterations = min(len(names), self.max_entries)
@@ -65,6 +84,140 @@ class KeggOrthology(mongo_util.MongoUtil):
                 collection.replace_one(
                     {'kegg_orthology_id': doc['kegg_orthology_id']}, doc, upsert=True)
 
+    def load_content_mirror(self):
+        """Load kegg_orthologs into MongoDB through a local flat-file mirror
+
+        Entries are fetched in batches into a single archive file (see :obj:`update_mirror`),
+        then parsed straight off the archive and written with bulk upserts.
+        """
+        _, _, collection = self.con_db(self.collection)
+        self.update_mirror()
+        docs = self.iter_mirror()
+        if self.max_entries != float('inf'):
+            docs = itertools.islice(docs, int(self.max_entries))
+        count = 0
+        for batch in flat_file_util.iter_batches(docs, self.bulk_size):
+            count += len(batch)
+            if self.verbose:
+                print('Writing kegg orthology entries {} ...'.format(count))
+            self._bulk_write(collection, [ReplaceOne({'kegg_orthology_id': doc['kegg_orthology_id']}, doc, upsert=True)
+                                          for doc in batch])
+
+    def _bulk_write(self, collection, bulk):
+        try:
+            collection.bulk_write(bulk, ordered=False)
+        except BulkWriteError as bwe:
+            pprint(bwe.details)
+
+    def read_mirror_index(self):
+        """Read index of the local mirror archive
+
+        Return:
+            (:obj:`dict`): {ko_id: {'offset': byte offset, 'length': byte length, 'name': htext line}}
+        """
+        if not os.path.exists(self.index_path) or not os.path.exists(self.archive_path):
+            return {}
+        with open(self.index_path, 'r') as f:
+            return json.load(f)
+
+    def write_mirror_index(self, index):
+        """Atomically write index of the local mirror archive
+
+        Args:
+            index (:obj:`dict`): index as returned by :obj:`read_mirror_index`.
+        """
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def update_mirror(self, names=None, batch_size=10):
+        """Fetch new or changed KO entries into the local mirror archive
+
+        An entry is (re)fetched when it is missing from the index or when its line
+        in the root hierarchy changed since it was mirrored. Fetched entries are appended
+        to the archive; the index always points to the newest copy of an entry.
+
+        Args:
+            names (:obj:`dict`, optional): {ko_id: htext line}. Defaults to :obj:`download_root`.
+            batch_size (:obj:`int`): number of entries per KEGG REST request (KEGG allows at most 10).
+
+        Return:
+            (:obj:`int`): number of entries fetched.
+        """
+        if names is None:
+            names = self.download_root()
+        os.makedirs(self.path, exist_ok=True)
+        index = self.read_mirror_index()
+        ids = sorted(name for name, line in names.items()
+                     if index.get(name, {}).get('name') != line)
+        if self.max_entries != float('inf'):
+            ids = ids[:int(self.max_entries)]
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+        count = 0
+        with open(self.archive_path, 'ab') as archive, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.download_ko_batch, batch) for batch in batches]
+            for i, future in enumerate(as_completed(futures)):
+                for ko_id, text in future.result().items():
+                    data = text.encode('utf-8')
+                    index[ko_id] = {'offset': archive.tell(), 'length': len(data),
+                                    'name': names.get(ko_id)}
+                    archive.write(data)
+                    count += 1
+                if self.verbose and i % 100 == 0:
+                    print('Mirrored {} of {} kegg orthology batches ...'.format(i + 1, len(batches)))
+            archive.flush()
+            self.write_mirror_index(index)
+        return count
+
+    def download_ko_batch(self, names):
+        """Download a batch of KO entries with a single KEGG REST request
+
+        Args:
+            names (:obj:`list` of :obj:`str`): KO ids, e.g. ['K00844', 'K12407'].
+
+        Return:
+            (:obj:`dict`): {ko_id: entry text (ending with '///')}
+        """
+        url = self.ENDPOINT_DOMAINS['get'] + '+'.join('ko:' + name for name in names)
+        try:
+            info = requests.get(url)
+            info.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            log_file = os.path.join(self.path, 'kegg_orthology_log.txt')
+            with open(log_file, 'a') as f:
+                f.write(str(e) + '\n')
+            return {}
+        return self.split_entries(info.text)
+
+    def split_entries(self, text):
+        """Split a KEGG flat-file response into individual entries
+
+        Args:
+            text (:obj:`str`): one or more entries, each terminated by '///'.
+
+        Return:
+            (:obj:`dict`): {ko_id: entry text (ending with '///')}
+        """
+        return {entry.split()[1]: entry for entry in flat_file_util.KEGG_FORMAT.split(text)}
+
+    def iter_mirror(self):
+        """Parse entries straight off the local mirror archive
+
+        Return:
+            (:obj:`iter` of :obj:`dict`): parsed KO documents, in KO id order.
+        """
+        index = self.read_mirror_index()
+        if not index:
+            return
+        with open(self.archive_path, 'rb') as archive, \
+                mmap.mmap(archive.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            for ko_id in sorted(index):
+                offset = index[ko_id]['offset']
+                text = buffer[offset:offset + index[ko_id]['length']]
+                yield self.parse_ko_lines(flat_file_util.KEGG_FORMAT.get_lines(text))
 
     def parse_definition(self, line):
         '''Definition line could be something as follows:
@@ -172,79 +325,8 @@ class KeggOrthology(mongo_util.MongoUtil):
         '''
         file_path = os.path.join(self.path, filename)
         try: 
-            with open(file_path, 'r') as f:
-                doc = {}
-                lines = f.readlines()
-
-                # get entry ID
-                doc['kegg_orthology_id'] = lines[0].split()[1]
-                # get list of gene name
-                doc['gene_name'] = [name.replace(
-                    ',', '') for name in lines[1].split()[1:]]
-                # get definition
-                enzyme_name, ec = self.parse_definition(lines[2])    
-                doc['definition'] = {'name': enzyme_name, 'ec_code': ec}
-
-                # get first word of all the lines
-                first_word = [line.split()[0] for line in lines]
-
-                # find line number of certain first words of interest
-                WOI_nonrepeating = ['PATHWAY', 'MODULE', 'DISEASE', 'BRITE', 'GENES']
-                reference = 'REFERENCE'
-
-                index_nonrepeating = [first_word.index(
-                    word) if word in first_word else -1 for word in WOI_nonrepeating]
-                index_reference = [i for i, v in enumerate(
-                    first_word) if v == reference]
-
-                pathway_begin = index_nonrepeating[0]
-                module_begin = index_nonrepeating[1]
-                disease_begin = index_nonrepeating[2]
-                brite_begin = index_nonrepeating[3]
-                gene_begin = index_nonrepeating[4]
-                
-                if pathway_begin == -1:
-                    doc['kegg_pathway'] = None
-                else:
-                    pathway_end = list(filter(lambda i: i != -1, index_nonrepeating))[1]
-                    pathway_lines = lines[pathway_begin:pathway_end] 
-                    doc['kegg_pathway'] = self.parse_pathway_disease(pathway_lines)
-                
-                if len(index_reference) == 0:
-                    gene_end = len(lines) - 1
-                else:
-                    gene_end = index_reference[0]
-
-                if disease_begin == -1:
-                    doc['kegg_disease'] = None
-                    module_end = brite_begin
-                else:
-                    module_end = disease_begin
-                    disease_lines = lines[disease_begin:brite_begin]
-                    doc['kegg_disease'] = self.parse_pathway_disease(disease_lines, category='disease')
-
-                if module_begin == -1:
-                    doc['kegg_module'] = None
-                else:
-                    module_lines = lines[module_begin:module_end]
-                    doc['kegg_module'] = self.parse_pathway_disease(module_lines, category='module')
-
-                # get gene_id's key,value pairs
-                doc['gene_ortholog'] = self.parse_gene(lines[gene_begin:gene_end])
-
-                # get reference's namespace:value pairs
-                ref_list = []
-                reference_line = [lines[i] for i in index_reference]
-                try:
-                    reference_info = [line.split()[1] for line in reference_line]
-                    for info in reference_info:
-                        ref_list.append({'namespace': info.split(':')[0],
-                                         'id': info.split(':')[1]})
-                except IndexError:
-                    pass    
-
-                doc['reference'] = ref_list
-                return doc
+            for lines in flat_file_util.KEGG_FORMAT.iter_records(file_path):
+                return self.parse_ko_lines(lines)
 
         except FileNotFoundError as e:
             log_file = os.path.join(self.path, 'kegg_orthology_log.txt')
@@ -254,6 +336,52 @@ class KeggOrthology(mongo_util.MongoUtil):
 
             
 
+    def parse_ko_lines(self, lines):
+        '''Parse lines of a single kegg_ortho entry into dictionary object
+
+        Args:
+            lines (:obj:`list` of :obj:`str`): lines of the entry, optionally including the trailing '///'.
+
+        Return:
+            (:obj:`dict`): parsed entry.
+        '''
+        doc = {}
+        # get entry ID
+        doc['kegg_orthology_id'] = lines[0].split()[1]
+        # get list of gene name
+        doc['gene_name'] = [name.replace(
+            ',', '') for name in lines[1].split()[1:]]
+        # get definition
+        enzyme_name, ec = self.parse_definition(lines[2])    
+        doc['definition'] = {'name': enzyme_name, 'ec_code': ec}
+
+        fields = flat_file_util.KEGG_FORMAT.get_fields(lines)
+
+        for tag, key, category in [('PATHWAY', 'kegg_pathway', 'pathway'),
+                                   ('MODULE', 'kegg_module', 'module'),
+                                   ('DISEASE', 'kegg_disease', 'disease')]:
+            if tag in fields:
+                doc[key] = self.parse_pathway_disease(fields[tag], category=category)
+            else:
+                doc[key] = None
+
+        # get gene_id's key,value pairs
+        doc['gene_ortholog'] = self.parse_gene(fields.get('GENES', []))
+
+        # get reference's namespace:value pairs
+        ref_list = []
+        reference_line = [line for line in fields.get('REFERENCE', []) if line.startswith('REFERENCE')]
+        try:
+            reference_info = [line.split()[1] for line in reference_line]
+            for info in reference_info:
+                ref_list.append({'namespace': info.split(':')[0],
+                                 'id': info.split(':')[1]})
+        except IndexError:
+            pass    
+
+        doc['reference'] = ref_list
+        return doc
+
     def download_ko(self, name):
         address = name.split('.')[0]
         try:
@@ -3,12 +3,13 @@ import requests
 import os
 from datanator.util import mongo_util
 from datanator.util import file_util
+from datanator.util import flat_file_util
 
 
 class KeggReaction(mongo_util.MongoUtil):
 
     def __init__(self, cache_dirname, MongoDB, db, replicaSet=None, verbose=False, max_entries=float('inf'),
-                username = None, password = None):
+                username = None, password = None, bulk_size=100):
         self.ENDPOINT_DOMAINS = {
             'root': 'https://www.genome.jp/kegg-bin/download_htext?htext=br08204.keg&format=json&filedir=',
         }
@@ -17,6 +18,7 @@ class KeggReaction(mongo_util.MongoUtil):
         self.db = db
         self.verbose = verbose
         self.max_entries = max_entries
+        self.bulk_size = bulk_size
         self.collection = 'kegg_reaction_class'
         self.path = os.path.join(self.cache_dirname, self.collection)
         super(KeggReaction, self).__init__(cache_dirname=cache_dirname, MongoDB=MongoDB, replicaSet=replicaSet, db=db,
@@ -55,19 +57,20 @@ class KeggReaction(mongo_util.MongoUtil):
 
         file_format = '.txt'
 
-        i = 0
-        for name in names:
-            if i == self.max_entries:
-                break
-            if self.verbose and i % 100 == 0:
-                print('Downloading {} of {} kegg reaction class file {}...'.format(
-                    i, iterations, name))
-            self.download_rxn_cls(name+file_format)
-            doc = self.parse_rxn_cls_txt(name+file_format)
-            if doc is not None:
-                collection.insert_one(doc)
-
-            i += 1
+        def iter_docs():
+            for i, name in enumerate(names):
+                if i == self.max_entries:
+                    break
+                if self.verbose and i % 100 == 0:
+                    print('Downloading {} of {} kegg reaction class file {}...'.format(
+                        i, iterations, name))
+                self.download_rxn_cls(name+file_format)
+                doc = self.parse_rxn_cls_txt(name+file_format)
+                if doc is not None:
+                    yield doc
+
+        for batch in flat_file_util.iter_batches(iter_docs(), self.bulk_size):
+            collection.insert_many(batch, ordered=False)
 
     def parse_rc_multiline(self, lines):
         ''' Input:
@@ -121,31 +124,8 @@ class KeggReaction(mongo_util.MongoUtil):
         '''
         file_path = os.path.join(self.path, filename)
         try: 
-            with open(file_path, 'r') as f:
-                doc = {}
-                lines = f.readlines()
-                # get first word of all the lines
-                first_word = [line.split()[0] for line in lines]
-                index_definition = first_word.index('DEFINITION') if 'DEFINITION' in first_word else None
-                index_rpair = first_word.index('RPAIR') if 'RPAIR' in first_word else None
-                index_reaction = first_word.index('REACTION') if 'REACTION' in first_word else None
-                index_enzyme = first_word.index('ENZYME') if 'ENZYME' in first_word else None
-                index_orthology = first_word.index('ORTHOLOGY') if 'ORTHOLOGY' in first_word else None
-                index_pathway = first_word.index('PATHWAY') if 'PATHWAY' in first_word else None
-
-                doc['rclass_id'] = lines[0].split()[1]
-                doc['definition'] = self.parse_rc_multiline(lines[index_definition:index_rpair])
-                doc['reaction_id'] = self.parse_rc_multiline(lines[index_reaction:index_enzyme])
-                doc['enzyme'] = self.parse_rc_multiline(lines[index_enzyme:index_pathway])
-                if index_orthology != None:
-                    ko_id, names = self.parse_rc_orthology(lines[index_orthology:-1])
-                    doc['orthology_id'] = []
-                    for _id, name in zip(ko_id, names):
-                        doc['orthology_id'].append({'ko_id': _id, 'enzyme_name': name})
-                else: 
-                    doc['orthology_id'] = None
-
-                return doc
+            for lines in flat_file_util.KEGG_FORMAT.iter_records(file_path):
+                return self.parse_rxn_cls_lines(lines)
 
         except FileNotFoundError as e:
             log_file = os.path.join(self.path, 'kegg_orthology_log.txt')
@@ -153,7 +133,40 @@ class KeggReaction(mongo_util.MongoUtil):
                 f.write(str(e)+'\n')
             pass
 
-            
+    def parse_rxn_cls_lines(self, lines):
+        '''Parse lines of a single reaction class entry into dictionary object
+
+        Args:
+            lines (:obj:`list` of :obj:`str`): lines of the entry, optionally including the trailing '///'.
+
+        Return:
+            (:obj:`dict`): parsed entry.
+        '''
+        fields = flat_file_util.KEGG_FORMAT.get_fields(lines)
+        doc = {}
+        doc['rclass_id'] = lines[0].split()[1]
+        for tag, key in [('DEFINITION', 'definition'), ('REACTION', 'reaction_id'), ('ENZYME', 'enzyme')]:
+            doc[key] = self.parse_rc_multiline(fields[tag]) if tag in fields else None
+        if 'ORTHOLOGY' in fields:
+            ko_id, names = self.parse_rc_orthology(fields['ORTHOLOGY'])
+            doc['orthology_id'] = []
+            for _id, name in zip(ko_id, names):
+                doc['orthology_id'].append({'ko_id': _id, 'enzyme_name': name})
+        else: 
+            doc['orthology_id'] = None
+        return doc
+
+    def iter_rxn_cls(self, file_path):
+        '''Parse the entries of a file of one or more reaction classes
+
+        Args:
+            file_path (:obj:`str`): path to the file.
+
+        Return:
+            (:obj:`iter` of :obj:`dict`): parsed entries.
+        '''
+        for lines in flat_file_util.KEGG_FORMAT.iter_records(file_path):
+            yield self.parse_rxn_cls_lines(lines)
 
     def download_rxn(self, name):
         address = name.split('.')[0]
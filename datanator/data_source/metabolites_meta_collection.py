@@ -2,6 +2,7 @@ from datanator_query_python.query import query_sabiork, query_xmdb
 from datanator.util import chem_util
 from datanator.util import file_util
 from datanator.util import index_collection
+from datanator.util import molecule_util
 import datanator.config.core
 import pymongo
 import re
@@ -37,74 +38,122 @@ class MetabolitesMeta(query_sabiork.QuerySabio):
         self.collation = Collation('en', strength=CollationStrength.SECONDARY)
         self.client, self.db, self.collection = self.con_db('metabolites_meta')
 
-    def load_content(self):
+    def load_content(self, bulk_size=1000):
         collection_name = 'metabolites_meta'
 
         ecmdb_fields = ['m2m_id', 'inchi', 'synonyms.synonym']
         self.fill_metabolite_fields(
-            fields=ecmdb_fields, collection_src='ecmdb', collection_des = collection_name)
+            fields=ecmdb_fields, collection_src='ecmdb', collection_des = collection_name,
+            bulk_size=bulk_size)
 
         ymdb_fields = ['ymdb_id', 'inchi', 'synonyms.synonym']
         self.fill_metabolite_fields(
-            fields=ymdb_fields, collection_src='ymdb', collection_des = collection_name)
+            fields=ymdb_fields, collection_src='ymdb', collection_des = collection_name,
+            bulk_size=bulk_size)
 
+        kinlaw_ids, participants = self.get_kinlaw_index()
         _, _, collection = self.con_db(collection_name)
-        k = 0
-        for doc in self.collection.find(filter={}, projection={'inchi':1}):
-            if k > self.max_entries:
+        updates = []
+        cursor = collection.find(filter={}, projection={'InChI_Key': 1})
+        for k, doc in enumerate(cursor):
+            if k == self.max_entries:
                 break
-            kinlaw_id = self.get_kinlawid_by_inchi([doc['inchi']])
-            rxn_participants = self.find_reaction_participants(kinlaw_id)
-            collection.update_one({'inchi': doc['inchi']},
-                                  {'$set': {'kinlaw_id': kinlaw_id,
-                                   'reaction_participants': rxn_participants}},
-                                  upsert=False)
-            k += 1
-        # i = 0
-        # cursor = collection.find(filter = {}, projection = {'similar_compounds_corrected':1, 'similar_compounds': 1})
-        # for doc in cursor:
-        #     if i % self.frequency == 0:
-        #         print(i)
-
-        #     replacement = []
-        #     for corrected in doc['similar_compounds_corrected']:
-        #         for k, v in corrected.items():
-        #             dic = {}
-        #             dic[k] = v
-        #             replacement.append(dic)
-
-        #     collection.update_one({'_id': doc['_id']},
-        #                          {'$set': {'similar_compounds': replacement}},
-        #                         upsert=False)
-        #     i += 1
-
-    def replace_key_in_similar_compounds(self):
-        query = {}
-        projection = {'similar_compounds': 1}
+            kinlaw_id = kinlaw_ids.get(doc.get('InChI_Key'), [])
+            rxn_participants = [participants[_id] for _id in kinlaw_id]
+            updates.append(({'_id': doc['_id']},
+                            {'$set': {'kinlaw_id': kinlaw_id,
+                                      'reaction_participants': rxn_participants}}))
+        self.bulk_update(collection, updates, label='kinetic laws', bulk_size=bulk_size)
+
+    def get_kinlaw_index(self, collection_str='sabio_rk'):
+        """Index the kinetic laws in sabio_rk by the InChI keys of their
+        reaction participants, in a single pass over the collection.
+
+        Args:
+            collection_str (:obj:`str`, optional): name of the sabio_rk collection.
+
+        Returns:
+            (:obj:`tuple`): dictionary which maps each InChI key to the kinlaw_ids
+            of the kinetic laws in which it participates, and dictionary which maps each
+            kinlaw_id to the names of its reactants and products
+            ({'substrates': [], 'products': []}).
+        """
+        _, _, col = self.con_db(collection_str)
+        projection = {'kinlaw_id': 1, '_id': 0,
+                      'reactants.name': 1, 'reactants.structures.InChI_Key': 1,
+                      'products.name': 1, 'products.structures.InChI_Key': 1}
+        kinlaw_ids = {}
+        participants = {}
+        for i, doc in enumerate(col.find(filter={}, projection=projection)):
+            if self.verbose and i % 10000 == 0:
+                print('Indexing kinetic law {} ...'.format(i))
+            kinlaw_id = doc['kinlaw_id']
+            reactants = doc.get('reactants', [])
+            products = doc.get('products', [])
+            participants[kinlaw_id] = {
+                'substrates': self.file_manager.get_val_from_dict_list(reactants, 'name'),
+                'products': self.file_manager.get_val_from_dict_list(products, 'name')}
+            for participant in reactants + products:
+                for structure in participant.get('structures') or []:
+                    ids = kinlaw_ids.setdefault(structure.get('InChI_Key'), [])
+                    if not ids or ids[-1] != kinlaw_id:
+                        ids.append(kinlaw_id)
+        kinlaw_ids.pop(None, None)
+        return kinlaw_ids, participants
+
+    def bulk_update(self, collection, updates, label='', bulk_size=1000, upsert=False):
+        """Write updates to a collection with unordered bulk writes.
+
+        Args:
+            collection (:obj:`pymongo.collection.Collection`): collection to update.
+            updates (:obj:`iter` of :obj:`tuple`): (filter, update) pairs.
+            label (:obj:`str`, optional): name of the information being loaded, for progress messages.
+            bulk_size (:obj:`int`, optional): number of updates per bulk write.
+            upsert (:obj:`bool`, optional): whether to insert missing documents.
+        """
+        bulk = []
+        for i, (_filter, update) in enumerate(updates):
+            bulk.append(pymongo.UpdateOne(_filter, update, upsert=upsert))
+            if len(bulk) == bulk_size:
+                if self.verbose:
+                    print('Loading {} info {} ...'.format(label, i + 1))
+                collection.bulk_write(bulk, ordered=False)
+                bulk = []
+        if len(bulk) != 0:
+            collection.bulk_write(bulk, ordered=False)
+
+    def replace_key_in_similar_compounds(self, bulk_size=1000):
         _, _, col = self.con_db('metabolites_meta')
-        docs = col.find(filter=query, projection=projection)
+        inchi_keys = {}
+        for doc in col.find(filter={}, projection={'inchi': 1, 'InChI_Key': 1}):
+            inchi_keys.setdefault(doc.get('inchi'), doc.get('InChI_Key'))
+
+        updates = []
+        docs = col.find(filter={'similar_compounds': {'$exists': True}},
+                        projection={'similar_compounds': 1})
         for doc in docs:
             result = []
             _list = doc['similar_compounds']
             for dic in _list:
                 old_key = list(dic.keys())[0]
-                try:
-                    new_key = col.find_one(filter={'inchi': old_key}, 
-                        projection={'InChI_Key':1})['InChI_Key']
-                    result.append( {new_key: dic[old_key]})
-                except TypeError:
+                new_key = inchi_keys.get(old_key)
+                if new_key is None:
                     result.append( {'NoStructure': -1} )
-            col.update_one({'_id': doc['_id']},
-                {'$set': {'similar_compounds': result} })
-        
+                else:
+                    result.append( {new_key: dic[old_key]})
+            updates.append(({'_id': doc['_id']},
+                            {'$set': {'similar_compounds': result} }))
+        self.bulk_update(col, updates, label='similar compounds', bulk_size=bulk_size)
 
-    def fill_metabolite_fields(self, fields=None, collection_src=None, collection_des = None):
+    def fill_metabolite_fields(self, fields=None, collection_src=None, collection_des = None,
+                               bulk_size=1000):
         '''Fill in values of fields of interest from 
             metabolite collection: ecmdb or ymdb
                 Args:
                         fileds: list of fields of interest
                         collection_src: collection in which query will be done
                         collection_des: collection in which result will be updated
+                        bulk_size: number of upserts per bulk write
 
         '''
         projection = {}
@@ -114,6 +163,7 @@ class MetabolitesMeta(query_sabiork.QuerySabio):
         _, _, col_src = self.con_db(collection_src)
         _, _, col_des = self.con_db(collection_des)
         cursor = col_src.find(filter={}, projection=projection)
+        updates = []
         i = 0
         for doc in cursor:
             if i == self.max_entries:
@@ -127,13 +177,13 @@ class MetabolitesMeta(query_sabiork.QuerySabio):
                 synonyms = doc.get('synonyms', None).get('synonym')
             except AttributeError:
                 synonyms = doc.get('synonyms', None)
-            col_des.update_one({'inchi': doc['inchi']},
-                                  { '$set': { fields[0]: doc[fields[0]],
-                                              fields[1]: doc[fields[1]],
-                                              'synonyms': synonyms,
-                                              'InChI_Key': doc['InChI_Key']}},
-                                  upsert=True)
+            updates.append(({'inchi': doc['inchi']},
+                            { '$set': { fields[0]: doc[fields[0]],
+                                        fields[1]: doc[fields[1]],
+                                        'synonyms': synonyms,
+                                        'InChI_Key': doc['InChI_Key']}}))
             i += 1
+        self.bulk_update(col_des, updates, label=collection_src, bulk_size=bulk_size, upsert=True)
 
 
     def fill_names(self):
@@ -234,6 +284,42 @@ class MetabolitesMeta(query_sabiork.QuerySabio):
         num, docs = self.get_duplicates('metabolites_meta', _key)
         return num, docs
 
+    def get_isomer_index(self, id_field='InChI_Key'):
+        """Index the isomers of the metabolites in a single pass over the collection.
+
+        Args:
+            id_field (:obj:`str`, optional): field which identifies each metabolite.
+
+        Returns:
+            (:obj:`molecule_util.IsomerIndex`): index of the stereoisomers, tautomers,
+            and protonation isomers of the metabolites.
+        """
+        index = molecule_util.IsomerIndex()
+        docs = self.collection.find(filter={'inchi': {'$ne': None}},
+                                    projection={'inchi': 1, id_field: 1})
+        for i, doc in enumerate(docs):
+            if i == self.max_entries:
+                break
+            id = doc.get(id_field, doc['_id'])
+            if id in index.keys or not doc['inchi'].startswith('InChI='):
+                continue
+            index.add(id, doc['inchi'])
+        return index
+
+    def get_isomer_groups(self, kind='tautomer', id_field='InChI_Key'):
+        """Group metabolites which are isomers of each other, e.g. to deduplicate
+        the collection.
+
+        Args:
+            kind (:obj:`str`, optional): 'stereoisomer', 'tautomer', or 'protonation_isomer'.
+            id_field (:obj:`str`, optional): field which identifies each metabolite.
+
+        Returns:
+            (:obj:`list` of :obj:`list`): ids of the metabolites in each group of
+            two or more isomers.
+        """
+        return self.get_isomer_index(id_field=id_field).get_clusters(kind)
+
     def reset_cellular_locations(self, start=0):
         """Github (https://github.com/KarrLab/datanator_rest_api/issues/69)
         """
@@ -1,6 +1,11 @@
 from io import BytesIO
+import multiprocessing
 import os
+import pymongo
+import re
 import shutil
+import threading
+import time
 import pandas as pd
 import requests
 import zipfile
@@ -22,15 +27,25 @@ class PaxNoSQL(mongo_util.MongoUtil):
             'pax_protein': 'http://pax-db.org/downloads/latest/paxdb-uniprot-links-v4.1.zip'
         }
         self.collection = 'pax'
+        self.report_lock = threading.Lock()
         super(PaxNoSQL, self).__init__(cache_dirname=cache_dirname, MongoDB=MongoDB, 
                 replicaSet=replicaSet, db=db,
                  verbose=verbose, max_entries=max_entries, username = username, 
                  password = password, authSource = authSource)
 
 
-    def load_content(self):
+    def load_content(self, processes=None, bulk_size=20):
         """ Collects and Parses all data from Pax DB website and adds to MongoDB
 
+        Files are parsed in a pool of :obj:`processes` worker processes (one task per file)
+        and their documents are written with unordered bulk upserts.
+
+        Args:
+            processes (:obj:`int`, optional): number of worker processes. Defaults to the number of CPUs.
+            bulk_size (:obj:`int`, optional): number of file documents per bulk write.
+
+        Returns:
+            :obj:`pymongo.collection.Collection`: collection of abundance files
         """
         client, db_obj, collection = self.con_db(self.collection)
         database_url = self.ENDPOINT_DOMAINS['pax']
@@ -53,186 +68,166 @@ class PaxNoSQL(mongo_util.MongoUtil):
         self.cwd_prot = self.cache_dirname+'/paxdb-uniprot-links-v4.1'
 
         # Insert Error Report in Cache
-        new_file = '/report.txt'
         new_path = self.cache_dirname + '/report.txt'
         self.report = open(new_path, 'w+')
         self.report.write('Errors found:\n')
 
         self.uniprot_pd = pd.read_csv(self.cwd_prot+'/paxdb-uniprot-links-v4.1.tsv',
                                       delimiter='\t', header=None, names=['string_id', 'uniprot_id'], index_col=0)
-
-        # Find data and parse individual files
-        file_count = 0
-        for _,_,files in (os.walk(self.cache_dirname)):
-        	file_count += len(files)
-        total = min(file_count, self.max_entries)
-
-        i = 0
-        for self.file_id in range(total):
-            if self.verbose:
-                print('Processing file_id = '+str(self.file_id+1)+' (out of '+str(total) +
-                      '; '+str(round(100*self.file_id/total, 2))+'%'+' already done)')
-            if i > self.max_entries:
-                break
-            entry = self.parse_paxDB_files()
-            collection.replace_one({'file_name':entry['file_name']},entry,upsert=True)
-            i += 1
-
-        client.close()
+        self.uniprot = uniprot_map(self.uniprot_pd)
+
+        data_files = self.data_files
+        if self.max_entries != float('inf'):
+            data_files = data_files[:int(self.max_entries)]
+        total = len(data_files)
+
+        start_time = time.time()
+        n_files = 0
+        n_observations = 0
+        bulk = []
+        with multiprocessing.Pool(processes=processes, initializer=_init_worker,
+                                  initargs=(self.uniprot,)) as pool:
+            tasks = [(file_path, self.cwd) for file_path in data_files]
+            for file_path, entry, errors in pool.imap_unordered(_parse_worker, tasks):
+                for error in errors:
+                    print('Error found, see reports.txt')
+                    self.write_report('Warning: {}, excluding file form DB ({})\n'.format(error, file_path))
+                n_files += 1
+                if entry is None:
+                    continue
+                n_observations += len(entry['observation'])
+                bulk.append(pymongo.ReplaceOne({'file_name': entry['file_name']}, entry, upsert=True))
+                if len(bulk) == bulk_size:
+                    collection.bulk_write(bulk, ordered=False)
+                    bulk = []
+                if self.verbose:
+                    elapsed = max(time.time() - start_time, 1e-9)
+                    print('Processed {} of {} files ({:.2f} files/s; {:.0f} observations/s)'.format(
+                        n_files, total, n_files / elapsed, n_observations / elapsed))
+        if len(bulk) != 0:
+            collection.bulk_write(bulk, ordered=False)
+
+        elapsed = max(time.time() - start_time, 1e-9)
+        self.throughput = {'files': n_files, 'observations': n_observations, 'seconds': elapsed,
+                           'files_per_second': n_files / elapsed,
+                           'observations_per_second': n_observations / elapsed}
+        self.report.close()
+        self.close()
 
         return collection
 
+    def write_report(self, message):
+        """ Append a message to the error report; safe to call from several threads
+
+        Args:
+            message (:obj:`str`): message
+        """
+        with self.report_lock:
+            self.report.write(message)
+            self.report.flush()
+
     def parse_paxDB_files(self):
         """ This function parses pax DB files and adds them to the NoSQL database
         """
         file_path = self.data_files[self.file_id]
-        entry = {}
         if self.verbose:
             print(file_path)
-
-        # Get NCBI taxonomy ID from file name
-        start = file_path.find('/', len(self.cwd)-1)+1
-        finish = file_path.find('/', len(self.cwd)+4)
-        ncbi_id = int(file_path[start:finish])
-
-        entry['ncbi_id'] = ncbi_id
-
-        # Get file_name
-        start = file_path.find('/', len(self.cwd))+1
-        file_name = file_path[start:]
-
-        entry['file_name'] = file_name
-
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-
-            # Get species name
-            start = lines[1].find(':')+2
-            finish = lines[1].find('-')-1
-            species_name = lines[1][start:finish]
-
-            field_name, _, _ = lines[1].partition(':')
-            if field_name == '#name':
-                entry['species_name'] = species_name
-            else:
-                print('Error found, see reports.txt')
-                self.report.write(
-                    'Warning: invalid #name field, excluding file form DB (file_id='+str(self.file_id)+'; '+file_name+')\n')
-                entry['species_name'] = None
-                return
-
-            # Get score
-            finish = len(lines[2])-1
-            score = float(lines[2][8:finish])
-
-            field_name, _, _ = lines[2].partition(':')
-            if field_name == '#score':
-                entry['score'] = score
-            else:
-                print('Error found, see reports.txt')
-                self.report.write(
-                    'Warning: invalid #score field, excluding file form DB (file_id='+str(self.file_id)+'; '+file_name+')\n')
-                entry['score'] = None
-                return
-
-            # Get weight
-            finish = lines[3].find('%')
-            if finish == -1:
-                weight = None
-            else:
-                weight = float(lines[3][9:finish])
-
-            field_name, _, _ = lines[3].partition(':')
-            if field_name == '#weight':
-                entry['weight'] = weight
-            else:
-                print('Error found, see reports.txt')
-                self.report.write('Warning: invalid #weight field, excluding file form DB (file_id=' +
-                                  str(self.file_id)+'; '+file_name+')\n')
-                entry['weight'] = None
-                return
-
-            # Get publication link
-            start = lines[4].find('http:')
-            finish = lines[4].find('"', start)
-            publication = lines[4][start:finish]
-
-            field_name, _, _ = lines[4].partition(':')
-            if field_name == '#description':
-                entry['publication'] = publication
-            else:
-                print('Error found, see reports.txt')
-                self.report.write('Warning: invalid #description field, excluding file form DB (file_id=' +
-                                  str(self.file_id)+'; '+file_name+')\n')
-                entry['publication'] = None
-                return
-
-            # Get organ
-            start = lines[5].find(':')+2
-            finish = len(lines[5])-1
-            organ = lines[5][start:finish]
-
-            field_name, _, _ = lines[5].partition(':')
-            if field_name == '#organ':
-                entry['organ'] = organ
-            else:
-                print('Error found, see reports.txt')
-                self.report.write(
-                    'Warning: invalid #organ field, excluding file form DB (file_id='+str(self.file_id)+'; '+file_name+')\n')
-                entry['organ'] = None
-                return
-
-            # Get coverage
-            start = lines[7].find(':')+2
-            finish = len(lines[7])-1
-            coverage = float(lines[7][start:finish])
-
-            field_name, _, _ = lines[7].partition(':')
-            if field_name == '#coverage':
-                entry['coverage'] = coverage
-            else:
-                print('Error found, see reports.txt')
-                self.report.write('Warning: invalid #coverage field, excluding file form DB (file_id=' +
-                                  str(self.file_id)+'; '+file_name+')\n')
-                entry['coverage'] = None
-                return
-
-            # Check column header
-            column_headers = lines[11].split()
-            if column_headers[0] == '#internal_id' \
-                    and column_headers[1] == 'string_external_id' \
-                    and column_headers[2] == 'abundance' \
-                    and len(column_headers) < 5:
-                pass
-            else:
-                print('Error found, see reports.txt')
-                self.report.write('Warning: invalid column headers, excluding file form DB (file_id=' +
-                                  str(self.file_id)+'; '+file_name+')\n')
-                return
-
-            """ --- Parse individual measurements and add them to DB ----------- """
-            observation = []
-            for i in range(12, len(lines)):
-                split_line = lines[i].split()
-                protein_id = split_line[0]
-                string_id = split_line[1]
-                abundance = split_line[2]
-                protein_info = None #default
-                if string_id in self.uniprot_pd.index.values:
-                    protein_info = {'string_id': string_id, 'uniprot_id':str(
-                        self.uniprot_pd.loc[string_id]['uniprot_id'])}
-                else:
-                    pass
-
-                observation.append(
-                    {'protein_id': protein_info, 'string_id': string_id, 'abundance': abundance})
-            entry['observation'] = observation
+        if not hasattr(self, 'uniprot'):
+            self.uniprot = uniprot_map(self.uniprot_pd)
+        entry, errors = parse_pax_file(file_path, self.cwd, self.uniprot)
+        for error in errors:
+            print('Error found, see reports.txt')
+            self.write_report('Warning: {}, excluding file form DB (file_id={}; {})\n'.format(
+                error, self.file_id, file_path))
         return entry
 
 
 '''Helper functions
 '''
 
+# header lines of an abundance file: line number -> (field, tag, pattern, type)
+HEADER_PATTERNS = {
+    1: ('species_name', '#name', re.compile(r'^#name:\s(.*?)(?:\s-.*)?$'), str),
+    2: ('score', '#score', re.compile(r'^#score:\s?(.*)$'), float),
+    3: ('weight', '#weight', re.compile(r'^#weight:(?:\s?(.*?)%)?'), float),
+    4: ('publication', '#description', re.compile(r'^#description:(?:.*?(http:[^"\n]*))?'), str),
+    5: ('organ', '#organ', re.compile(r'^#organ:\s(.*)$'), str),
+    7: ('coverage', '#coverage', re.compile(r'^#coverage:\s(.*)$'), float),
+}
+COLUMN_HEADER_PATTERN = re.compile(r'^#internal_id\s+string_external_id\s+abundance(\s+\S+)?\s*$')
+
+
+def uniprot_map(uniprot_pd):
+    """ Convert the STRING-to-UniProt link table into a dictionary
+
+    Args:
+        uniprot_pd (:obj:`pandas.DataFrame`): UniProt ids indexed by STRING id
+
+    Returns:
+        :obj:`dict`: {string_id: uniprot_id}
+    """
+    links = uniprot_pd[~uniprot_pd.index.duplicated(keep='first')]['uniprot_id']
+    return dict(zip(links.index, links.astype(str)))
+
+
+def parse_pax_file(file_path, cwd, uniprot):
+    """ Parse a single pax DB abundance file, streaming its observations
+
+    Args:
+        file_path (:obj:`str`): path to the abundance file
+        cwd (:obj:`str`): root directory of the abundance files
+        uniprot (:obj:`dict`): {string_id: uniprot_id}
+
+    Returns:
+        :obj:`tuple`:
+
+            * :obj:`dict`: file document or :obj:`None` if the file is invalid
+            * :obj:`list` of :obj:`str`: errors found
+    """
+    file_name = os.path.relpath(file_path, cwd).replace(os.sep, '/')
+    entry = {'ncbi_id': int(file_name.split('/')[0]), 'file_name': file_name}
+
+    with open(file_path, 'r') as f:
+        for i_line in range(12):
+            line = f.readline()
+            if i_line in HEADER_PATTERNS:
+                field, tag, pattern, cast = HEADER_PATTERNS[i_line]
+                match = pattern.match(line)
+                if match is None:
+                    return None, ['invalid {} field'.format(tag)]
+                value = match.group(1)
+                entry[field] = cast(value) if value is not None else None
+            elif i_line == 11 and not COLUMN_HEADER_PATTERN.match(line):
+                return None, ['invalid column headers']
+
+        observation = []
+        for line in f:
+            split_line = line.split()
+            if len(split_line) < 3:
+                continue
+            string_id = split_line[1]
+            protein_info = None #default
+            if string_id in uniprot:
+                protein_info = {'string_id': string_id, 'uniprot_id': uniprot[string_id]}
+            observation.append(
+                {'protein_id': protein_info, 'string_id': string_id, 'abundance': split_line[2]})
+        entry['observation'] = observation
+    return entry, []
+
+
+_uniprot = None
+
+
+def _init_worker(uniprot):
+    global _uniprot
+    _uniprot = uniprot
+
+
+def _parse_worker(args):
+    file_path, cwd = args
+    return (file_path,) + parse_pax_file(file_path, cwd, _uniprot)
+
+
 
 def find_files(path):
     """ Scan a directory (and its subdirectories) for files and sort by ncbi_id
@@ -1,62 +1,593 @@
 #from . import download_cdna
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datanator.util import rna_seq_util
 from urllib.request import urlretrieve
 import urllib
 import numpy as np
+import json
 import os
 import pandas as pd
 import requests
 import shutil
 import ftplib
 import gzip
+import hashlib
+import threading
+import time
+import zlib
 from Bio import SeqIO
 
 
 
 
 
-def get_processed_data_samples(samples, output_directory, temp_directory):
-    for sample in samples:
-        if sample.ensembl_info and sample.fastq_urls:
-            download_cdna(sample.ensembl_info[0].ref_genome, sample.ensembl_info[0].organism_strain, sample.ensembl_info[0].url, temp_directory)
-            fastq_urls = ""
-            for url in sample.fastq_urls:
-                fastq_urls = fastq_urls + url.url + " "
-            fastq_urls = fastq_urls[:-1]
-            download_fastq(sample.experiment_id, sample.name, temp_directory, fastq_urls)
-            process_cdna(sample.ensembl_info[0].organism_strain, output_directory, temp_directory)
-            process_fastq(sample.experiment_id, sample.name, sample.ensembl_info[0].organism_strain, len(sample.fastq_urls), sample.experiment.read_type, output_directory, temp_directory)
-            #delete_cdna_files(sample.ensembl_info[0].organism_strain, temp_directory)
-            delete_fastq_files(sample.experiment_id, sample.name, temp_directory)
-        else:
-            print("No FASTQ or no Ensembl for {}_{}".format(sample.experiment_id, sample.name))
+def get_processed_data_samples(samples, output_directory, temp_directory, **kwargs):
+    """ Download and quantify the FASTQ files of samples, overlapping the downloads,
+    the kallisto runs and the post-processing of different samples (see :obj:`SampleScheduler`)
+
+    Args:
+        samples (:obj:`list` of :obj:`array_express.Sample`): samples
+        output_directory (:obj:`str`): directory for the kallisto indices and the abundances
+        temp_directory (:obj:`str`): directory for the cDNA and FASTQ files
+        **kwargs: options of :obj:`SampleScheduler`
+
+    Returns:
+        :obj:`dict`: report of the run (see :obj:`SampleScheduler.run`)
+    """
+    return SampleScheduler(output_directory, temp_directory, **kwargs).run(samples)
+
+
+class Stage(object):
+    """ Bounded pool of workers for one stage of the pipeline which measures how busy its workers are
+
+    Attributes:
+        name (:obj:`str`): name of the stage
+        workers (:obj:`int`): number of workers
+        jobs (:obj:`int`): number of finished jobs
+        busy_seconds (:obj:`float`): total time spent by the workers on jobs
+    """
+
+    def __init__(self, name, workers):
+        """
+        Args:
+            name (:obj:`str`): name of the stage
+            workers (:obj:`int`): number of workers
+        """
+        self.name = name
+        self.workers = workers
+        self.jobs = 0
+        self.busy_seconds = 0.
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """ Queue a job
+
+        Args:
+            func (:obj:`callable`): job
+            *args: arguments of the job
+            **kwargs: keyword arguments of the job
+
+        Returns:
+            :obj:`concurrent.futures.Future`: result of the job
+        """
+        return self._executor.submit(self._run, func, args, kwargs)
+
+    def run(self, func, *args, **kwargs):
+        """ Run a job in the stage and wait for its result """
+        return self.submit(func, *args, **kwargs).result()
+
+    def _run(self, func, args, kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.jobs += 1
+                self.busy_seconds += time.time() - start
+
+    def utilization(self, seconds):
+        """ Get the fraction of the time that the workers of the stage were busy
+
+        Args:
+            seconds (:obj:`float`): wall time of the run
+
+        Returns:
+            :obj:`dict`: workers, jobs, busy seconds and utilization
+        """
+        return {
+            'workers': self.workers,
+            'jobs': self.jobs,
+            'busy_seconds': self.busy_seconds,
+            'utilization': self.busy_seconds / (seconds * self.workers) if seconds else 0.,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+class DiskBudget(object):
+    """ Limit on the total size of the files which samples keep in the temporary directory
+
+    A sample reserves its estimated size before its FASTQ files are downloaded and releases
+    it when they are deleted. A sample larger than the whole budget waits until it can run alone.
+
+    Attributes:
+        limit (:obj:`int`): number of bytes available, or :obj:`None` for no limit
+        used (:obj:`int`): number of bytes reserved
+    """
+
+    def __init__(self, limit=None):
+        """
+        Args:
+            limit (:obj:`int`, optional): number of bytes available, or :obj:`None` for no limit
+        """
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        """ Wait until a number of bytes is available and reserve them
+
+        Args:
+            size (:obj:`int`): number of bytes
+
+        Returns:
+            :obj:`int`: number of bytes reserved
+        """
+        if self.limit is not None:
+            size = min(size, self.limit)
+        with self._condition:
+            while self.limit is not None and self.used and self.used + size > self.limit:
+                self._condition.wait()
+            self.used += size
+        return size
+
+    def release(self, size):
+        """ Release reserved bytes
+
+        Args:
+            size (:obj:`int`): number of bytes
+        """
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class SampleScheduler(object):
+    """ Process samples through separate, bounded stages so that the network, the disk and the
+    CPUs are used at the same time
+
+    * download: downloads the cDNA of each strain and the FASTQ files of each sample
+    * quantify: builds the kallisto index of each strain, once for all of its samples, and
+      runs kallisto on each sample
+    * post-process: normalizes the abundances of each sample and deletes its FASTQ files
+
+    The FASTQ files of at most :obj:`disk_budget` bytes are kept in the temporary directory. The
+    stage reached by each sample is saved in a checkpoint file in the output directory, so that
+    a restarted run skips finished downloads, kallisto runs and samples.
+
+    Attributes:
+        output_directory (:obj:`str`): directory for the kallisto indices and the abundances
+        temp_directory (:obj:`str`): directory for the cDNA and FASTQ files
+        kallisto (:obj:`rna_seq_util.Kallisto`): interface to kallisto
+        threads_per_job (:obj:`int`): number of threads of each kallisto run
+        default_sample_size (:obj:`int`): size reserved for a sample whose download size is unknown
+        disk_budget (:obj:`DiskBudget`): limit on the size of the files in the temporary directory
+        stages (:obj:`dict` of :obj:`str`: :obj:`Stage`): stages of the pipeline
+        checkpoint_filename (:obj:`str`): path to the checkpoint file
+        verbose (:obj:`bool`): if :obj:`True`, print progress
+    """
+
+    CHECKPOINT_FILENAME = 'rna_seq_checkpoint.json'
+
+    def __init__(self, output_directory, temp_directory, kallisto=None, cpus=None, threads_per_job=1,
+                 download_workers=4, post_process_workers=2, disk_budget=None,
+                 default_sample_size=2 * 2 ** 30, verbose=False):
+        """
+        Args:
+            output_directory (:obj:`str`): directory for the kallisto indices and the abundances
+            temp_directory (:obj:`str`): directory for the cDNA and FASTQ files
+            kallisto (:obj:`rna_seq_util.Kallisto`, optional): interface to kallisto
+            cpus (:obj:`int`, optional): number of CPUs for kallisto; defaults to the number of CPUs of the machine
+            threads_per_job (:obj:`int`, optional): number of threads of each kallisto run
+            download_workers (:obj:`int`, optional): number of concurrent downloads
+            post_process_workers (:obj:`int`, optional): number of samples post-processed concurrently
+            disk_budget (:obj:`int`, optional): maximum number of bytes of FASTQ files in the temporary directory
+            default_sample_size (:obj:`int`, optional): size reserved for a sample whose download size is unknown
+            verbose (:obj:`bool`, optional): if :obj:`True`, print progress
+        """
+        self.output_directory = output_directory
+        self.temp_directory = temp_directory
+        self.kallisto = kallisto or rna_seq_util.Kallisto()
+        self.threads_per_job = threads_per_job
+        self.default_sample_size = default_sample_size
+        self.disk_budget = DiskBudget(disk_budget)
+        self.verbose = verbose
+        cpus = cpus or os.cpu_count() or 1
+        self.stages = {
+            'download': Stage('download', download_workers),
+            'quantify': Stage('quantify', max(1, cpus // threads_per_job)),
+            'post-process': Stage('post-process', post_process_workers),
+        }
+        self.checkpoint_filename = os.path.join(output_directory, self.CHECKPOINT_FILENAME)
+        self._checkpoint = {}
+        self._indices = {}
+        self._lock = threading.Lock()
+
+    def run(self, samples):
+        """ Process samples
+
+        Args:
+            samples (:obj:`list` of :obj:`array_express.Sample`): samples
+
+        Returns:
+            :obj:`dict`: lists of the samples which were processed, skipped because they were
+            already finished or had no FASTQ files or Ensembl information, and which failed;
+            wall time; and the utilization of each stage
+        """
+        start = time.time()
+        os.makedirs(self.output_directory, exist_ok=True)
+        self._checkpoint = self.read_checkpoint()
+        report = {'processed': [], 'finished': [], 'skipped': [], 'failed': []}
+
+        todo = []
+        for sample in samples:
+            key = self.get_key(sample)
+            if not (sample.ensembl_info and sample.fastq_urls):
+                print("No FASTQ or no Ensembl for {}_{}".format(sample.experiment_id, sample.name))
+                report['skipped'].append(key)
+            elif self._checkpoint.get(key) == 'done':
+                report['finished'].append(key)
+            else:
+                todo.append(sample)
+
+        # each sample is driven by a thread which waits on the stages; enough drivers are
+        # started to keep every stage busy, and the disk budget bounds the samples in flight
+        n_drivers = 2 * sum(stage.workers for stage in self.stages.values())
+        with ThreadPoolExecutor(max_workers=n_drivers, thread_name_prefix='sample') as drivers:
+            futures = {drivers.submit(self.process_sample, sample): self.get_key(sample) for sample in todo}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    future.result()
+                    report['processed'].append(key)
+                except Exception as error:
+                    print('Unable to process {}: {}'.format(key, error))
+                    report['failed'].append(key)
+
+        for stage in self.stages.values():
+            stage.shutdown()
+        report['seconds'] = time.time() - start
+        report['stages'] = {name: stage.utilization(report['seconds']) for name, stage in self.stages.items()}
+        if self.verbose:
+            print('Processed {} samples in {:.1f} s ({} finished before, {} skipped, {} failed)'.format(
+                len(report['processed']), report['seconds'], len(report['finished']),
+                len(report['skipped']), len(report['failed'])))
+            for name, stage in report['stages'].items():
+                print('  {}: {} jobs, {:.0%} utilization of {} workers'.format(
+                    name, stage['jobs'], stage['utilization'], stage['workers']))
+        return report
+
+    def process_sample(self, sample):
+        """ Download, quantify and post-process a sample, resuming from its checkpoint
+
+        Args:
+            sample (:obj:`array_express.Sample`): sample
+        """
+        key = self.get_key(sample)
+        ensembl_info = sample.ensembl_info[0]
+        fastq_urls = " ".join(url.url for url in sample.fastq_urls)
+
+        size = 0
+        if self._checkpoint.get(key) != 'quantified':
+            size = self.disk_budget.acquire(self.get_download_size(sample))
+            try:
+                downloaded = self.stages['download'].submit(download_fastq, sample.experiment_id, sample.name,
+                                                            self.temp_directory, fastq_urls)
+                self.get_index(ensembl_info)
+                downloaded.result()
+                self.stages['quantify'].run(quantify_fastq, sample.experiment_id, sample.name,
+                                            ensembl_info.organism_strain, len(sample.fastq_urls),
+                                            sample.experiment.read_type, self.output_directory,
+                                            self.temp_directory, kallisto=self.kallisto,
+                                            threads=self.threads_per_job)
+                self.save_checkpoint(key, 'quantified')
+            except Exception:
+                delete_fastq_files(sample.experiment_id, sample.name, self.temp_directory)
+                self.disk_budget.release(size)
+                raise
+
+        self.stages['post-process'].run(self.post_process, sample, size)
+        self.save_checkpoint(key, 'done')
+
+    def post_process(self, sample, size=0):
+        """ Normalize the abundances of a sample, delete its FASTQ files and release their
+        reservation of the disk budget
+
+        Args:
+            sample (:obj:`array_express.Sample`): sample
+            size (:obj:`int`, optional): number of bytes reserved for the FASTQ files of the sample
+        """
+        sample_dirname = "{}/{}/{}".format(self.output_directory, sample.experiment_id, sample.name)
+        try:
+            normalize_abundances(sample_dirname, sample.name)
+            delete_fastq_files(sample.experiment_id, sample.name, self.temp_directory)
+        finally:
+            self.disk_budget.release(size)
+
+    def get_index(self, ensembl_info):
+        """ Get the kallisto index of a strain, downloading its cDNA and building the index
+        the first time that it is needed
+
+        Concurrent requests for the same strain wait for the same index.
+
+        Args:
+            ensembl_info (:obj:`array_express.EnsemblInfo`): reference genome of the strain
+
+        Returns:
+            :obj:`str`: path to the index
+        """
+        strain_name = ensembl_info.organism_strain
+        with self._lock:
+            future = self._indices.get(strain_name)
+            owner = future is None
+            if owner:
+                future = self._indices[strain_name] = Future()
+        if owner:
+            try:
+                self.stages['download'].run(download_cdna, ensembl_info.ref_genome, strain_name,
+                                            ensembl_info.url, self.temp_directory)
+                future.set_result(self.stages['quantify'].run(process_cdna, strain_name, self.output_directory,
+                                                              self.temp_directory, kallisto=self.kallisto))
+            except Exception as error:
+                future.set_exception(error)
+        return future.result()
+
+    def get_download_size(self, sample):
+        """ Get the total size of the FASTQ files of a sample
+
+        Args:
+            sample (:obj:`array_express.Sample`): sample
+
+        Returns:
+            :obj:`int`: number of bytes, or :obj:`default_sample_size` if the size of a file is unknown
+        """
+        size = 0
+        for url in sample.fastq_urls:
+            url = url.url
+            try:
+                if url.startswith('file://'):
+                    size += os.path.getsize(urllib.request.url2pathname(url[len('file://'):]))
+                elif url.startswith(('http://', 'https://')):
+                    response = requests.head(url, allow_redirects=True, timeout=30)
+                    response.raise_for_status()
+                    size += int(response.headers['Content-Length'])
+                else:
+                    return self.default_sample_size
+            except (OSError, KeyError, ValueError, requests.exceptions.RequestException):
+                return self.default_sample_size
+        return size
+
+    @staticmethod
+    def get_key(sample):
+        return '{}__{}'.format(sample.experiment_id, sample.name)
+
+    def read_checkpoint(self):
+        """ Read the stage reached by each sample
+
+        Returns:
+            :obj:`dict`: dictionary which maps the key of each sample to 'quantified' or 'done'
+        """
+        if not os.path.isfile(self.checkpoint_filename):
+            return {}
+        with open(self.checkpoint_filename, 'r') as file:
+            return json.load(file)
+
+    def save_checkpoint(self, key, status):
+        """ Record the stage reached by a sample
+
+        Args:
+            key (:obj:`str`): key of the sample
+            status (:obj:`str`): 'quantified' or 'done'
+        """
+        with self._lock:
+            self._checkpoint[key] = status
+            tmp_filename = self.checkpoint_filename + '.tmp'
+            with open(tmp_filename, 'w') as file:
+                json.dump(self._checkpoint, file, indent=2, sort_keys=True)
+            os.replace(tmp_filename, self.checkpoint_filename)
+
+
+DOWNLOAD_CHUNK_SIZE = 2 ** 20
+
+
+def get_manifest_filename(file_name):
+    return "{}.manifest.json".format(file_name)
+
+
+def read_manifest(file_name):
+    """ Read the manifest of a downloaded file
+
+    Args:
+        file_name (:obj:`str`): path to the file
+
+    Returns:
+        :obj:`dict`: URL, size and SHA-256 checksum of the file, or :obj:`None` if the file has no manifest
+    """
+    manifest_filename = get_manifest_filename(file_name)
+    if not os.path.isfile(manifest_filename):
+        return None
+    try:
+        with open(manifest_filename, 'r') as file:
+            return json.load(file)
+    except ValueError:
+        return None
+
+
+def write_manifest(file_name, url, size, sha256):
+    """ Write the manifest of a downloaded file
+
+    Args:
+        file_name (:obj:`str`): path to the file
+        url (:obj:`str`): URL of the file
+        size (:obj:`int`): size of the file in bytes
+        sha256 (:obj:`str`): SHA-256 checksum of the file
+    """
+    manifest_filename = get_manifest_filename(file_name)
+    tmp_filename = manifest_filename + '.tmp'
+    with open(tmp_filename, 'w') as file:
+        json.dump({'url': url, 'size': size, 'sha256': sha256}, file)
+    os.replace(tmp_filename, manifest_filename)
+
+
+def hash_file(file_name, sha256=None, check_gzip=False):
+    """ Compute the SHA-256 checksum of a file, reading it in chunks
+
+    Args:
+        file_name (:obj:`str`): path to the file
+        sha256 (:obj:`hashlib.sha256`, optional): checksum of the data which precedes the file
+        check_gzip (:obj:`bool`, optional): if :obj:`True`, also decompress the file in chunks,
+            which checks the CRC and the length in the trailer of each gzip member
+
+    Returns:
+        :obj:`tuple`: SHA-256 checksum (:obj:`hashlib.sha256`) and size of the file
+
+    Raises:
+        :obj:`ValueError`: if the file isn't a complete, valid gzip file
+    """
+    sha256 = sha256 or hashlib.sha256()
+    size = 0
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if check_gzip else None
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            size += len(chunk)
+            while decompressor and chunk:
+                try:
+                    decompressor.decompress(chunk, DOWNLOAD_CHUNK_SIZE)
+                except zlib.error as error:
+                    raise ValueError('{} is not a valid gzip file: {}'.format(file_name, error))
+                if decompressor.eof:
+                    # concatenated gzip members
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if chunk else decompressor
+                else:
+                    chunk = decompressor.unconsumed_tail
+    if decompressor and not decompressor.eof:
+        raise ValueError('{} is truncated'.format(file_name))
+    return sha256, size
+
+
+def verify_download(file_name, url=None, checksum=False):
+    """ Check whether a cached download is complete
+
+    A file with a manifest is checked against the size in the manifest and, if :obj:`checksum`
+    is :obj:`True`, against its SHA-256 checksum. A gzip file without a manifest (e.g.
+    downloaded before manifests were kept) is checked by decompressing it in chunks, and
+    is given a manifest if it is valid. Memory use is constant in both cases.
+
+    Args:
+        file_name (:obj:`str`): path to the file
+        url (:obj:`str`, optional): URL of the file; a manifest for another URL doesn't match
+        checksum (:obj:`bool`, optional): if :obj:`True`, verify the checksum of files with manifests
+
+    Returns:
+        :obj:`bool`: :obj:`True` if the file is complete
+    """
+    if not os.path.isfile(file_name):
+        return False
+    manifest = read_manifest(file_name)
+    if manifest is not None:
+        if url is not None and manifest['url'] != url:
+            return False
+        if os.path.getsize(file_name) != manifest['size']:
+            return False
+        if checksum:
+            return hash_file(file_name)[0].hexdigest() == manifest['sha256']
+        return True
+    if not file_name.endswith('.gz'):
+        return False
+    try:
+        sha256, size = hash_file(file_name, check_gzip=True)
+    except (OSError, ValueError):
+        return False
+    write_manifest(file_name, url, size, sha256.hexdigest())
+    return True
+
+
+def download_file(url, file_name, session=None, timeout=60):
+    """ Download a file, resuming a previous partial download with an HTTP Range request
+
+    The file is downloaded to `<file_name>.partial` and moved to :obj:`file_name` once it is
+    complete (and, for gzip files, decompresses cleanly). Its size and SHA-256 checksum are
+    saved in a manifest next to it (see :obj:`verify_download`). URLs other than HTTP(S)
+    URLs are downloaded with :obj:`urlretrieve`, without resuming.
+
+    Args:
+        url (:obj:`str`): URL
+        file_name (:obj:`str`): path to save the file
+        session (:obj:`requests.Session`, optional): HTTP session
+        timeout (:obj:`float`, optional): timeout of the HTTP requests in seconds
+
+    Raises:
+        :obj:`ValueError`: if the downloaded gzip file is invalid
+    """
+    partial_file_name = file_name + '.partial'
+    if os.path.isfile(get_manifest_filename(file_name)):
+        os.remove(get_manifest_filename(file_name))
+
+    if url.startswith(('http://', 'https://')):
+        session = session or requests
+        start = os.path.getsize(partial_file_name) if os.path.isfile(partial_file_name) else 0
+        headers = {'Range': 'bytes={}-'.format(start)} if start else {}
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 416:
+                # the partial download already has every byte
+                pass
+            else:
+                response.raise_for_status()
+                mode = 'ab' if start and response.status_code == 206 else 'wb'
+                with open(partial_file_name, mode) as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+    else:
+        urlretrieve(url, partial_file_name)
+        urllib.request.urlcleanup()
+
+    try:
+        sha256, size = hash_file(partial_file_name, check_gzip=file_name.endswith('.gz'))
+    except ValueError:
+        os.remove(partial_file_name)
+        raise
+    os.replace(partial_file_name, file_name)
+    write_manifest(file_name, url, size, sha256.hexdigest())
 
 
 def download_cdna(ref_genome, strain_name, url, temp_directory):
     CDNA_DIR = "{}/CDNA_FILES".format(temp_directory)
     if not os.path.isdir(CDNA_DIR):
-        os.makedirs(CDNA_DIR)
+        os.makedirs(CDNA_DIR, exist_ok=True)
     file_name = "{}/{}.cdna.all.fa.gz".format(CDNA_DIR, strain_name)
-    if not os.path.isfile(file_name):
-        if ref_genome == "ensembl":
-            if not os.path.isfile(file_name):
-                file = urlretrieve(url, file_name)
-            os.chdir(temp_directory)
-        elif ref_genome == "genbank":
-            new_cdna_file = gzip.open(file_name, 'wb')
-            temp_file_name = "{}/{}.temp.all.fa.gz".format(CDNA_DIR, strain_name)
-            file = urlretrieve(url, temp_file_name)
-            list_locus_tags = []
-            with gzip.open(temp_file_name, "rt") as handle:
-                for record in SeqIO.parse(handle, "fasta"):
-                    locus_tag = record.description[record.description.find("[locus_tag=")+11:record.description.find("]", record.description.find("[locus_tag="))]
-                    if locus_tag in list_locus_tags:
-                        locus_tag = "{}_variation".format(locus_tag)
-                    list_locus_tags.append(locus_tag)
-                    new_cdna_file.write(bytes(">{}\n".format(locus_tag), 'utf-8'))
-                    new_cdna_file.write(bytes("{}\n".format(record.seq), 'utf-8'))
-    #print(locus_tag)
-            os.remove(temp_file_name)
+    if ref_genome == "ensembl":
+        if not verify_download(file_name, url=url):
+            download_file(url, file_name)
+    elif ref_genome == "genbank" and not os.path.isfile(file_name):
+        temp_file_name = "{}/{}.temp.all.fa.gz".format(CDNA_DIR, strain_name)
+        if not verify_download(temp_file_name, url=url):
+            download_file(url, temp_file_name)
+        list_locus_tags = []
+        with gzip.open(temp_file_name, "rt") as handle, gzip.open(file_name + '.tmp', 'wb') as new_cdna_file:
+            for record in SeqIO.parse(handle, "fasta"):
+                locus_tag = record.description[record.description.find("[locus_tag=")+11:record.description.find("]", record.description.find("[locus_tag="))]
+                if locus_tag in list_locus_tags:
+                    locus_tag = "{}_variation".format(locus_tag)
+                list_locus_tags.append(locus_tag)
+                new_cdna_file.write(bytes(">{}\n".format(locus_tag), 'utf-8'))
+                new_cdna_file.write(bytes("{}\n".format(record.seq), 'utf-8'))
+        os.replace(file_name + '.tmp', file_name)
+        os.remove(temp_file_name)
+        os.remove(get_manifest_filename(temp_file_name))
 
 
 
@@ -64,70 +595,224 @@ def download_cdna(ref_genome, strain_name, url, temp_directory):
 def download_fastq(experiment_name,  sample_name, temp_directory, fastq_urls):
     FASTQ_DIR = "{}/FASTQ_FILES".format(temp_directory)
     if not os.path.isdir(FASTQ_DIR):
-        os.makedirs(FASTQ_DIR)
+        os.makedirs(FASTQ_DIR, exist_ok=True)
     for num, url in enumerate(fastq_urls.split(" ")):
         print("starting {}".format(num))
         file_name = '{}/{}__{}__{}.fastq.gz'.format(FASTQ_DIR, experiment_name, sample_name, num)
-        file_must_be_downloaded = False
-        if os.path.isfile(file_name):
-            try:
-                with gzip.open(file_name, 'rb') as f:
-                    file_content = f.read()
-                file_must_be_downloaded = False
-            except:
-                file_must_be_downloaded = True
-        else:
-            file_must_be_downloaded = True
+        file_must_be_downloaded = not verify_download(file_name, url=url)
         if file_must_be_downloaded:
-            file = urlretrieve(url, file_name)  # there used to be a space after "gz". I removed it
-            urllib.urlcleanup()
-        else:
-            pass
+            download_file(url, file_name)
         print(file_must_be_downloaded)
         print("done with {}".format(num))
 
-def process_cdna(strain_name, output_directory, temp_directory):
+def process_cdna(strain_name, output_directory, temp_directory, kallisto=None):
 
     CDNA_DIR = "{}/CDNA_FILES".format(temp_directory)
     cdna_file = "{}/{}.cdna.all.fa.gz".format(CDNA_DIR, strain_name)
     KALLISTO_DIR = "{}/kallisto_index_files".format(output_directory)
     if not os.path.isdir(KALLISTO_DIR):
-        os.makedirs(KALLISTO_DIR)
+        os.makedirs(KALLISTO_DIR, exist_ok=True)
     kallisto_file = "{}/{}.idx".format(KALLISTO_DIR, strain_name)
     if not os.path.isfile(kallisto_file):
-        os.system("kallisto index -i {} {}".format(kallisto_file, cdna_file))
+        # build the index under a temporary name so that an interrupted build isn't mistaken for an index
+        temp_kallisto_file = "{}.tmp".format(kallisto_file)
+        (kallisto or rna_seq_util.Kallisto()).index([cdna_file], index_filename=temp_kallisto_file)
+        os.replace(temp_kallisto_file, kallisto_file)
+    return kallisto_file
 
 
 def process_fastq(experiment_name, sample_name, strain_name, num_fastq_files, read_type, output_directory, temp_directory):
+    sample_dirname = quantify_fastq(experiment_name, sample_name, strain_name, num_fastq_files, read_type,
+                                    output_directory, temp_directory)
+    normalize_abundances(sample_dirname, sample_name)
+
+
+def quantify_fastq(experiment_name, sample_name, strain_name, num_fastq_files, read_type, output_directory,
+                   temp_directory, kallisto=None, threads=1):
 
     exp_dirname = "{}/{}".format(output_directory, experiment_name)
     if not os.path.isdir(exp_dirname):
-        os.makedirs(exp_dirname)
+        os.makedirs(exp_dirname, exist_ok=True)
 
     sample_dirname = "{}/{}".format(exp_dirname, sample_name)
     if not os.path.isdir(sample_dirname):
-        os.makedirs(sample_dirname)
+        os.makedirs(sample_dirname, exist_ok=True)
 
+    kallisto = kallisto or rna_seq_util.Kallisto()
     fastq_filenames = []
     for num in range(num_fastq_files):
-        fastq_filenames.append("{}/FASTQ_Files/{}__{}__{}.fastq.gz".format(temp_directory, experiment_name, sample_name, num))
+        fastq_filenames.append("{}/FASTQ_FILES/{}__{}__{}.fastq.gz".format(temp_directory, experiment_name, sample_name, num))
     index_filename = '{}/kallisto_index_files/{}.idx'.format(output_directory, strain_name)
     output_dirname = '{}/output'.format(sample_dirname)
     if read_type == "single":
-            rna_seq_util.Kallisto().quant(fastq_filenames, index_filename=index_filename, output_dirname=output_dirname,
-                         single_end_reads=True, fragment_length=180, fragment_length_std=20)
+        kallisto.quant(fastq_filenames, index_filename=index_filename, output_dirname=output_dirname,
+                       single_end_reads=True, fragment_length=180, fragment_length_std=20, threads=threads)
     elif read_type == "paired":
-        rna_seq_util.Kallisto().quant(fastq_filenames, index_filename=index_filename, output_dirname=output_dirname)
+        kallisto.quant(fastq_filenames, index_filename=index_filename, output_dirname=output_dirname,
+                       threads=threads)
+    return sample_dirname
+
 
-    new_pandas = pd.read_csv('{}/output/abundance.tsv'.format(sample_dirname), sep='\t').set_index("target_id")
-    total_tpm = 0
-    for num in new_pandas['tpm']:
-        total_tpm = total_tpm + num
-    new_column = [num/total_tpm for num in new_pandas['tpm']]
-    new_pandas['target_id'] = new_column
-    new_pandas.to_pickle("{}/{}_abundances_binary".format(sample_dirname, sample_name))
-    #new_pandas.to_csv("{}/{}_abundances_csv".format(sample_dirname, sample.name))
+ABUNDANCE_DTYPES = {
+    'target_id': str,
+    'length': np.int32,
+    'eff_length': np.float32,
+    'est_counts': np.float32,
+    'tpm': np.float64,
+}
 
+_abundance_matrix_lock = threading.Lock()
+
+
+def normalize_abundances(sample_dirname, sample_name):
+    """ Normalize the TPM of a sample, save it as Parquet and add it to the abundance matrix of the experiment
+
+    Args:
+        sample_dirname (:obj:`str`): directory of the sample, which contains the output of kallisto
+        sample_name (:obj:`str`): name of the sample
+
+    Returns:
+        :obj:`pandas.DataFrame`: abundances, indexed by target id, with a column `normalized_tpm`
+    """
+    new_pandas = pd.read_csv('{}/output/abundance.tsv'.format(sample_dirname), sep='\t',
+                             dtype=ABUNDANCE_DTYPES).set_index("target_id")
+    tpm = new_pandas['tpm']
+    new_pandas['normalized_tpm'] = (tpm / tpm.sum()).astype(np.float32)
+    new_pandas['tpm'] = tpm.astype(np.float32)
+    new_pandas.to_parquet("{}/{}_abundances.parquet".format(sample_dirname, sample_name))
+
+    with _abundance_matrix_lock:
+        AbundanceMatrix(os.path.join(os.path.dirname(sample_dirname), 'abundance_matrix')) \
+            .append(sample_name, new_pandas['normalized_tpm'])
+    return new_pandas
+
+
+def read_abundances(sample_dirname, sample_name, columns=None):
+    """ Read the abundances of a sample saved by :obj:`normalize_abundances`
+
+    Args:
+        sample_dirname (:obj:`str`): directory of the sample
+        sample_name (:obj:`str`): name of the sample
+        columns (:obj:`list` of :obj:`str`, optional): columns to read
+
+    Returns:
+        :obj:`pandas.DataFrame`: abundances, indexed by target id
+    """
+    return pd.read_parquet("{}/{}_abundances.parquet".format(sample_dirname, sample_name), columns=columns)
+
+
+class AbundanceMatrix(object):
+    """ Experiment-level matrix of the normalized TPM of each target in each sample
+
+    The matrix is stored as a flat file of float32 values with one row per sample, along with
+    JSON lists of the targets and of the samples. Samples are added by appending a row, and
+    the matrix is memory-mapped for reading, so that cross-sample queries only read the pages
+    they touch.
+
+    Attributes:
+        dirname (:obj:`str`): directory of the matrix
+        targets (:obj:`list` of :obj:`str`): ids of the targets (columns)
+        samples (:obj:`list` of :obj:`str`): names of the samples (rows)
+    """
+
+    DTYPE = np.float32
+
+    def __init__(self, dirname):
+        """
+        Args:
+            dirname (:obj:`str`): directory of the matrix
+        """
+        self.dirname = dirname
+        self.targets = self._read_json('targets.json') or []
+        self.samples = self._read_json('samples.json') or []
+
+    @property
+    def values_filename(self):
+        return os.path.join(self.dirname, 'normalized_tpm.f32')
+
+    def _read_json(self, name):
+        filename = os.path.join(self.dirname, name)
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, 'r') as file:
+            return json.load(file)
+
+    def _write_json(self, name, value):
+        filename = os.path.join(self.dirname, name)
+        with open(filename + '.tmp', 'w') as file:
+            json.dump(value, file)
+        os.replace(filename + '.tmp', filename)
+
+    def append(self, sample_name, abundances):
+        """ Add a sample to the matrix, or replace it if it is already in the matrix
+
+        Args:
+            sample_name (:obj:`str`): name of the sample
+            abundances (:obj:`pandas.Series`): normalized TPM, indexed by target id
+
+        Raises:
+            :obj:`ValueError`: if the sample has targets which aren't in the matrix
+        """
+        os.makedirs(self.dirname, exist_ok=True)
+        if not self.targets:
+            self.targets = list(abundances.index)
+            self._write_json('targets.json', self.targets)
+        target_index = pd.Index(self.targets)
+        if abundances.index.equals(target_index):
+            row = abundances.to_numpy(dtype=self.DTYPE)
+        else:
+            positions = target_index.get_indexer(abundances.index)
+            if (positions < 0).any():
+                raise ValueError('Sample {} has targets which are not in the abundance matrix'.format(sample_name))
+            row = np.full(len(self.targets), np.nan, dtype=self.DTYPE)
+            row[positions] = abundances.to_numpy(dtype=self.DTYPE)
+
+        row_size = len(self.targets) * np.dtype(self.DTYPE).itemsize
+        with open(self.values_filename, 'ab') as file:
+            # drop a row which was written without being recorded in the list of samples
+            file.truncate(len(self.samples) * row_size)
+        if sample_name in self.samples:
+            with open(self.values_filename, 'r+b') as file:
+                file.seek(self.samples.index(sample_name) * row_size)
+                file.write(row.tobytes())
+        else:
+            with open(self.values_filename, 'ab') as file:
+                file.write(row.tobytes())
+            self.samples.append(sample_name)
+            self._write_json('samples.json', self.samples)
+
+    @property
+    def values(self):
+        """ Memory-mapped matrix
+
+        Returns:
+            :obj:`numpy.memmap`: read-only array with one row per sample and one column per target
+        """
+        if not self.samples:
+            return np.zeros((0, len(self.targets)), dtype=self.DTYPE)
+        return np.memmap(self.values_filename, dtype=self.DTYPE, mode='r',
+                         shape=(len(self.samples), len(self.targets)))
+
+    def to_frame(self, samples=None, targets=None):
+        """ Get the matrix, or a part of it, as a data frame
+
+        Args:
+            samples (:obj:`list` of :obj:`str`, optional): names of the samples; defaults to all samples
+            targets (:obj:`list` of :obj:`str`, optional): ids of the targets; defaults to all targets
+
+        Returns:
+            :obj:`pandas.DataFrame`: normalized TPM with one row per sample and one column per target
+        """
+        values = self.values
+        rows = slice(None) if samples is None else [self.samples.index(sample) for sample in samples]
+        if targets is None:
+            columns = slice(None)
+        else:
+            positions = {target: i for i, target in enumerate(self.targets)}
+            columns = [positions[target] for target in targets]
+        return pd.DataFrame(np.asarray(values[rows][:, columns]),
+                            index=self.samples if samples is None else samples,
+                            columns=self.targets if targets is None else targets)
 
 
 def delete_cdna_files(strain_name, temp_directory):
@@ -137,6 +822,9 @@ def delete_cdna_files(strain_name, temp_directory):
 
 
 def delete_fastq_files(experiment_name, sample_name, temp_directory):
-    for file in os.listdir("{}/FASTQ_Files".format(temp_directory)):
-        if file.startswith("{}__{}".format(experiment_name, sample_name)):
-            os.remove("{}/FASTQ_Files/{}".format(temp_directory, file))
+    FASTQ_DIR = "{}/FASTQ_FILES".format(temp_directory)
+    if not os.path.isdir(FASTQ_DIR):
+        return
+    for file in os.listdir(FASTQ_DIR):
+        if file.startswith("{}__{}__".format(experiment_name, sample_name)):
+            os.remove("{}/{}".format(FASTQ_DIR, file))
@@ -53,64 +53,93 @@ class ProteinAggregate:
         collation = Collation(locale='en', strength=CollationStrength.SECONDARY)
         self.col.create_index([("uniprot_id", pymongo.ASCENDING)], background=True, collation=collation)
 
-    def load_abundance_from_pax(self):
+    def load_abundance_from_pax(self, bulk_size=1000):
         '''
             Load protein abundance data but interating from pax collection.
+            Observations are unwound and grouped by uniprot_id on the server, then
+            pushed into the aggregate collection with one bulk update per protein.
+            At most max_entries observations of each pax document are loaded.
+
+            Args:
+                bulk_size (:obj:`int`): number of updates per bulk write.
         '''
         _, _, col_pax = self.mongo_manager.con_db('pax')
-        query = {}
-        projection = {'ncbi_id': 1, 'species_name': 1,
-                    'observation': 1, 'organ': 1}
-        docs = col_pax.find(filter=query, projection=projection, batch_size=5)
-        count = col_pax.count_documents(query)
-        progress = 0
-        for i, doc in enumerate(docs[progress:]):            
-            organ = doc['organ']
-            if self.verbose and i % 1 == 0:
-                print('Loading abundance info {} of {} ...'.format(
-                    i + progress, min(count, self.max_entries)))
-            for j, obs in enumerate(doc['observation']):
-                if j == self.max_entries:
-                    break
-                if self.verbose and j % 100 == 0 and i % 1 == 0:
-                    print('  Loading observation info {} of {} ...'.format(
-                        j, len(doc['observation'])))
-                try:
-                    uniprot_id = obs['protein_id']['uniprot_id']
-                    ordered_locus_name = obs['protein_id']['string_id'].split('.')[1]
-                    abundance = obs['abundance']
-                    dic = {'organ': organ, 'abundance': abundance,
-                           'ordered_locus_name': ordered_locus_name}
-                    self.col.update_one({'uniprot_id': uniprot_id},
-                                        {'$push': {'abundances': dic} }, upsert=True)
-                except TypeError:
-                    continue
-
-    def load_ko(self):
+        if self.max_entries != float('inf'):
+            observation = {'$slice': ['$observation', int(self.max_entries)]}
+        else:
+            observation = 1
+        pipeline = [
+            {'$project': {'organ': 1, 'observation': observation}},
+            {'$unwind': '$observation'},
+            {'$match': {'observation.protein_id.uniprot_id': {'$ne': None}}},
+            {'$group': {'_id': '$observation.protein_id.uniprot_id',
+                        'abundances': {'$push': {
+                            'organ': '$organ',
+                            'abundance': '$observation.abundance',
+                            'ordered_locus_name': {'$arrayElemAt': [
+                                {'$split': ['$observation.protein_id.string_id', '.']}, 1]}}}}},
+        ]
+        docs = col_pax.aggregate(pipeline, allowDiskUse=True, batchSize=bulk_size)
+        updates = (({'uniprot_id': doc['_id']},
+                    {'$push': {'abundances': {'$each': doc['abundances']}}}) for doc in docs)
+        self._bulk_update(updates, 'abundance', bulk_size=bulk_size, upsert=True)
+
+    def load_ko(self, bulk_size=1000):
         '''Load ko number for uniprot_id if such information
-           exists
+           exists. kegg_orthology is scanned once into in-memory
+           lookup tables which are then joined with the aggregate collection.
+
+           Args:
+                bulk_size (:obj:`int`): number of updates per bulk write.
         '''
+        _, _, col_ko = self.mongo_manager.con_db('kegg_orthology')
+        ko_by_gene = {}
+        ko_names = {}
+        projection = {'gene_name': 1, 'kegg_orthology_id': 1, 'definition.name': 1, '_id': 0}
+        for doc in col_ko.find(filter={}, projection=projection, batch_size=1000):
+            ko_number = doc['kegg_orthology_id']
+            ko_names[ko_number] = doc.get('definition', {}).get('name', [None])
+            for gene_name in doc.get('gene_name') or []:
+                ko_by_gene.setdefault(gene_name.lower(), ko_number)
+
         query = {}
         projection = {'uniprot_id': 1, 'gene_name': 1}
         docs = self.col.find(filter=query, projection=projection, batch_size=1000)
-        count = self.col.count_documents(query)
-        progress = 0
-        for i, doc in enumerate(docs[progress:]):
-            if i == self.max_entries + 2:  # for testing script
-                break
-            if self.verbose and i % 10 == 0:
-                print('Loading KO info {} of {} ...'.format(
-                    i + progress, min(count, self.max_entries)))
+        if self.max_entries != float('inf'):
+            docs = docs.limit(int(self.max_entries) + 2)  # for testing script
 
-            gene_name = doc['gene_name']
-            ko_number = self.kegg_manager.get_ko_by_name(gene_name)
+        def updates():
+            for doc in docs:
+                gene_names = doc.get('gene_name')
+                if not isinstance(gene_names, list):
+                    gene_names = [gene_names]
+                ko_number = next((ko_by_gene[gene_name.lower()] for gene_name in gene_names
+                                  if isinstance(gene_name, str) and gene_name.lower() in ko_by_gene), None)
+                if ko_number is not None:
+                    yield ({'uniprot_id': doc['uniprot_id']},
+                           {'$set': {'ko_number': ko_number,
+                                     'ko_name': ko_names[ko_number]}})
+        self._bulk_update(updates(), 'KO', bulk_size=bulk_size)
 
-            if ko_number != None:
-                ko_name_list = self.kegg_manager.get_def_by_kegg_id([ko_number])
-                ko_name = ko_name_list
-                self.col.update_one({'uniprot_id': doc['uniprot_id']},
-                                    {'$set': {'ko_number': ko_number,
-                                             'ko_name': ko_name}})
+    def _bulk_update(self, updates, label, bulk_size=1000, upsert=False):
+        '''Write updates to the aggregate collection with unordered bulk writes
+
+        Args:
+            updates (:obj:`iter` of :obj:`tuple`): (filter, update) pairs.
+            label (:obj:`str`): name of the information being loaded, for progress messages.
+            bulk_size (:obj:`int`): number of updates per bulk write.
+            upsert (:obj:`bool`): whether to insert missing documents.
+        '''
+        bulk = []
+        for i, (_filter, update) in enumerate(updates):
+            bulk.append(pymongo.UpdateOne(_filter, update, upsert=upsert, collation=self.collation))
+            if len(bulk) == bulk_size:
+                if self.verbose:
+                    print('Loading {} info {} ...'.format(label, i + 1))
+                self.col.bulk_write(bulk, ordered=False)
+                bulk = []
+        if len(bulk) != 0:
+            self.col.bulk_write(bulk, ordered=False)
 
     def load_ko_from_uniprot(self):
         """loading ko number from uniprot collection into
@@ -1,7 +1,126 @@
 from datanator_query_python.query import query_uniprot_org
 from datanator_query_python.util import mongo_util
 from datanator_query_python.config import config
+from pymongo import UpdateOne
 from pymongo.collation import Collation, CollationStrength
+from bs4 import BeautifulSoup
+import json
+import os
+import requests
+import time
+
+
+class CheckedQueryUniprotOrg(query_uniprot_org.QueryUniprotOrg):
+    """ :obj:`query_uniprot_org.QueryUniprotOrg` which raises :obj:`requests.HTTPError` when uniprot.org
+    answers with an error status (e.g. 429 or 503), instead of parsing the error page as a query
+    which matches no protein
+    """
+
+    def __init__(self, query, api='https://www.uniprot.org/uniprot/?', include='yes', compress='no',
+                 limit=1, offset=0):
+        """
+        Args:
+            query (:obj:`str`): query message
+            api (:obj:`str`, optional): API url
+            include (:obj:`str`, optional): whether to include isoforms. Defaults to 'yes'.
+            compress (:obj:`str`, optional): return results gzipped. Defaults to 'no'.
+            limit (:obj:`int`, optional): max number of results to return. Defaults to 1.
+            offset (:obj:`int`, optional): offset of the first result. Defaults to 0.
+        """
+        # same request as QueryUniprotOrg
+        columns = ('id,entry name,genes(PREFERRED),protein names,sequence,length,mass,ec,database(GeneID),'
+                   'reviewed,organism-id,database(KO),genes(ALTERNATIVE),genes(ORF),genes(OLN),database(EMBL),'
+                   'database(RefSeq),database(KEGG)')
+        suffix = 'query={}&sort=score&columns={}format={}&include={}&compress={}&limit={}&offset={}'.format(
+            query, columns, 'html', include, compress, limit, offset)
+        response = requests.get(api + suffix)
+        response.raise_for_status()
+        self.soup = BeautifulSoup(response.content, 'html.parser')
+
+
+class UniprotKoMap:
+    """Map of UniProt queries to UniProt IDs, KO numbers and protein names.
+
+    Each query is sent to uniprot.org at most once. Answers are kept in memory and, if a cache
+    path is given, saved on disk so that later runs need no lookups. Queries which match no
+    protein are only remembered for :obj:`miss_ttl` seconds, so that proteins added to UniProt
+    later are found; failed requests are not remembered at all.
+
+    Attributes:
+        cache_path (:obj:`str`): path to JSON file of previous answers
+        query_class (:obj:`type`): class used to query UniProt
+        miss_ttl (:obj:`float`): number of seconds for which a query which matches no protein is remembered
+        lookups (:obj:`int`): number of queries answered
+        hits (:obj:`int`): number of queries answered from the cache
+    """
+
+    def __init__(self, cache_path=None, query_class=None, miss_ttl=7 * 24 * 60 * 60):
+        """
+        Args:
+            cache_path (:obj:`str`, optional): path to JSON file of previous answers
+            query_class (:obj:`type`, optional): class used to query UniProt. Defaults to
+                :obj:`CheckedQueryUniprotOrg`.
+            miss_ttl (:obj:`float`, optional): number of seconds for which a query which matches
+                no protein is remembered. Defaults to one week.
+        """
+        self.cache_path = cache_path
+        self.query_class = query_class or CheckedQueryUniprotOrg
+        self.miss_ttl = miss_ttl
+        self.lookups = 0
+        self.hits = 0
+        self.cache = {}
+        self._modified = False
+        if cache_path and os.path.isfile(cache_path):
+            with open(cache_path, 'r') as f:
+                self.cache = json.load(f)
+
+    @property
+    def hit_rate(self):
+        """ Fraction of the queries answered from the cache """
+        return self.hits / self.lookups if self.lookups else 0.
+
+    def get(self, query):
+        """Get the UniProt ID, KO number and protein names of a query
+
+        Args:
+            query (:obj:`str`): UniProt query, e.g. 'b0001 Escherichia coli'
+
+        Return:
+            (:obj:`dict`): uniprot_id, ko_number and protein_names
+
+        Raises:
+            :obj:`requests.HTTPError`: if uniprot.org answers with an error status
+        """
+        self.lookups += 1
+        protein = self.cache.get(query)
+        if protein is not None:
+            expires = protein.get('expires')
+            if expires is None:
+                self.hits += 1
+                return protein
+            if expires > time.time():
+                self.hits += 1
+                return {key: value for key, value in protein.items() if key != 'expires'}
+        manager = self.query_class(query)
+        protein = {'uniprot_id': manager.get_uniprot_id(),
+                   'ko_number': manager.get_kegg_ortholog(),
+                   'protein_names': manager.get_protein_name()}
+        if protein['uniprot_id'] is None:
+            self.cache[query] = dict(protein, expires=time.time() + self.miss_ttl)
+        else:
+            self.cache[query] = protein
+        self._modified = True
+        return protein
+
+    def save(self):
+        """ Save the new answers to :obj:`cache_path` """
+        if not self.cache_path or not self._modified:
+            return
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_path, self.cache_path)
+        self._modified = False
 
 
 class Reorg:
@@ -15,7 +134,7 @@ class Reorg:
                  verbose=False, max_entries=float('inf'), username=None, 
                  password = None, authSource='admin', readPreference='nearest',
                  des_collection='rna_halflife_new', src_collection='rna_halflife',
-                 des_db='test'):
+                 des_db='test', ko_map=None):
         """Init.
         
         Args:
@@ -29,6 +148,8 @@ class Reorg:
             password ([type], optional): [description]. Defaults to None.
             authSource (str, optional): [description]. Defaults to 'admin'.
             readPreference (str, optional): [description]. Defaults to 'nearest'.
+            ko_map (:obj:`UniprotKoMap`, optional): map of UniProt queries to UniProt IDs and KO numbers.
+                Defaults to a map cached in `cache_dirname`.
         """
         self.max_entries = max_entries
         self.verbose = verbose
@@ -39,6 +160,10 @@ class Reorg:
                                                                                 verbose=verbose, max_entries=max_entries, username=username, 
                                                                                 password=password, authSource=authSource, readPreference=readPreference).con_db(collection_str=des_collection)
         self.collation = Collation('en', strength=CollationStrength.SECONDARY)
+        if ko_map is None:
+            cache_path = os.path.join(cache_dirname, 'order_by_ko_uniprot.json') if cache_dirname else None
+            ko_map = UniprotKoMap(cache_path=cache_path)
+        self.ko_map = ko_map
 
     def helper(self, doi, start=0):
         """helper function for each publication
@@ -63,21 +188,33 @@ class Reorg:
         count = self.src_collection.count_documents(query)
         return docs, count
 
-    def fill_helper(self, doi, field_name, start=0, species=None):
+    def fill_helper(self, doi, field_name, start=0, species=None, bulk_size=1000):
         """Method to fill new collection across different dois.
+
+        The subdocuments of the publication are read in one pass, each distinct protein is
+        mapped to its UniProt ID and KO number once (see :obj:`UniprotKoMap`), and the
+        subdocuments are grouped by protein in memory and written with bulk upserts.
         
         Args:
             doi (:obj:`str`): DOI of publications.
             field_name (:obj:`str`): Name of the field that indicates the mRNA identifier.
             start (:obj:`int`, optional): Starting document position. Defaults to 0.
             species (:obj:`str`, optional): NCBI Taxonomy name of the organism
+            bulk_size (:obj:`int`, optional): Number of upserts per bulk write. Defaults to 1000.
+
+        Return:
+            (:obj:`dict`): statistics of the reorganization
         """
+        t0 = time.time()
+        lookups, hits = self.ko_map.lookups, self.ko_map.hits
+
+        subdocs = []
         docs, count = self.helper(doi, start=start)
         for i, doc in enumerate(docs):
             if i == self.max_entries:
                 break
             if self.verbose and i % 50 == 0:
-                print('Processing doi {} doc {} out of {} ...'.format(doi, i, count-start))
+                print('Reading doi {} doc {} out of {} ...'.format(doi, i, count-start))
             for subdoc in doc['halflives']:
                 reference = subdoc.get('reference')[0]['doi']
                 if reference != doi:
@@ -88,65 +225,140 @@ class Reorg:
                     systematic_name = subdoc.get(field_name)
                     if isinstance(systematic_name, list):
                         systematic_name = systematic_name[0]
-                if species is None:
-                    species = subdoc.get('species')
-
-                uniprot_org_manager = query_uniprot_org.QueryUniprotOrg(systematic_name+' '+species)
-                uniprot_id = uniprot_org_manager.get_uniprot_id()
-                ko = uniprot_org_manager.get_kegg_ortholog()
-                protein_names = uniprot_org_manager.get_protein_name()
-                if uniprot_id is not None:
-                    self.des_collection.update_one({'uniprot_id': uniprot_id},
-                                                    {'$addToSet': {'halflives': subdoc},
-                                                     '$set': {'protein_names': protein_names,
-                                                              'ko_number': ko}}, upsert=True, collation=self.collation)                
-                else:
-                    uniprot_org_manager = query_uniprot_org.QueryUniprotOrg(systematic_name)
-                    uniprot_id = uniprot_org_manager.get_uniprot_id()
-                    ko = uniprot_org_manager.get_kegg_ortholog()
-                    protein_names = uniprot_org_manager.get_protein_name()
-                    if uniprot_id is not None:
-                        self.des_collection.update_one({'uniprot_id': uniprot_id},
-                                                        {'$addToSet': {'halflives': subdoc},
-                                                        '$set': {'protein_names': protein_names,
-                                                                 'ko_number': ko}}, upsert=True, collation=self.collation)
-                    else:
-                        self.des_collection.update_one({'identifier': systematic_name},
-                                                        {'$addToSet': {'halflives': subdoc},
-                                                        '$set': {'protein_names': [protein_names],
-                                                                 'ko_number': None}}, upsert=True, collation=self.collation)
-                        print(systematic_name)
-
-    def fill_gr_131_helper(self, start=0):
+                subdocs.append((systematic_name, species or subdoc.get('species'), subdoc))
+
+        proteins = {}
+        try:
+            for systematic_name, _species, _ in subdocs:
+                if (systematic_name, _species) not in proteins:
+                    proteins[(systematic_name, _species)] = self.get_protein(systematic_name, _species)
+        finally:
+            self.ko_map.save()
+
+        groups = {}
+        for systematic_name, _species, subdoc in subdocs:
+            protein = proteins[(systematic_name, _species)]
+            if protein['uniprot_id'] is not None:
+                _filter = {'uniprot_id': protein['uniprot_id']}
+                protein_names = protein['protein_names']
+            else:
+                _filter = {'identifier': systematic_name}
+                protein_names = [protein['protein_names']]
+            key = tuple(_filter.items())
+            if key not in groups:
+                groups[key] = (_filter, {'protein_names': protein_names, 'ko_number': protein['ko_number']}, [])
+            groups[key][2].append(subdoc)
+
+        def updates():
+            for _filter, _set, group in groups.values():
+                yield _filter, {'$addToSet': {'halflives': {'$each': group}}, '$set': _set}
+        self._bulk_update(updates(), bulk_size=bulk_size, upsert=True)
+
+        stats = self._stats(t0, lookups, hits)
+        stats.update({'subdocs': len(subdocs),
+                      'proteins': len(proteins),
+                      'ko_numbers': len(set(_set['ko_number'] for _, _set, _ in groups.values()
+                                            if _set['ko_number'] is not None)),
+                      'documents': len(groups)})
+        if self.verbose:
+            for _filter, _, _ in groups.values():
+                if 'identifier' in _filter:
+                    print(_filter['identifier'])
+            self._print_stats(doi, stats)
+        return stats
+
+    def get_protein(self, systematic_name, species):
+        """Get the UniProt ID, KO number and protein names of a gene,
+        first within the species and then across all species.
+
+        Args:
+            systematic_name (:obj:`str`): Name of the gene.
+            species (:obj:`str`): NCBI Taxonomy name of the organism.
+
+        Return:
+            (:obj:`dict`): uniprot_id, ko_number and protein_names
+        """
+        protein = self.ko_map.get(systematic_name + ' ' + species)
+        if protein['uniprot_id'] is None:
+            protein = self.ko_map.get(systematic_name)
+        return protein
+
+    def fill_gr_131_helper(self, start=0, bulk_size=1000):
         """Fill 10.1101/gr.131037.111
         
         Args:
             start (:obj:`int`, optional): Starting position. Defaults to 0.
+            bulk_size (:obj:`int`, optional): Number of updates per bulk write. Defaults to 1000.
+
+        Return:
+            (:obj:`dict`): statistics of the reorganization
         """
+        t0 = time.time()
+        lookups, hits = self.ko_map.lookups, self.ko_map.hits
+
         docs = self.src_collection.find({'identifier': {'$exists': True}}, skip=start)
         count = self.src_collection.count_documents({'identifier': {'$exists': True}})
+        queries = {}
         for i, doc in enumerate(docs):
             if i == self.max_entries:
                 break
             if self.verbose and i % 50 == 0:
-                print('Processing doi {} doc {} out of {} ...'.format('10.1101/gr.131037.111', i, count-start))
-            identifier = doc['identifier']
+                print('Reading doi {} doc {} out of {} ...'.format('10.1101/gr.131037.111', i, count-start))
             for subdoc in doc['halflives']:
-                query = ' OR '.join(subdoc.get('accession_id'))
-                uniprot_org_manager = query_uniprot_org.QueryUniprotOrg(query)
-                uniprot_id = uniprot_org_manager.get_uniprot_id()
-                ko = uniprot_org_manager.get_kegg_ortholog()
-                protein_names = uniprot_org_manager.get_protein_name()
-                if uniprot_id is not None:
-                    self.des_collection.update_one({'identifier': identifier},
-                                                    {'$set': {'protein_names': protein_names,
-                                                             'ko_number': ko,
-                                                             'uniprot_id': uniprot_id},
-                                                    '$unset': {'identifier': ""}}, upsert=False, collation=self.collation)
-                else:
-                    print(identifier)
-                    continue       
+                queries.setdefault(doc['identifier'], []).append(' OR '.join(subdoc.get('accession_id')))
+
+        def updates():
+            for identifier, _queries in queries.items():
+                for query in _queries:
+                    protein = self.ko_map.get(query)
+                    if protein['uniprot_id'] is not None:
+                        yield ({'identifier': identifier},
+                               {'$set': {'protein_names': protein['protein_names'],
+                                         'ko_number': protein['ko_number'],
+                                         'uniprot_id': protein['uniprot_id']},
+                                '$unset': {'identifier': ""}})
+                    elif self.verbose:
+                        print(identifier)
+        try:
+            self._bulk_update(updates(), bulk_size=bulk_size, upsert=False)
+        finally:
+            self.ko_map.save()
+
+        stats = self._stats(t0, lookups, hits)
+        stats['documents'] = len(queries)
+        if self.verbose:
+            self._print_stats('10.1101/gr.131037.111', stats)
+        return stats
+
+    def _bulk_update(self, updates, bulk_size=1000, upsert=False):
+        """Write updates to the destination collection with unordered bulk writes
+
+        Args:
+            updates (:obj:`iter` of :obj:`tuple`): (filter, update) pairs.
+            bulk_size (:obj:`int`): number of updates per bulk write.
+            upsert (:obj:`bool`): whether to insert missing documents.
+        """
+        bulk = []
+        for _filter, update in updates:
+            bulk.append(UpdateOne(_filter, update, upsert=upsert, collation=self.collation))
+            if len(bulk) == bulk_size:
+                self.des_collection.bulk_write(bulk, ordered=False)
+                bulk = []
+        if len(bulk) != 0:
+            self.des_collection.bulk_write(bulk, ordered=False)
+
+    def _stats(self, t0, lookups, hits):
+        lookups = self.ko_map.lookups - lookups
+        hits = self.ko_map.hits - hits
+        return {'lookups': lookups,
+                'cache_hits': hits,
+                'cache_hit_rate': hits / lookups if lookups else 0.,
+                'seconds': time.time() - t0}
 
+    def _print_stats(self, doi, stats):
+        print('Reorganized doi {} into {} documents in {:.1f} s; {} of {} UniProt lookups '
+              'were cached ({:.0%})'.format(doi, stats['documents'], stats['seconds'],
+                                            stats['cache_hits'], stats['lookups'], stats['cache_hit_rate']))
 
     def fill_cell(self, start=0):
         """Processing 10.1016/j.cell.2013.12.026.
@@ -522,7 +522,8 @@ class SabioRk(data_source.HttpDataSource):
         if self.verbose:
             print('Downloading {} kinetic laws ...'.format(len(new_ids)))
 
-        self.load_kinetic_laws(new_ids)
+        with self.bulk_load():
+            self.load_kinetic_laws(new_ids)
 
         if self.verbose:
             print('  done')
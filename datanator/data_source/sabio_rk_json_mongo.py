@@ -1,5 +1,5 @@
 '''Parse SabioRk json files into MongoDB documents
-    (json files acquired by running sqlite_to_json.py)
+    (json or jsonl files acquired by running sqlite_to_json.py)
 :Author: Zhouyang Lian <zhouyang.lian@familian.life>
 :Author: Jonathan <jonrkarr@gmail.com>
 :Date: 2019-04-02
@@ -13,6 +13,7 @@ import datanator.config.core
 from pymongo import MongoClient
 from datanator.util import mongo_util
 from datanator.util import chem_util, file_util
+from datanator.data_source import sqlite_to_json
 from datanator_query_python.query import query_taxon_tree, query_sabiork, query_protein
 from pathlib import Path
 import re
@@ -54,6 +55,8 @@ class SabioRkNoSQL(mongo_util.MongoUtil):
         self.chem_manager = chem_util.ChemUtil()
         self.tax_manager = query_taxon_tree.QueryTaxonTree(username=username, MongoDB=MongoDB,
                                                             password=password)
+        for manager in (self.sabiork_manager, self.protein_manager, self.tax_manager):
+            mongo_util.client_pool.adopt(manager, self.client)
         self.file_manager = file_util.FileUtil()
 
     # load json files
@@ -61,6 +64,12 @@ class SabioRkNoSQL(mongo_util.MongoUtil):
         file_names = []
         file_dict = {}
         directory = '../../datanator/data_source/cache/SabioRk'
+        if os.path.isfile(os.path.join(directory, sqlite_to_json.MANIFEST_FILENAME)):
+            manifest = sqlite_to_json.read_manifest(directory)
+            for name in manifest['tables']:
+                file_names.append(name)
+                file_dict[name] = list(sqlite_to_json.iter_table(directory, name, manifest=manifest)) or None
+            return (file_names, file_dict)
         pathlist = Path(directory).glob('**/*.json')
         for path in pathlist:
             path_in_str = str(path)
@@ -723,7 +732,7 @@ class SabioRkNoSQL(mongo_util.MongoUtil):
                                            {'$set': {'kegg_meta': ko_meta}}, upsert=False)
             else:
                 continue
-        self.client.close()
+        self.close()
 
 
 def main():
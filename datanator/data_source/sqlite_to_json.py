@@ -1,21 +1,43 @@
- 
 '''Converts tables in SQLite into json files
 	Attributes:
 		database: path to sqlite database
 		query: query execution command in string format
-		
+
+	Tables are exported by :obj:`SQLToJSON.export`, which streams the rows of each table in
+	batches into a JSON Lines or Parquet file and records the number of rows and the checksum
+	of each file in ``manifest.json``. Use :obj:`iter_table` to read an exported table back
+	one row at a time.
 '''
 
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import base64
+import bz2
+import datetime
+import gzip
+import hashlib
 import json
 import os
+import pyarrow
+import pyarrow.parquet
 import sqlite3
 import pprint
 
+MANIFEST_FILENAME = 'manifest.json'
+JSONL_COMPRESSIONS = {
+    None: ('', open),
+    'gzip': ('.gz', gzip.open),
+    'bz2': ('.bz2', bz2.open),
+}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
 class SQLToJSON():
 
-    def __init__(self, query, cache_dirname=None):
+    def __init__(self, query, cache_dirname=None, batch_size=10000):
         self.query = query
         self.cache_dirname = cache_dirname
+        self.batch_size = batch_size
 
     def db(self):
         database = self.cache_dirname
@@ -23,40 +45,347 @@ class SQLToJSON():
 
     # returns all the table names in a sqlite database
     def table(self):
-    	cursor = self.db().cursor()
-    	cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    	tables = cursor.fetchall()
-    	table_names = []
-    	for table_name in tables:
-        	table_names.append(table_name[0])
-    	cursor.connection.close()
-    	return table_names
+        cursor = self.db().cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = cursor.fetchall()
+        table_names = []
+        for table_name in tables:
+            table_names.append(table_name[0])
+        cursor.connection.close()
+        return table_names
 
     # one : return as one json file or not
     def query_table(self, table, one=True):
-        cur = self.db().cursor()
-        query = self.query + table
-        cur.execute(query)
-        r = [dict((cur.description[i][0], value)
-                  for i, value in enumerate(row)) for row in cur.fetchall()]
-        cur.connection.close()
+        r = [row for batch in self.iter_batches(table) for row in batch]
         return (r if r else None) if one else r
 
+    def iter_batches(self, table):
+        """ Iterate over the rows of a table in batches of at most :obj:`batch_size` rows
 
-def main():
-    database = './cache/SabioRk.sqlite'
-    query = "select * from "
-    collection_dir = './cache/SabioRk/'
-    os.makedirs(os.path.dirname(collection_dir), exist_ok=True)
+        SQLite steps through the result of the query as rows are fetched, so only one
+        batch is held in memory at a time.
+
+        Args:
+            table (:obj:`str`): name of the table
+
+        Returns:
+            :obj:`generator`: lists of rows (:obj:`dict`)
+        """
+        connection = self.db()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(self.query + quote_identifier(table))
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+        finally:
+            connection.close()
+
+    def get_columns(self, table):
+        """ Get the names and declared types of the columns of a table
+
+        Args:
+            table (:obj:`str`): name of the table
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: name and declared type of each column
+        """
+        connection = self.db()
+        try:
+            cursor = connection.execute('PRAGMA table_info({})'.format(quote_identifier(table)))
+            return [(row[1], row[2]) for row in cursor.fetchall()]
+        finally:
+            connection.close()
+
+    def export(self, dirname, tables=None, format='jsonl', compression=None, max_workers=4):
+        """ Export tables into a directory of JSON Lines or Parquet files and a manifest
+
+        Each table is exported by a separate thread with its own connection. The manifest
+        is written after all of the tables have been exported.
+
+        Args:
+            dirname (:obj:`str`): directory to save the files
+            tables (:obj:`list` of :obj:`str`, optional): tables to export; default: all tables
+            format (:obj:`str`, optional): ``jsonl`` or ``parquet``
+            compression (:obj:`str`, optional): ``gzip`` or ``bz2`` for JSON Lines; a Parquet codec
+                (e.g. ``snappy``, ``gzip``, ``zstd``) for Parquet
+            max_workers (:obj:`int`, optional): number of tables to export in parallel
+
+        Returns:
+            :obj:`dict`: manifest
+        """
+        if format not in ('jsonl', 'parquet'):
+            raise ValueError('Unsupported format {}'.format(format))
+        if format == 'jsonl' and compression not in JSONL_COMPRESSIONS:
+            raise ValueError('Unsupported JSON Lines compression {}'.format(compression))
+
+        os.makedirs(dirname, exist_ok=True)
+        if tables is None:
+            tables = self.table()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = list(executor.map(
+                lambda table: self.export_table(table, dirname, format=format, compression=compression),
+                tables))
+
+        manifest = {
+            'database': os.path.basename(self.cache_dirname),
+            'created': datetime.datetime.utcnow().isoformat(),
+            'format': format,
+            'compression': compression,
+            'tables': {entry.pop('table'): entry for entry in entries},
+        }
+        write_manifest(dirname, manifest)
+        return manifest
+
+    def export_table(self, table, dirname, format='jsonl', compression=None):
+        """ Export a table into a JSON Lines or Parquet file
+
+        The file is written to a temporary path and renamed when it is complete.
+
+        Args:
+            table (:obj:`str`): name of the table
+            dirname (:obj:`str`): directory to save the file
+            format (:obj:`str`, optional): ``jsonl`` or ``parquet``
+            compression (:obj:`str`, optional): compression of the file
+
+        Returns:
+            :obj:`dict`: manifest entry with the name of the table, the name, size and SHA-256
+            checksum of the file, and the number of rows
+        """
+        if format == 'jsonl':
+            filename = table + '.jsonl' + JSONL_COMPRESSIONS[compression][0]
+        else:
+            filename = table + '.parquet'
+        path = os.path.join(dirname, filename)
+        tmp_path = path + '.tmp'
+
+        if format == 'jsonl':
+            rows = self.write_jsonl(table, tmp_path, compression)
+        else:
+            rows = self.write_parquet(table, tmp_path, compression)
+        os.replace(tmp_path, path)
+
+        sha256, size = hash_file(path)
+        return {
+            'table': table,
+            'file': filename,
+            'rows': rows,
+            'size': size,
+            'sha256': sha256,
+        }
+
+    def write_jsonl(self, table, path, compression=None):
+        """ Write the rows of a table to a JSON Lines file
+
+        Args:
+            table (:obj:`str`): name of the table
+            path (:obj:`str`): path to the file
+            compression (:obj:`str`, optional): ``gzip`` or ``bz2``
+
+        Returns:
+            :obj:`int`: number of rows
+        """
+        rows = 0
+        with JSONL_COMPRESSIONS[compression][1](path, 'wt', encoding='utf-8') as file:
+            for batch in self.iter_batches(table):
+                file.write(''.join(json.dumps(row, default=_json_default) + '\n' for row in batch))
+                rows += len(batch)
+        return rows
+
+    def write_parquet(self, table, path, compression=None):
+        """ Write the rows of a table to a Parquet file, one row group per batch
+
+        The schema is derived from the declared types of the columns, following SQLite's
+        type affinity rules (see :obj:`get_arrow_type`).
+
+        Args:
+            table (:obj:`str`): name of the table
+            path (:obj:`str`): path to the file
+            compression (:obj:`str`, optional): Parquet compression codec
+
+        Returns:
+            :obj:`int`: number of rows
+        """
+        schema = pyarrow.schema([(name, get_arrow_type(type)) for name, type in self.get_columns(table)])
+        rows = 0
+        with pyarrow.parquet.ParquetWriter(path, schema, compression=compression or 'none') as writer:
+            for batch in self.iter_batches(table):
+                writer.write_table(to_arrow_table(batch, schema))
+                rows += len(batch)
+            if not rows:
+                writer.write_table(schema.empty_table())
+        return rows
+
+
+def quote_identifier(name):
+    """ Quote the name of a table or column for use in SQL
+
+    Args:
+        name (:obj:`str`): name
+
+    Returns:
+        :obj:`str`: quoted name
+    """
+    return '"{}"'.format(name.replace('"', '""'))
 
-    temp = SQLToJSON(query, cache_dirname=database)
-    tables = temp.table()
 
-    for table in tables:
-        file_name = os.path.join(collection_dir + table + '.json')
-        result = temp.query_table(table)
-        with open(file_name, "w") as f:
-            f.write(json.dumps(result, indent=4))
+def get_arrow_type(declared_type):
+    """ Get the Arrow type of a column from its declared SQLite type
+
+    Args:
+        declared_type (:obj:`str`): declared type, e.g. ``INTEGER`` or ``VARCHAR(255)``
+
+    Returns:
+        :obj:`pyarrow.DataType`: Arrow type
+    """
+    declared_type = (declared_type or '').upper()
+    if declared_type == 'BOOLEAN':
+        return pyarrow.bool_()
+    if 'INT' in declared_type:
+        return pyarrow.int64()
+    if 'BLOB' in declared_type:
+        return pyarrow.binary()
+    if any(type in declared_type for type in ('REAL', 'FLOA', 'DOUB', 'NUMERIC', 'DECIMAL')):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def to_arrow_table(rows, schema):
+    """ Convert rows into an Arrow table
+
+    SQLite doesn't enforce the declared types of columns. Booleans, which SQLite stores as
+    integers, are converted to :obj:`bool` and other values in text columns are converted
+    to :obj:`str`.
+
+    Args:
+        rows (:obj:`list` of :obj:`dict`): rows
+        schema (:obj:`pyarrow.Schema`): schema
+
+    Returns:
+        :obj:`pyarrow.Table`: table
+    """
+    arrays = []
+    for field in schema:
+        values = [row[field.name] for row in rows]
+        if field.type == pyarrow.bool_():
+            values = [None if value is None else bool(value) for value in values]
+        elif field.type == pyarrow.string():
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def hash_file(path):
+    """ Compute the SHA-256 checksum and size of a file, reading it in chunks
+
+    Args:
+        path (:obj:`str`): path to the file
+
+    Returns:
+        :obj:`tuple`: hexadecimal SHA-256 checksum (:obj:`str`) and size (:obj:`int`)
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            size += len(chunk)
+    return sha256.hexdigest(), size
+
+
+def write_manifest(dirname, manifest):
+    """ Save the manifest of an export
+
+    Args:
+        dirname (:obj:`str`): directory of the export
+        manifest (:obj:`dict`): manifest
+    """
+    path = os.path.join(dirname, MANIFEST_FILENAME)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def read_manifest(dirname):
+    """ Read the manifest of an export
+
+    Args:
+        dirname (:obj:`str`): directory of the export
+
+    Returns:
+        :obj:`dict`: manifest
+    """
+    with open(os.path.join(dirname, MANIFEST_FILENAME), 'r') as file:
+        return json.load(file)
+
+
+def verify_export(dirname, manifest=None):
+    """ Check the sizes and checksums of the files of an export against its manifest
+
+    Args:
+        dirname (:obj:`str`): directory of the export
+        manifest (:obj:`dict`, optional): manifest; default: read from :obj:`dirname`
+
+    Returns:
+        :obj:`list` of :obj:`str`: names of the tables whose files are missing or don't match the manifest
+    """
+    manifest = manifest or read_manifest(dirname)
+    invalid = []
+    for table, entry in sorted(manifest['tables'].items()):
+        path = os.path.join(dirname, entry['file'])
+        if not os.path.isfile(path) or hash_file(path) != (entry['sha256'], entry['size']):
+            invalid.append(table)
+    return invalid
+
+
+def iter_table(dirname, table, manifest=None, batch_size=10000):
+    """ Iterate over the rows of an exported table without loading the whole file
+
+    Args:
+        dirname (:obj:`str`): directory of the export
+        table (:obj:`str`): name of the table
+        manifest (:obj:`dict`, optional): manifest; default: read from :obj:`dirname`
+        batch_size (:obj:`int`, optional): number of rows to read at a time from Parquet files
+
+    Returns:
+        :obj:`generator`: rows (:obj:`dict`)
+    """
+    manifest = manifest or read_manifest(dirname)
+    path = os.path.join(dirname, manifest['tables'][table]['file'])
+    if manifest['format'] == 'parquet':
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+    else:
+        with JSONL_COMPRESSIONS[manifest['compression']][1](path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the tables of a SQLite database')
+    parser.add_argument('--database', default='./cache/SabioRk.sqlite', help='path to the SQLite database')
+    parser.add_argument('--output', default='./cache/SabioRk/', help='directory to save the exported tables')
+    parser.add_argument('--format', default='jsonl', choices=['jsonl', 'parquet'])
+    parser.add_argument('--compression', default=None, help='compression of the exported files')
+    parser.add_argument('--max-workers', type=int, default=4, help='number of tables to export in parallel')
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of rows to fetch at a time')
+    args = parser.parse_args()
+
+    query = "select * from "
+    temp = SQLToJSON(query, cache_dirname=args.database, batch_size=args.batch_size)
+    manifest = temp.export(args.output, format=args.format, compression=args.compression,
+                           max_workers=args.max_workers)
+    pprint.pprint({table: entry['rows'] for table, entry in manifest['tables'].items()})
 
 if __name__ == '__main__':
     main()
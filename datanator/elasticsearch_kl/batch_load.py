@@ -4,6 +4,7 @@ from datanator_query_python.config import config as config_mongo
 from karr_lab_aws_manager.elasticsearch_kl import index_setting_file
 from datanator.util import mongo_util
 from karr_lab_aws_manager.elasticsearch_kl import util as es_util
+from datanator.elasticsearch_kl import parallel_load
 import json
 from pathlib import Path
 
@@ -120,17 +121,9 @@ class MongoToES(es_util.EsUtil):
                  password=password, authSource=authSource, readPreference=readPreference)
         docs = manager._collection.find(filter=query, projection=projection)
         for doc in docs:
-            if doc['InChI_Key'] is None:
-                continue    
-            sim_com = doc['similar_compounds']
-            tmp = []
-            for compound in sim_com:
-                inchi_key = list(compound.keys())[0]
-                score = list(compound.values())[0]
-                new_dic = {'inchikey': inchi_key, 'similarity_score': score}
-                tmp.append(new_dic)
-            doc['similar_compounds'] = tmp
-            yield doc     
+            doc = reshape_metabolites_meta(doc)
+            if doc is not None:
+                yield doc
 
     def data_from_mongo_sabiork(self, server, db, username, password, verbose=False,
                                 readPreference='nearest', authSource='admin', projection={'_id': 0},
@@ -250,6 +243,52 @@ class MongoToES(es_util.EsUtil):
         return (count, docs)
 
 
+    def data_to_es_parallel(self, collection, alias, _id, query={}, projection=None,
+                            transform=None, index_body=None, readers=4, writers=4):
+        ''' Reindex a mongodb collection into a new versioned index in parallel and
+            atomically swap `alias` to it (see :obj:`parallel_load.ParallelIndexer`)
+
+            Args:
+                collection (:obj:`pymongo.collection.Collection`): collection to be indexed
+                alias (:obj:`str`): name under which the index is queried
+                _id (:obj:`str`): key in mongo collection for identification
+                query (:obj:`dict`): mongodb query filter
+                projection (:obj:`dict`): mongodb query projection. Defaults to excluding
+                    `_id` unless it is used as Elasticsearch id.
+                transform (:obj:`callable`): function applied to each document before indexing
+                index_body (:obj:`dict`): settings and mappings of the new index
+                readers (:obj:`int`): number of collection ranges read in parallel
+                writers (:obj:`int`): number of concurrent bulk requests
+
+            Returns:
+                (:obj:`dict`): docs, failed, seconds and docs_per_second of the load, and name of the new index
+        '''
+        indexer = parallel_load.ParallelIndexer(self.es_endpoint, auth=self.awsauth,
+                                                readers=readers, writers=writers, verbose=self.verbose)
+        return indexer.reindex(alias, collection, _id=_id, query=query, projection=projection,
+                               transform=transform, index_body=index_body)
+
+
+def reshape_metabolites_meta(doc):
+    ''' Reshape similar_compounds of a metabolites_meta document for elasticsearch,
+        e.g. [{'KEY': 0.9}] -> [{'inchikey': 'KEY', 'similarity_score': 0.9}]
+
+        Args:
+            doc (:obj:`dict`): metabolites_meta document
+
+        Returns:
+            (:obj:`dict`): reshaped document or :obj:`None` if the document has no InChI_Key
+    '''
+    if doc['InChI_Key'] is None:
+        return None
+    tmp = []
+    for compound in doc['similar_compounds']:
+        inchi_key = list(compound.keys())[0]
+        score = list(compound.values())[0]
+        tmp.append({'inchikey': inchi_key, 'similarity_score': score})
+    doc['similar_compounds'] = tmp
+    return doc
+
 
 def main():
     conf = config_mongo.Config()
@@ -0,0 +1,319 @@
+""" Parallel, streaming bulk indexing of MongoDB collections into Elasticsearch
+
+Documents are read from `_id` ranges of a collection by a pool of reader threads
+and passed through a bounded queue to a pool of writer threads which send them
+to Elasticsearch with bulk requests whose size adapts to the response latency.
+Reindexing writes into a new, versioned index and atomically points the alias
+at it once all documents have been indexed.
+"""
+
+from bson import ObjectId
+import datetime
+import json
+import queue
+import requests
+import threading
+import time
+
+
+class ComplexEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        elif isinstance(o, datetime.datetime):
+            return o.__str__()
+        return json.JSONEncoder.default(self, o)
+
+
+class AdaptiveBulkSize:
+    """ Bulk request size which grows while requests are fast and shrinks when they are slow
+
+    Attributes:
+        size (:obj:`int`): current number of documents per bulk request
+    """
+
+    def __init__(self, initial=500, minimum=50, maximum=5000, target_latency=1.):
+        """
+        Args:
+            initial (:obj:`int`, optional): initial number of documents per request
+            minimum (:obj:`int`, optional): minimum number of documents per request
+            maximum (:obj:`int`, optional): maximum number of documents per request
+            target_latency (:obj:`float`, optional): desired duration of a bulk request in seconds
+        """
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def update(self, latency):
+        """ Adjust the size after a bulk request
+
+        Args:
+            latency (:obj:`float`): duration of the request in seconds
+
+        Returns:
+            :obj:`int`: new number of documents per request
+        """
+        with self._lock:
+            if latency > self.target_latency:
+                self.size = max(self.minimum, self.size // 2)
+            elif latency < self.target_latency / 2:
+                self.size = min(self.maximum, int(self.size * 1.5) + 1)
+            return self.size
+
+
+class ParallelIndexer:
+    """ Index MongoDB collections into Elasticsearch with parallel readers and writers """
+
+    _DONE = object()
+
+    def __init__(self, es_endpoint, auth=None, readers=4, writers=4, queue_size=10000,
+                 bulk_size=None, verbose=False,
+                 headers={"Content-Type": "application/x-ndjson"}):
+        """
+        Args:
+            es_endpoint (:obj:`str`): url of Elasticsearch, e.g. 'http://localhost:9200'
+            auth (:obj:`requests.auth.AuthBase`, optional): authentication for Elasticsearch requests
+            readers (:obj:`int`, optional): number of `_id` ranges read in parallel
+            writers (:obj:`int`, optional): number of concurrent bulk requests
+            queue_size (:obj:`int`, optional): maximum number of documents waiting to be sent
+            bulk_size (:obj:`AdaptiveBulkSize`, optional): bulk request size policy
+            verbose (:obj:`bool`, optional): display progress messages
+            headers (:obj:`dict`, optional): headers of bulk requests
+        """
+        self.es_endpoint = es_endpoint.rstrip('/')
+        self.auth = auth
+        self.readers = readers
+        self.writers = writers
+        self.queue_size = queue_size
+        self.bulk_size = bulk_size or AdaptiveBulkSize()
+        self.verbose = verbose
+        self.headers = headers
+
+    def reindex(self, alias, collection, _id='_id', query={}, projection=None,
+                transform=None, index_body=None, delete_old=True, version=None):
+        """ Index a collection into a new versioned index and swap `alias` to it
+
+        Args:
+            alias (:obj:`str`): name under which the index is queried, e.g. 'protein'
+            collection (:obj:`pymongo.collection.Collection`): collection to be indexed
+            _id (:obj:`str`, optional): key in the documents used as Elasticsearch id
+            query (:obj:`dict`, optional): mongodb query filter
+            projection (:obj:`dict`, optional): mongodb query projection. Defaults to excluding
+                `_id` unless it is used as Elasticsearch id.
+            transform (:obj:`callable`, optional): function applied to each document; documents for
+                which it returns :obj:`None` are skipped
+            index_body (:obj:`dict`, optional): settings and mappings of the new index
+            delete_old (:obj:`bool`, optional): delete the indices previously behind `alias`
+            version (:obj:`str`, optional): suffix of the new index. Defaults to a timestamp.
+
+        Returns:
+            :obj:`dict`: statistics of the load (see :obj:`index_collection`) plus the name of the new index
+
+        Raises:
+            :obj:`ValueError`: if `_id` is '_id' and `projection` excludes it
+        """
+        projection = self._get_projection(_id, projection)
+        version = version or datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S')
+        index = '{}_v{}'.format(alias, version)
+        r = requests.put(self.es_endpoint + '/' + index, auth=self.auth, json=index_body or {})
+        r.raise_for_status()
+
+        try:
+            stats = self.index_collection(index, collection, _id=_id, query=query,
+                                          projection=projection, transform=transform)
+            if stats['failed'] != 0:
+                raise RuntimeError('{} documents failed to be indexed into {}; alias {} left unchanged'.format(
+                    stats['failed'], index, alias))
+        except Exception:
+            requests.delete(self.es_endpoint + '/' + index, auth=self.auth)
+            raise
+
+        requests.post(self.es_endpoint + '/' + index + '/_refresh', auth=self.auth).raise_for_status()
+        old_indices = self.swap_alias(alias, index)
+        if delete_old:
+            for old_index in old_indices:
+                requests.delete(self.es_endpoint + '/' + old_index, auth=self.auth)
+        stats['index'] = index
+        return stats
+
+    def swap_alias(self, alias, index):
+        """ Atomically point `alias` at `index` only
+
+        A concrete index which has the name of the alias (from loads prior to versioned indices)
+        is removed in the same request.
+
+        Args:
+            alias (:obj:`str`): name of alias
+            index (:obj:`str`): name of index
+
+        Returns:
+            :obj:`list` of :obj:`str`: indices previously behind the alias
+        """
+        actions = []
+        old_indices = []
+        r = requests.get(self.es_endpoint + '/_alias/' + alias, auth=self.auth)
+        if r.status_code == 200:
+            old_indices = [name for name in r.json() if name != index]
+            actions += [{'remove': {'index': name, 'alias': alias}} for name in old_indices]
+        elif requests.head(self.es_endpoint + '/' + alias, auth=self.auth).status_code == 200:
+            actions.append({'remove_index': {'index': alias}})
+        actions.append({'add': {'index': index, 'alias': alias}})
+        r = requests.post(self.es_endpoint + '/_aliases', auth=self.auth, json={'actions': actions})
+        r.raise_for_status()
+        return old_indices
+
+    def index_collection(self, index, collection, _id='_id', query={}, projection=None,
+                         transform=None):
+        """ Index all documents of a collection into an existing index
+
+        Args:
+            index (:obj:`str`): name of index
+            collection (:obj:`pymongo.collection.Collection`): collection to be indexed
+            _id (:obj:`str`, optional): key in the documents used as Elasticsearch id
+            query (:obj:`dict`, optional): mongodb query filter
+            projection (:obj:`dict`, optional): mongodb query projection. Defaults to excluding
+                `_id` unless it is used as Elasticsearch id.
+            transform (:obj:`callable`, optional): function applied to each document; documents for
+                which it returns :obj:`None` are skipped
+
+        Returns:
+            :obj:`dict`: statistics: collection, docs (indexed), failed, seconds and docs_per_second
+
+        Raises:
+            :obj:`ValueError`: if `_id` is '_id' and `projection` excludes it
+        """
+        projection = self._get_projection(_id, projection)
+        start = time.time()
+        docs = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        counts = {'indexed': 0, 'failed': 0}
+        counts_lock = threading.Lock()
+
+        def read(_filter):
+            try:
+                for doc in collection.find(filter={**query, **_filter}, projection=projection):
+                    if transform is not None:
+                        doc = transform(doc)
+                        if doc is None:
+                            continue
+                    docs.put(doc)
+            except Exception as error:
+                errors.append(error)
+
+        def write():
+            session = requests.Session()
+            session.auth = self.auth
+            batch = []
+            while True:
+                doc = docs.get()
+                if doc is not self._DONE:
+                    batch.append(doc)
+                if batch and (doc is self._DONE or len(batch) >= self.bulk_size.size):
+                    try:
+                        indexed, failed = self._send(session, index, _id, batch)
+                    except Exception as error:
+                        errors.append(error)
+                        indexed, failed = 0, len(batch)
+                    with counts_lock:
+                        counts['indexed'] += indexed
+                        counts['failed'] += failed
+                        if self.verbose:
+                            print('Indexed {} documents into {} ...'.format(counts['indexed'], index))
+                    batch = []
+                if doc is self._DONE:
+                    return
+
+        writer_threads = [threading.Thread(target=write, daemon=True) for _ in range(self.writers)]
+        reader_threads = [threading.Thread(target=read, args=(_filter,), daemon=True)
+                          for _filter in self.split_id_ranges(collection, self.readers, query=query)]
+        for thread in writer_threads + reader_threads:
+            thread.start()
+        for thread in reader_threads:
+            thread.join()
+        for _ in writer_threads:
+            docs.put(self._DONE)
+        for thread in writer_threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        seconds = max(time.time() - start, 1e-9)
+        stats = {'collection': collection.name, 'docs': counts['indexed'], 'failed': counts['failed'],
+                 'seconds': seconds, 'docs_per_second': counts['indexed'] / seconds}
+        if self.verbose:
+            print('Indexed {docs} documents of {collection} in {seconds:.1f} s ({docs_per_second:.0f} docs/s)'.format(**stats))
+        return stats
+
+    @staticmethod
+    def _get_projection(_id, projection):
+        """ Get the projection of the documents to be indexed
+
+        Args:
+            _id (:obj:`str`): key in the documents used as Elasticsearch id
+            projection (:obj:`dict`): mongodb query projection
+
+        Returns:
+            :obj:`dict`: projection
+
+        Raises:
+            :obj:`ValueError`: if `_id` is '_id' and `projection` excludes it
+        """
+        if projection is None:
+            return None if _id == '_id' else {'_id': 0}
+        if _id == '_id' and '_id' in projection and not projection['_id']:
+            raise ValueError("Documents cannot be indexed by '_id' when the projection excludes it")
+        return projection
+
+    def split_id_ranges(self, collection, n, query={}):
+        """ Split a collection into `n` `_id` ranges of about the same number of documents
+
+        Args:
+            collection (:obj:`pymongo.collection.Collection`): collection
+            n (:obj:`int`): number of ranges
+            query (:obj:`dict`, optional): mongodb query filter
+
+        Returns:
+            :obj:`list` of :obj:`dict`: mongodb filters, one per range
+        """
+        pipeline = [{'$match': query}, {'$bucketAuto': {'groupBy': '$_id', 'buckets': n}}]
+        bounds = [bucket['_id']['min'] for bucket in collection.aggregate(pipeline, allowDiskUse=True)]
+        if len(bounds) <= 1:
+            return [{}]
+        filters = [{'_id': {'$lt': bounds[1]}}]
+        for lower, upper in zip(bounds[1:-1], bounds[2:]):
+            filters.append({'_id': {'$gte': lower, '$lt': upper}})
+        filters.append({'_id': {'$gte': bounds[-1]}})
+        return filters
+
+    def _send(self, session, index, _id, batch):
+        """ Send one bulk request and adapt the bulk size to its latency
+
+        Args:
+            session (:obj:`requests.Session`): http session
+            index (:obj:`str`): name of index
+            _id (:obj:`str`): key in the documents used as Elasticsearch id
+            batch (:obj:`list` of :obj:`dict`): documents
+
+        Returns:
+            :obj:`tuple` of :obj:`int`: number of indexed and failed documents
+        """
+        lines = []
+        for doc in batch:
+            if '_id' in doc:
+                doc['id'] = doc.pop('_id')
+            doc_id = doc['id'] if _id == '_id' else doc[_id]
+            lines.append(json.dumps({'index': {'_index': index, '_id': str(doc_id)}}))
+            lines.append(json.dumps(doc, cls=ComplexEncoder))
+        body = '\n'.join(lines) + '\n'
+
+        start = time.time()
+        r = session.post(self.es_endpoint + '/_bulk', data=body.encode('utf-8'), headers=self.headers)
+        self.bulk_size.update(time.time() - start)
+        r.raise_for_status()
+        result = r.json()
+        if not result.get('errors'):
+            return len(batch), 0
+        failed = sum(1 for item in result['items'] if list(item.values())[0].get('status', 500) >= 300)
+        return len(batch) - failed, failed
@@ -1,4 +1,5 @@
 from datanator_query_python.config import motor_client_manager, config
+from datanator.data_source import corum_nosql
 import simplejson as json
 import asyncio
 from pymongo import UpdateOne
@@ -54,11 +55,7 @@ class MigrateCorum:
                 except BulkWriteError as bwe:
                     pprint(bwe.details)
                     bulk_write = []
-            doc.pop("complex_id")
-            doc["ncbi_taxonomy_id"] = doc["SWISSPROT_organism_NCBI_ID"]
-            doc.pop("SWISSPROT_organism_NCBI_ID")
-            doc["schema_version"] = "2"
-            bulk_write.append(UpdateOne({'ComplexID': doc.get("ComplexID")}, {'$set': json.loads(json.dumps(doc, ignore_nan=True))}, upsert=True))
+            bulk_write.append(self.transform(doc))
         if len(bulk_write) != 0:
             try:
                 self.to_collection.bulk_write(bulk_write)
@@ -67,6 +64,46 @@ class MigrateCorum:
             finally:
                 print("Done.")  
 
+    async def process_file(self, filename, bulk_size=1000):
+        """Transform complexes parsed straight from a CORUM file and move them to new database,
+        without reading them back from the old database
+
+        Args:
+            filename(:obj:`str`): path to CORUM file (e.g. allComplexes.txt)
+            bulk_size(:obj:`int`): number of complexes per bulk write
+        """
+        bulk_write = []
+        for i, doc in enumerate(corum_nosql.iter_complexes(filename, max_entries=self.max_entries)):
+            bulk_write.append(self.transform(doc))
+            if len(bulk_write) == bulk_size:
+                print("Processing file {}".format(i + 1))
+                try:
+                    await self.to_collection.bulk_write(bulk_write, ordered=False)
+                except BulkWriteError as bwe:
+                    pprint(bwe.details)
+                bulk_write = []
+        if len(bulk_write) != 0:
+            try:
+                await self.to_collection.bulk_write(bulk_write, ordered=False)
+            except BulkWriteError as bwe:
+                pprint(bwe.details)
+        print("Done.")
+
+    def transform(self, doc):
+        """Transform a complex into schema 2
+
+        Args:
+            doc(:obj:`dict`): complex as loaded by :obj:`corum_nosql.CorumNoSQL`
+
+        Return:
+            (:obj:`pymongo.UpdateOne`): upsert of the transformed complex
+        """
+        doc.pop("complex_id")
+        doc["ncbi_taxonomy_id"] = doc["SWISSPROT_organism_NCBI_ID"]
+        doc.pop("SWISSPROT_organism_NCBI_ID")
+        doc["schema_version"] = "2"
+        return UpdateOne({'ComplexID': doc.get("ComplexID")}, {'$set': json.loads(json.dumps(doc, ignore_nan=True))}, upsert=True)
+
 
 def main():
     loop = asyncio.get_event_loop()
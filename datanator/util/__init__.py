@@ -1,7 +1,19 @@
-from . import molecule_util
-from . import rna_seq_util
-from . import taxonomy_util
-from . import warning_util
-from . import mongo_util
-from . import file_util
-from . import chem_util
+import importlib
+
+# submodules are imported on first access so that importing a light module such as
+# `datanator.util.constants` does not load openbabel, ete3, pymongo, etc.
+__all__ = [
+    'molecule_util',
+    'rna_seq_util',
+    'taxonomy_util',
+    'warning_util',
+    'mongo_util',
+    'file_util',
+    'chem_util',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
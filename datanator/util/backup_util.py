@@ -0,0 +1,583 @@
+""" Content-addressed, incremental backups of files and directories
+
+A backup is split into fixed-size chunks which are stored under their SHA-256 digest
+together with a manifest which lists, for each file, its size and the digests of its
+chunks. Uploading a new version of a backup only transfers the chunks which the store
+doesn't already have, and restoring a backup only transfers the chunks which are not
+already present in the local copy. Every restored chunk is verified against its digest.
+Restores write to a `.partial` file which is kept if the restore is interrupted so that
+a later restore only fetches the chunks which are still missing or corrupt.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import abc
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MANIFEST_FORMAT = 1
+
+
+class ChecksumError(Exception):
+    """ A chunk does not match its digest """
+    pass
+
+
+class PackageStore(object, metaclass=abc.ABCMeta):
+    """ Storage of chunks and manifests of backups """
+
+    @abc.abstractmethod
+    def has_chunks(self, digests):
+        """ Determine which chunks the store already has
+
+        Args:
+            digests (:obj:`list` of :obj:`str`): digests of chunks
+
+        Returns:
+            :obj:`set` of :obj:`str`: digests of the chunks in the store
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_chunk(self, digest):
+        """ Get a chunk
+
+        Args:
+            digest (:obj:`str`): digest of chunk
+
+        Returns:
+            :obj:`bytes`: content of chunk
+        """
+        pass
+
+    @abc.abstractmethod
+    def put_chunk(self, digest, data):
+        """ Save a chunk
+
+        Args:
+            digest (:obj:`str`): digest of chunk
+            data (:obj:`bytes`): content of chunk
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_manifest(self, name):
+        """ Get the manifest of a backup
+
+        Args:
+            name (:obj:`str`): name of backup
+
+        Returns:
+            :obj:`dict`: manifest or :obj:`None` if the store has no backup with name `name`
+        """
+        pass
+
+    @abc.abstractmethod
+    def put_manifest(self, name, manifest):
+        """ Save the manifest of a backup
+
+        Args:
+            name (:obj:`str`): name of backup
+            manifest (:obj:`dict`): manifest
+        """
+        pass
+
+    def flush(self):
+        """ Publish the chunks and manifests saved since the last flush """
+        pass
+
+    def get_file(self, name, path):
+        """ Restore a file or directory which the store holds whole, e.g. a backup made before
+        backups were chunked
+
+        Args:
+            name (:obj:`str`): path of the file or directory within the store
+            path (:obj:`str`): path to restore the file or directory to
+
+        Returns:
+            :obj:`bool`: :obj:`True` if the store holds a file or directory with name `name`
+        """
+        return False
+
+
+class LocalPackageStore(PackageStore):
+    """ Package store in a local directory
+
+    Attributes:
+        dirname (:obj:`str`): directory of the store
+    """
+
+    def __init__(self, dirname):
+        """
+        Args:
+            dirname (:obj:`str`): directory of the store
+        """
+        self.dirname = dirname
+
+    def has_chunks(self, digests):
+        return set(digest for digest in digests if os.path.isfile(self._chunk_path(digest)))
+
+    def get_chunk(self, digest):
+        with open(self._chunk_path(digest), 'rb') as file:
+            return file.read()
+
+    def put_chunk(self, digest, data):
+        self._write(self._chunk_path(digest), data)
+
+    def get_manifest(self, name):
+        path = self._manifest_path(name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def put_manifest(self, name, manifest):
+        self._write(self._manifest_path(name), json.dumps(manifest, indent=2).encode())
+
+    def get_file(self, name, path):
+        src = os.path.join(self.dirname, name)
+        if not os.path.exists(src):
+            return False
+        remove_path(path)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.isdir(src):
+            shutil.copytree(src, path)
+        else:
+            shutil.copy2(src, path)
+        return True
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.dirname, chunk_path(digest))
+
+    def _manifest_path(self, name):
+        return os.path.join(self.dirname, manifest_path(name))
+
+    def _write(self, path, data):
+        """ Write a file atomically so that readers never see a partial chunk or manifest """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+
+class QuiltPackageStore(PackageStore):
+    """ Package store in a Quilt package
+
+    Chunks and manifests are saved as files of the package. The chunks which the package
+    already has are determined from the manifests of the package.
+
+    Attributes:
+        quilt_package (:obj:`str`): identifier of Quilt package
+        quilt_owner (:obj:`str`): owner of Quilt package
+        verbose (:obj:`bool`): if :obj:`True`, print status information to the standard output
+    """
+
+    def __init__(self, quilt_package, quilt_owner=None, verbose=False):
+        """
+        Args:
+            quilt_package (:obj:`str`): identifier of Quilt package
+            quilt_owner (:obj:`str`, optional): owner of Quilt package
+            verbose (:obj:`bool`, optional): if :obj:`True`, print status information to the standard output
+        """
+        self.quilt_package = quilt_package
+        self.quilt_owner = quilt_owner
+        self.verbose = verbose
+        self._staged_dirname = None
+        self._remote_chunks = None
+        self._lock = threading.Lock()
+
+    def has_chunks(self, digests):
+        if self._remote_chunks is None:
+            remote_chunks = set()
+            tmp_dirname = tempfile.mkdtemp()
+            try:
+                try:
+                    self._get_manager(tmp_dirname).download(system_path='manifests', sym_links=True)
+                except ValueError:
+                    # the package doesn't have any backups yet; other errors (e.g. authentication,
+                    # network) propagate rather than forcing all of the chunks to be uploaded again
+                    pass
+                for dirname, _, filenames in os.walk(os.path.join(tmp_dirname, 'manifests')):
+                    for filename in filenames:
+                        with open(os.path.join(dirname, filename), 'r') as file:
+                            for entry in json.load(file)['files']:
+                                remote_chunks.update(entry['chunks'])
+            finally:
+                shutil.rmtree(tmp_dirname)
+            self._remote_chunks = remote_chunks
+        return set(digest for digest in digests if digest in self._remote_chunks)
+
+    def get_chunk(self, digest):
+        return self._download(chunk_path(digest))
+
+    def put_chunk(self, digest, data):
+        self._stage(chunk_path(digest), data)
+
+    def get_manifest(self, name):
+        try:
+            data = self._download(manifest_path(name))
+        except ValueError:
+            # the package doesn't contain the manifest
+            return None
+        return json.loads(data.decode())
+
+    def put_manifest(self, name, manifest):
+        self._stage(manifest_path(name), json.dumps(manifest, indent=2).encode())
+
+    def flush(self):
+        """ Add the staged chunks and manifests to the package and push it """
+        if self._staged_dirname is None:
+            return
+
+        # install and export package
+        tmp_dirname = tempfile.mkdtemp()
+        manager = self._get_manager(tmp_dirname)
+        manager.download(sym_links=True)
+
+        # link staged files into package
+        for abs_dirname, _, filenames in os.walk(self._staged_dirname):
+            rel_dirname = os.path.relpath(abs_dirname, self._staged_dirname)
+            os.makedirs(os.path.join(tmp_dirname, rel_dirname), exist_ok=True)
+            for filename in filenames:
+                tmp_path = os.path.join(tmp_dirname, rel_dirname, filename)
+                if os.path.lexists(tmp_path):
+                    os.remove(tmp_path)
+                os.symlink(os.path.join(abs_dirname, filename), tmp_path)
+
+        # build and push package
+        manager.upload()
+
+        # cleanup temporary directories
+        shutil.rmtree(tmp_dirname)
+        shutil.rmtree(self._staged_dirname)
+        self._staged_dirname = None
+        self._remote_chunks = None
+
+    def get_file(self, name, path):
+        tmp_dirname = tempfile.mkdtemp()
+        try:
+            try:
+                self._get_manager(tmp_dirname).download(system_path=name, sym_links=True)
+            except ValueError:
+                return False
+            if not os.path.lexists(os.path.join(tmp_dirname, name)):
+                return False
+            remove_path(path)
+            os.rename(os.path.join(tmp_dirname, name), path)
+            return True
+        finally:
+            shutil.rmtree(tmp_dirname)
+
+    def _get_manager(self, dirname):
+        import wc_utils.quilt
+        return wc_utils.quilt.QuiltManager(dirname, self.quilt_package, owner=self.quilt_owner, verbose=self.verbose)
+
+    def _download(self, path):
+        tmp_dirname = tempfile.mkdtemp()
+        try:
+            self._get_manager(tmp_dirname).download(system_path=path, sym_links=True)
+            with open(os.path.join(tmp_dirname, path), 'rb') as file:
+                return file.read()
+        finally:
+            shutil.rmtree(tmp_dirname)
+
+    def _stage(self, path, data):
+        with self._lock:
+            if self._staged_dirname is None:
+                self._staged_dirname = tempfile.mkdtemp()
+        abs_path = os.path.join(self._staged_dirname, path)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        with open(abs_path, 'wb') as file:
+            file.write(data)
+
+
+class ChunkedBackup(object):
+    """ Upload and restore content-addressed backups of files and directories
+
+    Attributes:
+        store (:obj:`PackageStore`): store of chunks and manifests
+        chunk_size (:obj:`int`): size of chunks in bytes
+        max_workers (:obj:`int`): maximum number of chunks hashed or transferred in parallel
+        retries (:obj:`int`): number of times to fetch a chunk again which doesn't match its digest
+        verbose (:obj:`bool`): if :obj:`True`, print status information to the standard output
+    """
+
+    def __init__(self, store, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=8, retries=2, verbose=False):
+        """
+        Args:
+            store (:obj:`PackageStore`): store of chunks and manifests
+            chunk_size (:obj:`int`, optional): size of chunks in bytes
+            max_workers (:obj:`int`, optional): maximum number of chunks hashed or transferred in parallel
+            retries (:obj:`int`, optional): number of times to fetch a chunk again which doesn't match its digest
+            verbose (:obj:`bool`, optional): if :obj:`True`, print status information to the standard output
+        """
+        self.store = store
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.retries = retries
+        self.verbose = verbose
+
+    def vprint(self, str):
+        if self.verbose:
+            print(str)
+
+    def upload(self, name, path, flush=True):
+        """ Back up a file or directory, transferring only the chunks which the store doesn't have
+
+        Args:
+            name (:obj:`str`): name of backup
+            path (:obj:`str`): path to file or directory
+            flush (:obj:`bool`, optional): if :obj:`True`, publish the backup after uploading it
+
+        Returns:
+            :obj:`dict`: statistics: files, chunks, transferred (chunks) and bytes_transferred
+        """
+        manifest = self.build_manifest(path)
+
+        locations = {}
+        for entry in manifest['files']:
+            for i_chunk, digest in enumerate(entry['chunks']):
+                locations.setdefault(digest, (entry['path'], i_chunk))
+        present = self.store.has_chunks(list(locations.keys()))
+        missing = [digest for digest in locations if digest not in present]
+
+        def put(digest):
+            rel_path, i_chunk = locations[digest]
+            data = self._read_chunk(os.path.join(path, rel_path) if rel_path else path, i_chunk)
+            self.store.put_chunk(digest, data)
+            return len(data)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            bytes_transferred = sum(executor.map(put, missing))
+
+        self.store.put_manifest(name, manifest)
+        if flush:
+            self.store.flush()
+
+        stats = {
+            'files': len(manifest['files']),
+            'chunks': len(locations),
+            'transferred': len(missing),
+            'bytes_transferred': bytes_transferred,
+        }
+        self.vprint('Uploaded {transferred} of {chunks} chunks ({bytes_transferred} bytes) of {files} files'.format(**stats)
+                    + ' of ' + name)
+        return stats
+
+    def download(self, name, path):
+        """ Restore a backup, transferring only the chunks which are not already present locally
+
+        Chunks are taken from the current version of the file at `path`, if any, and from the
+        `.partial` file left by an interrupted restore before they are fetched from the store.
+
+        Args:
+            name (:obj:`str`): name of backup
+            path (:obj:`str`): path to restore the file or directory to
+
+        Returns:
+            :obj:`dict`: statistics: files, chunks, transferred (chunks), reused (chunks) and bytes_transferred
+
+        Backups which were saved whole, before backups were chunked, are restored as whole
+        files (see :obj:`PackageStore.get_file`).
+
+        Raises:
+            :obj:`ValueError`: if the store has no backup with name `name`
+            :obj:`ChecksumError`: if a chunk still doesn't match its digest after `retries` attempts
+        """
+        manifest = self.store.get_manifest(name)
+        if manifest is None:
+            if not self.store.get_file(name, path):
+                raise ValueError('Package store does not contain a backup with name {}'.format(name))
+            self.vprint('Downloaded unchunked backup ' + name)
+            return {'files': 1, 'chunks': 0, 'transferred': 0, 'reused': 0, 'bytes_transferred': 0}
+
+        stats = {'files': 0, 'chunks': 0, 'transferred': 0, 'reused': 0, 'bytes_transferred': 0}
+        if manifest['type'] == 'file':
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            self._restore_file(manifest['files'][0], path, manifest['chunk_size'], stats)
+        else:
+            if os.path.isfile(path):
+                os.remove(path)
+            rel_paths = set()
+            for entry in manifest['files']:
+                self._restore_file(entry, os.path.join(path, entry['path']), manifest['chunk_size'], stats)
+                rel_paths.add(os.path.normpath(entry['path']))
+            for abs_dirname, _, filenames in os.walk(path):
+                for filename in filenames:
+                    rel_path = os.path.relpath(os.path.join(abs_dirname, filename), path)
+                    if rel_path not in rel_paths and not rel_path.endswith('.partial'):
+                        os.remove(os.path.join(abs_dirname, filename))
+
+        self.vprint('Downloaded {transferred} and reused {reused} of {chunks} chunks ({bytes_transferred} bytes) '
+                    'of {files} files'.format(**stats) + ' of ' + name)
+        return stats
+
+    def build_manifest(self, path):
+        """ Split a file or the files of a directory into chunks and hash them
+
+        Args:
+            path (:obj:`str`): path to file or directory
+
+        Returns:
+            :obj:`dict`: manifest
+        """
+        if os.path.isfile(path):
+            type = 'file'
+            rel_paths = ['']
+        else:
+            type = 'directory'
+            rel_paths = []
+            for abs_dirname, _, filenames in os.walk(path):
+                for filename in filenames:
+                    rel_paths.append(os.path.relpath(os.path.join(abs_dirname, filename), path))
+            rel_paths.sort()
+
+        files = []
+        for rel_path in rel_paths:
+            file_path = os.path.join(path, rel_path) if rel_path else path
+            files.append({
+                'path': rel_path,
+                'size': os.path.getsize(file_path),
+                'chunks': self.hash_chunks(file_path),
+            })
+
+        return {
+            'format': MANIFEST_FORMAT,
+            'type': type,
+            'chunk_size': self.chunk_size,
+            'files': files,
+        }
+
+    def hash_chunks(self, path, chunk_size=None):
+        """ Get the digests of the chunks of a file
+
+        Args:
+            path (:obj:`str`): path to file
+            chunk_size (:obj:`int`, optional): size of chunks in bytes; defaults to :obj:`chunk_size`
+
+        Returns:
+            :obj:`list` of :obj:`str`: digests of the chunks
+        """
+        chunk_size = chunk_size or self.chunk_size
+        n_chunks = -(-os.path.getsize(path) // chunk_size)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda i_chunk: hash_chunk(self._read_chunk(path, i_chunk, chunk_size)),
+                                     range(n_chunks)))
+
+    def _read_chunk(self, path, i_chunk, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        with open(path, 'rb') as file:
+            file.seek(i_chunk * chunk_size)
+            return file.read(chunk_size)
+
+    def _restore_file(self, entry, path, chunk_size, stats):
+        """ Restore one file of a backup
+
+        Args:
+            entry (:obj:`dict`): entry of the file in the manifest
+            path (:obj:`str`): path to restore the file to
+            chunk_size (:obj:`int`): size of chunks in bytes
+            stats (:obj:`dict`): statistics to update
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = path + '.partial'
+
+        # chunks of the current version of the file which can be copied rather than downloaded
+        local = {}
+        if os.path.isfile(path):
+            for i_chunk, digest in enumerate(self.hash_chunks(path, chunk_size)):
+                local.setdefault(digest, i_chunk)
+
+        # keep the chunks which an interrupted restore already wrote
+        with open(partial_path, 'ab') as file:
+            file.truncate(entry['size'])
+        written = self.hash_chunks(partial_path, chunk_size)
+        todo = [i_chunk for i_chunk, digest in enumerate(entry['chunks']) if written[i_chunk] != digest]
+
+        lock = threading.Lock()
+        with open(partial_path, 'r+b') as file:
+            def fetch(i_chunk):
+                digest = entry['chunks'][i_chunk]
+                if digest in local:
+                    data = self._read_chunk(path, local[digest], chunk_size)
+                    transferred = False
+                else:
+                    for _ in range(self.retries + 1):
+                        data = self.store.get_chunk(digest)
+                        if hash_chunk(data) == digest:
+                            break
+                    else:
+                        raise ChecksumError('Chunk {} of {} does not match its digest {}'.format(
+                            i_chunk, entry['path'] or path, digest))
+                    transferred = True
+                with lock:
+                    file.seek(i_chunk * chunk_size)
+                    file.write(data)
+                return transferred, len(data)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(fetch, todo))
+
+        os.replace(partial_path, path)
+
+        stats['files'] += 1
+        stats['chunks'] += len(entry['chunks'])
+        stats['transferred'] += sum(1 for transferred, _ in results if transferred)
+        stats['reused'] += len(entry['chunks']) - sum(1 for transferred, _ in results if transferred)
+        stats['bytes_transferred'] += sum(size for transferred, size in results if transferred)
+
+
+def remove_path(path):
+    """ Remove a file or directory, if it exists
+
+    Args:
+        path (:obj:`str`): path
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def hash_chunk(data):
+    """ Get the digest of a chunk
+
+    Args:
+        data (:obj:`bytes`): content of chunk
+
+    Returns:
+        :obj:`str`: SHA-256 digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_path(digest):
+    """ Get the path of a chunk within a package
+
+    Args:
+        digest (:obj:`str`): digest of chunk
+
+    Returns:
+        :obj:`str`: path
+    """
+    return os.path.join('chunks', digest[:2], digest)
+
+
+def manifest_path(name):
+    """ Get the path of the manifest of a backup within a package
+
+    Args:
+        name (:obj:`str`): name of backup
+
+    Returns:
+        :obj:`str`: path
+    """
+    return os.path.join('manifests', name + '.json')
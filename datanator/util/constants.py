@@ -1,5 +1,4 @@
 import os
-import pkg_resources
 
 ## Paths
 DATA_CACHE_DIR = os.path.expanduser(os.path.join('~', '.wc', 'data', 'datanator'))
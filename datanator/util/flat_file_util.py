@@ -0,0 +1,175 @@
+""" Streaming parser for flat files of tagged, delimited records
+
+Flat-file sources such as ExPASy ENZYME and KEGG store one record after another, each
+terminated by a delimiter line (``//`` or ``///``). Each line of a record starts with a
+field tag (e.g. ``ID``, ``DEFINITION``) or, in the case of continuation lines, with
+whitespace.
+
+:obj:`FlatFileFormat` describes such a format. Its :obj:`FlatFileFormat.iter_records`
+memory-maps a file and yields one record at a time so that large files can be parsed in
+constant memory, and its :obj:`FlatFileFormat.get_fields` groups the lines of a record by
+their tags. :obj:`iter_batches` groups parsed records for bulk writes.
+"""
+
+import collections
+import itertools
+import mmap
+import re
+
+
+class FlatFileFormat(object):
+    """ Layout of the records of a flat file
+
+    Attributes:
+        delimiter (:obj:`str`): line which terminates each record, e.g. ``//``
+        tag_width (:obj:`int`): width of the column of field tags; the value of a field
+            starts after this column
+        encoding (:obj:`str`): encoding of the file
+    """
+
+    def __init__(self, delimiter, tag_width, encoding='utf-8'):
+        """
+        Args:
+            delimiter (:obj:`str`): line which terminates each record, e.g. ``//``
+            tag_width (:obj:`int`): width of the column of field tags
+            encoding (:obj:`str`, optional): encoding of the file
+        """
+        self.delimiter = delimiter
+        self.tag_width = tag_width
+        self.encoding = encoding
+        self._delimiter_pattern = re.compile(
+            rb'^' + re.escape(delimiter.encode(encoding)) + rb'[ \t\r]*(?:\n|\Z)', re.MULTILINE)
+
+    def iter_spans(self, buffer):
+        """ Find the records in a buffer
+
+        Content after the last delimiter, such as a truncated record, is ignored.
+
+        Args:
+            buffer (:obj:`bytes` or :obj:`mmap.mmap`): content of a flat file
+
+        Returns:
+            :obj:`generator` of :obj:`tuple`: start and end offsets of each record; the span
+            includes the delimiter line
+        """
+        start = 0
+        for match in self._delimiter_pattern.finditer(buffer):
+            yield (start, match.end())
+            start = match.end()
+
+    def iter_records(self, filename):
+        """ Memory-map a file and iterate over the lines of its records
+
+        Blank records, such as a blank line before a delimiter, are skipped.
+
+        Args:
+            filename (:obj:`str`): path to the file
+
+        Returns:
+            :obj:`generator` of :obj:`list` of :obj:`str`: lines of each record, without line
+            endings and without the delimiter line
+        """
+        with open(filename, 'rb') as file:
+            try:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                return
+            with buffer:
+                for start, end in self.iter_spans(buffer):
+                    lines = self.get_lines(buffer[start:end])
+                    if lines:
+                        yield lines
+
+    def split(self, text):
+        """ Split the text of one or more records into the text of each record
+
+        Args:
+            text (:obj:`str`): records
+
+        Returns:
+            :obj:`list` of :obj:`str`: text of each record, including its delimiter line
+        """
+        data = text.encode(self.encoding)
+        return [data[start:end].decode(self.encoding) for start, end in self.iter_spans(data)]
+
+    def get_lines(self, record):
+        """ Get the lines of a record
+
+        Args:
+            record (:obj:`bytes` or :obj:`str`): text of a record, optionally including its delimiter line
+
+        Returns:
+            :obj:`list` of :obj:`str`: lines of the record, without line endings and without the
+            delimiter line; empty if the record is blank
+        """
+        if isinstance(record, bytes):
+            record = record.decode(self.encoding)
+        lines = record.splitlines()
+        if lines and lines[-1].rstrip() == self.delimiter:
+            lines.pop()
+        while lines and not lines[-1].strip():
+            lines.pop()
+        return lines
+
+    def get_fields(self, lines):
+        """ Group the lines of a record by their field tags
+
+        A line which starts with a non-whitespace character starts a field whose tag is the
+        first word of the line. Other lines continue the preceding field. The lines of
+        fields which occur more than once, such as ``REFERENCE`` in KEGG or ``CA`` in
+        ENZYME, are concatenated in order.
+
+        Args:
+            lines (:obj:`list` of :obj:`str`): lines of a record, optionally including the delimiter line
+
+        Returns:
+            :obj:`collections.OrderedDict`: dictionary which maps each tag to the lines of its
+            field(s), including the lines which contain the tag
+        """
+        fields = collections.OrderedDict()
+        field = None
+        for line in lines:
+            if not line.strip() or line.rstrip() == self.delimiter:
+                continue
+            if not line[0].isspace():
+                field = fields.setdefault(line.split(None, 1)[0], [])
+            if field is not None:
+                field.append(line)
+        return fields
+
+    def get_value(self, line):
+        """ Get the value of a line, without its tag column
+
+        Args:
+            line (:obj:`str`): line of a record
+
+        Returns:
+            :obj:`str`: value
+        """
+        return line[self.tag_width:].rstrip()
+
+
+#: ExPASy ENZYME (enzyme.dat)
+ENZYME_FORMAT = FlatFileFormat('//', 5)
+
+#: KEGG DBGET entries (e.g. KO and RCLASS)
+KEGG_FORMAT = FlatFileFormat('///', 12)
+
+
+def iter_batches(iterable, batch_size):
+    """ Group items into batches, e.g. for bulk writes
+
+    Args:
+        iterable (:obj:`iterable`): items
+        batch_size (:obj:`int`): maximum number of items per batch
+
+    Returns:
+        :obj:`generator` of :obj:`list`: batches
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -12,6 +12,8 @@ import openbabel
 import pybel
 import re
 
+HYDROGEN_PATTERN = re.compile('H[0-9]*')
+
 
 class Molecule(object):
     """ Represents a molecule
@@ -270,7 +272,7 @@ class InchiMolecule(object):
                     or self.charge != other.charge:
                 return False
         else:
-            if re.sub('H[0-9]*', '', self.formula) != re.sub('H[0-9]*', '', other.formula) or \
+            if HYDROGEN_PATTERN.sub('', self.formula) != HYDROGEN_PATTERN.sub('', other.formula) or \
                     self.connections != other.connections:
                 return False
 
@@ -337,7 +339,7 @@ class InchiMolecule(object):
             :obj:`bool`: :obj:`True` if the molecules are protonation isomers
         """
         return isinstance(other, InchiMolecule) \
-            and re.sub('H[0-9]*', '', self.formula) == re.sub('H[0-9]*', '', other.formula) \
+            and HYDROGEN_PATTERN.sub('', self.formula) == HYDROGEN_PATTERN.sub('', other.formula) \
             and self.connections == other.connections
 
     def get_formula_and_connectivity(self):
@@ -350,3 +352,207 @@ class InchiMolecule(object):
         if self.connections:
             val += '/c' + self.connections
         return val
+
+    def get_layer_keys(self):
+        """ Get the keys which identify the stereoisomers, tautomers, and protonation isomers
+        of the molecule
+
+        Returns:
+            :obj:`InchiLayerKeys`: keys
+        """
+        return InchiLayerKeys.from_layers(self.formula, self.connections, self.hydrogens,
+                                          self.protons, self.charge, self.double_bonds)
+
+
+class InchiLayerKeys(object):
+    """ Canonical keys of the layers of an InChI-encoded structure which are shared by isomers
+
+    Two molecules have the same key if and only if :obj:`InchiMolecule.is_stereoisomer`,
+    :obj:`InchiMolecule.is_tautomer`, or :obj:`InchiMolecule.is_protonation_isomer`,
+    respectively, is :obj:`True` for them.
+
+    Attributes:
+        stereoisomer (:obj:`str`): formula, connectivity, protonation (h, p, q), and double bond (b) layers
+        tautomer (:obj:`str`): formula, connectivity, and protonation (h, p, q) layers
+        protonation_isomer (:obj:`str`): formula without hydrogen and connectivity layers
+    """
+    __slots__ = ('stereoisomer', 'tautomer', 'protonation_isomer')
+
+    def __init__(self, stereoisomer, tautomer, protonation_isomer):
+        self.stereoisomer = stereoisomer
+        self.tautomer = tautomer
+        self.protonation_isomer = protonation_isomer
+
+    @classmethod
+    def from_layers(cls, formula, connections, hydrogens, protons, charge, double_bonds):
+        """ Generate the keys from the values of the layers of a structure
+
+        Args:
+            formula (:obj:`str`): empirical formula layer
+            connections (:obj:`str`): atomic connections (c) layer
+            hydrogens (:obj:`str`): hydrogen (h) layer
+            protons (:obj:`str`): proton (p) layer
+            charge (:obj:`str`): charge (q) layer
+            double_bonds (:obj:`str`): double bonds (b) layer
+
+        Returns:
+            :obj:`InchiLayerKeys`: keys
+        """
+        tautomer = '/'.join((formula, 'c' + connections, 'h' + hydrogens, 'p' + protons, 'q' + charge))
+        return cls(tautomer + '/b' + double_bonds, tautomer,
+                   HYDROGEN_PATTERN.sub('', formula) + '/c' + connections)
+
+    @classmethod
+    def from_inchi(cls, structure):
+        """ Generate the keys of an InChI-encoded structure
+
+        This splits the structure once and doesn't create an :obj:`InchiMolecule`.
+
+        Args:
+            structure (:obj:`str`): InChI-encoded structure of a molecule
+
+        Returns:
+            :obj:`InchiLayerKeys`: keys
+
+        Raises:
+            :obj:`ValueError`: if :obj:`structure` is not a valid InChI string
+        """
+        if not structure.startswith('InChI='):
+            raise ValueError('{} is a not a valid InChI string'.format(structure))
+
+        layers = {}
+        for layer in structure.split('/')[1:]:
+            if layer[0].isalpha() and layer[0].islower():
+                layers[layer[0]] = layer[1:]
+            else:
+                layers[''] = layer
+        return cls.from_layers(layers.get('', ''), layers.get('c', ''), layers.get('h', ''),
+                               layers.get('p', ''), layers.get('q', ''), layers.get('b', ''))
+
+    def get(self, kind):
+        """ Get a key
+
+        Args:
+            kind (:obj:`str`): ``stereoisomer``, ``tautomer``, or ``protonation_isomer``
+
+        Returns:
+            :obj:`str`: key
+        """
+        return getattr(self, kind)
+
+    def __eq__(self, other):
+        return isinstance(other, InchiLayerKeys) and \
+            (self.stereoisomer, self.protonation_isomer) == (other.stereoisomer, other.protonation_isomer)
+
+    def __hash__(self):
+        return hash((self.stereoisomer, self.protonation_isomer))
+
+    def __repr__(self):
+        return 'InchiLayerKeys(stereoisomer={!r}, tautomer={!r}, protonation_isomer={!r})'.format(
+            self.stereoisomer, self.tautomer, self.protonation_isomer)
+
+
+class IsomerIndex(object):
+    """ Index of the stereoisomers, tautomers, and protonation isomers of a collection of molecules
+
+    Each molecule is added in a single step by looking up its :obj:`InchiLayerKeys` in one
+    dictionary per kind of isomer, so a whole collection is grouped into isomer clusters
+    in one pass and the isomers of a molecule are found with a dictionary lookup.
+
+    Attributes:
+        keys (:obj:`dict`): dictionary which maps the id of each molecule to its keys
+        clusters (:obj:`dict`): dictionary which maps each kind of isomer to a dictionary
+            which maps keys to the ids of the molecules with that key
+
+        KINDS (:obj:`tuple` of :obj:`str`): kinds of isomers
+    """
+    KINDS = InchiLayerKeys.__slots__
+
+    def __init__(self, molecules=None):
+        """
+        Args:
+            molecules (:obj:`iterable` of :obj:`tuple`, optional): id and InChI-encoded structure of each molecule
+        """
+        self.keys = {}
+        self.clusters = {kind: {} for kind in self.KINDS}
+        for id, structure in (molecules or []):
+            self.add(id, structure)
+
+    def add(self, id, structure):
+        """ Add a molecule to the index
+
+        Args:
+            id (:obj:`object`): id of the molecule, e.g. its InChI key
+            structure (:obj:`str`): InChI-encoded structure
+
+        Returns:
+            :obj:`InchiLayerKeys`: keys of the molecule
+
+        Raises:
+            :obj:`ValueError`: if :obj:`structure` is not a valid InChI string or the index already
+                contains a molecule with id :obj:`id`
+        """
+        if id in self.keys:
+            raise ValueError('The index already contains {}'.format(id))
+        keys = InchiLayerKeys.from_inchi(structure)
+        self.keys[id] = keys
+        for kind in self.KINDS:
+            self.clusters[kind].setdefault(keys.get(kind), []).append(id)
+        return keys
+
+    def get_isomers(self, structure, kind='tautomer'):
+        """ Get the ids of the molecules in the index which are isomers of a structure
+
+        Args:
+            structure (:obj:`str`): InChI-encoded structure
+            kind (:obj:`str`, optional): ``stereoisomer``, ``tautomer``, or ``protonation_isomer``
+
+        Returns:
+            :obj:`list`: ids of the isomers, in the order in which they were added
+        """
+        return list(self.clusters[kind].get(InchiLayerKeys.from_inchi(structure).get(kind), ()))
+
+    def get_stereoisomers(self, structure):
+        """ Get the ids of the molecules in the index which are stereoisomers of a structure
+
+        Args:
+            structure (:obj:`str`): InChI-encoded structure
+
+        Returns:
+            :obj:`list`: ids of the stereoisomers
+        """
+        return self.get_isomers(structure, kind='stereoisomer')
+
+    def get_tautomers(self, structure):
+        """ Get the ids of the molecules in the index which are tautomers of a structure
+
+        Args:
+            structure (:obj:`str`): InChI-encoded structure
+
+        Returns:
+            :obj:`list`: ids of the tautomers
+        """
+        return self.get_isomers(structure, kind='tautomer')
+
+    def get_protonation_isomers(self, structure):
+        """ Get the ids of the molecules in the index which are protonation isomers of a structure
+
+        Args:
+            structure (:obj:`str`): InChI-encoded structure
+
+        Returns:
+            :obj:`list`: ids of the protonation isomers
+        """
+        return self.get_isomers(structure, kind='protonation_isomer')
+
+    def get_clusters(self, kind='tautomer', min_size=2):
+        """ Get the clusters of isomers
+
+        Args:
+            kind (:obj:`str`, optional): ``stereoisomer``, ``tautomer``, or ``protonation_isomer``
+            min_size (:obj:`int`, optional): minimum number of molecules in a cluster
+
+        Returns:
+            :obj:`list` of :obj:`list`: ids of the molecules in each cluster
+        """
+        return [list(ids) for ids in self.clusters[kind].values() if len(ids) >= min_size]
@@ -1,18 +1,226 @@
 import pymongo
+from pymongo import monitoring
+from pymongo.errors import BulkWriteError
 import wc_utils.quilt
-from bson import decode_all
+from bson import decode_file_iter, json_util
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+import os
+import threading
+import time
 from genson import SchemaBuilder
 
 
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """ Count connection pool events of a client """
+
+    def __init__(self):
+        self.counts = {'connections_created': 0, 'connections_closed': 0,
+                       'checkouts': 0, 'checkins': 0, 'checkout_failures': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count('connections_created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._count('checkout_failures')
+
+    def connection_checked_out(self, event):
+        self._count('checkouts')
+
+    def connection_checked_in(self, event):
+        self._count('checkins')
+
+    def stats(self):
+        """ Summarize the events
+
+        Returns:
+            :obj:`dict`: event counts, plus number of open and checked out connections
+        """
+        with self._lock:
+            stats = dict(self.counts)
+        stats['connections_open'] = stats['connections_created'] - stats['connections_closed']
+        stats['connections_in_use'] = stats['checkouts'] - stats['checkins']
+        return stats
+
+
+class SharedMongoClient(pymongo.MongoClient):
+    """ Client handed out by :obj:`ClientPool`, which stays open for as long as any manager uses it """
+
+    def close(self):
+        """ Release one reference to the client; the client is only closed once every manager
+        which uses it has released it
+        """
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            pymongo.MongoClient.close(self)
+        else:
+            pool.release(self)
+
+
+class ClientPool:
+    """ Process-wide registry of pooled clients, one per server, credentials and read preference """
+
+    def __init__(self):
+        self._clients = {}
+        self._references = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+
+    def get(self, MongoDB=None, username=None, password=None, authSource='admin', readPreference='nearest'):
+        """ Get the shared client for a server, creating it on first use
+
+        Args:
+            MongoDB (:obj:`str`): MongoDB server address
+            username (:obj:`str`, optional): username
+            password (:obj:`str`, optional): password
+            authSource (:obj:`str`, optional): database to authenticate against
+            readPreference (:obj:`str`, optional): read preference
+
+        Returns:
+            :obj:`SharedMongoClient`: client
+        """
+        key = (MongoDB, username, password, authSource, readPreference)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                string = "mongodb+srv://{}:{}@{}/?authSource={}&retryWrites=true&w=majority&readPreference={}".format(
+                    username, password, MongoDB, authSource, readPreference)
+                listener = PoolStatsListener()
+                client = SharedMongoClient(string, event_listeners=[listener])
+                client._pool = self
+                client._pool_key = key
+                self._clients[key] = client
+                self._references[key] = 0
+                self._listeners[key] = listener
+            self._references[key] += 1
+            return client
+
+    def release(self, client):
+        """ Release a reference to a client, closing the client when it was the last one
+
+        Args:
+            client (:obj:`SharedMongoClient`): client
+        """
+        key = client._pool_key
+        with self._lock:
+            if self._clients.get(key) is not client:
+                return
+            self._references[key] -= 1
+            if self._references[key] > 0:
+                return
+            del self._clients[key], self._references[key], self._listeners[key]
+        pymongo.MongoClient.close(client)
+
+    def adopt(self, manager, client):
+        """ Rebind the client, databases and collections of a manager built outside of this
+        module (e.g. query managers of datanator_query_python) to a shared client and close
+        the manager's own client
+
+        Args:
+            manager (:obj:`object`): manager with `client`, `db_obj` and/or collection attributes
+            client (:obj:`SharedMongoClient`): shared client
+
+        Returns:
+            :obj:`object`: manager
+        """
+        own_clients = []
+        for name, value in list(vars(manager).items()):
+            if isinstance(value, pymongo.MongoClient) and value is not client:
+                own_clients.append(value)
+                setattr(manager, name, client)
+            elif isinstance(value, pymongo.database.Database):
+                setattr(manager, name, client.get_database(value.name))
+            elif isinstance(value, pymongo.collection.Collection):
+                setattr(manager, name, client.get_database(value.database.name)[value.name])
+            elif hasattr(value, '__dict__') and isinstance(getattr(value, 'client', None), pymongo.MongoClient):
+                self.adopt(value, client)
+        for own_client in own_clients:
+            if isinstance(own_client, SharedMongoClient):
+                self.release(own_client)
+            else:
+                pymongo.MongoClient.close(own_client)
+        with self._lock:
+            if client._pool_key in self._references:
+                self._references[client._pool_key] += len(own_clients)
+        return manager
+
+    def stats(self):
+        """ Statistics of the shared clients
+
+        Returns:
+            :obj:`list` of :obj:`dict`: server, username, read preference, number of references
+                and connection counts (see :obj:`PoolStatsListener.stats`) of each client
+        """
+        with self._lock:
+            items = [(key, self._references[key], self._listeners[key]) for key in self._clients]
+        result = []
+        for (MongoDB, username, _, authSource, readPreference), references, listener in items:
+            result.append({'server': MongoDB, 'username': username, 'authSource': authSource,
+                           'readPreference': readPreference, 'references': references,
+                           **listener.stats()})
+        return result
+
+    def close_all(self):
+        """ Close every shared client """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._references.clear()
+            self._listeners.clear()
+        for client in clients:
+            pymongo.MongoClient.close(client)
+
+
+client_pool = ClientPool()
+
+
 class MongoUtil:
 
     def __init__(self, cache_dirname=None, MongoDB=None, replicaSet=None, db='test',
                  verbose=False, max_entries=float('inf'), username = None, 
                  password = None, authSource = 'admin', readPreference='nearest'):
-        string = "mongodb+srv://{}:{}@{}/{}?authSource={}&retryWrites=true&w=majority&readPreference={}".format(username, password, MongoDB, db, authSource, readPreference)
-        self.client = pymongo.MongoClient(string)
+        self.client = client_pool.get(MongoDB=MongoDB, username=username, password=password,
+                                      authSource=authSource, readPreference=readPreference)
         self.db_obj = self.client.get_database(db)
+        self.cache_dirname = cache_dirname
+        self.verbose = verbose
+
+    def close(self):
+        '''Release this manager's reference to the shared client; the client is
+        closed once every manager which uses it has been closed. Closing a
+        manager more than once has no further effect.
+        '''
+        client = getattr(self, 'client', None)
+        if client is None:
+            return
+        self.client = None
+        client.close()
 
     def list_all_collections(self):
         '''List all non-system collections within database
@@ -36,22 +244,119 @@ class MongoUtil:
             Do nothing
         Else:
             Load data into db from quiltdata (karrlab/datanator)
+            (an interrupted load is resumed, see :obj:`restore_bson`)
 
         Args:
             collection_str: name of collection (e.g. 'ecmdb', 'pax', etc)
         '''
         _, _, collection = self.con_db(collection_str)
-        if collection.find({}).count() != 0:
+        filename = collection_str + '.bson'
+        path = os.path.join(self.cache_dirname, filename)
+        if collection.estimated_document_count() != 0 and not os.path.exists(path + '.offset'):
             return collection
         else:
-            manager = wc_utils.quilt.QuiltManager(
-                path=self.cache_dirname, package='datanator')
-            filename = collection_str + '.bson'
-            manager.download_package(filename)
-            with open((self.cache_dirname + '/' + filename), 'rb') as f:
-                collection.insert(decode_all(f.read()))
+            if not os.path.exists(path):
+                manager = wc_utils.quilt.QuiltManager(
+                    path=self.cache_dirname, package='datanator')
+                manager.download_package(filename)
+            self.restore_bson(collection_str, path)
             return collection
 
+    def restore_bson(self, collection_str, path, batch_size=1000, workers=4, indexes=None):
+        '''Restore a collection from a BSON dump in constant memory
+
+        Documents are decoded incrementally and inserted with unordered batches by
+        :obj:`workers` parallel writers. The offset up to which all batches have been
+        committed is checkpointed in `<path>.offset`, so that an interrupted restore
+        resumes from there; the checkpoint is removed once the restore completes.
+        Indexes are built after all documents have been loaded.
+
+        Args:
+            collection_str (:obj:`str`): name of collection
+            path (:obj:`str`): path to the BSON dump
+            batch_size (:obj:`int`, optional): number of documents per insertion
+            workers (:obj:`int`, optional): number of parallel writers
+            indexes (:obj:`list` of :obj:`dict`, optional): index specifications ({'key': ..., 'name': ..., ...})
+                to build after the load. Defaults to those in the `<collection>.metadata.json` file
+                written by mongodump next to the dump, if any.
+
+        Returns:
+            :obj:`dict`: number of documents and bytes restored, seconds, documents/s and MB/s
+        '''
+        _, _, collection = self.con_db(collection_str)
+        checkpoint = path + '.offset'
+        start_offset = 0
+        if os.path.exists(checkpoint):
+            with open(checkpoint, 'r') as f:
+                start_offset = int(f.read().strip() or 0)
+
+        start_time = time.time()
+        n_docs = 0
+        pending = []
+        committed = start_offset
+
+        def insert(batch):
+            try:
+                collection.insert_many(batch, ordered=False)
+            except BulkWriteError as bwe:
+                # documents inserted after the last checkpoint of an interrupted restore
+                errors = [e for e in bwe.details['writeErrors'] if e['code'] != 11000]
+                if errors:
+                    raise
+
+        def commit(wait=False):
+            nonlocal committed
+            while pending and (wait or pending[0][1].done()):
+                offset, future = pending.pop(0)
+                future.result()
+                committed = offset
+            with open(checkpoint, 'w') as f:
+                f.write(str(committed))
+
+        with open(path, 'rb') as f, ThreadPoolExecutor(max_workers=workers) as executor:
+            f.seek(start_offset)
+            batch = []
+            for doc in decode_file_iter(f):
+                batch.append(doc)
+                if len(batch) == batch_size:
+                    n_docs += len(batch)
+                    pending.append((f.tell(), executor.submit(insert, batch)))
+                    batch = []
+                    if len(pending) >= 2 * workers:
+                        pending[0][1].result()
+                    commit()
+                    if self.verbose:
+                        print('Restored {} documents into {} ...'.format(n_docs, collection_str))
+            if batch:
+                n_docs += len(batch)
+                pending.append((f.tell(), executor.submit(insert, batch)))
+            commit(wait=True)
+
+        if indexes is None:
+            metadata_path = os.path.join(os.path.dirname(path), collection_str + '.metadata.json')
+            indexes = []
+            if os.path.exists(metadata_path):
+                with open(metadata_path, 'r') as f:
+                    indexes = json_util.loads(f.read()).get('indexes', [])
+        models = []
+        for index in indexes:
+            if index['name'] == '_id_':
+                continue
+            options = {k: v for k, v in index.items() if k not in ['key', 'v', 'ns']}
+            models.append(pymongo.IndexModel(list(index['key'].items()), **options))
+        if models:
+            collection.create_indexes(models)
+        os.remove(checkpoint)
+
+        seconds = max(time.time() - start_time, 1e-9)
+        n_bytes = committed - start_offset
+        stats = {'documents': n_docs, 'bytes': n_bytes, 'seconds': seconds,
+                 'documents_per_second': n_docs / seconds, 'mb_per_second': n_bytes / seconds / 1e6}
+        if self.verbose:
+            print('Restored {documents} documents ({bytes} bytes) in {seconds:.1f} s '
+                  '({documents_per_second:.0f} documents/s; {mb_per_second:.1f} MB/s)'.format(**stats))
+        return stats
+
     def print_schema(self, collection_str):
         '''Print out schema of a collection
            removed '_id' from collection due to its object type
@@ -12,15 +12,96 @@ from datanator.util import molecule_util
 import numpy
 
 
-def calc_reactant_product_pairs(reaction):
-    """ Get list of pairs of similar reactants and products using a greedy algorithm.
+class FingerprintCache(object):
+    """ Cache of the fingerprints of structures
+
+    Fingerprints are stored as arrays of bits so that the Tanimoto similarities between many
+    structures can be calculated with a single matrix product.
+
+    Attributes:
+        fingerprint_type (:obj:`str`): fingerprint type
+        fingerprints (:obj:`dict`): dictionary which maps structures to their fingerprints
+            (:obj:`numpy.ndarray` of :obj:`numpy.uint8`, one element per bit)
+    """
+
+    def __init__(self, fingerprint_type='fp2'):
+        """
+        Args:
+            fingerprint_type (:obj:`str`, optional): fingerprint type
+        """
+        self.fingerprint_type = fingerprint_type
+        self.fingerprints = {}
+
+    def get_bits(self, structure):
+        """ Get the fingerprint of a structure, calculating it if it isn't cached
+
+        Args:
+            structure (:obj:`str`): structure
+
+        Returns:
+            :obj:`numpy.ndarray` of :obj:`numpy.uint8`: bits of the fingerprint
+        """
+        bits = self.fingerprints.get(structure)
+        if bits is None:
+            bits = self.fingerprints[structure] = self.calc_bits(structure)
+        return bits
+
+    def calc_bits(self, structure):
+        """ Calculate the fingerprint of a structure
+
+        Args:
+            structure (:obj:`str`): structure
+
+        Returns:
+            :obj:`numpy.ndarray` of :obj:`numpy.uint8`: bits of the fingerprint
+        """
+        fingerprint = molecule_util.Molecule(structure=structure).get_fingerprint(self.fingerprint_type)
+        words = numpy.array(fingerprint.fp, dtype='<u4')
+        return numpy.unpackbits(words.view(numpy.uint8), bitorder='little')
+
+    def calc_similarities(self, structures, other_structures):
+        """ Calculate the Tanimoto similarity between each pair of structures
+
+        Two structures whose fingerprints have no bits set are considered to be identical.
+
+        Args:
+            structures (:obj:`list` of :obj:`str`): structures
+            other_structures (:obj:`list` of :obj:`str`): other structures
+
+        Returns:
+            :obj:`numpy.ndarray`: similarity between each structure (rows) and each other structure (columns)
+        """
+        if not structures or not other_structures:
+            return numpy.zeros((len(structures), len(other_structures)))
+        bits = numpy.array([self.get_bits(structure) for structure in structures], dtype=numpy.float64)
+        other_bits = numpy.array([self.get_bits(structure) for structure in other_structures], dtype=numpy.float64)
+        intersection = bits.dot(other_bits.T)
+        union = bits.sum(axis=1)[:, numpy.newaxis] + other_bits.sum(axis=1)[numpy.newaxis, :] - intersection
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(union > 0, intersection / union, 1.)
+
+
+fingerprint_cache = FingerprintCache()
+
+
+def calc_reactant_product_pairs(reaction, fingerprints=None):
+    """ Get list of pairs of similar reactants and products
+
+    Reactants and products are paired so that the sum of the similarities of the pairs is
+    maximal (see :obj:`solve_assignment`). The pairs are ordered from the most to the least
+    similar, followed by the unpaired reactants and then the unpaired products.
 
     Args:
         reaction (:obj:`data_model.Reaction`): reaction
+        fingerprints (:obj:`FingerprintCache`, optional): cache of fingerprints; default: a cache
+            which is shared by all calls
 
     Returns:
         :obj:`list` of :obj:`tuple` of obj:`data_model.Specie`, :obj:`data_model.Specie`: list of pairs of similar reactants and products
     """
+    if fingerprints is None:
+        fingerprints = fingerprint_cache
+
     participants = reaction.get_ordered_participants()
     reactants = list(filter(lambda p: p.coefficient < 0, participants))
     products = list(filter(lambda p: p.coefficient > 0, participants))
@@ -30,36 +111,102 @@ def calc_reactant_product_pairs(reaction):
     reactants = sorted(reactants, key=key, reverse=True)
     products = sorted(products, key=key, reverse=True)
 
-    # create :obj:`molecule_util.Molecule` objects for each reactant and product
-    reactant_mols = [molecule_util.Molecule(structure=reactant.specie.structure) for reactant in reactants]
-    product_mols = [molecule_util.Molecule(structure=product.specie.structure) for product in products]
-
     # calculate similarities between each reactant and each product
-    similarities = numpy.full((len(reactants), len(products)), numpy.nan)
-    for i_reactant, reactant in enumerate(reactant_mols):
-        for i_product, product in enumerate(product_mols):
-            similarities[i_reactant, i_product] = reactant.get_similarity(product)
-
-    # initialize pairs of similar reactants and products
-    pairs = []
-
-    # iteratively identify the most similar pair of reactants and products
-    for i in range(min(len(reactants), len(products))):
-        index = numpy.argmax(similarities)
-        indices = numpy.unravel_index(index, dims=similarities.shape)
-        i_reactant = indices[0]
-        i_product = indices[1]
-        pairs.append((reactants[i_reactant], products[i_product]))
-
-        reactants.pop(i_reactant)
-        products.pop(i_product)
-        similarities = numpy.delete(similarities, i_reactant, axis=0)
-        similarities = numpy.delete(similarities, i_product, axis=1)
+    similarities = fingerprints.calc_similarities([reactant.specie.structure for reactant in reactants],
+                                                  [product.specie.structure for product in products])
+
+    # pair reactants and products, from the most to the least similar pair
+    assignment = solve_assignment(similarities)
+    assignment.sort(key=lambda pair: (-similarities[pair], pair))
+    pairs = [(reactants[i_reactant], products[i_product]) for i_reactant, i_product in assignment]
 
     # unpaired products, reactants
-    for reactant in reactants:
-        pairs.append((reactant, None))
-    for product in products:
-        pairs.append((None, product))
+    paired_reactants = set(i_reactant for i_reactant, _ in assignment)
+    paired_products = set(i_product for _, i_product in assignment)
+    for i_reactant, reactant in enumerate(reactants):
+        if i_reactant not in paired_reactants:
+            pairs.append((reactant, None))
+    for i_product, product in enumerate(products):
+        if i_product not in paired_products:
+            pairs.append((None, product))
 
     return pairs
+
+
+def calc_reactant_product_pairs_batch(reactions, fingerprints=None):
+    """ Get the pairs of similar reactants and products of each of several reactions
+
+    The fingerprint of each distinct structure is only calculated once.
+
+    Args:
+        reactions (:obj:`list` of :obj:`data_model.Reaction`): reactions
+        fingerprints (:obj:`FingerprintCache`, optional): cache of fingerprints; default: a new cache
+
+    Returns:
+        :obj:`list` of :obj:`list` of :obj:`tuple`: pairs of similar reactants and products of each
+        reaction (see :obj:`calc_reactant_product_pairs`)
+    """
+    if fingerprints is None:
+        fingerprints = FingerprintCache()
+    return [calc_reactant_product_pairs(reaction, fingerprints=fingerprints) for reaction in reactions]
+
+
+def solve_assignment(scores):
+    """ Find the pairs of rows and columns which maximize the sum of their scores
+
+    Each row and each column is used at most once, and ``min(n_rows, n_cols)`` pairs are returned.
+    The assignment is found with the Hungarian algorithm (shortest augmenting paths with
+    potentials) in :math:`O(n^2 m)`, where each step is vectorized over the columns.
+
+    Args:
+        scores (:obj:`numpy.ndarray`): score of each pair of a row and a column
+
+    Returns:
+        :obj:`list` of :obj:`tuple` of :obj:`int`, :obj:`int`: row and column of each pair
+    """
+    scores = numpy.asarray(scores, dtype=numpy.float64)
+    transposed = scores.shape[0] > scores.shape[1]
+    cost = -(scores.T if transposed else scores)
+    n_rows, n_cols = cost.shape
+    if n_rows == 0:
+        return []
+
+    # column 0 is a dummy column from which each row is added; rows and columns are 1-indexed
+    row_potentials = numpy.zeros(n_rows + 1)
+    col_potentials = numpy.zeros(n_cols + 1)
+    col_rows = numpy.zeros(n_cols + 1, dtype=int)
+    for i_row in range(1, n_rows + 1):
+        col_rows[0] = i_row
+        prev_cols = numpy.zeros(n_cols + 1, dtype=int)
+        min_slacks = numpy.full(n_cols + 1, numpy.inf)
+        visited = numpy.zeros(n_cols + 1, dtype=bool)
+        i_col = 0
+
+        # grow a tree of tight edges until it reaches an unassigned column
+        while col_rows[i_col] != 0:
+            visited[i_col] = True
+            row = col_rows[i_col]
+            slacks = cost[row - 1] - row_potentials[row] - col_potentials[1:]
+            improved = ~visited[1:] & (slacks < min_slacks[1:])
+            min_slacks[1:][improved] = slacks[improved]
+            prev_cols[1:][improved] = i_col
+
+            unvisited_slacks = numpy.where(visited[1:], numpy.inf, min_slacks[1:])
+            next_col = int(numpy.argmin(unvisited_slacks)) + 1
+            delta = unvisited_slacks[next_col - 1]
+
+            row_potentials[col_rows[visited]] += delta
+            col_potentials[visited] -= delta
+            min_slacks[~visited] -= delta
+            i_col = next_col
+
+        # augment the assignment along the path to the column
+        while i_col != 0:
+            prev_col = prev_cols[i_col]
+            col_rows[i_col] = col_rows[prev_col]
+            i_col = prev_col
+
+    pairs = [(int(col_rows[i_col]) - 1, i_col - 1) for i_col in range(1, n_cols + 1) if col_rows[i_col] != 0]
+    if transposed:
+        pairs = [(i_col, i_row) for i_row, i_col in pairs]
+    return sorted(pairs)
@@ -3,10 +3,126 @@ from datanator.data_source import uniprot_nosql
 from datanator.util import file_util
 from datanator_query_python.util import mongo_util
 from pathlib import Path, PurePath, PurePosixPath
+from pymongo.collation import Collation, CollationStrength
+import json
 import math
+import os
 import pandas as pd
 
 
+class UniprotResolver:
+    """ Resolve identifiers to UniProt IDs with one query per batch of distinct identifiers
+
+    Identifiers are matched case-insensitively, like the other queries of the uniprot collection.
+    Gene names are also matched against the alternative, ORF and ordered locus names; matches on
+    the primary gene name take precedence.
+    Answers are cached in memory and, if a cache path is given, on disk. Only identifiers which
+    were found are cached, so identifiers which are added to the uniprot collection later are
+    looked up again.
+
+    Attributes:
+        collection (:obj:`pymongo.collection.Collection`): uniprot collection
+        cache_path (:obj:`str`): path to JSON file of previous answers
+        batch_size (:obj:`int`): maximum number of identifiers per query
+        queries (:obj:`int`): number of queries sent to the collection
+    """
+
+    IDENTIFIER_FIELDS = {
+        'oln': ('gene_name_oln',),
+        'gene_name': ('gene_name', 'gene_name_alt', 'gene_name_orf', 'gene_name_oln'),
+        'sequence_embl': ('sequence_embl',),
+    }
+
+    def __init__(self, collection, cache_path=None, batch_size=10000):
+        """
+        Args:
+            collection (:obj:`pymongo.collection.Collection`): uniprot collection
+            cache_path (:obj:`str`, optional): path to JSON file of previous answers
+            batch_size (:obj:`int`, optional): maximum number of identifiers per query
+        """
+        self.collection = collection
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.queries = 0
+        self.collation = Collation(locale='en', strength=CollationStrength.SECONDARY)
+        self.cache = {}
+        if cache_path and os.path.isfile(cache_path):
+            with open(cache_path, 'r') as f:
+                self.cache = json.load(f)
+
+    def resolve(self, names, identifier_type='oln', species=None):
+        """ Get the UniProt IDs of identifiers
+
+        Args:
+            names (:obj:`list` of :obj:`str`): identifiers
+            identifier_type (:obj:`str`, optional): type of identifier, i.e. 'oln', 'gene_name', 'sequence_embl'
+            species (:obj:`list`, optional): NCBI Taxonomy IDs of the species
+
+        Returns:
+            (:obj:`dict`): UniProt ID of each identifier which is in the collection, keyed by the
+            identifier as given
+        """
+        fields = self.IDENTIFIER_FIELDS[identifier_type]
+        projection = {'_id': 0, 'uniprot_id': 1, **{field: 1 for field in fields}}
+        prefix = self._cache_prefix(identifier_type, species)
+        names = set(name for name in names if isinstance(name, str) and name)
+
+        resolved = {}
+        todo = {}
+        for name in names:
+            uniprot_id = self.cache.get(prefix + name.lower())
+            if uniprot_id is None:
+                todo.setdefault(name.lower(), []).append(name)
+            else:
+                resolved[name] = uniprot_id
+
+        found = {}
+        keys = list(todo.keys())
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i:i + self.batch_size]
+            if len(fields) == 1:
+                query = {fields[0]: {'$in': batch}}
+            else:
+                query = {'$or': [{field: {'$in': batch}} for field in fields]}
+            if species is not None:
+                query['ncbi_taxonomy_id'] = {'$in': species}
+            self.queries += 1
+            batch = set(batch)
+            for doc in self.collection.find(filter=query, projection=projection, collation=self.collation):
+                for rank, field in enumerate(fields):
+                    values = doc.get(field)
+                    if not isinstance(values, list):
+                        values = [values]
+                    for value in values:
+                        if not isinstance(value, str):
+                            continue
+                        key = value.lower()
+                        if key in batch and (key not in found or rank < found[key][0]):
+                            found[key] = (rank, doc['uniprot_id'])
+        found = {key: uniprot_id for key, (_, uniprot_id) in found.items()}
+
+        if found:
+            for key, uniprot_id in found.items():
+                for name in todo[key]:
+                    resolved[name] = uniprot_id
+            self.cache.update({prefix + key: uniprot_id for key, uniprot_id in found.items()})
+            self.save()
+        return resolved
+
+    def save(self):
+        """ Save the cache to :obj:`cache_path` """
+        if not self.cache_path:
+            return
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+    @staticmethod
+    def _cache_prefix(identifier_type, species):
+        return '{}|{}|'.format(identifier_type, ','.join(str(s) for s in sorted(species)) if species else '')
+
+
 class RnaHLUtil(mongo_util.MongoUtil):
 
     def __init__(self, server=None, username=None, password=None, src_db=None,
@@ -24,6 +140,22 @@ class RnaHLUtil(mongo_util.MongoUtil):
                                                                 database=src_db, collection_str=protein_col)
         self.uniprot_collection_manager = uniprot_nosql.UniprotNoSQL(MongoDB=server, db=des_db, verbose=True,
         username=username, password=password, authSource=authDB, collection_str=protein_col)
+        self._uniprot_resolver = None
+
+    @property
+    def uniprot_resolver(self):
+        """ Resolver of identifiers against the uniprot collection, cached in :obj:`cache_dir`
+
+        Returns:
+            (:obj:`UniprotResolver`): resolver
+        """
+        if self._uniprot_resolver is None:
+            cache_path = None
+            if self.cache_dir:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                cache_path = os.path.join(self.cache_dir, 'uniprot_resolver.json')
+            self._uniprot_resolver = UniprotResolver(self.uniprot_query_manager.collection, cache_path=cache_path)
+        return self._uniprot_resolver
 
     def uniprot_names(self, results, count):
         """Extract protein_name and gene_name from returned
@@ -51,11 +183,7 @@ class RnaHLUtil(mongo_util.MongoUtil):
             oln (:obj:`str`): Ordered locus name
             species (:obj:`list`): NCBI Taxonomy ID of the species 
         """
-        gene_name, protein_name = self.uniprot_query_manager.get_gene_protein_name_by_oln(oln.split(' or '), species=species)
-        if gene_name is None and protein_name is None: # no such entry in uniprot collection
-            self.uniprot_collection_manager.load_uniprot(query=True, msg=oln, species=species)
-        else:
-            return
+        self._fill_uniprot(oln, 'oln', species=species)
 
     def fill_uniprot_by_gn(self, gene_name, species=None):
         """Fill uniprot collection using gene name
@@ -64,11 +192,7 @@ class RnaHLUtil(mongo_util.MongoUtil):
             gene_name (:obj:`str`): Ordered locus name
             species (:obj:`list`): NCBI Taxonomy ID of the species 
         """
-        protein_name = self.uniprot_query_manager.get_protein_name_by_gn(gene_name.split(' or '), species=species)
-        if protein_name is None: # no such entry in uniprot collection
-            self.uniprot_collection_manager.load_uniprot(query=True, msg=gene_name, species=species)
-        else:
-            return
+        self._fill_uniprot(gene_name, 'gene_name', species=species)
 
     def fill_uniprot_by_embl(self, embl, species=None):
         """Fill uniprot collection using EMBL data
@@ -77,11 +201,19 @@ class RnaHLUtil(mongo_util.MongoUtil):
             embl (:obj:`str`): sequence embl data
             species (:obj:`list`): NCBI Taxonomy ID of the species 
         """
-        _, protein_name = self.uniprot_query_manager.get_gene_protein_name_by_embl(embl.split(' or '), species=species)
-        if protein_name is None: # no such entry in uniprot collection
-            self.uniprot_collection_manager.load_uniprot(query=True, msg=embl, species=species)
-        else:
-            return
+        self._fill_uniprot(embl, 'sequence_embl', species=species)
+
+    def _fill_uniprot(self, name, identifier_type, species=None):
+        """Load an entry into the uniprot collection if none of the
+        alternative identifiers in name is in it yet
+
+        Args:
+            name (:obj:`str`): identifiers joined by ' or '
+            identifier_type (:obj:`str`): type of identifier, i.e. 'oln', 'gene_name', 'sequence_embl'
+            species (:obj:`list`): NCBI Taxonomy ID of the species
+        """
+        if not self.uniprot_resolver.resolve(name.split(' or '), identifier_type=identifier_type, species=species):
+            self.uniprot_collection_manager.load_uniprot(query=True, msg=name, species=species)
 
     def make_df(self, url, sheet_name, header=0, names=None, usecols=None,
                 skiprows=None, nrows=None, na_values=None, file_type='xlsx',
@@ -113,7 +245,9 @@ class RnaHLUtil(mongo_util.MongoUtil):
 
     def fill_uniprot_with_df(self, df, identifier, identifier_type='oln', species=None):
         """Fill uniprot colleciton with ordered_locus_name
-        from excel sheet
+        from excel sheet. The distinct identifiers of the sheet are resolved
+        with one query per batch; only rows none of whose identifiers are in
+        the uniprot collection are downloaded from UniProt.
         
         Args:
             df (:obj:`pandas.DataFrame`): dataframe to be inserted into uniprot collection.
@@ -121,19 +255,56 @@ class RnaHLUtil(mongo_util.MongoUtil):
             identifier (:obj:`str`): name of column that stores ordered locus name information.
             identifier_type (:obj:`str`): type of identifier, i.e. 'oln', 'gene_name'
             species (:obj:`list`): NCBI Taxonomy ID of the species.
+
+        Return:
+            (:obj:`pandas.DataFrame`): copy of df whose uniprot_id column, added or overwritten, holds
+            the uniprot_id of the first resolved identifier of each row; the uniprot_id of rows without
+            identifiers is null
         """
-        row_count = len(df.index)
-        for index, row in df.iterrows():
-            if index == self.max_entries:
-                break
-            if index % 10 == 0 and self.verbose:
-                print("Inserting locus {}: {} out of {} into uniprot collection.".format(index, row[identifier], row_count))
-            names = row[identifier].split(',')
-            condition = ' or '
-            name = condition.join(names)
-            if identifier_type == 'oln':
-                self.fill_uniprot_by_oln(name, species=species)
-            elif identifier_type == 'gene_name':
-                self.fill_uniprot_by_gn(name, species=species)
-            elif identifier_type == 'sequence_embl':
-                self.fill_uniprot_by_embl(name, species=species)
\ No newline at end of file
+        if not math.isinf(self.max_entries):
+            df = df.iloc[:int(self.max_entries)]
+        names = explode_identifiers(df[identifier])
+        resolved = self.uniprot_resolver.resolve(names.unique(), identifier_type=identifier_type, species=species)
+
+        uniprot_ids = first_uniprot_ids(names, resolved)
+        missing = names.index.unique().difference(uniprot_ids.index)
+        for count, index in enumerate(missing):
+            name = ' or '.join(names.loc[[index]])
+            if count % 10 == 0 and self.verbose:
+                print("Inserting locus {}: {} out of {} into uniprot collection.".format(count, name, len(missing)))
+            self.uniprot_collection_manager.load_uniprot(query=True, msg=name, species=species)
+
+        if len(missing):
+            resolved.update(self.uniprot_resolver.resolve(names.loc[missing].unique(),
+                                                          identifier_type=identifier_type, species=species))
+            uniprot_ids = first_uniprot_ids(names, resolved)
+        df = df.copy()
+        df['uniprot_id'] = uniprot_ids
+        return df
+
+
+def explode_identifiers(column):
+    """Split comma-separated identifiers into one row per identifier
+
+    Args:
+        column (:obj:`pandas.Series`): identifiers, e.g. 'b0001,b0002'
+
+    Return:
+        (:obj:`pandas.Series`): identifiers indexed by the index of their row
+    """
+    names = column.dropna().astype(str).str.split(',').explode().str.strip()
+    return names[names != '']
+
+
+def first_uniprot_ids(names, resolved):
+    """Get the UniProt ID of the first resolved identifier of each row
+
+    Args:
+        names (:obj:`pandas.Series`): identifiers indexed by the index of their row
+        resolved (:obj:`dict`): UniProt ID of each resolved identifier
+
+    Return:
+        (:obj:`pandas.Series`): UniProt IDs of the rows which have a resolved identifier
+    """
+    uniprot_ids = names.map(resolved).dropna()
+    return uniprot_ids[~uniprot_ids.index.duplicated(keep='first')]
@@ -10,7 +10,18 @@
 import subprocess
 
 class Kallisto(object):
-    """ Python interface to `kallisto <https://pachterlab.github.io/kallisto>`_. """
+    """ Python interface to `kallisto <https://pachterlab.github.io/kallisto>`_.
+
+    Attributes:
+        executable (:obj:`str`): path to the kallisto executable
+    """
+
+    def __init__(self, executable='kallisto'):
+        """
+        Args:
+            executable (:obj:`str`, optional): path to the kallisto executable
+        """
+        self.executable = executable
 
     def index(self, fasta_filenames, index_filename=None, kmer_size=31, make_unique=False):
         """ Generate index from FASTA files 
@@ -114,5 +125,5 @@ class Kallisto(object):
         else:
             stdout = subprocess.DEVNULL
             stderr = subprocess.DEVNULL
-        subprocess.check_call(['kallisto', cmd] + args, stdout=stdout, stderr=stderr)
+        subprocess.check_call([self.executable, cmd] + args, stdout=stdout, stderr=stderr)
         
\ No newline at end of file
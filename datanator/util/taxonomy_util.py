@@ -8,6 +8,37 @@
 """
 
 from ete3 import NCBITaxa
+import functools
+
+_ncbi_taxa = None
+
+
+def get_ncbi_taxa():
+    """ Get an :obj:`NCBITaxa` instance shared across the process, creating it on first use
+
+    Returns:
+        :obj:`NCBITaxa`: NCBI Taxonomy database
+    """
+    global _ncbi_taxa
+    if _ncbi_taxa is None:
+        _ncbi_taxa = NCBITaxa()
+    return _ncbi_taxa
+
+
+@functools.lru_cache(maxsize=None)
+def get_ncbi_id_by_name(name):
+    """ Get the NCBI Taxonomy ID of an organism name. Lookups are memoized.
+
+    Args:
+        name (:obj:`str`): name of the organism, e.g. 'Homo sapiens'
+
+    Returns:
+        :obj:`int` or :obj:`None`: NCBI Taxonomy ID or :obj:`None` if the name isn't in the NCBI database
+    """
+    result = get_ncbi_taxa().get_name_translator([name])
+    if name in result:
+        return result[name][0]
+    return None
 
 
 def setup_database(force_update=False):
@@ -0,0 +1,133 @@
+""" Measure the throughput and memory of parsing flat files with `flat_file_util`
+
+Records are parsed into documents with the parsers of the ENZYME and KEGG orthology
+loaders, either by reading the whole file and splitting it line by line (``readlines``)
+or by streaming the records off a memory map (``mmap``). Each mode runs in a separate
+process so that its peak memory can be measured. Unless a file is given, a synthetic
+file is generated.
+
+Usage::
+
+    python scripts/benchmark_flat_file_parsing.py --format kegg --records 200000
+    python scripts/benchmark_flat_file_parsing.py --format enzyme --file enzyme.dat
+"""
+
+from datanator.data_source.ec import EC
+from datanator.data_source.kegg_orthology import KeggOrthology
+from datanator.util import flat_file_util
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ENZYME_RECORD = '''ID   1.1.1.{0}
+DE   Alcohol dehydrogenase {0}.
+AN   Aldehyde reductase.
+CA   (1) A primary alcohol + NAD(+) = an aldehyde + NADH +
+CA   H(+).
+CA   (2) A secondary alcohol + NAD(+) = a ketone + NADH + H(+).
+CF   Zn(2+) or Fe cation.
+CC   -!- Acts on primary or secondary alcohols or hemi-acetals with very broad
+CC       specificity; however the enzyme oxidizes methanol much more poorly
+CC       than ethanol.
+PR   PROSITE; PDOC00058;
+DR   P07327, ADH1A_HUMAN;  P28469, ADH1A_MACMU;  Q5RBP7, ADH1A_PONAB;
+DR   P25405, ADH1A_SAAHA;  P25406, ADH1B_SAAHA;  P00327, ADH1E_HORSE;
+//
+'''
+
+KEGG_RECORD = '''ENTRY       K{0:05d}                      KO
+NAME        HK
+DEFINITION  hexokinase [EC:2.7.1.1]
+PATHWAY     ko00010  Glycolysis / Gluconeogenesis
+            ko00051  Fructose and mannose metabolism
+MODULE      M00001  Glycolysis (Embden-Meyerhof pathway), glucose => pyruvate
+DISEASE     H00069  Glycogen storage diseases
+BRITE       KEGG Orthology (KO) [BR:ko00001]
+             09100 Metabolism
+              09101 Carbohydrate metabolism
+GENES       HSA: 3098(HK1) 3099(HK2) 3101(HK3)
+            PTR: 450505(HK1) 460067(HK2)
+            XCC: XCC2294(phbB) XCC3355(fabG)
+REFERENCE   PMID:3136310
+  AUTHORS   Nishi S, Seino S, Bell GI
+  TITLE     Human hexokinase: sequences of amino- and carboxyl-terminal halves are homologous.
+  JOURNAL   Biochem Biophys Res Commun 157:937-43 (1988)
+///
+'''
+
+
+def generate(filename, format, records):
+    template = ENZYME_RECORD if format == 'enzyme' else KEGG_RECORD
+    with open(filename, 'w') as file:
+        for i_record in range(records):
+            file.write(template.format(i_record))
+
+
+def iter_readlines(filename, delimiter):
+    with open(filename, 'r') as file:
+        lines = file.readlines()
+    record = []
+    for line in lines:
+        if line.rstrip() == delimiter:
+            yield record
+            record = []
+        else:
+            record.append(line.rstrip('\n'))
+
+
+def run(filename, format, mode):
+    if format == 'enzyme':
+        parse = EC.__new__(EC).make_doc
+        file_format = flat_file_util.ENZYME_FORMAT
+    else:
+        parse = KeggOrthology.__new__(KeggOrthology).parse_ko_lines
+        file_format = flat_file_util.KEGG_FORMAT
+
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if mode == 'mmap':
+        records = file_format.iter_records(filename)
+    else:
+        records = iter_readlines(filename, file_format.delimiter)
+    n_docs = 0
+    for batch in flat_file_util.iter_batches(map(parse, records), 1000):
+        n_docs += len(batch)
+    seconds = time.time() - start
+    rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024
+    print('{:<10s} {:>8d} records  {:>7.2f} s  {:>10.0f} records/s  {:>8.1f} MB peak memory'.format(
+        mode + ':', n_docs, seconds, n_docs / seconds, rss))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--format', choices=['enzyme', 'kegg'], default='kegg', help='format of the file')
+    parser.add_argument('--records', type=int, default=200000, help='number of synthetic records')
+    parser.add_argument('--file', default=None, help='file to parse instead of a synthetic file')
+    parser.add_argument('--mode', choices=['readlines', 'mmap'], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.file, args.format, args.mode)
+        return
+
+    dirname = tempfile.mkdtemp()
+    try:
+        filename = args.file
+        if filename is None:
+            filename = os.path.join(dirname, 'records.txt')
+            generate(filename, args.format, args.records)
+        print('{} ({:.1f} MB)'.format(filename, os.path.getsize(filename) / 1e6))
+        for mode in ['readlines', 'mmap']:
+            subprocess.check_call([sys.executable, __file__, '--format', args.format,
+                                   '--file', filename, '--mode', mode])
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    main()
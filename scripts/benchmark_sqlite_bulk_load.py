@@ -0,0 +1,107 @@
+""" Compare the time to build a SQLite-backed data source with and without `CachedDataSource.bulk_load`
+
+The synthetic data source mimics the SABIO-RK build: each entry is looked up by its id
+before it is created, is linked to cross references through an association table whose
+foreign keys are indexed, and the session is committed after every batch of entries.
+
+Usage::
+
+    python scripts/benchmark_sqlite_bulk_load.py --entries 20000 --batch-size 1
+"""
+
+from datanator.core import data_source
+import argparse
+import os
+import shutil
+import sqlalchemy
+import sqlalchemy.ext.declarative
+import sqlalchemy.orm
+import tempfile
+import time
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+entry_resource = sqlalchemy.Table(
+    'entry_resource', Base.metadata,
+    sqlalchemy.Column('entry__id', sqlalchemy.Integer, sqlalchemy.ForeignKey('entry._id'), index=True),
+    sqlalchemy.Column('resource__id', sqlalchemy.Integer, sqlalchemy.ForeignKey('resource._id'), index=True),
+)
+
+
+class Entry(Base):
+    __tablename__ = 'entry'
+    _id = sqlalchemy.Column(sqlalchemy.Integer(), primary_key=True)
+    id = sqlalchemy.Column(sqlalchemy.Integer(), index=True)
+    name = sqlalchemy.Column(sqlalchemy.String())
+    cross_references = sqlalchemy.orm.relationship('Resource', secondary=entry_resource, backref='entries')
+
+
+class Resource(Base):
+    __tablename__ = 'resource'
+    _id = sqlalchemy.Column(sqlalchemy.Integer(), primary_key=True)
+    namespace = sqlalchemy.Column(sqlalchemy.String())
+    id = sqlalchemy.Column(sqlalchemy.String())
+    sqlalchemy.schema.UniqueConstraint(namespace, id)
+
+
+class SyntheticDataSource(data_source.CachedDataSource):
+    base_model = Base
+
+    def __init__(self, cache_dirname, entries, batch_size, bulk):
+        self.entries = entries
+        self.batch_size = batch_size
+        self.bulk = bulk
+        super(SyntheticDataSource, self).__init__(cache_dirname=cache_dirname, load_content=True,
+                                                  download_backups=False, quilt_owner='benchmark',
+                                                  quilt_package='benchmark')
+
+    def load_content(self):
+        if self.bulk:
+            with self.bulk_load():
+                self.load_entries()
+        else:
+            self.load_entries()
+            self.session.commit()
+
+    def load_entries(self):
+        for i_entry in range(self.entries):
+            if self.session.query(Entry).filter_by(id=i_entry).count():
+                continue
+            entry = Entry(id=i_entry, name='entry {}'.format(i_entry))
+            for i_ref in range(3):
+                namespace, id = 'namespace-{}'.format(i_ref), str(i_entry % 1000)
+                resource = self.session.query(Resource).filter_by(namespace=namespace, id=id).first()
+                if resource is None:
+                    resource = Resource(namespace=namespace, id=id)
+                    self.session.add(resource)
+                entry.cross_references.append(resource)
+            self.session.add(entry)
+            if i_entry % self.batch_size == self.batch_size - 1:
+                self.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', type=int, default=20000, help='number of entries to load')
+    parser.add_argument('--batch-size', type=int, default=1, help='number of entries per commit')
+    args = parser.parse_args()
+
+    for bulk in [False, True]:
+        dirname = tempfile.mkdtemp()
+        try:
+            start = time.time()
+            src = SyntheticDataSource(dirname, args.entries, args.batch_size, bulk)
+            seconds = time.time() - start
+            n_entries = src.session.query(Entry).count()
+            n_links = src.session.query(entry_resource).count()
+            src.session.close()
+            src.engine.dispose()
+            print('{:<17s} {:>8.2f} s  {:>8.0f} entries/s  ({} entries, {} cross references, {:.1f} MB)'.format(
+                'bulk load mode:' if bulk else 'default settings:', seconds, n_entries / seconds,
+                n_entries, n_links, os.path.getsize(src.filename) / 1e6))
+        finally:
+            shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    main()
@@ -252,6 +252,35 @@ class TestReaction(unittest.TestCase):
         self.assertEqual(len(part), 1)
         self.assertEqual(part[0].coefficient, 4)
 
+    def test_get_ordered_participants_cache(self):
+        atp = data_model.Specie(structure=self.atp, id='atp')
+        adp = data_model.Specie(structure=self.adp, id='adp')
+        c = data_model.Compartment(id='c')
+        rxn = data_model.Reaction(participants=[
+            data_model.ReactionParticipant(specie=adp, compartment=c, coefficient=1, order=2),
+            data_model.ReactionParticipant(specie=atp, compartment=c, coefficient=-1, order=1),
+            data_model.ReactionParticipant(specie=atp, compartment=c, coefficient=-1, order=1),
+        ])
+
+        participants = rxn.get_ordered_participants()
+        self.assertEqual([(p.specie.id, p.coefficient) for p in participants], [('atp', -2), ('adp', 1)])
+
+        # repeated calls return the cached participants rather than collapsing them again
+        participants.pop()
+        self.assertEqual([(p.specie.id, p.coefficient) for p in rxn.get_ordered_participants()], [('atp', -2), ('adp', 1)])
+
+        # the participants of the reaction are not changed by collapsing them
+        self.assertEqual([p.coefficient for p in rxn.participants], [1, -1, -1])
+
+        # the cache is invalidated when the participants change
+        rxn.participants[0].coefficient = 2
+        self.assertEqual([(p.specie.id, p.coefficient) for p in rxn.get_ordered_participants()], [('atp', -2), ('adp', 2)])
+        self.assertEqual([p.coefficient for p in rxn.participants], [2, -1, -1])
+
+        rxn.participants.append(data_model.ReactionParticipant(specie=adp, compartment=c, coefficient=0))
+        self.assertEqual(len(rxn.get_ordered_participants()), 2)
+        self.assertEqual(len(rxn.get_ordered_participants(collapse_repeated=False)), 4)
+
     def test_get_reactants(self):
         rxn = self.make_reaction()
         self.assertEqual(rxn.get_reactants(), rxn.participants[0:2])
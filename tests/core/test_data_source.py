@@ -0,0 +1,128 @@
+""" Tests of the data source base classes
+
+:Copyright: 2019, Karr Lab
+:License: MIT
+"""
+
+from datanator.core import data_source
+import shutil
+import sqlalchemy
+import sqlalchemy.ext.declarative
+import sqlalchemy.orm
+import tempfile
+import unittest
+
+Base = sqlalchemy.ext.declarative.declarative_base()
+
+
+class Parent(Base):
+    __tablename__ = 'parent'
+    _id = sqlalchemy.Column(sqlalchemy.Integer(), primary_key=True)
+    id = sqlalchemy.Column(sqlalchemy.Integer(), index=True)
+
+
+class Child(Base):
+    __tablename__ = 'child'
+    _id = sqlalchemy.Column(sqlalchemy.Integer(), primary_key=True)
+    parent_id = sqlalchemy.Column(sqlalchemy.Integer(), sqlalchemy.ForeignKey('parent._id'), index=True)
+    parent = sqlalchemy.orm.relationship('Parent', backref='children')
+
+
+class LocalDataSource(data_source.CachedDataSource):
+    base_model = Base
+
+    def load_content(self):
+        pass
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.src = LocalDataSource(cache_dirname=self.dirname, download_backups=False,
+                                   quilt_owner='owner', quilt_package='package')
+
+    def tearDown(self):
+        self.src.session.close()
+        self.src.engine.dispose()
+        shutil.rmtree(self.dirname)
+
+    def pragma(self, name):
+        connection = self.src.engine.raw_connection()
+        try:
+            return connection.cursor().execute('PRAGMA {}'.format(name)).fetchone()[0]
+        finally:
+            connection.close()
+
+    def indexes(self, type='index'):
+        connection = self.src.engine.raw_connection()
+        try:
+            return set(row[0] for row in connection.cursor().execute(
+                "SELECT name FROM sqlite_master WHERE type = ?", (type,)).fetchall())
+        finally:
+            connection.close()
+
+    def test_bulk_load(self):
+        self.assertEqual([index.name for index in self.src.get_deferrable_indexes()], ['ix_child_parent_id'])
+        self.assertEqual(self.indexes(), {'ix_parent_id', 'ix_child_parent_id'})
+
+        with self.src.bulk_load():
+            self.assertEqual(self.pragma('journal_mode'), 'wal')
+            self.assertEqual(self.pragma('synchronous'), 0)
+            self.assertEqual(self.indexes(), {'ix_parent_id'})
+            for i in range(10):
+                parent = Parent(id=i)
+                parent.children.append(Child())
+                self.src.session.add(parent)
+                self.src.session.commit()
+
+        self.assertEqual(self.pragma('journal_mode'), 'delete')
+        self.assertEqual(self.pragma('synchronous'), 2)
+        self.assertEqual(self.indexes(), {'ix_parent_id', 'ix_child_parent_id'})
+        self.assertIn('sqlite_stat1', self.indexes(type='table'))
+        self.assertEqual(self.src.session.query(Child).count(), 10)
+
+    def test_bulk_load_error(self):
+        with self.assertRaises(ValueError):
+            with self.src.bulk_load():
+                self.src.session.add(Parent(id=1))
+                raise ValueError()
+        self.assertEqual(self.src.session.query(Parent).count(), 0)
+        self.assertEqual(self.pragma('journal_mode'), 'delete')
+        self.assertEqual(self.indexes(), {'ix_parent_id', 'ix_child_parent_id'})
+
+
+class TestParseTableTimings(unittest.TestCase):
+
+    def test_serial_dump(self):
+        lines = [
+            (0., 'pg_dump: reading schemas'),
+            (1., 'pg_dump: dumping contents of table "public.observation"'),
+            (4., 'pg_dump: dumping contents of table "public.taxon"'),
+            (4.5, 'pg_dump: dumping contents of table "public.entity"'),
+        ]
+        timings = data_source.parse_table_timings(lines, 6.)
+        self.assertEqual(timings, {'observation': 3., 'taxon': 0.5, 'entity': 1.5})
+
+    def test_parallel_restore(self):
+        lines = [
+            (0., 'pg_restore: launching item 3342 TABLE DATA public observation'),
+            (0.5, 'pg_restore: launching item 3343 TABLE DATA public taxon'),
+            (1., 'pg_restore: finished item 3343 TABLE DATA public taxon'),
+            (1., 'pg_restore: launching item 3344 TABLE DATA entity'),
+            (2., 'pg_restore: finished item 3344 TABLE DATA entity'),
+            (5., 'pg_restore: finished item 3342 TABLE DATA public observation'),
+            (5., 'pg_restore: launching item 3350 INDEX public observation_pkey'),
+        ]
+        timings = data_source.parse_table_timings(lines, 9., parallel=True)
+        self.assertEqual(timings, {'observation': 5., 'taxon': 0.5, 'entity': 1.})
+
+    def test_parallel_dump(self):
+        lines = [
+            (0., 'pg_dump: dumping contents of table "public.observation"'),
+            (0., 'pg_dump: dumping contents of table "public.taxon"'),
+            (2., 'pg_dump: finished item 3343 TABLE DATA taxon'),
+            (3., 'pg_dump: finished item 3342 TABLE DATA observation'),
+        ]
+        timings = data_source.parse_table_timings(lines, 3., parallel=True)
+        self.assertEqual(timings, {'observation': 3., 'taxon': 2.})
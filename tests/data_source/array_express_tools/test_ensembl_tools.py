@@ -0,0 +1,53 @@
+import unittest
+from unittest import mock
+from datanator.data_source.array_express_tools import ensembl_tools
+import os
+import shutil
+import tempfile
+
+
+class TestOrganismIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_find(self):
+        index = ensembl_tools.OrganismIndex.from_taxonomy(ensembl_tools.ORGANISM_TAXONOMY_FILENAME)
+        self.assertEqual(index.find('Escherichia coli K-12'), ('eco', 'escherichia coli k-12 mg1655'))
+        self.assertEqual(index.find('escherichia coli str. K-12 substr. W3110'), ('ecj', 'escherichia coli k-12 w3110'))
+        self.assertEqual(index.find('Escherichia coli'), ('eco', 'escherichia coli k-12 mg1655'))
+        self.assertEqual(index.find('neisseria meningitidis 510612'), ('nmx', 'neisseria meningitidis 510612'))
+        self.assertEqual(index.find('Escherichia unknownii'), None)
+
+    def test_save_load(self):
+        taxonomy_filename = ensembl_tools.ORGANISM_TAXONOMY_FILENAME
+        index_filename = os.path.join(self.dirname, 'index.json')
+        index = ensembl_tools.get_organism_index(taxonomy_filename, index_filename)
+        self.assertTrue(os.path.isfile(index_filename))
+        self.assertIs(ensembl_tools.get_organism_index(taxonomy_filename, index_filename), index)
+
+        loaded = ensembl_tools.OrganismIndex.load(index_filename)
+        self.assertEqual(loaded.names, index.names)
+        self.assertEqual(loaded.sorted_names, index.sorted_names)
+        self.assertEqual(loaded.find('bacillus subtilis'), index.find('bacillus subtilis'))
+
+
+class TestLineage(unittest.TestCase):
+
+    def test_get_taxonomic_lineage(self):
+        ncbi = mock.Mock()
+        ncbi.get_name_translator.return_value = {'Escherichia coli': [562]}
+        ncbi.get_lineage.return_value = [1, 131567, 2, 1224, 561, 562]
+        ncbi.get_taxid_translator.return_value = {1: 'root', 131567: 'cellular organisms', 2: 'Bacteria',
+                                                  1224: 'Proteobacteria', 561: 'Escherichia', 562: 'Escherichia coli'}
+        ensembl_tools._get_taxonomic_lineage.cache_clear()
+        with mock.patch.object(ensembl_tools.taxonomy_util, 'get_ncbi_taxa', return_value=ncbi):
+            lineage = ensembl_tools.get_taxonomic_lineage('Escherichia coli')
+            lineage.append('modified')
+            self.assertEqual(ensembl_tools.get_taxonomic_lineage('Escherichia coli'),
+                             ['Escherichia coli', 'Escherichia', 'Proteobacteria', 'Bacteria', 'cellular organisms', 'root'])
+        self.assertEqual(ncbi.get_lineage.call_count, 1)
+        ensembl_tools._get_taxonomic_lineage.cache_clear()
@@ -0,0 +1,346 @@
+import unittest
+from unittest import mock
+from datanator.data_source.process_rna_seq import core
+from datanator.util import rna_seq_util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import threading
+import types
+
+# stand-in for kallisto which writes an index or an abundance table and logs its invocations
+STUB_KALLISTO = '''#!{python}
+import os, sys, time
+cmd = sys.argv[1]
+options = dict(arg[2:].split('=', 1) for arg in sys.argv[2:] if arg.startswith('--') and '=' in arg)
+files = [arg for arg in sys.argv[2:] if not arg.startswith('--')]
+with open({log!r}, 'a') as log:
+    log.write(' '.join([cmd] + [os.path.basename(file) for file in files]) + '\\n')
+time.sleep(0.1)
+if cmd == 'index':
+    with open(options['index'], 'w') as file:
+        file.write('index')
+elif cmd == 'quant':
+    if any(not os.path.isfile(file) for file in files):
+        sys.exit(1)
+    os.makedirs(options['output-dir'], exist_ok=True)
+    with open(os.path.join(options['output-dir'], 'abundance.tsv'), 'w') as file:
+        file.write('target_id\\tlength\\teff_length\\test_counts\\ttpm\\n')
+        file.write('t1\\t100\\t80\\t10\\t300000\\n')
+        file.write('t2\\t200\\t180\\t20\\t700000\\n')
+'''
+
+
+class TestSampleScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.output_directory = os.path.join(self.dirname, 'output')
+        self.temp_directory = os.path.join(self.dirname, 'temp')
+        self.log_filename = os.path.join(self.dirname, 'kallisto.log')
+        executable = os.path.join(self.dirname, 'kallisto')
+        with open(executable, 'w') as file:
+            file.write(STUB_KALLISTO.format(python=sys.executable, log=self.log_filename))
+        os.chmod(executable, 0o755)
+        self.kallisto = rna_seq_util.Kallisto(executable=executable)
+
+        os.makedirs(os.path.join(self.temp_directory, 'CDNA_FILES'))
+        for strain in ['strain_a', 'strain_b']:
+            with gzip.open(os.path.join(self.temp_directory, 'CDNA_FILES', strain + '.cdna.all.fa.gz'), 'wt') as file:
+                file.write('>t1\nACGT\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def get_sample(self, name, strain='strain_a', n_fastq=1, read_type='single'):
+        urls = []
+        for i in range(n_fastq):
+            filename = os.path.join(self.dirname, 'reads', '{}_{}.fastq.gz'.format(name, i))
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with gzip.open(filename, 'wt') as file:
+                file.write('@r1\nACGT\n+\nFFFF\n')
+            urls.append(types.SimpleNamespace(url=pathlib.Path(filename).as_uri()))
+        ensembl_info = types.SimpleNamespace(ref_genome='ensembl', organism_strain=strain, url=None)
+        return types.SimpleNamespace(experiment_id='E-MTAB-1', name=name, fastq_urls=urls,
+                                     ensembl_info=[ensembl_info],
+                                     experiment=types.SimpleNamespace(read_type=read_type))
+
+    def read_log(self):
+        with open(self.log_filename, 'r') as file:
+            return file.read().splitlines()
+
+    def test_run(self):
+        samples = [self.get_sample('S{}'.format(i), strain='strain_a' if i % 3 else 'strain_b') for i in range(6)]
+        samples[1].experiment.read_type = 'paired'
+        samples.append(types.SimpleNamespace(experiment_id='E-MTAB-1', name='no_fastq', fastq_urls=[],
+                                             ensembl_info=[]))
+        scheduler = core.SampleScheduler(self.output_directory, self.temp_directory, kallisto=self.kallisto,
+                                         cpus=3, download_workers=2, disk_budget=10 ** 6)
+        report = scheduler.run(samples)
+
+        self.assertEqual(sorted(report['processed']), ['E-MTAB-1__S{}'.format(i) for i in range(6)])
+        self.assertEqual(report['skipped'], ['E-MTAB-1__no_fastq'])
+        self.assertEqual(report['failed'], [])
+
+        # each index is built once, and the runs of kallisto overlap
+        log = self.read_log()
+        self.assertEqual(sorted(line for line in log if line.startswith('index')),
+                         ['index strain_a.cdna.all.fa.gz', 'index strain_b.cdna.all.fa.gz'])
+        self.assertEqual(len([line for line in log if line.startswith('quant')]), 6)
+        self.assertEqual(report['stages']['quantify']['workers'], 3)
+        self.assertEqual(report['stages']['quantify']['jobs'], 8)
+        self.assertLess(report['seconds'], report['stages']['quantify']['busy_seconds'])
+        for stage in report['stages'].values():
+            self.assertGreater(stage['utilization'], 0.)
+            self.assertLessEqual(stage['utilization'], 1.)
+
+        abundances = core.read_abundances(os.path.join(self.output_directory, 'E-MTAB-1', 'S1'), 'S1')
+        self.assertEqual(list(abundances.index), ['t1', 't2'])
+        self.assertEqual(abundances['normalized_tpm'].tolist(), [core.np.float32(0.3), core.np.float32(0.7)])
+        matrix = core.AbundanceMatrix(os.path.join(self.output_directory, 'E-MTAB-1', 'abundance_matrix'))
+        self.assertEqual(sorted(matrix.samples), ['S{}'.format(i) for i in range(6)])
+        self.assertEqual(os.listdir(os.path.join(self.temp_directory, 'FASTQ_FILES')), [])
+        self.assertEqual(scheduler.disk_budget.used, 0)
+
+        # a restart skips the finished samples
+        os.remove(self.log_filename)
+        scheduler = core.SampleScheduler(self.output_directory, self.temp_directory, kallisto=self.kallisto)
+        report = scheduler.run(samples[:6] + [self.get_sample('S6')])
+        self.assertEqual(report['processed'], ['E-MTAB-1__S6'])
+        self.assertEqual(len(report['finished']), 6)
+        self.assertEqual(self.read_log(), ['quant E-MTAB-1__S6__0.fastq.gz'])
+
+    def test_resume_quantified_sample(self):
+        sample = self.get_sample('S0')
+        scheduler = core.SampleScheduler(self.output_directory, self.temp_directory, kallisto=self.kallisto)
+        scheduler.run([sample])
+        with open(scheduler.checkpoint_filename, 'r') as file:
+            self.assertEqual(json.load(file), {'E-MTAB-1__S0': 'done'})
+
+        scheduler.save_checkpoint('E-MTAB-1__S0', 'quantified')
+        os.remove(self.log_filename)
+        report = scheduler.__class__(self.output_directory, self.temp_directory, kallisto=self.kallisto).run([sample])
+        self.assertEqual(report['processed'], ['E-MTAB-1__S0'])
+        self.assertFalse(os.path.exists(self.log_filename))
+        self.assertEqual(report['stages']['download']['jobs'], 0)
+        self.assertEqual(report['stages']['post-process']['jobs'], 1)
+
+    def test_failure(self):
+        samples = [self.get_sample('S0'), self.get_sample('S1')]
+        samples[1].fastq_urls[0].url = pathlib.Path(os.path.join(self.dirname, 'missing.fastq.gz')).as_uri()
+        scheduler = core.SampleScheduler(self.output_directory, self.temp_directory, kallisto=self.kallisto)
+        report = scheduler.run(samples)
+        self.assertEqual(report['processed'], ['E-MTAB-1__S0'])
+        self.assertEqual(report['failed'], ['E-MTAB-1__S1'])
+        self.assertEqual(scheduler.read_checkpoint(), {'E-MTAB-1__S0': 'done'})
+
+    def test_disk_budget_held_until_fastq_files_deleted(self):
+        sample = self.get_sample('S0')
+        scheduler = core.SampleScheduler(self.output_directory, self.temp_directory, kallisto=self.kallisto,
+                                         disk_budget=10 ** 6)
+        scheduler.get_download_size = lambda sample: 1000
+        used = []
+
+        def delete_fastq_files(*args):
+            used.append(scheduler.disk_budget.used)
+            delete(*args)
+
+        delete = core.delete_fastq_files
+        with mock.patch.object(core, 'delete_fastq_files', delete_fastq_files):
+            report = scheduler.run([sample])
+        self.assertEqual(report['processed'], ['E-MTAB-1__S0'])
+        self.assertEqual(used, [1000])
+        self.assertEqual(scheduler.disk_budget.used, 0)
+
+    def test_disk_budget(self):
+        budget = core.DiskBudget(100)
+        self.assertEqual(budget.acquire(60), 60)
+        self.assertEqual(budget.used, 60)
+        budget.release(60)
+        self.assertEqual(budget.acquire(500), 100)
+        budget.release(100)
+        self.assertEqual(budget.used, 0)
+
+
+class TestAbundances(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def write_abundances(self, sample_name, tpm):
+        sample_dirname = os.path.join(self.dirname, 'E-MTAB-1', sample_name)
+        os.makedirs(os.path.join(sample_dirname, 'output'))
+        with open(os.path.join(sample_dirname, 'output', 'abundance.tsv'), 'w') as file:
+            file.write('target_id\tlength\teff_length\test_counts\ttpm\n')
+            for i, value in enumerate(tpm):
+                file.write('t{}\t100\t80.5\t10\t{}\n'.format(i, value))
+        return sample_dirname
+
+    def test_normalize_abundances(self):
+        sample_dirname = self.write_abundances('S0', [1., 3., 0., 4.])
+        abundances = core.normalize_abundances(sample_dirname, 'S0')
+        self.assertEqual(abundances['normalized_tpm'].tolist(), [0.125, 0.375, 0., 0.5])
+
+        abundances = core.read_abundances(sample_dirname, 'S0')
+        self.assertEqual(abundances.index.tolist(), ['t0', 't1', 't2', 't3'])
+        self.assertEqual(abundances['normalized_tpm'].tolist(), [0.125, 0.375, 0., 0.5])
+        self.assertEqual(abundances['length'].dtype, core.np.int32)
+        self.assertEqual(abundances['normalized_tpm'].dtype, core.np.float32)
+        self.assertEqual(core.read_abundances(sample_dirname, 'S0', columns=['tpm']).columns.tolist(), ['tpm'])
+
+    def test_abundance_matrix(self):
+        for i in range(3):
+            core.normalize_abundances(self.write_abundances('S{}'.format(i), [i + 1., 1., 2.]), 'S{}'.format(i))
+
+        matrix = core.AbundanceMatrix(os.path.join(self.dirname, 'E-MTAB-1', 'abundance_matrix'))
+        self.assertEqual(matrix.samples, ['S0', 'S1', 'S2'])
+        self.assertEqual(matrix.targets, ['t0', 't1', 't2'])
+        self.assertIsInstance(matrix.values, core.np.memmap)
+        self.assertEqual(matrix.values.shape, (3, 3))
+        self.assertEqual(matrix.values[:, 0].tolist(), [0.25, float(core.np.float32(0.4)), 0.5])
+
+        frame = matrix.to_frame(samples=['S2', 'S0'], targets=['t2', 't0'])
+        self.assertEqual(frame.index.tolist(), ['S2', 'S0'])
+        self.assertEqual(frame.columns.tolist(), ['t2', 't0'])
+        self.assertEqual(frame.loc['S0', 't2'], 0.5)
+
+        # samples are replaced in place, and a row which wasn't recorded is dropped
+        matrix.append('S1', core.pd.Series([0., 1.], index=['t2', 't1']))
+        with open(matrix.values_filename, 'ab') as file:
+            file.write(b'\0' * 6)
+        matrix = core.AbundanceMatrix(matrix.dirname)
+        matrix.append('S3', core.pd.Series([1.], index=['t0']))
+        self.assertEqual(matrix.samples, ['S0', 'S1', 'S2', 'S3'])
+        frame = matrix.to_frame()
+        self.assertEqual(frame.loc['S1', ['t1', 't2']].tolist(), [1., 0.])
+        self.assertTrue(core.np.isnan(frame.loc['S1', 't0']))
+        self.assertEqual(frame.loc['S3'].tolist()[0], 1.)
+        self.assertTrue(core.np.isnan(frame.loc['S3', 't1']))
+
+        with self.assertRaises(ValueError):
+            matrix.append('S4', core.pd.Series([1.], index=['t9']))
+
+
+class FileServer(BaseHTTPRequestHandler):
+    """ HTTP server of in-memory files which supports Range requests and can cut off responses """
+
+    files = {}
+    requests = []
+    cut_off = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = self.files[self.path]
+        range = self.headers.get('Range')
+        self.requests.append((self.path, range))
+        start = int(range[len('bytes='):-1]) if range else 0
+        if start >= len(data):
+            self.send_response(416)
+            self.end_headers()
+            return
+        self.send_response(206 if range else 200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        body = data[start:]
+        if self.cut_off is not None:
+            body = body[:self.cut_off]
+        self.wfile.write(body)
+
+
+class TestDownload(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FileServer)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{}/reads.fastq.gz'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dirname, 'reads.fastq.gz')
+        self.content = gzip.compress(os.urandom(3 * 2 ** 20)) + gzip.compress(b'@r1\nACGT\n+\nFFFF\n')
+        FileServer.files = {'/reads.fastq.gz': self.content}
+        FileServer.requests = []
+        FileServer.cut_off = None
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def read(self):
+        with open(self.file_name, 'rb') as file:
+            return file.read()
+
+    def test_download_and_verify(self):
+        core.download_file(self.url, self.file_name)
+        self.assertEqual(self.read(), self.content)
+        manifest = core.read_manifest(self.file_name)
+        self.assertEqual(manifest['size'], len(self.content))
+        self.assertEqual(manifest['url'], self.url)
+        self.assertTrue(core.verify_download(self.file_name, url=self.url, checksum=True))
+        self.assertFalse(core.verify_download(self.file_name, url='http://other/reads.fastq.gz'))
+
+        with open(self.file_name, 'r+b') as file:
+            file.seek(100)
+            file.write(b'corrupt')
+        self.assertTrue(core.verify_download(self.file_name))
+        self.assertFalse(core.verify_download(self.file_name, checksum=True))
+
+        with open(self.file_name, 'r+b') as file:
+            file.truncate(1000)
+        self.assertFalse(core.verify_download(self.file_name))
+
+    def test_resume(self):
+        FileServer.cut_off = 2 ** 20
+        with self.assertRaises(Exception):
+            core.download_file(self.url, self.file_name)
+        self.assertFalse(os.path.isfile(self.file_name))
+        self.assertEqual(os.path.getsize(self.file_name + '.partial'), 2 ** 20)
+
+        FileServer.cut_off = None
+        core.download_file(self.url, self.file_name)
+        self.assertEqual(FileServer.requests[-1], ('/reads.fastq.gz', 'bytes={}-'.format(2 ** 20)))
+        self.assertEqual(self.read(), self.content)
+        self.assertFalse(os.path.isfile(self.file_name + '.partial'))
+        self.assertTrue(core.verify_download(self.file_name, checksum=True))
+
+    def test_verify_without_manifest(self):
+        with open(self.file_name, 'wb') as file:
+            file.write(self.content)
+        self.assertTrue(core.verify_download(self.file_name, url=self.url))
+        self.assertEqual(core.read_manifest(self.file_name)['size'], len(self.content))
+
+        os.remove(core.get_manifest_filename(self.file_name))
+        with open(self.file_name, 'wb') as file:
+            file.write(self.content[:-10])
+        self.assertFalse(core.verify_download(self.file_name))
+        self.assertIsNone(core.read_manifest(self.file_name))
+
+    def test_download_fastq(self):
+        temp_directory = os.path.join(self.dirname, 'temp')
+        core.download_fastq('E-MTAB-1', 'S0', temp_directory, self.url)
+        core.download_fastq('E-MTAB-1', 'S0', temp_directory, self.url)
+        self.assertEqual(len(FileServer.requests), 1)
+
+        file_name = os.path.join(temp_directory, 'FASTQ_FILES', 'E-MTAB-1__S0__0.fastq.gz')
+        with open(file_name, 'r+b') as file:
+            file.truncate(1000)
+        core.download_fastq('E-MTAB-1', 'S0', temp_directory, self.url)
+        self.assertEqual(len(FileServer.requests), 2)
+        with open(file_name, 'rb') as file:
+            self.assertEqual(file.read(), self.content)
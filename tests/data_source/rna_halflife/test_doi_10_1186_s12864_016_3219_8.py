@@ -31,7 +31,7 @@ class TestProteinAggregate(unittest.TestCase):
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
         cls.src.db.drop_collection(cls.collection_str)
-        cls.src.client.close()
+        cls.src.close()
 
     def test_download_xlsx(self):
         result = self.src.download_xlsx('MeOH')
@@ -1,6 +1,14 @@
 import unittest
 from datanator.data_source.rna_halflife import order_by_ko
 from datanator_query_python.config import config
+from tests.fake_mongo import FakeCollection
+from unittest import mock
+import json
+import os
+import requests
+import shutil
+import tempfile
+import time
 
 
 class TestReorg(unittest.TestCase):
@@ -62,4 +70,134 @@ class TestReorg(unittest.TestCase):
 
     @unittest.skip('passed')
     def test_fill_journal_pone(self):
-        self.src.fill_journal_pone()         
\ No newline at end of file
+        self.src.fill_journal_pone()
+
+
+class FakeQueryUniprotOrg:
+    """ Stand-in for `QueryUniprotOrg` which knows a few proteins and counts the queries """
+
+    proteins = {
+        'b0001 Escherichia coli': ('P0AD86', 'K08278', 'Thr operon leader peptide'),
+        'b0002 Escherichia coli': ('P00561', 'K12524', 'Aspartokinase'),
+        'b0003': ('P00547', 'K00872', 'Homoserine kinase'),
+    }
+    queries = []
+
+    def __init__(self, query):
+        self.queries.append(query)
+        self.protein = self.proteins.get(query, (None, None, None))
+
+    def get_uniprot_id(self):
+        return self.protein[0]
+
+    def get_kegg_ortholog(self):
+        return self.protein[1]
+
+    def get_protein_name(self):
+        return self.protein[2]
+
+
+class TestReorgBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dirname = tempfile.mkdtemp()
+        FakeQueryUniprotOrg.queries = []
+        self.doi = '10.1093/nar/gkt1150'
+        ref = [{'doi': self.doi}]
+        self.docs = [
+            {'halflives': [{'ordered_locus_name': 'b0001', 'halflife': 1, 'reference': ref},
+                           {'ordered_locus_name': 'b0001', 'halflife': 2, 'reference': [{'doi': 'other'}]}]},
+            {'halflives': [{'ordered_locus_name': ['b0002'], 'halflife': 3, 'reference': ref}]},
+            {'halflives': [{'ordered_locus_name': 'b0001', 'halflife': 4, 'reference': ref},
+                           {'ordered_locus_name': 'b0003', 'halflife': 5, 'reference': ref},
+                           {'ordered_locus_name': 'b0004', 'halflife': 6, 'reference': ref}]},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dirname)
+
+    def get_reorg(self):
+        ko_map = order_by_ko.UniprotKoMap(cache_path=os.path.join(self.cache_dirname, 'ko.json'),
+                                          query_class=FakeQueryUniprotOrg)
+        src = order_by_ko.Reorg(MongoDB='mongodb://localhost:27017', ko_map=ko_map)
+        src.src_collection = FakeCollection(self.docs)
+        src.des_collection = FakeCollection()
+        return src
+
+    def test_fill_helper(self):
+        src = self.get_reorg()
+        stats = src.fill_helper(self.doi, 'ordered_locus_name', species='Escherichia coli')
+        self.assertEqual(stats['subdocs'], 5)
+        self.assertEqual(stats['proteins'], 4)
+        self.assertEqual(stats['documents'], 4)
+        self.assertEqual(stats['ko_numbers'], 3)
+        self.assertEqual(stats['cache_hit_rate'], 0.)
+        self.assertEqual(sorted(FakeQueryUniprotOrg.queries),
+                         ['b0001 Escherichia coli', 'b0002 Escherichia coli', 'b0003',
+                          'b0003 Escherichia coli', 'b0004', 'b0004 Escherichia coli'])
+
+        self.assertEqual(len(src.des_collection.bulks), 1)
+        updates = {str(request._filter): request for request in src.des_collection.bulks[0]}
+        update = updates[str({'uniprot_id': 'P0AD86'})]
+        self.assertTrue(update._upsert)
+        self.assertEqual([subdoc['halflife'] for subdoc in update._doc['$addToSet']['halflives']['$each']], [1, 4])
+        self.assertEqual(update._doc['$set'], {'protein_names': 'Thr operon leader peptide', 'ko_number': 'K08278'})
+        self.assertEqual(updates[str({'uniprot_id': 'P00547'})]._doc['$set']['ko_number'], 'K00872')
+        self.assertEqual(updates[str({'identifier': 'b0004'})]._doc['$set'], {'protein_names': [None], 'ko_number': None})
+
+        # a rerun is answered from the cache on disk
+        FakeQueryUniprotOrg.queries = []
+        src = self.get_reorg()
+        stats = src.fill_helper(self.doi, 'ordered_locus_name', species='Escherichia coli')
+        self.assertEqual(FakeQueryUniprotOrg.queries, [])
+        self.assertEqual(stats['cache_hit_rate'], 1.)
+        self.assertEqual(src.ko_map.hit_rate, 1.)
+
+    def test_fill_helper_bulk_size(self):
+        src = self.get_reorg()
+        src.fill_helper(self.doi, 'ordered_locus_name', species='Escherichia coli', bulk_size=3)
+        self.assertEqual([len(bulk) for bulk in src.des_collection.bulks], [3, 1])
+
+    def test_fill_helper_http_error(self):
+        class FailingQueryUniprotOrg(FakeQueryUniprotOrg):
+            def __init__(self, query):
+                if query.startswith('b0003'):
+                    raise requests.HTTPError('429 Client Error: Too Many Requests')
+                super().__init__(query)
+
+        src = self.get_reorg()
+        src.ko_map.query_class = FailingQueryUniprotOrg
+        with self.assertRaises(requests.HTTPError):
+            src.fill_helper(self.doi, 'ordered_locus_name', species='Escherichia coli')
+        with open(os.path.join(self.cache_dirname, 'ko.json'), 'r') as f:
+            self.assertEqual(sorted(json.load(f)), ['b0001 Escherichia coli', 'b0002 Escherichia coli'])
+
+    def test_ko_map_miss_ttl(self):
+        cache_path = os.path.join(self.cache_dirname, 'ko.json')
+        ko_map = order_by_ko.UniprotKoMap(cache_path=cache_path, query_class=FakeQueryUniprotOrg, miss_ttl=60)
+        self.assertEqual(ko_map.get('b0004'), {'uniprot_id': None, 'ko_number': None, 'protein_names': None})
+        self.assertEqual(ko_map.get('b0004'), {'uniprot_id': None, 'ko_number': None, 'protein_names': None})
+        ko_map.get('b0003')
+        ko_map.save()
+        self.assertEqual(FakeQueryUniprotOrg.queries, ['b0004', 'b0003'])
+
+        ko_map = order_by_ko.UniprotKoMap(cache_path=cache_path, query_class=FakeQueryUniprotOrg, miss_ttl=60)
+        ko_map.get('b0004')
+        self.assertEqual(FakeQueryUniprotOrg.queries, ['b0004', 'b0003'])
+        with mock.patch.object(order_by_ko.time, 'time', return_value=time.time() + 120):
+            ko_map.get('b0004')
+            self.assertEqual(ko_map.get('b0003')['uniprot_id'], 'P00547')
+        self.assertEqual(FakeQueryUniprotOrg.queries, ['b0004', 'b0003', 'b0004'])
+
+    def test_checked_query_uniprot_org(self):
+        response = requests.Response()
+        response.status_code = 503
+        with mock.patch.object(order_by_ko.requests, 'get', return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                order_by_ko.CheckedQueryUniprotOrg('b0001')
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'<html><body></body></html>'
+        with mock.patch.object(order_by_ko.requests, 'get', return_value=response):
+            self.assertEqual(order_by_ko.CheckedQueryUniprotOrg('b0001').get_uniprot_id(), None)
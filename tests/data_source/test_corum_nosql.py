@@ -16,6 +16,7 @@ from datanator.data_source import corum_nosql
 import tempfile
 import shutil
 import pymongo
+import os
 import datanator.config.core
 
 class TestCorumNoSQL(unittest.TestCase):
@@ -42,7 +43,7 @@ class TestCorumNoSQL(unittest.TestCase):
         self.assertEqual(cursor.count(), 3)
         self.assertEqual(cursor[1]['complex_id'], 2)
         self.assertEqual(cursor[2]['subunits_protein_name'], ['B-cell lymphoma 6 protein', 'Histone deacetylase 7'])
-        src.client.close()
+        src.close()
 
     @unittest.skip(" loading all contents")
     def test_load_all_content(self):
@@ -123,4 +124,32 @@ class TestCorumNoSQL(unittest.TestCase):
         self.assertEqual(result, exp)
         subunits = [None]
         result = corum_nosql.parse_subunits(subunits)
-        self.assertEqual(result, [None])
\ No newline at end of file
+        self.assertEqual(result, [None])
+
+    def test_iter_complexes(self):
+        columns = ['ComplexID', 'ComplexName', 'Organism', 'Synonyms', 'Cell line', 'subunits(UniProt IDs)',
+                   'subunits(Entrez IDs)', 'Protein complex purification method', 'GO ID', 'GO description',
+                   'FunCat ID', 'FunCat description', 'subunits(Gene name)', 'Subunits comment', 'PubMed ID',
+                   'Complex comment', 'Disease comment', 'SWISSPROT organism', 'subunits(Gene name syn)',
+                   'subunits(Protein name)']
+        row = ['1', 'BCL6-HDAC4 complex', 'Human', 'None', 'None', 'P41182;P56524-2', '604;9759',
+               'MI:0007- anti tag coimmunoprecipitation', 'GO:0006265;GO:0045892', 'DNA topological change;negative regulation',
+               '10.01.09.05;11.02.03.04.03', 'DNA conformation modification;transcription repression', 'BCL6;HDAC4',
+               'None', '11929873', 'None', 'None', 'Homo sapiens (Human);Homo sapiens (Human)', 'BCL5;KIAA0288',
+               'B-cell lymphoma 6 protein;Histone deacetylase 4']
+        filename = os.path.join(self.cache_dirname, 'allComplexes.txt')
+        with open(filename, 'w') as file:
+            file.write('\t'.join(columns) + '\n')
+            file.write('\t'.join(row) + '\n')
+            file.write('\t'.join(['2'] + row[1:]) + '\n')
+        entries = list(corum_nosql.iter_complexes(filename, max_entries=1))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['complex_id'], 1)
+        self.assertEqual(entries[0]['pubmed_id'], 11929873)
+        self.assertEqual(entries[0]['Synonyms'], None)
+        self.assertEqual(entries[0]['subunits_isoform_id'], ['P41182', 'P56524-2'])
+        self.assertEqual(entries[0]['subunits_uniprot_id'], ['P41182', 'P56524'])
+        self.assertEqual(entries[0]['subunits_protein_name'], ['B-cell lymphoma 6 protein', 'Histone deacetylase 4'])
+        self.assertEqual(entries[0]['SWISSPROT_organism_NCBI_ID'], 9606)
+        self.assertNotIn('SWISSPROT organism', entries[0])
+        self.assertEqual(len(list(corum_nosql.iter_complexes(filename))), 2)
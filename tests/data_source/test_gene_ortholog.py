@@ -1,8 +1,107 @@
 import unittest
+from unittest import mock
+import os
+import requests
 import shutil
 import tempfile
+import threading
+import time
+from bs4 import BeautifulSoup
 from datanator.data_source import gene_ortholog
 import datanator.config.core
+from tests.fake_mongo import FakeCollection
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'kegg_ssdb')
+
+
+class Response:
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+
+    def raise_for_status(self):
+        if self.status_code != 200:
+            raise requests.exceptions.HTTPError('{} Error'.format(self.status_code), response=self)
+
+
+class ReplaySession:
+    """ Stand-in for `requests.Session` which replays recorded SSDB pages """
+
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.urls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            self.urls.append(url)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        path = os.path.join(FIXTURES, url.split('org_gene=')[1].replace(':', '_') + '.html')
+        if not os.path.isfile(path):
+            return Response(404, b'')
+        with open(path, 'rb') as f:
+            return Response(200, f.read())
+
+
+class TestSsdbFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dirname)
+
+    def test_parse_ssdb_hits(self):
+        with open(os.path.join(FIXTURES, 'aly_ARALYDRAFT_486312.html'), 'r') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        hits = list(gene_ortholog.parse_ssdb_hits(soup))
+        self.assertEqual([hit['org_gene'] for hit in hits], ['ath:AT3G58610', 'crb:17883452', 'csat:104737069'])
+        self.assertEqual(hits[0], {'org_gene': 'ath:AT3G58610', 'length': 591, 'sw_score': 3832, 'margin': 1168,
+                                   'bits': 879, 'identity': 0.967, 'overlap': 591})
+        self.assertEqual(hits[1]['margin'], 1044)
+        self.assertEqual(hits[1]['sw_score'], 3708)
+        self.assertEqual(hits[2]['margin'], None)
+        self.assertEqual(hits[2]['length'], 590)
+
+    def test_fetch_all(self):
+        session = ReplaySession(delay=0.05)
+        fetcher = gene_ortholog.SsdbFetcher(cache_dirname=self.cache_dirname, max_workers=2,
+                                            requests_per_second=None, session=session)
+        queries = ['aly:ARALYDRAFT_486312', 'ath:AT3G58610', 'aly:ARALYDRAFT_486312', 'hsa:0']
+        pages = dict(fetcher.fetch_all(queries))
+        self.assertEqual(sorted(pages), ['aly:ARALYDRAFT_486312', 'ath:AT3G58610'])
+        self.assertIn('ath:AT3G58610', pages['aly:ARALYDRAFT_486312'])
+        self.assertEqual(len(session.urls), 3)
+        self.assertEqual(session.max_active, 2)
+        metrics = fetcher.metrics
+        self.assertEqual(metrics['pages'], 2)
+        self.assertEqual(metrics['downloads'], 2)
+        self.assertEqual(metrics['errors'], 1)
+        self.assertGreater(metrics['bytes'], 0)
+        self.assertGreater(metrics['pages_per_second'], 0)
+
+        # pages are replayed from the cache
+        session = ReplaySession()
+        fetcher = gene_ortholog.SsdbFetcher(cache_dirname=self.cache_dirname, session=session)
+        self.assertEqual(fetcher.fetch('ath:AT3G58610'), pages['ath:AT3G58610'])
+        self.assertEqual(session.urls, [])
+        self.assertEqual(fetcher.metrics['cache_hit_rate'], 1.)
+
+    def test_rate_limit(self):
+        session = ReplaySession()
+        fetcher = gene_ortholog.SsdbFetcher(max_workers=4, requests_per_second=20., session=session)
+        start = time.time()
+        list(fetcher.fetch_all(['aly:ARALYDRAFT_486312', 'ath:AT3G58610', 'hsa:1', 'hsa:2', 'hsa:3']))
+        self.assertGreaterEqual(time.time() - start, 0.19)
+        self.assertEqual(len(session.urls), 5)
 
 
 class TestKeggOrgCode(unittest.TestCase):
@@ -43,4 +142,39 @@ class TestKeggOrgCode(unittest.TestCase):
 
     def test_parse_gene_info(self):
         result = self.src.parse_gene_info('100008727')
-        self.assertEqual(['AAD18037.1', 'AAD38154.1', 'AFS49951.1', 'NP_001075529.1', 'Q9XSZ4.1', 'XP_008265676.1', 'XP_017202733.1'], result)
\ No newline at end of file
+        self.assertEqual(['AAD18037.1', 'AAD38154.1', 'AFS49951.1', 'NP_001075529.1', 'Q9XSZ4.1', 'XP_008265676.1', 'XP_017202733.1'], result)
+
+    def test_get_uniprot_ids_memoized(self):
+        uniprot_manager = mock.Mock()
+        uniprot_manager.get_id_by_org_gene.return_value = ([{'uniprot_id': 'Q05758'}], 1)
+        with mock.patch.object(self.src, 'uniprot_manager', uniprot_manager), \
+                mock.patch.object(self.src, '_uniprot_ids', {}):
+            self.assertEqual(self.src.get_uniprot_ids('ath:AT3G58610'), ['Q05758'])
+            self.assertEqual(self.src.get_uniprot_ids('ath:AT3G58610'), ['Q05758'])
+        self.assertEqual(uniprot_manager.get_id_by_org_gene.call_count, 1)
+
+    def test_load_data(self):
+        docs = [{'uniprot_id': 'D7LLW3', 'entrez_id': 9316032}, {'uniprot_id': 'Q05758', 'entrez_id': 825030},
+                {'uniprot_id': 'D7LLW3_2', 'entrez_id': 9316032}, {'uniprot_id': 'P00001', 'entrez_id': None}]
+        org_genes = {'D7LLW3': 'aly:ARALYDRAFT_486312', 'Q05758': 'ath:AT3G58610',
+                     'D7LLW3_2': 'aly:ARALYDRAFT_486312'}
+        uniprot_manager = mock.Mock(collection=FakeCollection(docs))
+        uniprot_manager.get_id_by_org_gene.side_effect = lambda org_gene: ([{'uniprot_id': org_gene.upper()}], 1)
+        session = ReplaySession()
+        fetcher = gene_ortholog.SsdbFetcher(cache_dirname=os.path.join(self.cache_dirname, 'kegg_ssdb'),
+                                            requests_per_second=None, session=session)
+        with mock.patch.object(self.src, 'uniprot_manager', uniprot_manager), \
+                mock.patch.object(self.src, 'fetcher', fetcher), \
+                mock.patch.object(self.src, 'uniprot_to_org_gene', org_genes.get), \
+                mock.patch.object(self.src, '_uniprot_ids', {}):
+            metrics = self.src.load_data(top_hits=2)
+        self.assertEqual(len(session.urls), 2)
+        self.assertEqual(metrics['pages'], 2)
+        updates = {request._filter['uniprot_id']: request._doc['$set']['orthologs']
+                   for bulk in uniprot_manager.collection.bulks for request in bulk}
+        self.assertEqual(sorted(updates), ['D7LLW3', 'D7LLW3_2', 'Q05758'])
+        self.assertEqual([hit['org_gene'] for hit in updates['D7LLW3']], ['ath:AT3G58610', 'crb:17883452'])
+        self.assertEqual(updates['D7LLW3'][0]['uniprot_id'], ['ATH:AT3G58610'])
+        self.assertEqual(updates['D7LLW3_2'], updates['D7LLW3'])
+        self.assertEqual(updates['Q05758'][0]['org_gene'], 'aly:ARALYDRAFT_486312')
+        self.assertEqual(uniprot_manager.get_id_by_org_gene.call_count, 3)
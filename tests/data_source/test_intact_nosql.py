@@ -4,6 +4,7 @@ import os
 import unittest
 import tempfile
 import datanator.config.core
+import pandas
 
 class TestCorumNoSQL(unittest.TestCase):
 
@@ -53,3 +54,34 @@ class TestCorumNoSQL(unittest.TestCase):
         self.assertEqual(cursor.count(), 1)
         self.assertEqual(cursor[0]['method'], 'anti tag coimmunoprecipitation')
         self.assertEqual(cursor[0]['confidence'], 'intact-miscore:0.51')
+
+    def test_parse_interactions(self):
+        data = pandas.DataFrame({
+            '#ID(s) interactor A': ['uniprotkb:P12345', 'chebi:"CHEBI:15422"'],
+            'ID(s) interactor B': ['intact:EBI-1', 'uniprotkb:Q67890'],
+            'Alias(es) interactor A': ['uniprotkb:abc(gene name)|uniprotkb:ABC(gene name)', '-'],
+            'Alias(es) interactor B': ['psi-mi:xyz_human(display_short)', '-'],
+            'Interaction type(s)': ['psi-mi:"MI:0914"(association)', '-'],
+            'Interaction detection method(s)': ['psi-mi:"MI:0007"(anti tag coimmunoprecipitation)', '-'],
+            'Type(s) interactor A': ['psi-mi:"MI:0326"(protein)', '-'],
+            'Type(s) interactor B': ['psi-mi:"MI:0326"(protein)', '-'],
+            'Biological role(s) interactor A': ['psi-mi:"MI:0499"(unspecified role)', '-'],
+            'Biological role(s) interactor B': ['-', '-'],
+            'Feature(s) interactor A': ['-', '-'],
+            'Feature(s) interactor B': ['-', '-'],
+            'Stoichiometry(s) interactor A': ['-', '-'],
+            'Stoichiometry(s) interactor B': ['-', '-'],
+            'Interaction identifier(s)': ['intact:EBI-526288', 'intact:EBI-2'],
+            'Publication Identifier(s)': ['imex:IM-1|pubmed:10831611', 'mint:x'],
+            'Publication 1st author(s)': ['Foo et al.', '-'],
+            'Confidence value(s)': ['intact-miscore:0.51', '-'],
+        })
+        docs = self.src._frame_to_docs(self.src.parse_interactions(data))
+        self.assertEqual(docs[0]['_id'], 0)
+        self.assertEqual((docs[0]['protein_a'], docs[0]['gene_a']), ('P12345', 'ABC'))
+        self.assertEqual((docs[0]['protein_b'], docs[0]['gene_b']), ('xyz_human', None))
+        self.assertEqual(docs[0]['method'], 'anti tag coimmunoprecipitation')
+        self.assertEqual(docs[0]['role_b'], None)
+        self.assertEqual(docs[0]['publication'], '10831611')
+        self.assertEqual((docs[1]['protein_a'], docs[1]['protein_b']), (None, 'Q67890'))
+        self.assertEqual(docs[1]['publication'], None)
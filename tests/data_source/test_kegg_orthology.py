@@ -73,7 +73,7 @@ class TestKeggOrthology(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
-        cls.client.close()
+        cls.src.close()
     
     @unittest.skip('passed')
     def test_download_ko(self):
@@ -163,4 +163,29 @@ class TestKeggOrthology(unittest.TestCase):
             with open('foo') as h:
                 lines = h.readlines()
         result = self.src.parse_gene(lines)
-        self.assertEqual(result[-1], {'organism': 'XCC', 'genetic_info': [{'locus_id': 'XCC2294', 'gene_id': 'phbB'}, {'locus_id': 'XCC3355', 'gene_id': 'fabG'}]})        
\ No newline at end of file
+        self.assertEqual(result[-1], {'organism': 'XCC', 'genetic_info': [{'locus_id': 'XCC2294', 'gene_id': 'phbB'}, {'locus_id': 'XCC3355', 'gene_id': 'fabG'}]})        
+
+    def test_split_entries(self):
+        text = ('ENTRY       K00844                      KO\nNAME        HK\n///\n'
+                'ENTRY       K12407                      KO\nNAME        GCK\n///\n')
+        result = self.src.split_entries(text)
+        self.assertEqual(list(result.keys()), ['K00844', 'K12407'])
+        self.assertEqual(result['K12407'], 'ENTRY       K12407                      KO\nNAME        GCK\n///\n')
+
+    def test_update_mirror(self):
+        entry = 'ENTRY       {}                      KO\nNAME        foo\nDEFINITION  bar [EC:1.1.1.1]\nGENES       HSA: 1(A)\n///\n'
+        def get(url):
+            response = unittest.mock.Mock()
+            response.text = ''.join(entry.format(_id[3:]) for _id in url.split('/')[-1].split('+'))
+            return response
+        names = {'K{:05d}'.format(i): 'K{:05d}  foo; bar'.format(i) for i in range(12)}
+        with patch('requests.get', side_effect=get) as m:
+            self.assertEqual(self.src.update_mirror(names), 12)
+            self.assertEqual(m.call_count, 2)
+            self.assertEqual(self.src.update_mirror(names), 0)
+            names['K00003'] = 'K00003  foo; changed'
+            self.assertEqual(self.src.update_mirror(names), 1)
+        docs = list(self.src.iter_mirror())
+        self.assertEqual(len(docs), 12)
+        self.assertEqual(docs[3]['kegg_orthology_id'], 'K00003')
+        self.assertEqual(docs[3]['definition'], {'name': ['bar'], 'ec_code': ['1.1.1.1']})
@@ -74,7 +74,7 @@ class TestKeggReaction(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
-        cls.client.close()
+        cls.src.close()
     
     # @unittest.skip('passed')
     def test_download_rxn_cls(self):
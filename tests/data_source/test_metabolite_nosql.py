@@ -37,7 +37,7 @@ class TestMetaboliteNoSQL(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
-        cls.client.close()
+        cls.src.close()
 
     @unittest.skip('ecmdb.ca and ymdb.ca xml server http 500 error')
     def test_write_to_json(self):
@@ -4,6 +4,7 @@ import datanator.config.core
 import pymongo
 import tempfile
 import shutil
+from unittest import mock
 
 
 class TestMetabolitesMeta(unittest.TestCase):
@@ -44,4 +45,51 @@ class TestMetabolitesMeta(unittest.TestCase):
         self.assertEqual(cursor['InChI_Key'], 'DBXBTMSZEOQQDU-UHFFFAOYSA-N')
         
     def test_replace_key_in_similar_compounds(self):
-        self.src.replace_key_in_similar_compounds()
\ No newline at end of file
+        self.src.replace_key_in_similar_compounds()
+
+    def test_get_isomer_groups(self):
+        docs = [
+            {'_id': 0, 'InChI_Key': 'GXIURPTVHJPJLF-UWTATZPHSA-N',
+             'inchi': 'InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2-10H,1H2,(H2,11,12,13)/t2-,3-,4+,5-,6-/m1/s1'},
+            {'_id': 1, 'InChI_Key': 'NBSCHQHZLSJFNQ-GASJEMHNSA-N',
+             'inchi': 'InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2-10H,1H2,(H2,11,12,13)/t2-,3+,4+,5-,6?/m1/s1'},
+            {'_id': 2, 'InChI_Key': 'BGWGXPAPYGQALX-ARQDHWQXSA-N',
+             'inchi': 'InChI=1S/C6H13O9P/c7-1-3(8)5(10)6(11)4(9)2-15-16(12,13)14/h4-7,9-11H,1-2H2,(H2,12,13,14)/t4-,5-,6-/m1/s1'},
+            {'_id': 3, 'InChI_Key': 'BGWGXPAPYGQALX-ARQDHWQXSA-N',
+             'inchi': 'InChI=1S/C6H13O9P/c7-1-3(8)5(10)6(11)4(9)2-15-16(12,13)14/h4-7,9-11H,1-2H2,(H2,12,13,14)/t4-,5-,6-/m1/s1'},
+            {'_id': 4, 'inchi': 'C6H13O9P'},
+        ]
+        collection = mock.Mock()
+        collection.find.return_value = iter(docs)
+        with mock.patch.object(self.src, 'collection', collection):
+            groups = self.src.get_isomer_groups(kind='stereoisomer')
+        self.assertEqual(groups, [['GXIURPTVHJPJLF-UWTATZPHSA-N', 'NBSCHQHZLSJFNQ-GASJEMHNSA-N']])
+        collection.find.assert_called_once_with(filter={'inchi': {'$ne': None}},
+                                                projection={'inchi': 1, 'InChI_Key': 1})
+
+    def test_get_kinlaw_index(self):
+        docs = [
+            {'kinlaw_id': 1,
+             'reactants': [{'name': 'ATP', 'structures': [{'InChI_Key': 'ZKHQWZAMYRWXGA-KQYNXXCUSA-J'}]},
+                           {'name': 'D-Glucose', 'structures': [{'InChI_Key': 'WQZGKKKJIJFFOK-GASJEMHNSA-N'}]},
+                           {'reactants_aggregate': ['ZKHQWZAMYRWXGA-KQYNXXCUSA-J', 'WQZGKKKJIJFFOK-GASJEMHNSA-N']}],
+             'products': [{'name': 'ADP', 'structures': [{'InChI_Key': 'XTWYTFMLZFPYCI-KQYNXXCUSA-K'}]},
+                          {'name': 'H+', 'structures': []}]},
+            {'kinlaw_id': 2,
+             'reactants': [{'name': 'ATP', 'structures': [{'InChI_Key': 'ZKHQWZAMYRWXGA-KQYNXXCUSA-J'}]},
+                           {'name': 'Water', 'structures': [{'InChI_Key': None}]}],
+             'products': [{'name': 'ATP', 'structures': [{'InChI_Key': 'ZKHQWZAMYRWXGA-KQYNXXCUSA-J'}]}]},
+        ]
+        collection = mock.Mock()
+        collection.find.return_value = iter(docs)
+        with mock.patch.object(self.src, 'con_db', return_value=(None, None, collection)):
+            kinlaw_ids, participants = self.src.get_kinlaw_index()
+        self.assertEqual(kinlaw_ids, {
+            'ZKHQWZAMYRWXGA-KQYNXXCUSA-J': [1, 2],
+            'WQZGKKKJIJFFOK-GASJEMHNSA-N': [1],
+            'XTWYTFMLZFPYCI-KQYNXXCUSA-K': [1],
+        })
+        self.assertEqual(participants[1], {'substrates': ['ATP', 'D-Glucose', 'no such key'],
+                                           'products': ['ADP', 'H+']})
+        self.assertEqual(participants[2], {'substrates': ['ATP', 'Water'], 'products': ['ATP']})
+        self.assertEqual(collection.find.call_count, 1)
@@ -3,6 +3,8 @@ from datanator.data_source import pax_nosql
 import datanator.config.core
 import tempfile
 import shutil
+import os
+import pandas
 
 class TestCorumNoSQL(unittest.TestCase):
 
@@ -33,3 +35,46 @@ class TestCorumNoSQL(unittest.TestCase):
         self.assertEqual(cursor.count(), 1)
         self.assertEqual(cursor[0]['weight'], 20)
         self.assertEqual(cursor[0]['observation'][1]['string_id'], '882.DVU0142')
+
+    def test_parse_pax_file(self):
+        os.makedirs(os.path.join(self.cache_dirname, '882'))
+        file_path = os.path.join(self.cache_dirname, '882', '882-WHOLE_ORGANISM-integrated.txt')
+        with open(file_path, 'w') as file:
+            file.write('#\n'
+                       '#name: D.vulgaris - Whole organism, integrated\n'
+                       '#score: 3.14\n'
+                       '#weight: 20%\n'
+                       '#description: integrated dataset: <a href="http://pax-db.org/#!species/882" target="_blank">link</a>\n'
+                       '#organ: WHOLE_ORGANISM\n'
+                       '#integrated: true\n'
+                       '#coverage: 82\n'
+                       '#\n#\n#\n'
+                       '#internal_id\tstring_external_id\tabundance\n'
+                       '1\t882.DVU0949\t12.5\n'
+                       '2\t882.DVU0142\t3\n')
+        uniprot = pax_nosql.uniprot_map(pandas.DataFrame({'uniprot_id': ['Q72DW2']},
+                                                         index=pandas.Index(['882.DVU0949'], name='string_id')))
+        entry, errors = pax_nosql.parse_pax_file(file_path, self.cache_dirname, uniprot)
+        self.assertEqual(errors, [])
+        self.assertEqual(entry['file_name'], '882/882-WHOLE_ORGANISM-integrated.txt')
+        self.assertEqual(entry['ncbi_id'], 882)
+        self.assertEqual(entry['species_name'], 'D.vulgaris')
+        self.assertEqual(entry['weight'], 20)
+        self.assertEqual(entry['publication'], 'http://pax-db.org/#!species/882')
+        self.assertEqual(entry['coverage'], 82)
+        self.assertEqual(entry['observation'][0], {'protein_id': {'string_id': '882.DVU0949', 'uniprot_id': 'Q72DW2'},
+                                                   'string_id': '882.DVU0949', 'abundance': '12.5'})
+        self.assertEqual(entry['observation'][1]['protein_id'], None)
+
+        # the description after the species name is optional
+        with open(file_path, 'r') as file:
+            content = file.read()
+        with open(file_path, 'w') as file:
+            file.write(content.replace('#name: D.vulgaris - Whole organism, integrated', '#name: D.vulgaris'))
+        entry, errors = pax_nosql.parse_pax_file(file_path, self.cache_dirname, uniprot)
+        self.assertEqual(errors, [])
+        self.assertEqual(entry['species_name'], 'D.vulgaris')
+
+        with open(file_path, 'w') as file:
+            file.write('#\n#name: D.vulgaris - Whole organism, integrated\n#score 3.14\n')
+        self.assertEqual(pax_nosql.parse_pax_file(file_path, self.cache_dirname, uniprot), (None, ['invalid #score field']))
@@ -1,5 +1,9 @@
 import unittest
+from unittest import mock
 from datanator.data_source import protein_aggregate
+from datanator.util import mongo_util
+from pymongo.collation import Collation, CollationStrength
+import pymongo
 import tempfile
 import shutil
 import json
@@ -33,7 +37,7 @@ class TestProteinAggregate(unittest.TestCase):
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
         # cls.src.db.drop_collection(cls.collection_str)
-        cls.src.client.close()
+        mongo_util.client_pool.release(cls.src.client)
 
     # # @unittest.skip('passed')
     # def test_load_abundance_from_pax(self):
@@ -83,3 +87,64 @@ class TestProteinAggregate(unittest.TestCase):
         result_1 = self.src.col.find_one({'uniprot_id': 'P16064'})
         self.assertTrue({'kinlaw_id': 1, 'ncbi_taxonomy_id': 1467} in result_1['kinetics'])
 
+
+class TestProteinAggregateBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.src = protein_aggregate.ProteinAggregate.__new__(protein_aggregate.ProteinAggregate)
+        self.src.max_entries = float('inf')
+        self.src.verbose = False
+        self.src.collation = Collation(locale='en', strength=CollationStrength.SECONDARY)
+        self.src.col = mock.Mock()
+        self.src.mongo_manager = mock.Mock()
+
+    def update(self, uniprot_id, update, upsert=False):
+        return pymongo.UpdateOne({'uniprot_id': uniprot_id}, update, upsert=upsert, collation=self.src.collation)
+
+    def test_load_abundance_from_pax(self):
+        abundances = {
+            'P1': [{'organ': 'WHOLE_ORGANISM', 'abundance': 1.5, 'ordered_locus_name': 'b0001'}],
+            'P2': [{'organ': 'WHOLE_ORGANISM', 'abundance': 2., 'ordered_locus_name': 'b0002'},
+                   {'organ': 'LIVER', 'abundance': 3., 'ordered_locus_name': 'b0002'}],
+            'P3': [{'organ': 'LIVER', 'abundance': 4., 'ordered_locus_name': 'b0003'}],
+        }
+        col_pax = mock.Mock()
+        col_pax.aggregate.return_value = iter([{'_id': key, 'abundances': value} for key, value in abundances.items()])
+        self.src.mongo_manager.con_db.return_value = (None, None, col_pax)
+        self.src.load_abundance_from_pax(bulk_size=2)
+
+        pipeline = col_pax.aggregate.call_args[0][0]
+        self.assertEqual(pipeline[0], {'$project': {'organ': 1, 'observation': 1}})
+        self.assertEqual(pipeline[1], {'$unwind': '$observation'})
+        bulks = [call[0][0] for call in self.src.col.bulk_write.call_args_list]
+        expected = [self.update(key, {'$push': {'abundances': {'$each': value}}}, upsert=True)
+                    for key, value in abundances.items()]
+        self.assertEqual(bulks, [expected[:2], expected[2:]])
+
+        # max_entries limits the observations of each pax document
+        self.src.max_entries = 5
+        col_pax.aggregate.return_value = iter([])
+        self.src.load_abundance_from_pax()
+        pipeline = col_pax.aggregate.call_args[0][0]
+        self.assertEqual(pipeline[0], {'$project': {'organ': 1, 'observation': {'$slice': ['$observation', 5]}}})
+
+    def test_load_ko(self):
+        col_ko = mock.Mock()
+        col_ko.find.return_value = [
+            {'kegg_orthology_id': 'K00001', 'gene_name': ['adh', 'ADH1'], 'definition': {'name': ['alcohol dehydrogenase']}},
+            {'kegg_orthology_id': 'K00002', 'gene_name': ['gdh'], 'definition': {'name': ['glutamate dehydrogenase']}},
+        ]
+        self.src.mongo_manager.con_db.return_value = (None, None, col_ko)
+        self.src.col.find.return_value = [
+            {'uniprot_id': 'P1', 'gene_name': 'Adh1'},
+            {'uniprot_id': 'P2', 'gene_name': ['xyz', 'GDH']},
+            {'uniprot_id': 'P3', 'gene_name': ['xyz']},
+            {'uniprot_id': 'P4', 'gene_name': None},
+            {'uniprot_id': 'P5'},
+        ]
+        self.src.load_ko()
+        bulks = [call[0][0] for call in self.src.col.bulk_write.call_args_list]
+        self.assertEqual(bulks, [[
+            self.update('P1', {'$set': {'ko_number': 'K00001', 'ko_name': ['alcohol dehydrogenase']}}),
+            self.update('P2', {'$set': {'ko_number': 'K00002', 'ko_name': ['glutamate dehydrogenase']}}),
+        ]])
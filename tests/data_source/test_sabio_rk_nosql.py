@@ -1,5 +1,6 @@
 from datanator.data_source import sabio_rk_nosql
 from datanator.util import file_util
+from datanator.util import mongo_util
 import datanator.config.core
 import unittest
 import tempfile
@@ -37,7 +38,7 @@ class TestSabioRk(unittest.TestCase):
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
         cls.src.db_obj.drop_collection("sabio_rk")
-        cls.src.client.close()
+        mongo_util.client_pool.release(cls.src.client)
 
     @unittest.skip('passed, avoid unnecessary http requests')
     def test_load_kinetic_law_ids(self):
@@ -0,0 +1,70 @@
+import unittest
+from datanator.data_source import sqlite_to_json
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+
+class TestSQLToJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.database = os.path.join(self.dirname, 'SabioRk.sqlite')
+        connection = sqlite3.connect(self.database)
+        connection.execute('CREATE TABLE entry (_id INTEGER PRIMARY KEY, name VARCHAR(255), value FLOAT, '
+                           'active BOOLEAN, modified DATETIME)')
+        connection.executemany('INSERT INTO entry VALUES (?, ?, ?, ?, ?)', [
+            (i, 'entry {}'.format(i), i / 2 if i % 3 else None, i % 2, '2019-04-02 00:00:00')
+            for i in range(25)])
+        connection.execute('CREATE TABLE "empty table" (_id INTEGER PRIMARY KEY)')
+        connection.commit()
+        connection.close()
+        self.src = sqlite_to_json.SQLToJSON('select * from ', cache_dirname=self.database, batch_size=7)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_query_table(self):
+        self.assertEqual(sorted(self.src.table()), ['empty table', 'entry'])
+        rows = self.src.query_table('entry')
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[1], {'_id': 1, 'name': 'entry 1', 'value': 0.5, 'active': 1,
+                                   'modified': '2019-04-02 00:00:00'})
+        self.assertEqual(self.src.query_table('empty table'), None)
+        self.assertEqual(self.src.query_table('empty table', one=False), [])
+        self.assertEqual([len(batch) for batch in self.src.iter_batches('entry')], [7, 7, 7, 4])
+
+    def test_export_jsonl(self):
+        out = os.path.join(self.dirname, 'jsonl')
+        manifest = self.src.export(out, compression='gzip', max_workers=2)
+        self.assertEqual(manifest['tables']['entry']['file'], 'entry.jsonl.gz')
+        self.assertEqual(manifest['tables']['entry']['rows'], 25)
+        self.assertEqual(manifest['tables']['empty table']['rows'], 0)
+        self.assertEqual(sqlite_to_json.read_manifest(out), manifest)
+        self.assertEqual(sqlite_to_json.verify_export(out), [])
+        self.assertEqual(list(sqlite_to_json.iter_table(out, 'entry')), self.src.query_table('entry'))
+        self.assertEqual(list(sqlite_to_json.iter_table(out, 'empty table')), [])
+
+        with open(os.path.join(out, 'entry.jsonl.gz'), 'ab') as file:
+            file.write(b'\0')
+        self.assertEqual(sqlite_to_json.verify_export(out), ['entry'])
+
+    def test_export_parquet(self):
+        out = os.path.join(self.dirname, 'parquet')
+        manifest = self.src.export(out, tables=['entry'], format='parquet', compression='snappy')
+        self.assertEqual(list(manifest['tables'].keys()), ['entry'])
+        self.assertEqual(sqlite_to_json.verify_export(out), [])
+
+        rows = list(sqlite_to_json.iter_table(out, 'entry', batch_size=10))
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[1], {'_id': 1, 'name': 'entry 1', 'value': 0.5, 'active': True,
+                                   'modified': '2019-04-02 00:00:00'})
+        self.assertEqual(rows[3]['value'], None)
+
+    def test_export_errors(self):
+        with self.assertRaises(ValueError):
+            self.src.export(self.dirname, format='csv')
+        with self.assertRaises(ValueError):
+            self.src.export(self.dirname, compression='zip')
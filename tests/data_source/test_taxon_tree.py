@@ -27,7 +27,7 @@ class TestTaxonTree(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
-        cls.src.client.close()
+        cls.src.close()
 
     # @unittest.skip('passed')
     def test_download_dump(self):
@@ -0,0 +1,174 @@
+import unittest
+from unittest import mock
+from datanator.elasticsearch_kl import parallel_load
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tests.fake_mongo import FakeCollection
+import json
+import threading
+
+
+class LocalES(BaseHTTPRequestHandler):
+    """ Single-node stand-in for the parts of the Elasticsearch REST API used by the indexer """
+
+    indices = {}
+    aliases = {}
+    fail_ids = set()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(json.dumps(body).encode())
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+
+    def do_PUT(self):
+        self._body()
+        self.indices[self.path.strip('/')] = {}
+        self._reply(200, {'acknowledged': True})
+
+    def do_HEAD(self):
+        self._reply(200 if self.path.strip('/') in self.indices else 404)
+
+    def do_GET(self):
+        alias = self.path.split('/_alias/')[-1]
+        names = [name for name, _alias in self.aliases.items() if _alias == alias]
+        if names:
+            self._reply(200, {name: {'aliases': {alias: {}}} for name in names})
+        else:
+            self._reply(404, {})
+
+    def do_DELETE(self):
+        self.indices.pop(self.path.strip('/'), None)
+        self._reply(200, {'acknowledged': True})
+
+    def do_POST(self):
+        body = self._body()
+        if self.path == '/_bulk':
+            lines = body.strip().split('\n')
+            items = []
+            for action, source in zip(lines[::2], lines[1::2]):
+                meta = json.loads(action)['index']
+                status = 400 if meta['_id'] in self.fail_ids else 201
+                if status == 201:
+                    self.indices[meta['_index']][meta['_id']] = json.loads(source)
+                items.append({'index': {'_id': meta['_id'], 'status': status}})
+            self._reply(200, {'errors': any(i['index']['status'] != 201 for i in items), 'items': items})
+        elif self.path == '/_aliases':
+            for action in json.loads(body)['actions']:
+                if 'add' in action:
+                    self.aliases[action['add']['index']] = action['add']['alias']
+                elif 'remove' in action:
+                    self.aliases.pop(action['remove']['index'], None)
+                else:
+                    self.indices.pop(action['remove_index']['index'], None)
+            self._reply(200, {'acknowledged': True})
+        else:
+            self._reply(200, {})
+
+
+class Collection(FakeCollection):
+    """ :obj:`FakeCollection` which splits its documents into `_id` buckets like `$bucketAuto` """
+
+    def __init__(self, docs):
+        super().__init__(sorted(docs, key=lambda doc: doc['_id']), name='protein')
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        n = pipeline[-1]['$bucketAuto']['buckets']
+        size = -(-len(self.docs) // n)
+        return [{'_id': {'min': self.docs[i]['_id']}} for i in range(0, len(self.docs), size)]
+
+
+class TestParallelIndexer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), LocalES)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.endpoint = 'http://127.0.0.1:{}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        LocalES.indices.clear()
+        LocalES.aliases.clear()
+        LocalES.fail_ids.clear()
+        self.collection = Collection([{'_id': i, 'uniprot_id': 'P{:05d}'.format(i), 'length': i}
+                                      for i in range(1000)])
+
+    def test_adaptive_bulk_size(self):
+        size = parallel_load.AdaptiveBulkSize(initial=100, minimum=10, maximum=120, target_latency=1.)
+        self.assertEqual(size.update(0.1), 120)
+        self.assertEqual(size.update(0.7), 120)
+        self.assertEqual(size.update(2.), 60)
+        for _ in range(10):
+            size.update(5.)
+        self.assertEqual(size.size, 10)
+
+    def test_split_id_ranges(self):
+        src = parallel_load.ParallelIndexer(self.endpoint)
+        filters = src.split_id_ranges(self.collection, 4)
+        self.assertEqual(filters, [{'_id': {'$lt': 250}},
+                                   {'_id': {'$gte': 250, '$lt': 500}},
+                                   {'_id': {'$gte': 500, '$lt': 750}},
+                                   {'_id': {'$gte': 750}}])
+        n = sum(len(list(self.collection.find(_filter))) for _filter in filters)
+        self.assertEqual(n, 1000)
+
+    def test_reindex(self):
+        LocalES.indices['protein'] = {'old': {}}
+        src = parallel_load.ParallelIndexer(self.endpoint, readers=3, writers=2, queue_size=50,
+            bulk_size=parallel_load.AdaptiveBulkSize(initial=64, minimum=16, maximum=256))
+        stats = src.reindex('protein', self.collection, _id='uniprot_id', version='1',
+                            transform=lambda doc: doc if doc['length'] % 10 else None)
+        self.assertEqual(stats['index'], 'protein_v1')
+        self.assertEqual(stats['docs'], 900)
+        self.assertEqual(stats['failed'], 0)
+        self.assertTrue(stats['docs_per_second'] > 0)
+        self.assertEqual(len(LocalES.indices['protein_v1']), 900)
+        self.assertEqual(LocalES.indices['protein_v1']['P00001'], {'uniprot_id': 'P00001', 'length': 1})
+        self.assertNotIn('protein', LocalES.indices)
+        self.assertEqual(LocalES.aliases, {'protein_v1': 'protein'})
+
+        stats = src.reindex('protein', self.collection, _id='uniprot_id', version='2')
+        self.assertEqual(stats['docs'], 1000)
+        self.assertEqual(LocalES.aliases, {'protein_v2': 'protein'})
+        self.assertNotIn('protein_v1', LocalES.indices)
+
+    def test_reindex_default_id(self):
+        src = parallel_load.ParallelIndexer(self.endpoint)
+        stats = src.reindex('protein', self.collection, version='1')
+        self.assertEqual(stats['docs'], 1000)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(LocalES.indices['protein_v1']['7'], {'id': 7, 'uniprot_id': 'P00007', 'length': 7})
+
+        with self.assertRaises(ValueError):
+            src.reindex('protein', self.collection, projection={'_id': 0}, version='2')
+        self.assertNotIn('protein_v2', LocalES.indices)
+
+    def test_reindex_failure_keeps_alias(self):
+        LocalES.aliases['protein_v1'] = 'protein'
+        LocalES.indices['protein_v1'] = {}
+        LocalES.fail_ids.add('P00007')
+        src = parallel_load.ParallelIndexer(self.endpoint)
+        with self.assertRaises(RuntimeError):
+            src.reindex('protein', self.collection, _id='uniprot_id', version='2')
+        self.assertEqual(LocalES.aliases, {'protein_v1': 'protein'})
+        self.assertNotIn('protein_v2', LocalES.indices)
+
+    def test_reindex_error_deletes_new_index(self):
+        src = parallel_load.ParallelIndexer(self.endpoint)
+        with mock.patch.object(self.collection, 'find', side_effect=ConnectionError('lost connection to mongodb')):
+            with self.assertRaises(ConnectionError):
+                src.reindex('protein', self.collection, _id='uniprot_id', version='3')
+        self.assertNotIn('protein_v3', LocalES.indices)
+        self.assertEqual(LocalES.aliases, {})
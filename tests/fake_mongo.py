@@ -0,0 +1,143 @@
+""" In-memory stand-ins for the parts of pymongo used by the tests of the loaders """
+
+
+class FakeCursor(list):
+    """ Documents returned by :obj:`FakeCollection.find` """
+
+    def limit(self, n):
+        return FakeCursor(self[:n])
+
+    def batch_size(self, n):
+        return self
+
+    def close(self):
+        pass
+
+
+class FakeCollection:
+    """ In-memory stand-in for a pymongo collection
+
+    Filters support equality, dotted paths through arrays, `$and`, `$or`, `$in`, `$ne`,
+    `$exists`, `$eq`, `$gt`, `$gte`, `$lt` and `$lte`. String comparisons are case-insensitive
+    when a collation is given. Bulk writes are recorded rather than applied.
+
+    Attributes:
+        docs (:obj:`list` of :obj:`dict`): documents
+        name (:obj:`str`): name of the collection
+        filters (:obj:`list` of :obj:`dict`): filters of the calls to :obj:`find`
+        bulks (:obj:`list` of :obj:`list`): requests of the calls to :obj:`bulk_write`
+    """
+
+    def __init__(self, docs=(), name='test'):
+        """
+        Args:
+            docs (:obj:`list` of :obj:`dict`, optional): documents
+            name (:obj:`str`, optional): name of the collection
+        """
+        self.docs = list(docs)
+        self.name = name
+        self.filters = []
+        self.bulks = []
+
+    def find(self, filter=None, projection=None, collation=None, skip=0, **kwargs):
+        self.filters.append(filter)
+        docs = [project(doc, projection) for doc in self.docs if match(doc, filter, collation)]
+        return FakeCursor(docs[skip:])
+
+    def count_documents(self, filter, collation=None):
+        return sum(1 for doc in self.docs if match(doc, filter, collation))
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulks.append(list(requests))
+
+
+def match(doc, filter, collation=None):
+    """ Determine if a document matches a filter
+
+    Args:
+        doc (:obj:`dict`): document
+        filter (:obj:`dict`): mongodb query filter
+        collation (:obj:`pymongo.collation.Collation`, optional): if given, compare strings case-insensitively
+
+    Returns:
+        :obj:`bool`: :obj:`True` if the document matches
+    """
+    fold = (lambda value: value.lower() if isinstance(value, str) else value) if collation else (lambda value: value)
+    for key, condition in (filter or {}).items():
+        if key == '$and':
+            matched = all(match(doc, sub_filter, collation) for sub_filter in condition)
+        elif key == '$or':
+            matched = any(match(doc, sub_filter, collation) for sub_filter in condition)
+        else:
+            matched = match_values([fold(value) for value in get_values(doc, key)], condition, fold)
+        if not matched:
+            return False
+    return True
+
+
+def match_values(values, condition, fold):
+    if not (isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)):
+        condition = {'$eq': condition}
+    values_or_null = values or [None]
+    for operator, arg in condition.items():
+        if operator == '$exists':
+            matched = bool(values) == bool(arg)
+        elif operator == '$eq':
+            matched = fold(arg) in values_or_null
+        elif operator == '$ne':
+            matched = fold(arg) not in values_or_null
+        elif operator == '$in':
+            matched = any(fold(value) in values_or_null for value in arg)
+        elif operator in ('$gt', '$gte', '$lt', '$lte'):
+            compare = {'$gt': lambda a, b: a > b, '$gte': lambda a, b: a >= b,
+                       '$lt': lambda a, b: a < b, '$lte': lambda a, b: a <= b}[operator]
+            matched = any(value is not None and compare(value, fold(arg)) for value in values)
+        else:
+            raise NotImplementedError('{} is not supported'.format(operator))
+        if not matched:
+            return False
+    return True
+
+
+def get_values(doc, path):
+    """ Get the values at a dotted path of a document, descending into arrays
+
+    Args:
+        doc (:obj:`dict`): document
+        path (:obj:`str`): dotted path, e.g. 'halflives.reference.doi'
+
+    Returns:
+        :obj:`list`: values; empty if the path does not exist
+    """
+    values = [doc]
+    for key in path.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict) and key in value:
+                next_values.append(value[key])
+        values = []
+        for value in next_values:
+            if isinstance(value, list):
+                values.extend(value)
+            else:
+                values.append(value)
+    return values
+
+
+def project(doc, projection):
+    """ Apply a projection of top-level fields to a document
+
+    Args:
+        doc (:obj:`dict`): document
+        projection (:obj:`dict`): mongodb query projection
+
+    Returns:
+        :obj:`dict`: projected copy of the document
+    """
+    if not projection:
+        return dict(doc)
+    included = set(key.split('.')[0] for key, value in projection.items() if value and key != '_id')
+    if included:
+        return {key: value for key, value in doc.items()
+                if key in included or (key == '_id' and projection.get('_id', 1))}
+    return {key: value for key, value in doc.items() if projection.get(key, 1)}
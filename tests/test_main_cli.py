@@ -9,15 +9,17 @@
 
 from capturer import CaptureOutput
 from cement.utils import test
-from datanator.__main__ import App
+from datanator.__main__ import App, benchmark_startup, get_lazy_imports
 from datanator.util import warning_util
 import datanator
 import mock
 import os
 import re
 import shutil
+import subprocess
 import sqlalchemy.orm
 import sqlalchemy_utils
+import sys
 import tempfile
 import unittest
 from os import path
@@ -385,4 +387,55 @@ class DbControllerTestCase(unittest.TestCase):
         session = sqlalchemy.orm.sessionmaker(bind=datanator.db.engine)()
         query = session.query(datanator.core.models.Observation)
         self.assertGreater(query.count(), 0)
-        session.close()
\ No newline at end of file
+        session.close()
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_heavy_dependencies_not_imported(self):
+        code = 'import datanator.__main__, sys; print(" ".join(sorted(sys.modules)))'
+        modules = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                                 check=True).stdout.decode().split()
+        for module in ['pandas', 'pubchempy', 'ete3', 'openbabel', 'pymongo', 'datanator.util.molecule_util']:
+            self.assertNotIn(module, modules)
+
+    def test_help(self):
+        with CaptureOutput(termination_delay=0.1) as capturer:
+            with App(argv=['--help']) as app:
+                with self.assertRaises(SystemExit):
+                    app.run()
+            self.assertIn('benchmark-startup', capturer.get_text())
+
+    def test_get_lazy_imports(self):
+        controllers = {controller.Meta.label: controller for controller in App.Meta.handlers}
+        self.assertEqual(get_lazy_imports(controllers['base']), [])
+        # imported by create_taxon, which the command calls
+        self.assertEqual(get_lazy_imports(controllers['get-rank']), ['datanator.util:taxonomy_util'])
+        self.assertEqual(get_lazy_imports(controllers['get-structure']), ['bioservices', 'pubchempy'])
+
+    def test_benchmark_startup(self):
+        class Controller(object):
+            class Meta:
+                label = 'json'
+
+            def _default(self):
+                import json
+                from datanator.util import file_util
+
+        class BrokenController(object):
+            class Meta:
+                label = 'broken'
+
+            def _default(self):
+                from datanator.data_source import does_not_exist
+                import json
+
+        timings = benchmark_startup(controllers=[Controller, BrokenController], repeats=1)
+        self.assertGreater(timings['startup'], 0)
+        self.assertEqual([c['controller'] for c in timings['controllers']], ['json', 'broken'])
+        self.assertEqual(timings['controllers'][0]['modules'], ['json', 'datanator.util:file_util'])
+        self.assertGreaterEqual(timings['controllers'][0]['seconds'], 0)
+        self.assertIsNone(timings['controllers'][0]['error'])
+        self.assertEqual(timings['controllers'][1]['modules'], ['datanator.data_source:does_not_exist', 'json'])
+        self.assertIn('datanator.data_source:does_not_exist: ModuleNotFoundError', timings['controllers'][1]['error'])
+        self.assertNotIn('json:', timings['controllers'][1]['error'])
@@ -0,0 +1,177 @@
+import unittest
+from unittest import mock
+from datanator.util import backup_util
+import os
+import shutil
+import tempfile
+
+
+class CountingStore(backup_util.LocalPackageStore):
+    """ Local store which counts the chunks transferred and can corrupt chunks """
+
+    def __init__(self, dirname):
+        super(CountingStore, self).__init__(dirname)
+        self.puts = 0
+        self.gets = 0
+        self.corrupt = set()
+
+    def put_chunk(self, digest, data):
+        self.puts += 1
+        super(CountingStore, self).put_chunk(digest, data)
+
+    def get_chunk(self, digest):
+        self.gets += 1
+        data = super(CountingStore, self).get_chunk(digest)
+        if digest in self.corrupt:
+            data = b'x' + data[1:]
+        return data
+
+
+class TestChunkedBackup(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.store = CountingStore(os.path.join(self.dirname, 'store'))
+        self.backup = backup_util.ChunkedBackup(self.store, chunk_size=1024, max_workers=4)
+
+        self.filename = os.path.join(self.dirname, 'Source.sqlite')
+        self.content = bytearray(os.urandom(10 * 1024 + 100))
+        with open(self.filename, 'wb') as file:
+            file.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def read(self, path):
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_upload_only_changed_chunks(self):
+        stats = self.backup.upload('Source.sqlite', self.filename)
+        self.assertEqual(stats, {'files': 1, 'chunks': 11, 'transferred': 11, 'bytes_transferred': len(self.content)})
+
+        manifest = self.store.get_manifest('Source.sqlite')
+        self.assertEqual(manifest['type'], 'file')
+        self.assertEqual(manifest['files'][0]['size'], len(self.content))
+        self.assertEqual(manifest['files'][0]['chunks'][0], backup_util.hash_chunk(bytes(self.content[:1024])))
+
+        self.content[3000] ^= 0xff
+        with open(self.filename, 'wb') as file:
+            file.write(self.content)
+        stats = self.backup.upload('Source.sqlite', self.filename)
+        self.assertEqual(stats['transferred'], 1)
+        self.assertEqual(stats['bytes_transferred'], 1024)
+        self.assertEqual(self.store.puts, 12)
+
+    def test_download(self):
+        self.backup.upload('Source.sqlite', self.filename)
+
+        restored = os.path.join(self.dirname, 'restore', 'Source.sqlite')
+        stats = self.backup.download('Source.sqlite', restored)
+        self.assertEqual(self.read(restored), bytes(self.content))
+        self.assertEqual(stats['transferred'], 11)
+        self.assertFalse(os.path.exists(restored + '.partial'))
+
+        # only the changed chunk is fetched for an updated backup
+        self.content[5000] ^= 0xff
+        with open(self.filename, 'wb') as file:
+            file.write(self.content)
+        self.backup.upload('Source.sqlite', self.filename)
+        stats = self.backup.download('Source.sqlite', restored)
+        self.assertEqual(stats['transferred'], 1)
+        self.assertEqual(stats['reused'], 10)
+        self.assertEqual(self.read(restored), bytes(self.content))
+
+        with self.assertRaises(ValueError):
+            self.backup.download('Other.sqlite', restored)
+
+    def test_download_verifies_and_resumes(self):
+        self.backup.upload('Source.sqlite', self.filename)
+        digests = self.store.get_manifest('Source.sqlite')['files'][0]['chunks']
+        restored = os.path.join(self.dirname, 'Restored.sqlite')
+
+        self.store.corrupt.add(digests[7])
+        with self.assertRaises(backup_util.ChecksumError):
+            self.backup.download('Source.sqlite', restored)
+        self.assertFalse(os.path.exists(restored))
+        self.assertTrue(os.path.exists(restored + '.partial'))
+
+        # the restore resumes from the chunks which were already written
+        self.store.corrupt.clear()
+        self.store.gets = 0
+        with open(restored + '.partial', 'r+b') as file:
+            file.seek(2048)
+            file.write(b'\0' * 1024)
+        stats = self.backup.download('Source.sqlite', restored)
+        self.assertEqual(self.read(restored), bytes(self.content))
+        self.assertLess(self.store.gets, 11)
+        self.assertEqual(stats['transferred'], self.store.gets)
+
+    def test_directory(self):
+        src = os.path.join(self.dirname, 'dump')
+        os.makedirs(os.path.join(src, 'tables'))
+        with open(os.path.join(src, 'toc.dat'), 'wb') as file:
+            file.write(b'toc')
+        with open(os.path.join(src, 'tables', '1.dat'), 'wb') as file:
+            file.write(bytes(self.content))
+        with open(os.path.join(src, 'empty.dat'), 'wb') as file:
+            pass
+        stats = self.backup.upload('dump', src)
+        self.assertEqual(stats['files'], 3)
+
+        dest = os.path.join(self.dirname, 'restored_dump')
+        os.makedirs(dest)
+        with open(os.path.join(dest, 'stale.dat'), 'wb') as file:
+            file.write(b'stale')
+        self.backup.download('dump', dest)
+        self.assertEqual(self.read(os.path.join(dest, 'toc.dat')), b'toc')
+        self.assertEqual(self.read(os.path.join(dest, 'tables', '1.dat')), bytes(self.content))
+        self.assertEqual(self.read(os.path.join(dest, 'empty.dat')), b'')
+        self.assertFalse(os.path.exists(os.path.join(dest, 'stale.dat')))
+
+    def test_download_unchunked(self):
+        # packages created before backups were chunked hold whole files and no manifests
+        os.makedirs(self.store.dirname)
+        shutil.copy2(self.filename, os.path.join(self.store.dirname, 'Source.sqlite'))
+        self.assertEqual(self.store.get_manifest('Source.sqlite'), None)
+
+        restored = os.path.join(self.dirname, 'restore', 'Source.sqlite')
+        stats = self.backup.download('Source.sqlite', restored)
+        self.assertEqual(self.read(restored), bytes(self.content))
+        self.assertEqual(stats['transferred'], 0)
+        self.assertEqual(self.store.gets, 0)
+
+        # the chunked backup takes precedence once it exists
+        self.content[0] ^= 0xff
+        with open(self.filename, 'wb') as file:
+            file.write(self.content)
+        self.backup.upload('Source.sqlite', self.filename)
+        self.backup.download('Source.sqlite', restored)
+        self.assertEqual(self.read(restored), bytes(self.content))
+
+
+class TestQuiltPackageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = backup_util.QuiltPackageStore('datanator')
+
+    def test_has_chunks_without_backups(self):
+        manager = mock.Mock()
+        manager.download.side_effect = ValueError('datanator does not contain a file with the path `manifests`')
+        with mock.patch.object(self.store, '_get_manager', return_value=manager):
+            self.assertEqual(self.store.has_chunks(['abc']), set())
+            self.assertEqual(self.store.get_manifest('Source.sqlite'), None)
+            self.assertFalse(self.store.get_file('Source.sqlite', 'Source.sqlite'))
+
+    def test_has_chunks_propagates_other_errors(self):
+        manager = mock.Mock()
+        manager.download.side_effect = ConnectionError()
+        with mock.patch.object(self.store, '_get_manager', return_value=manager):
+            with self.assertRaises(ConnectionError):
+                self.store.has_chunks(['abc'])
+            with self.assertRaises(ConnectionError):
+                self.store.has_chunks(['abc'])
+            with self.assertRaises(ConnectionError):
+                self.store.get_manifest('Source.sqlite')
+            with self.assertRaises(ConnectionError):
+                self.store.get_file('Source.sqlite', 'Source.sqlite')
@@ -0,0 +1,59 @@
+import unittest
+from datanator.util import flat_file_util
+import os
+import shutil
+import tempfile
+
+
+class TestFlatFileFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def write(self, text):
+        filename = os.path.join(self.dirname, 'records.txt')
+        with open(filename, 'w') as file:
+            file.write(text)
+        return filename
+
+    def test_iter_records(self):
+        filename = self.write('CC   header\n//\n'
+                              'ID   1.1.1.1\nDE   Alcohol dehydrogenase.\n//\n'
+                              '\n//\n'
+                              'ID   1.1.1.2\nDE   Alcohol dehydrogenase (NADP(+)).\n//\r\n'
+                              'ID   1.1.1.3\n')
+        records = list(flat_file_util.ENZYME_FORMAT.iter_records(filename))
+        self.assertEqual(records, [
+            ['CC   header'],
+            ['ID   1.1.1.1', 'DE   Alcohol dehydrogenase.'],
+            ['ID   1.1.1.2', 'DE   Alcohol dehydrogenase (NADP(+)).'],
+        ])
+
+        self.assertEqual(list(flat_file_util.ENZYME_FORMAT.iter_records(self.write(''))), [])
+
+    def test_delimiters(self):
+        text = 'ENTRY       K00844\nNAME        HK\n///\nENTRY       K12407\n///'
+        self.assertEqual(flat_file_util.KEGG_FORMAT.split(text), [
+            'ENTRY       K00844\nNAME        HK\n///\n', 'ENTRY       K12407\n///'])
+        self.assertEqual(flat_file_util.ENZYME_FORMAT.split(text), [])
+
+    def test_get_fields(self):
+        lines = ['ENTRY       RC00001                     RClass',
+                 'DEFINITION  C8x-C8y:*-*:C1x+C8x+C8x-C1x+C8x+C8x',
+                 '            N1y-N2y:*-*:C1a+C1x+C1y-C1a+C1x+C2y',
+                 'REFERENCE   PMID:3136310',
+                 '  AUTHORS   Nishi S, Seino S, Bell GI',
+                 'REFERENCE   PMID:2387591',
+                 '///']
+        fields = flat_file_util.KEGG_FORMAT.get_fields(lines)
+        self.assertEqual(list(fields.keys()), ['ENTRY', 'DEFINITION', 'REFERENCE'])
+        self.assertEqual(fields['DEFINITION'], lines[1:3])
+        self.assertEqual(fields['REFERENCE'], lines[3:6])
+        self.assertEqual(flat_file_util.KEGG_FORMAT.get_value(lines[2]), 'N1y-N2y:*-*:C1a+C1x+C1y-C1a+C1x+C2y')
+
+    def test_iter_batches(self):
+        self.assertEqual(list(flat_file_util.iter_batches(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(flat_file_util.iter_batches([], 3)), [])
@@ -24,27 +24,25 @@ class TestMongoUtil(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(cls.cache_dirname)
+        cls.src.close()
 
     @unittest.skip('passed')
     def test_index_corum(self):
         col_str = 'corum'
         self.src.index_corum(col_str)
-        client, _, collection = self.src.con_db(col_str)
+        _, _, collection = self.src.con_db(col_str)
         self.assertEqual(len(list(collection.list_indexes())), 4)
-        client.close()
 
     @unittest.skip('passed')
     def test_index_sabio(self):
         col_str = 'sabio_rk'
         self.src.index_sabio(col_str)
-        client,_,collection = self.src.con_db(col_str)
+        _,_,collection = self.src.con_db(col_str)
         self.assertEqual( len(list(collection.list_indexes())), 11) # 10 + 1
-        client.close()
 
     @unittest.skip('passed')
     def test_index_uniprot(self):
         col_str = 'uniprot'
         self.src.index_uniprot(col_str)
-        client,_,collection = self.src.con_db(col_str)
-        self.assertEqual( len(list(collection.list_indexes())), 3) # 2 + 1
-        client.close()
\ No newline at end of file
+        _,_,collection = self.src.con_db(col_str)
+        self.assertEqual( len(list(collection.list_indexes())), 3) # 2 + 1
\ No newline at end of file
@@ -186,3 +186,70 @@ class TestInchiMolecule(unittest.TestCase):
 
         water = molecule_util.InchiMolecule('InChI=1S/H2O/h1H2')
         self.assertEqual(water.get_formula_and_connectivity(), 'H2O')
+
+    def test_get_layer_keys(self):
+        glc6p = molecule_util.InchiMolecule(
+            'InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2-10H,1H2,(H2,11,12,13)/t2-,3-,4+,5-,6-/m1/s1')
+        gal6p = molecule_util.InchiMolecule(
+            'InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2-10H,1H2,(H2,11,12,13)/t2-,3+,4+,5-,6?/m1/s1')
+        fru6p = molecule_util.InchiMolecule(
+            'InChI=1S/C6H13O9P/c7-1-3(8)5(10)6(11)4(9)2-15-16(12,13)14/h4-7,9-11H,1-2H2,(H2,12,13,14)/t4-,5-,6-/m1/s1')
+
+        self.assertEqual(glc6p.get_layer_keys(), gal6p.get_layer_keys())
+        self.assertNotEqual(glc6p.get_layer_keys(), fru6p.get_layer_keys())
+        self.assertEqual(glc6p.get_layer_keys(), molecule_util.InchiLayerKeys.from_inchi(str(glc6p)))
+
+        molecules = [glc6p, gal6p, fru6p,
+                     molecule_util.InchiMolecule('InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2'),
+                     molecule_util.InchiMolecule('InChI=1S/C6H12O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h3/q-1'),
+                     molecule_util.InchiMolecule('InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2/b1-2+'),
+                     ]
+        for a in molecules:
+            a_keys = a.get_layer_keys()
+            for b in molecules:
+                b_keys = b.get_layer_keys()
+                self.assertEqual(a_keys.stereoisomer == b_keys.stereoisomer, a.is_stereoisomer(b))
+                self.assertEqual(a_keys.tautomer == b_keys.tautomer, a.is_tautomer(b))
+                self.assertEqual(a_keys.protonation_isomer == b_keys.protonation_isomer, a.is_protonation_isomer(b))
+
+        with self.assertRaisesRegex(ValueError, 'not a valid InChI'):
+            molecule_util.InchiLayerKeys.from_inchi('C6H13O9P')
+
+
+class TestIsomerIndex(unittest.TestCase):
+    glc6p = 'InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2-10H,1H2,(H2,11,12,13)/t2-,3-,4+,5-,6-/m1/s1'
+    gal6p = 'InChI=1S/C6H13O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2-10H,1H2,(H2,11,12,13)/t2-,3+,4+,5-,6?/m1/s1'
+    glc6p_2 = 'InChI=1S/C6H11O9P/c7-3-2(1-14-16(11,12)13)15-6(10)5(9)4(3)8/h2-10H,1H2,(H2,11,12,13)/p-2/t2-,3-,4+,5-,6-/m1/s1'
+    fru6p = 'InChI=1S/C6H13O9P/c7-1-3(8)5(10)6(11)4(9)2-15-16(12,13)14/h4-7,9-11H,1-2H2,(H2,12,13,14)/t4-,5-,6-/m1/s1'
+
+    def test(self):
+        index = molecule_util.IsomerIndex([
+            ('glc6p', self.glc6p),
+            ('gal6p', self.gal6p),
+            ('glc6p_2', self.glc6p_2),
+            ('fru6p', self.fru6p),
+        ])
+
+        self.assertEqual(index.get_stereoisomers(self.glc6p), ['glc6p', 'gal6p'])
+        self.assertEqual(index.get_tautomers(self.gal6p), ['glc6p', 'gal6p'])
+        self.assertEqual(index.get_protonation_isomers(self.glc6p), ['glc6p', 'gal6p', 'glc6p_2'])
+        self.assertEqual(index.get_stereoisomers(self.fru6p), ['fru6p'])
+        self.assertEqual(index.get_tautomers('InChI=1S/H2O/h1H2'), [])
+
+        self.assertEqual(index.get_clusters('stereoisomer'), [['glc6p', 'gal6p']])
+        self.assertEqual(index.get_clusters('protonation_isomer'), [['glc6p', 'gal6p', 'glc6p_2']])
+        self.assertEqual(sorted(index.get_clusters('tautomer', min_size=1)), [['fru6p'], ['glc6p', 'gal6p'], ['glc6p_2']])
+
+        self.assertEqual(index.keys['glc6p'], molecule_util.InchiMolecule(self.glc6p).get_layer_keys())
+
+    def test_add(self):
+        index = molecule_util.IsomerIndex()
+        keys = index.add('glc6p', self.glc6p)
+        self.assertEqual(keys, molecule_util.InchiLayerKeys.from_inchi(self.glc6p))
+        self.assertEqual(index.get_stereoisomers(self.gal6p), ['glc6p'])
+
+        with self.assertRaisesRegex(ValueError, 'already contains'):
+            index.add('glc6p', self.gal6p)
+        with self.assertRaisesRegex(ValueError, 'not a valid InChI'):
+            index.add('h2o', 'H2O')
+        self.assertEqual(list(index.keys.keys()), ['glc6p'])
@@ -3,6 +3,8 @@ from datanator.util import mongo_util
 import datanator.config.core
 import tempfile
 import shutil
+import bson
+import os
 
 
 class TestMongoUtil(unittest.TestCase):
@@ -21,6 +23,7 @@ class TestMongoUtil(unittest.TestCase):
             replicaSet = replSet, db = cls.db, verbose=True, max_entries=20,
             username = username, password = password)
         cls.collection_str = 'ecmdb'
+        cls.config = {'MongoDB': MongoDB, 'username': username, 'password': password}
 
 
     @classmethod
@@ -51,4 +54,52 @@ class TestMongoUtil(unittest.TestCase):
         self.assertEqual(a['properties']['synonyms'],  {'type': 'object', 'properties': {'synonym': {'type': 'array', 
             'items': {'type': 'string'}}}, 'required': ['synonym']})
 
+    def test_client_pool(self):
+        src = mongo_util.MongoUtil(db='test', **self.config)
+        self.assertIs(src.client, self.src.client)
+        self.assertEqual(src.db_obj.name, 'test')
+        stats = [s for s in mongo_util.client_pool.stats() if s['readPreference'] == 'nearest'][0]
+        self.assertTrue(stats['references'] >= 2)
+        references = stats['references']
+        src.close()
+        src.close()
+        self.assertIsNone(src.client)
+        stats = [s for s in mongo_util.client_pool.stats() if s['readPreference'] == 'nearest'][0]
+        self.assertEqual(stats['references'], references - 1)
+        self.assertEqual(self.src.list_all_collections(), self.src.list_all_collections())
+        stats = mongo_util.client_pool.stats()[0]
+        self.assertTrue(stats['connections_open'] >= 1)
+        self.assertEqual(stats['connections_in_use'], 0)
 
+    def test_shared_client_close(self):
+        src_1 = mongo_util.MongoUtil(db='test', **self.config)
+        src_2 = mongo_util.MongoUtil(db='test', **self.config)
+        self.assertIs(src_1.client, src_2.client)
+        stats = [s for s in mongo_util.client_pool.stats() if s['readPreference'] == 'nearest'][0]
+        references = stats['references']
+        src_1.client.close()
+        stats = [s for s in mongo_util.client_pool.stats() if s['readPreference'] == 'nearest'][0]
+        self.assertEqual(stats['references'], references - 1)
+        self.assertIsInstance(src_2.list_all_collections(), list)
+        self.assertIsInstance(self.src.list_all_collections(), list)
+        src_2.close()
+
+    def test_restore_bson(self):
+        src = mongo_util.MongoUtil(db='test', **self.config)
+        _, _, collection = src.con_db('test_restore_bson')
+        collection.drop()
+        path = os.path.join(self.cache_dirname, 'test_restore_bson.bson')
+        with open(path, 'wb') as f:
+            for i in range(25):
+                f.write(bson.encode({'_id': i, 'name': str(i)}))
+        # resume after the first 10 documents
+        with open(path + '.offset', 'w') as f:
+            f.write(str(10 * len(bson.encode({'_id': 0, 'name': '0'}))))
+        collection.insert_many([{'_id': i, 'name': str(i)} for i in range(12)])
+        stats = src.restore_bson('test_restore_bson', path, batch_size=4, workers=2,
+                                 indexes=[{'key': {'name': 1}, 'name': 'name_1'}])
+        self.assertEqual(stats['documents'], 15)
+        self.assertEqual(collection.count_documents({}), 25)
+        self.assertIn('name_1', collection.index_information())
+        self.assertFalse(os.path.exists(path + '.offset'))
+        collection.drop()
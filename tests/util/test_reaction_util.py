@@ -8,6 +8,9 @@
 
 from datanator.core import data_model
 from datanator.util import reaction_util
+from unittest import mock
+import itertools
+import numpy
 import unittest
 
 
@@ -54,3 +57,61 @@ class TestReaction(unittest.TestCase):
 
         self.assertEqual(pairs[2][0], None)
         self.assertIn(pairs[2][1].specie.id, ['h', 'pi'])
+
+    def test_calc_reactant_product_pairs_batch(self):
+        fingerprints = reaction_util.FingerprintCache()
+        rxns = [self.make_reaction(), self.make_reaction()]
+        pairs = reaction_util.calc_reactant_product_pairs_batch(rxns, fingerprints=fingerprints)
+        self.assertEqual(len(pairs), 2)
+        for rxn_pairs in pairs:
+            self.assertEqual(rxn_pairs[0][0].specie.id, 'atp')
+            self.assertEqual(rxn_pairs[0][1].specie.id, 'adp')
+            self.assertEqual(rxn_pairs[2][0], None)
+        self.assertEqual(sorted(fingerprints.fingerprints.keys()), sorted([self.adp, self.atp, self.h, self.h2o, self.pi]))
+
+
+class TestFingerprintCache(unittest.TestCase):
+
+    def test_calc_similarities(self):
+        fingerprints = reaction_util.FingerprintCache()
+        bits = {
+            'a': numpy.array([1, 1, 0, 0], dtype=numpy.uint8),
+            'b': numpy.array([1, 0, 1, 0], dtype=numpy.uint8),
+            'c': numpy.array([0, 0, 0, 0], dtype=numpy.uint8),
+        }
+        with mock.patch.object(fingerprints, 'calc_bits', side_effect=lambda structure: bits[structure]) as calc_bits:
+            similarities = fingerprints.calc_similarities(['a', 'b', 'c'], ['a', 'b', 'c', 'a'])
+            numpy.testing.assert_array_almost_equal(similarities, [
+                [1., 1. / 3., 0., 1.],
+                [1. / 3., 1., 0., 1. / 3.],
+                [0., 0., 1., 0.],
+            ])
+            self.assertEqual(calc_bits.call_count, 3)
+        self.assertEqual(fingerprints.calc_similarities([], ['a']).shape, (0, 1))
+
+
+class TestSolveAssignment(unittest.TestCase):
+
+    def test_solve_assignment(self):
+        # the greedy choice (0, 0) leads to a worse total score
+        scores = numpy.array([[0.9, 0.8],
+                              [0.7, 0.1]])
+        self.assertEqual(reaction_util.solve_assignment(scores), [(0, 1), (1, 0)])
+
+        scores = numpy.array([[0.1, 0.5, 0.2],
+                              [0.4, 0.6, 0.3]])
+        self.assertEqual(reaction_util.solve_assignment(scores), [(0, 1), (1, 0)])
+        self.assertEqual(reaction_util.solve_assignment(scores.T), [(0, 1), (1, 0)])
+
+        self.assertEqual(reaction_util.solve_assignment(numpy.zeros((0, 3))), [])
+        self.assertEqual(reaction_util.solve_assignment(numpy.zeros((3, 0))), [])
+
+    def test_solve_assignment_is_optimal(self):
+        random_state = numpy.random.RandomState(0)
+        for i_trial in range(20):
+            scores = random_state.rand(4, 5)
+            pairs = reaction_util.solve_assignment(scores)
+            total = sum(scores[pair] for pair in pairs)
+            best = max(sum(scores[i_row, i_col] for i_row, i_col in enumerate(cols))
+                       for cols in itertools.permutations(range(5), 4))
+            self.assertAlmostEqual(total, best)
@@ -3,6 +3,8 @@ import tempfile
 import shutil
 from datanator.util import rna_halflife_util
 from datanator_query_python.config import config
+from unittest import mock
+from tests.fake_mongo import FakeCollection
 import pandas as pd
 
 
@@ -48,4 +50,96 @@ class TestRnaHlUtil(unittest.TestCase):
         self.assertEqual(df_1.iloc[0]['a'], 5.74239011770224)
 
     def test_fill_uniprot_with_df(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class TestUniprotResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.collection = FakeCollection([
+            {'uniprot_id': 'P00001', 'gene_name': 'dnaA', 'gene_name_oln': ['b0001', 'b0001a'], 'ncbi_taxonomy_id': 562},
+            {'uniprot_id': 'P00002', 'gene_name': 'dnaN', 'gene_name_oln': ['b0002'], 'ncbi_taxonomy_id': 562,
+             'sequence_embl': ['AAA0001.1']},
+            {'uniprot_id': 'Q00002', 'gene_name': 'dnaN', 'gene_name_oln': ['BSU0002'], 'ncbi_taxonomy_id': 1423},
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_resolve(self):
+        cache_path = self.cache_dir + '/cache.json'
+        resolver = rna_halflife_util.UniprotResolver(self.collection, cache_path=cache_path, batch_size=2)
+        self.assertEqual(resolver.resolve(['b0001', 'b0002', 'b0003', 'b0001a']),
+                         {'b0001': 'P00001', 'b0001a': 'P00001', 'b0002': 'P00002'})
+        self.assertEqual(resolver.queries, 2)
+        self.assertEqual(resolver.resolve(['dnaN'], identifier_type='gene_name', species=[1423]), {'dnaN': 'Q00002'})
+        self.assertEqual(resolver.resolve(['AAA0001.1'], identifier_type='sequence_embl'), {'AAA0001.1': 'P00002'})
+        self.assertEqual(self.collection.filters[2], {
+            '$or': [{'gene_name': {'$in': ['dnan']}}, {'gene_name_alt': {'$in': ['dnan']}},
+                    {'gene_name_orf': {'$in': ['dnan']}}, {'gene_name_oln': {'$in': ['dnan']}}],
+            'ncbi_taxonomy_id': {'$in': [1423]}})
+
+        resolver = rna_halflife_util.UniprotResolver(self.collection, cache_path=cache_path)
+        self.assertEqual(resolver.resolve(['b0001', 'b0002']), {'b0001': 'P00001', 'b0002': 'P00002'})
+        self.assertEqual(resolver.resolve(['dnaN'], identifier_type='gene_name', species=[1423]), {'dnaN': 'Q00002'})
+        self.assertEqual(resolver.queries, 0)
+        resolver.resolve(['b0003'])
+        self.assertEqual(resolver.queries, 1)
+
+    def test_resolve_case_insensitive(self):
+        resolver = rna_halflife_util.UniprotResolver(self.collection)
+        self.assertEqual(resolver.resolve(['B0001', 'b0001', 'DNAA'], identifier_type='oln'),
+                         {'B0001': 'P00001', 'b0001': 'P00001'})
+        self.assertEqual(resolver.resolve(['DNAA', 'dnaa'], identifier_type='gene_name'),
+                         {'DNAA': 'P00001', 'dnaa': 'P00001'})
+        self.assertEqual(resolver.queries, 2)
+        self.assertEqual(resolver.resolve(['b0001A'], identifier_type='oln'), {'b0001A': 'P00001'})
+        self.assertEqual(resolver.resolve(['B0001'], identifier_type='oln'), {'B0001': 'P00001'})
+        self.assertEqual(resolver.queries, 3)
+
+    def test_resolve_alternative_gene_names(self):
+        self.collection.docs.insert(0, {'uniprot_id': 'P00003', 'gene_name': 'holA', 'gene_name_alt': ['dnaN', 'holX'],
+                                        'gene_name_orf': ['ORF0003'], 'gene_name_oln': ['b0003'], 'ncbi_taxonomy_id': 562})
+        resolver = rna_halflife_util.UniprotResolver(self.collection)
+        self.assertEqual(resolver.resolve(['HOLX', 'orf0003', 'b0003', 'dnaN'], identifier_type='gene_name'),
+                         {'HOLX': 'P00003', 'orf0003': 'P00003', 'b0003': 'P00003', 'dnaN': 'P00002'})
+        self.assertEqual(resolver.queries, 1)
+
+    def test_fill_uniprot_with_df_blank_identifiers(self):
+        src = rna_halflife_util.RnaHLUtil.__new__(rna_halflife_util.RnaHLUtil)
+        src.max_entries = float('inf')
+        src.verbose = False
+        src._uniprot_resolver = rna_halflife_util.UniprotResolver(self.collection)
+        src.uniprot_collection_manager = mock.Mock()
+
+        df = pd.DataFrame({'oln': ['b0001', float('nan'), '', ' , ', 'b0004'], 'half_life': [1., 2., 3., 4., 5.]})
+        merged = src.fill_uniprot_with_df(df, 'oln')
+        src.uniprot_collection_manager.load_uniprot.assert_called_once_with(query=True, msg='b0004', species=None)
+        self.assertEqual(merged['uniprot_id'].tolist()[0], 'P00001')
+        self.assertTrue(merged['uniprot_id'].isna().tolist()[1:])
+        self.assertEqual(merged['half_life'].tolist(), [1., 2., 3., 4., 5.])
+
+    def test_fill_uniprot_with_df_existing_column(self):
+        src = rna_halflife_util.RnaHLUtil.__new__(rna_halflife_util.RnaHLUtil)
+        src.max_entries = float('inf')
+        src.verbose = False
+        src._uniprot_resolver = rna_halflife_util.UniprotResolver(self.collection)
+        src.uniprot_collection_manager = mock.Mock()
+
+        df = pd.DataFrame({'oln': ['b0002', 'b0001'], 'uniprot_id': ['old', 'old']})
+        merged = src.fill_uniprot_with_df(df, 'oln')
+        self.assertEqual(merged.columns.tolist(), ['oln', 'uniprot_id'])
+        self.assertEqual(merged['uniprot_id'].tolist(), ['P00002', 'P00001'])
+        self.assertEqual(df['uniprot_id'].tolist(), ['old', 'old'])
+
+    def test_merge(self):
+        df = pd.DataFrame({'oln': ['b0001', 'b0003, b0002', None, 'b0004'], 'half_life': [1., 2., 3., 4.]})
+        names = rna_halflife_util.explode_identifiers(df['oln'])
+        self.assertEqual(names.tolist(), ['b0001', 'b0003', 'b0002', 'b0004'])
+        self.assertEqual(names.index.tolist(), [0, 1, 1, 3])
+        uniprot_ids = rna_halflife_util.first_uniprot_ids(names, {'b0001': 'P00001', 'b0002': 'P00002'})
+        self.assertEqual(uniprot_ids.to_dict(), {0: 'P00001', 1: 'P00002'})
+        merged = df.join(uniprot_ids.rename('uniprot_id'))
+        self.assertEqual(merged['uniprot_id'].tolist()[:2], ['P00001', 'P00002'])
+        self.assertTrue(merged['uniprot_id'].isna().tolist()[2:])
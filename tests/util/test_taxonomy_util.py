@@ -81,6 +81,14 @@ class TestTaxonomyUtil(unittest.TestCase):
         taxon = taxonomy_util.Taxon(name='mycoplasma XXX')
         self.assertEqual(taxon.get_ncbi_id(), None)
 
+    def test_get_ncbi_id_by_name(self):
+        self.assertEqual(taxonomy_util.get_ncbi_id_by_name('Mycoplasma genitalium'), 2097)
+        hits = taxonomy_util.get_ncbi_id_by_name.cache_info().hits
+        self.assertEqual(taxonomy_util.get_ncbi_id_by_name('Mycoplasma genitalium'), 2097)
+        self.assertEqual(taxonomy_util.get_ncbi_id_by_name.cache_info().hits, hits + 1)
+        self.assertEqual(taxonomy_util.get_ncbi_id_by_name('mycoplasma XXX'), None)
+        self.assertIs(taxonomy_util.get_ncbi_taxa(), taxonomy_util.get_ncbi_taxa())
+
     def test_Taxon_get_parent_taxa(self):
         parents = taxonomy_util.Taxon(name='mycoplasma genitalium').get_parent_taxa()
         self.assertEqual(parents[-1].name, 'Mycoplasma')